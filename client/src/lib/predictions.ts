@@ -0,0 +1,58 @@
+// client/src/lib/predictions.ts
+// Expands the ML service's compact prediction format (response_format=compact)
+// into the full shape the viewers read: `mask`/`points` as {x, y} lists and
+// `bbox` as {x, y, w, h}. Full-format responses pass through unchanged.
+
+export const COMPACT_SCHEMA_VERSION = 1;
+
+type PointDict = { x: number; y: number };
+
+function toPointDicts(flat: number[]): PointDict[] {
+  const points: PointDict[] = [];
+  for (let i = 0; i + 1 < flat.length; i += 2) {
+    points.push({ x: flat[i], y: flat[i + 1] });
+  }
+  return points;
+}
+
+export function expandPrediction(item: any): any {
+  if (!Array.isArray(item?.points) || typeof item.points[0] !== "number") {
+    return item;
+  }
+  const points = toPointDicts(item.points);
+  const expanded: any = { ...item, points, mask: points };
+  if (Array.isArray(item.bbox)) {
+    const [x, y, w, h] = item.bbox;
+    expanded.bbox = { x, y, w, h };
+  }
+  return expanded;
+}
+
+function expandPredictionMap(predictions: Record<string, any[]> | undefined) {
+  if (!predictions) return predictions;
+  const expanded: Record<string, any[]> = {};
+  for (const [key, items] of Object.entries(predictions)) {
+    expanded[key] = Array.isArray(items) ? items.map(expandPrediction) : items;
+  }
+  return expanded;
+}
+
+// Accepts an /analyze or /analyze-pages response in either format
+export function expandAnalysisResults<T = any>(results: any): T {
+  if (!results || results.format !== "compact") {
+    return results;
+  }
+  if (results.schema_version !== COMPACT_SCHEMA_VERSION) {
+    throw new Error(`Unsupported compact prediction schema version: ${results.schema_version}`);
+  }
+  if (Array.isArray(results.results)) {
+    return {
+      ...results,
+      results: results.results.map((page: any) => ({
+        ...page,
+        predictions: expandPredictionMap(page.predictions),
+      })),
+    };
+  }
+  return { ...results, predictions: expandPredictionMap(results.predictions) };
+}
@@ -21,6 +21,7 @@ import { useToast } from "@/hooks/use-toast";
 import { useDocument } from "@/hooks/useDocument";
 import { useDocumentUpload } from "@/hooks/useDocumentUpload";
 import { apiRequest, queryClient } from "@/lib/queryClient";
+import { expandAnalysisResults } from "@/lib/predictions";
 import { createApiUrl, createMlUrl } from "@/config/api";
 import { Download, Ruler, Square, Hash, MessageSquare, PanelLeft, PanelRight, Hand, FileText, ChevronDown, Keyboard, Sparkles } from "lucide-react";
 import type { Drawing, Project } from "@shared/schema";
@@ -255,19 +256,15 @@ export default function Dashboard() {
     setAnalysisResults(null);
 
     try {
-      // Calculate scale value once
-      let scaleValue: number;
-      if (customPixelsPerFoot) {
-        scaleValue = customPixelsPerFoot / 96;
-      } else {
-        const scaleMap: { [key: string]: number } = {
-          '1/4" = 1\'': 0.25,
-          '1/8" = 1\'': 0.125,
-          '1/2" = 1\'': 0.5,
-          '1" = 1\'': 1.0,
-        };
-        scaleValue = scaleMap[selectedScale] || 0.25;
-      }
+      // Calculate scale value once. A calibrated pixels-per-foot value is sent
+      // as-is; the ML service converts it using the image's real DPI.
+      const scaleMap: { [key: string]: number } = {
+        '1/4" = 1\'': 0.25,
+        '1/8" = 1\'': 0.125,
+        '1/2" = 1\'': 0.5,
+        '1" = 1\'': 1.0,
+      };
+      const scaleValue: number = scaleMap[selectedScale] || 0.25;
 
       // Analyze all pages
       let allPredictions: Detection[] = [];
@@ -290,10 +287,14 @@ export default function Dashboard() {
         formData.append('file', imageFile);
         formData.append('types', JSON.stringify(typesToAnalyze));
         formData.append('scale', scaleValue.toString());
+        formData.append('response_format', 'compact');
+        if (customPixelsPerFoot) {
+          formData.append('pixels_per_foot', customPixelsPerFoot.toString());
+        }
 
         console.log('[Analysis] Sending request to ML service:', createMlUrl('/analyze'));
         const mlStart = performance.now();
-        const results = await apiRequest(createMlUrl('/analyze'), 'POST', formData, true);
+        const results = expandAnalysisResults(await apiRequest(createMlUrl('/analyze'), 'POST', formData, true));
         console.log(`[Analysis] ML inference took ${(performance.now() - mlStart).toFixed(0)}ms`);
 
         lastResults = results;
@@ -336,7 +337,7 @@ export default function Dashboard() {
             const saveStart = performance.now();
             await apiRequest(createApiUrl(`/api/drawings/${currentDrawing.id}/analysis`), 'POST', {
               results: lastResults,
-              scale: scaleValue
+              scale: lastResults?.scale ?? scaleValue
             });
             console.log(`[Analysis] Saving to DB took ${(performance.now() - saveStart).toFixed(0)}ms`);
 
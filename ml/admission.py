@@ -0,0 +1,403 @@
+"""
+Admission Control for EstimAgent
+Keeps a burst of /upload-pdf and /analyze-pages requests from allocating more
+memory than the instance has (and OOM-killing every request in flight).
+
+Each request reserves its estimated peak memory before the expensive part
+starts; the estimate comes from what it will rasterize (page count × sheet
+size at the render DPI, see upload_cost_mb() / page_analysis_cost_mb()).
+Requests that do not fit in the budget wait in a short queue and are turned
+away with 429 and a Retry-After when the queue is full or the wait runs out.
+
+Priorities: single-image /analyze and one-page /analyze-pages calls are
+interactive, uploads and multi-page analyses are bulk.
+- Bulk work may reserve at most `bulk_share` of the budget and run at most
+  `max_bulk` jobs at once, so interactive calls always find headroom.
+- Waiting interactive requests are admitted before waiting bulk ones, and
+  no bulk job starts while an interactive request is still waiting for room
+  (a small upload would take the memory it is waiting for); bulk jobs are
+  admitted in arrival order (a large upload is not overtaken forever by
+  small ones).
+- While the container's working-set memory is above `memory_high_water` of
+  its limit, bulk jobs only start when nothing else is running.
+- With nothing running, any request is admitted, however large its estimate.
+
+Work a request hands to a thread or worker process keeps running when the
+client goes away, so it keeps its reservation until it finishes: await it
+through hold(), which defers the request's release() until then.
+
+Retry-After is the time until the earliest running job is expected to
+finish, from a moving average of seconds per unit of work (page × model) per
+endpoint.
+
+All bookkeeping runs on the event loop thread; acquire() and release() must
+be called from it.
+"""
+
+import os
+import math
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE, BULK = 'interactive', 'bulk'
+
+_MB = 1024 * 1024
+
+# Working memory of one remote model call (encoded image, request body, parsed response)
+MODEL_CALL_MB = 24
+# Fixed overhead of a request (PDF parsing, response building)
+REQUEST_BASE_MB = 32
+# Private memory of a busy render worker besides the page it holds (interpreter, pdftoppm)
+RENDER_WORKER_MB = 16
+
+
+class AdmissionRejected(Exception):
+    """The request was not admitted; retry after `retry_after` seconds."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+# ------------------------------------------------------------------------------
+# Cost estimates
+# ------------------------------------------------------------------------------
+
+def raster_mb(width_in: float, height_in: float, dpi: float, channels: int = 3) -> float:
+    """Size of an RGB bitmap of a `width_in` x `height_in` inch sheet at `dpi`."""
+    return width_in * dpi * height_in * dpi * channels / _MB
+
+
+def preview_mb(width_in: float, height_in: float, longest_side: int, channels: int = 3) -> float:
+    """Size of a bitmap rendered so its longest side is `longest_side` pixels."""
+    longest = max(width_in, height_in) or 1
+    return longest_side * longest_side * (min(width_in, height_in) / longest) * channels / _MB
+
+
+def upload_cost_mb(sheets: Sequence[Tuple[float, float]], preview_size: int,
+                   full_dpi: Optional[float] = None, render_workers: int = 0) -> float:
+    """
+    Peak memory of processing an upload: pdf2image returns a run of pages as
+    bitmaps all at once, so every preview (and, with eager full renders, every
+    full-resolution page) may be in memory together. With render workers, up
+    to `render_workers` pages are also being rasterized at once, each by its
+    own pdftoppm, on top of the workers' own overhead.
+    """
+    total = sum(preview_mb(w, h, preview_size) for w, h in sheets)
+    if full_dpi:
+        total += sum(raster_mb(w, h, full_dpi) for w, h in sheets)
+    if render_workers and sheets:
+        largest = max(raster_mb(w, h, full_dpi) if full_dpi else preview_mb(w, h, preview_size) for w, h in sheets)
+        total += min(render_workers, len(sheets)) * (RENDER_WORKER_MB + largest)
+    return REQUEST_BASE_MB + total
+
+
+def page_analysis_cost_mb(sheets: Sequence[Tuple[float, float]], dpi: float, models: int) -> float:
+    """
+    Peak memory of analyzing pages: they are rendered and analyzed one at a
+    time, so the largest sheet counts (rendered bitmap plus its decoded copy),
+    plus the working memory of the model calls.
+    """
+    largest = max((raster_mb(w, h, dpi) for w, h in sheets), default=0.0)
+    return REQUEST_BASE_MB + 2 * largest + models * MODEL_CALL_MB
+
+
+# ------------------------------------------------------------------------------
+# Memory state
+# ------------------------------------------------------------------------------
+
+def _read(path: str) -> Optional[str]:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _cgroup_memory() -> Optional[Tuple[float, float]]:
+    """(working set, limit) in MB of this container (cgroup v2, then v1), or None without a limit."""
+    for current, limit, stat, inactive in (
+        ('/sys/fs/cgroup/memory.current', '/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory.stat',
+         'inactive_file'),
+        ('/sys/fs/cgroup/memory/memory.usage_in_bytes', '/sys/fs/cgroup/memory/memory.limit_in_bytes',
+         '/sys/fs/cgroup/memory/memory.stat', 'total_inactive_file'),
+    ):
+        limit_value, current_value = _read(limit), _read(current)
+        if not limit_value or not current_value or limit_value == 'max' or int(limit_value) >= 1 << 60:
+            continue
+        used = int(current_value)
+        # Working set, as the OOM killer sees it: reclaimable file cache does not count
+        for line in (_read(stat) or '').splitlines():
+            key, _, value = line.partition(' ')
+            if key == inactive:
+                used -= int(value)
+                break
+        return max(used, 0) / _MB, int(limit_value) / _MB
+    return None
+
+
+def memory_state() -> Optional[Tuple[float, float]]:
+    """(used, limit) in MB: the container's cgroup, else this process's RSS against physical memory."""
+    cgroup = _cgroup_memory()
+    if cgroup:
+        return cgroup
+    statm = _read('/proc/self/statm')
+    try:
+        page_size = os.sysconf('SC_PAGE_SIZE')
+        physical = page_size * os.sysconf('SC_PHYS_PAGES') / _MB
+    except (AttributeError, ValueError, OSError):
+        return None
+    if not statm:
+        return None
+    return int(statm.split()[1]) * page_size / _MB, physical
+
+
+def default_budget_mb(fraction: float = 0.6, fallback: float = 4096) -> float:
+    """`fraction` of the memory limit, leaving room for the baseline process and caches."""
+    state = memory_state()
+    return state[1] * fraction if state else fallback
+
+
+# ------------------------------------------------------------------------------
+# Controller
+# ------------------------------------------------------------------------------
+
+class Ticket:
+    """An admitted (or waiting) request's reservation."""
+
+    __slots__ = ('endpoint', 'priority', 'cost_mb', 'work_units', 'expected_seconds', 'queued_at', 'started_at',
+                 'busy', 'release_pending')
+
+    def __init__(self, endpoint: str, priority: str, cost_mb: float, work_units: float, expected_seconds: float):
+        self.endpoint = endpoint
+        self.priority = priority
+        self.cost_mb = cost_mb
+        self.work_units = work_units
+        self.expected_seconds = expected_seconds
+        self.queued_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        # Offloaded work still running under this reservation, and the release() it held back
+        self.busy = 0
+        self.release_pending: Optional[bool] = None
+
+
+class AdmissionController:
+    """Memory-budgeted admission with an interactive and a bulk priority class."""
+
+    def __init__(
+        self,
+        budget_mb: float,
+        bulk_share: float = 0.75,
+        max_bulk: int = 2,
+        max_waiting: int = 16,
+        max_wait_seconds: float = 15,
+        memory_high_water: float = 0.85,
+        unit_seconds: float = 2.0,
+        enabled: bool = True,
+        metrics=None,
+    ):
+        self.enabled = enabled
+        self.budget_mb = budget_mb
+        self.bulk_share = bulk_share
+        self.max_bulk = max_bulk
+        self.max_waiting = max_waiting
+        self.max_wait_seconds = max_wait_seconds
+        self.memory_high_water = memory_high_water
+        self.metrics = metrics
+        self._default_unit_seconds = unit_seconds
+        self._unit_seconds: Dict[str, float] = {}
+        self._running: List[Ticket] = []
+        self._waiting: List[Tuple[Ticket, asyncio.Future]] = []
+        self._memory: Optional[Tuple[float, float]] = None
+        self._memory_read_at = 0.0
+        self._stats = {'admitted': 0, 'queued': 0, 'rejected_queue_full': 0, 'rejected_timeout': 0}
+
+    # -- state ---------------------------------------------------------------------
+
+    def _memory_pressure(self) -> bool:
+        now = time.monotonic()
+        if now - self._memory_read_at > 0.5:
+            self._memory = memory_state()
+            self._memory_read_at = now
+        return bool(self._memory) and self._memory[0] > self._memory[1] * self.memory_high_water
+
+    def _reserved(self, priority: Optional[str] = None) -> float:
+        return sum(t.cost_mb for t in self._running if priority is None or t.priority == priority)
+
+    def _fits(self, ticket: Ticket) -> bool:
+        if not self._running:
+            return True
+        if self._reserved() + ticket.cost_mb > self.budget_mb:
+            return False
+        if ticket.priority == BULK:
+            bulk = [t for t in self._running if t.priority == BULK]
+            return (
+                len(bulk) < self.max_bulk
+                and self._reserved(BULK) + ticket.cost_mb <= self.budget_mb * self.bulk_share
+                and not self._memory_pressure()
+            )
+        return True
+
+    def retry_after(self) -> int:
+        """Seconds until the earliest running job is expected to finish (1-60)."""
+        now = time.monotonic()
+        remaining = [t.started_at + t.expected_seconds - now for t in self._running]
+        return min(max(1, math.ceil(min(remaining, default=1))), 60)
+
+    def stats(self) -> Dict[str, Any]:
+        self._memory_pressure()
+        return dict(
+            self._stats,
+            enabled=self.enabled,
+            budget_mb=round(self.budget_mb),
+            reserved_mb=round(self._reserved()),
+            running={p: sum(1 for t in self._running if t.priority == p) for p in (INTERACTIVE, BULK)},
+            waiting={p: sum(1 for t, _ in self._waiting if t.priority == p) for p in (INTERACTIVE, BULK)},
+            memory_mb=[round(v) for v in self._memory] if self._memory else None,
+            seconds_per_unit={k: round(v, 2) for k, v in self._unit_seconds.items()},
+        )
+
+    # -- admission -----------------------------------------------------------------
+
+    def _record(self, ticket: Ticket, outcome: str, wait_seconds: float = 0.0) -> None:
+        if self.metrics:
+            self.metrics.observe_admission(ticket.endpoint, ticket.priority, outcome, wait_seconds)
+
+    def _reject(self, ticket: Ticket, outcome: str, reason: str) -> AdmissionRejected:
+        self._stats[outcome] += 1
+        self._record(ticket, outcome, time.monotonic() - ticket.queued_at)
+        retry_after = self.retry_after()
+        logger.warning("Request not admitted", extra={
+            "endpoint": ticket.endpoint, "priority": ticket.priority, "reason": reason,
+            "cost_mb": round(ticket.cost_mb), "retry_after": retry_after,
+        })
+        return AdmissionRejected(reason, retry_after)
+
+    def _start(self, ticket: Ticket) -> None:
+        ticket.started_at = time.monotonic()
+        self._running.append(ticket)
+        self._stats['admitted'] += 1
+        self._record(ticket, 'admitted', ticket.started_at - ticket.queued_at)
+
+    def _waiting_ahead(self, priority: str) -> int:
+        """Waiters that come before a new request of `priority`."""
+        if priority == INTERACTIVE:
+            return sum(1 for t, _ in self._waiting if t.priority == INTERACTIVE)
+        return len(self._waiting)
+
+    def precheck(self, endpoint: str, priority: str) -> None:
+        """Cheap check before a request body is read: reject if its class's queue is already full."""
+        if not self.enabled:
+            return
+        if sum(1 for t, _ in self._waiting if t.priority == priority) >= self.max_waiting:
+            raise self._reject(Ticket(endpoint, priority, 0, 0, 0), 'rejected_queue_full', 'admission queue full')
+
+    async def acquire(self, endpoint: str, cost_mb: float, work_units: float = 1, priority: str = BULK) -> Ticket:
+        """
+        Reserve `cost_mb` for a request, waiting up to max_wait_seconds.
+        Raises AdmissionRejected when the queue is full or the wait times out.
+        """
+        unit_seconds = self._unit_seconds.get(endpoint, self._default_unit_seconds)
+        ticket = Ticket(endpoint, priority, cost_mb, work_units, work_units * unit_seconds)
+        if not self.enabled:
+            ticket.started_at = ticket.queued_at
+            return ticket
+        if not self._waiting_ahead(priority) and self._fits(ticket):
+            self._start(ticket)
+            return ticket
+        if sum(1 for t, _ in self._waiting if t.priority == priority) >= self.max_waiting:
+            raise self._reject(ticket, 'rejected_queue_full', 'admission queue full')
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.append((ticket, future))
+        # Interactive waiters first, then arrival order
+        self._waiting.sort(key=lambda w: (w[0].priority != INTERACTIVE, w[0].queued_at))
+        self._stats['queued'] += 1
+        try:
+            await asyncio.wait((future,), timeout=self.max_wait_seconds)
+        except asyncio.CancelledError:
+            # Client went away: give back a reservation granted meanwhile
+            if future.done():
+                self.release(ticket, completed=False)
+            else:
+                self._dequeue(future)
+            raise
+        if not future.done():
+            self._dequeue(future)
+            raise self._reject(ticket, 'rejected_timeout', f'no capacity within {self.max_wait_seconds:g}s')
+        return ticket
+
+    def _dequeue(self, future: asyncio.Future) -> None:
+        self._waiting = [w for w in self._waiting if w[1] is not future]
+        future.cancel()
+
+    def _grant(self) -> None:
+        """
+        Start waiters that now fit: interactive ones first, then bulk ones
+        strictly in order, and none while an interactive waiter does not fit.
+        """
+        interactive_waiting = False
+        for ticket, future in list(self._waiting):
+            if future.done():
+                continue
+            if ticket.priority == BULK and interactive_waiting:
+                break
+            if self._fits(ticket):
+                self._waiting = [w for w in self._waiting if w[1] is not future]
+                self._start(ticket)
+                future.set_result(True)
+            elif ticket.priority == INTERACTIVE:
+                interactive_waiting = True
+            else:
+                break
+
+    async def hold(self, ticket: Ticket, work: Awaitable[Any]) -> Any:
+        """
+        Await offloaded work (asyncio.to_thread(), a worker pool's run_async())
+        that uses `ticket`'s memory. If the request is cancelled meanwhile the
+        work carries on, and release() of the ticket waits until it is done.
+        """
+        future = asyncio.ensure_future(work)
+        ticket.busy += 1
+        future.add_done_callback(lambda done: self._work_done(ticket, done))
+        return await asyncio.shield(future)
+
+    def _work_done(self, ticket: Ticket, future: asyncio.Future) -> None:
+        if not future.cancelled():
+            future.exception()  # retrieved here when the awaiting request is gone
+        ticket.busy -= 1
+        if not ticket.busy and ticket.release_pending is not None:
+            completed, ticket.release_pending = ticket.release_pending, None
+            self.release(ticket, completed)
+
+    def release(self, ticket: Ticket, completed: bool = True) -> None:
+        """
+        Give back a reservation; `completed` feeds the per-endpoint time estimate.
+        Deferred while work started through hold() is still running.
+        """
+        if not self.enabled or ticket not in self._running:
+            return
+        if ticket.busy:
+            ticket.release_pending = completed and ticket.release_pending is not False
+            return
+        self._running.remove(ticket)
+        if completed and ticket.work_units:
+            observed = (time.monotonic() - ticket.started_at) / ticket.work_units
+            previous = self._unit_seconds.get(ticket.endpoint)
+            self._unit_seconds[ticket.endpoint] = observed if previous is None else 0.8 * previous + 0.2 * observed
+        self._grant()
+
+    @asynccontextmanager
+    async def admit(self, endpoint: str, cost_mb: float, work_units: float = 1, priority: str = BULK):
+        """acquire() for the duration of the block."""
+        ticket = await self.acquire(endpoint, cost_mb, work_units, priority)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
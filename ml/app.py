@@ -1,20 +1,26 @@
 # ml/app.py
 from __future__ import annotations
 
-import io
 import json
 import os
+import time
+import asyncio
 import uuid
+import itertools
+import functools
 import shutil
 import base64
+import tempfile
+import logging
 import requests
-from datetime import datetime
 from typing import Any, Dict, List, Optional
 
-from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+from fastapi import FastAPI, Form, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, PlainTextResponse, FileResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, FileResponse, Response
 from fastapi.staticfiles import StaticFiles
+from starlette.exceptions import HTTPException as StarletteHTTPException
+from starlette.routing import Match
 from PIL import Image
 from dotenv import load_dotenv
 from inference_sdk import InferenceHTTPClient
@@ -22,6 +28,28 @@ import torch
 from ultralytics import YOLO
 import numpy as np
 from pdf_processor import PDFProcessor
+from page_index import PageIndex, file_hash
+from singleflight import SingleFlight
+from metrics import Metrics
+from log_config import (
+    configure_logging, current_request_id, detection_logger, reset_request_id, sample_detection, set_request_id,
+)
+from tracing import Tracer, load_span_exporter
+from profiling import RequestProfiler
+from admission import (
+    BULK, INTERACTIVE, AdmissionController, AdmissionRejected, default_budget_mb, page_analysis_cost_mb, upload_cost_mb,
+)
+from upstream import load_upstream_guard
+from workers import CPUWorkerPool, worker_count
+from speculative import SpeculativeScheduler
+from uploads import multipart_openapi, receive_upload
+from storage import StorageManager
+from page_store import load_page_store
+from responses import COMPACT_SCHEMA_VERSION, RESPONSE_FORMATS, FastJSONResponse, dumps, format_predictions
+from image_ingest import UnreadableImageError, ingest_image
+from image_backend import load_image_backend
+from page_classifier import load_page_classifier
+from page_diff import boxes_intersect, changed_regions, expand_regions, pad_box, prediction_box
 
 # ------------------------------------------------------------------------------
 # Env & constants
@@ -29,6 +57,15 @@ from pdf_processor import PDFProcessor
 
 load_dotenv()
 
+# JSON lines (LOG_FORMAT=text for local development), written off the request threads.
+# DETECTION_LOG_SAMPLE_RATE logs per-detection measurements for that fraction of detections.
+configure_logging(
+    level=os.getenv("LOG_LEVEL", "INFO"),
+    fmt=os.getenv("LOG_FORMAT", "json"),
+    detection_sample_rate=float(os.getenv("DETECTION_LOG_SAMPLE_RATE", "0")),
+)
+logger = logging.getLogger("estimagent.ml")
+
 # Room Detection Model - detects only rooms
 ROOM_API_KEY = os.getenv("ROOM_API_KEY", "")
 ROOM_WORKSPACE = os.getenv("ROOM_WORKSPACE", "")
@@ -47,6 +84,11 @@ DOORWINDOW_WORKSPACE = os.getenv("DOORWINDOW_WORKSPACE", "")
 DOORWINDOW_PROJECT = os.getenv("DOORWINDOW_PROJECT", "")  # mytool-i6igr
 DOORWINDOW_VERSION = os.getenv("DOORWINDOW_VERSION", "")
 
+# Roboflow endpoints. Point them at a self-hosted inference server or the benchmark
+# stand-in (benchmarks/fake_roboflow.py); other hosts are called with the hosted route shape.
+ROBOFLOW_API_URL = os.getenv("ROBOFLOW_API_URL", "https://detect.roboflow.com")
+ROBOFLOW_CLASSIFY_API_URL = os.getenv("ROBOFLOW_CLASSIFY_API_URL", "https://serverless.roboflow.com")
+
 # Construct model IDs from environment variables
 # Format: "project_id/model_version_id" (as expected by the API)
 ROOM_MODEL_ID = ""
@@ -59,9 +101,9 @@ CUSTOM_ROOM_MODEL_PATH = os.getenv("CUSTOM_ROOM_MODEL_PATH")
 if CUSTOM_ROOM_MODEL_PATH and os.path.exists(CUSTOM_ROOM_MODEL_PATH):
     try:
         CUSTOM_ROOM_MODEL = YOLO(CUSTOM_ROOM_MODEL_PATH)
-        print(f"[ML] Loaded custom room detection model from {CUSTOM_ROOM_MODEL_PATH}")
+        logger.info(f"Loaded custom room detection model from {CUSTOM_ROOM_MODEL_PATH}")
     except Exception as e:
-        print(f"[WARNING] Failed to load custom room detection model: {e}")
+        logger.warning(f"Failed to load custom room detection model: {e}")
 
 WALL_MODEL_ID = ""
 if WALL_PROJECT and WALL_VERSION:
@@ -71,6 +113,10 @@ DOORWINDOW_MODEL_ID = ""
 if DOORWINDOW_PROJECT and DOORWINDOW_VERSION:
     DOORWINDOW_MODEL_ID = f"{DOORWINDOW_PROJECT}/{DOORWINDOW_VERSION}"
 
+# Pixel density assumed for uploads that carry no DPI metadata (screenshots,
+# phone photos). PDF page renders record their true DPI in the JPEG header.
+DEFAULT_IMAGE_DPI = float(os.getenv("DEFAULT_IMAGE_DPI", "96"))
+
 UPLOAD_DIR = os.getenv("UPLOAD_DIR", "/opt/render/project/src/uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
@@ -78,11 +124,133 @@ os.makedirs(UPLOAD_DIR, exist_ok=True)
 PDF_UPLOAD_DIR = os.path.join(UPLOAD_DIR, "pdfs")
 os.makedirs(PDF_UPLOAD_DIR, exist_ok=True)
 
+# Upload lifecycle: uploads are evicted UPLOAD_TTL_HOURS after last access, and
+# least recently used first while UPLOAD_DIR exceeds UPLOAD_QUOTA_MB
+storage = StorageManager(
+    UPLOAD_DIR,
+    ttl_seconds=float(os.getenv("UPLOAD_TTL_HOURS", "24")) * 3600,
+    quota_bytes=int(os.getenv("UPLOAD_QUOTA_MB", "2048")) * 1024 * 1024,
+    min_idle_seconds=float(os.getenv("UPLOAD_MIN_IDLE_SECONDS", "600")),
+)
+STORAGE_SWEEP_INTERVAL = float(os.getenv("STORAGE_SWEEP_INTERVAL_SECONDS", "300"))
+
+# Shared store for upload artifacts so any instance can serve any upload: local, s3 or fs
+page_store = load_page_store(os.getenv("PAGE_STORE", "local"))
+
+# Index of previously rendered pages and cached model outputs, shared across uploads
+PAGE_INDEX_DIR = os.getenv("PAGE_INDEX_DIR", os.path.join(UPLOAD_DIR, "page_index"))
+# Reuse Roboflow responses for byte-identical inputs (set to 0 to always call the API); cached
+# responses expire DETECTION_CACHE_TTL_HOURS after last use and are evicted LRU past DETECTION_CACHE_MAX_MB
+page_index = PageIndex(
+    PAGE_INDEX_DIR,
+    max_entries=int(os.getenv("PAGE_INDEX_MAX_ENTRIES", "5000")),
+    detection_max_bytes=int(os.getenv("DETECTION_CACHE_MAX_MB", "256")) * 1024 * 1024,
+    detection_ttl_seconds=float(os.getenv("DETECTION_CACHE_TTL_HOURS", "168")) * 3600,
+)
+DETECTION_CACHE = os.getenv("DETECTION_CACHE", "1") == "1"
+
+# Identical model calls in flight at the same time share one upstream request
+inflight_inferences = SingleFlight()
+
+# Per-request span traces, exported as OTLP/JSON (TRACE_EXPORTER: none, file or otlp);
+# callers sending X-Debug-Trace: 1 get the timing tree back whatever the exporter
+tracer = Tracer(
+    enabled=os.getenv("TRACING_ENABLED", "1") == "1",
+    exporter=load_span_exporter(os.getenv("TRACE_EXPORTER", "none")),
+    sample_rate=float(os.getenv("TRACE_SAMPLE_RATE", "1")),
+    max_spans=int(os.getenv("TRACE_MAX_SPANS", "5000")),
+    service_name=os.getenv("OTEL_SERVICE_NAME", "estimagent-ml"),
+)
+
+# Per-stage latency histograms on /metrics (needs prometheus_client); stages are also trace spans
+metrics = Metrics(enabled=os.getenv("METRICS_ENABLED", "1") == "1", tracer=tracer)
+
+# Admission control: expensive requests reserve their estimated peak memory from
+# this budget; when it is spent they wait briefly, then get 429 with Retry-After
+admission = AdmissionController(
+    budget_mb=float(os.getenv("ADMISSION_MEMORY_BUDGET_MB") or default_budget_mb()),
+    bulk_share=float(os.getenv("ADMISSION_BULK_SHARE", "0.75")),
+    max_bulk=int(os.getenv("ADMISSION_MAX_BULK", "2")),
+    max_waiting=int(os.getenv("ADMISSION_MAX_WAITING", "16")),
+    max_wait_seconds=float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "15")),
+    memory_high_water=float(os.getenv("ADMISSION_MEMORY_HIGH_WATER", "0.85")),
+    enabled=os.getenv("ADMISSION_CONTROL", "1") == "1",
+    metrics=metrics,
+)
+# Per-model rate limits (token bucket + concurrency cap) and circuit breakers for
+# Roboflow calls: {ROOM,WALL,DOORWINDOW,PAGE}_RATE_LIMIT etc., see upstream.py
+upstream_guards = {
+    "room": load_upstream_guard("room", "ROOM", metrics),
+    "wall": load_upstream_guard("wall", "WALL", metrics),
+    "doorwindow": load_upstream_guard("doorwindow", "DOORWINDOW", metrics),
+    "page": load_upstream_guard("page", "PAGE", metrics),
+}
+UPSTREAM_BY_MODEL_ID = {
+    model_id: upstream_guards[name]
+    for name, model_id in (("room", ROOM_MODEL_ID), ("wall", WALL_MODEL_ID), ("doorwindow", DOORWINDOW_MODEL_ID))
+    if model_id
+}
+
+# Multi-core mode: CPU-bound stages (upload decode/encode, local YOLO) run in
+# CPU_WORKERS processes forked at startup that share the loaded models (workers.py).
+# Use this instead of `uvicorn --workers`, which loads every model once per process.
+cpu_workers = CPUWorkerPool(
+    workers=int(os.getenv("CPU_WORKERS", "0")),
+    torch_threads=int(os.getenv("CPU_WORKER_TORCH_THREADS", "1")),
+    metrics=metrics,
+)
+# PDF pages are rendered and JPEG-encoded by PDF_RENDER_WORKERS processes
+# ("auto" = the available cores not taken by CPU_WORKERS; in-process when that leaves one)
+render_workers = CPUWorkerPool(
+    workers=worker_count(os.getenv("PDF_RENDER_WORKERS", "auto"), reserved=cpu_workers.workers),
+    metrics=metrics,
+    name="render",
+)
+
+# Reserved by one /analyze call (decoded image, resized copy, three model calls)
+ADMISSION_ANALYZE_MB = float(os.getenv("ADMISSION_ANALYZE_MB", "128"))
+# Sheet assumed when an upload's page sizes cannot be read (ARCH D)
+DEFAULT_SHEET_INCHES = (36.0, 24.0)
+
+# On-demand profiles of single requests (PROFILE_REQUESTS, or X-Profile from an admin).
+# Artifacts stay out of UPLOAD_DIR, which is served publicly under /uploads.
+profiler = RequestProfiler(
+    os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "estimagent-profiles")),
+    default_mode=os.getenv("PROFILE_REQUESTS", "off"),
+    admin_token=os.getenv("PROFILE_ADMIN_TOKEN", ""),
+    interval=float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000,
+    memory_frames=int(os.getenv("PROFILE_MEMORY_FRAMES", "25")),
+    max_artifacts=int(os.getenv("PROFILE_MAX_ARTIFACTS", "50")),
+)
+
+# Incremental re-analysis of revised sheets (/analyze-pages with base_upload_id)
+INCREMENTAL_TILE_SIZE = int(os.getenv("INCREMENTAL_TILE_SIZE", "256"))
+INCREMENTAL_CONTEXT_MARGIN = int(os.getenv("INCREMENTAL_CONTEXT_MARGIN", "256"))
+INCREMENTAL_MAX_CHANGED_FRACTION = float(os.getenv("INCREMENTAL_MAX_CHANGED_FRACTION", "0.5"))
+
+# JPEG encode/downscale library: auto, pillow, vips or turbojpeg
+image_backend = load_image_backend(os.getenv("IMAGE_BACKEND", "auto"))
+
+# Upload size limits, enforced while streaming uploads to disk
+MAX_IMAGE_UPLOAD_MB = int(os.getenv("MAX_IMAGE_UPLOAD_MB", "50"))
+MAX_PDF_UPLOAD_MB = int(os.getenv("MAX_PDF_UPLOAD_MB", "500"))
+
+# Speculative pre-analysis: after /upload-pdf, warm the detection cache for
+# pages of these types in the background (opt-in, or per upload via form field)
+SPECULATIVE_ANALYSIS = os.getenv("SPECULATIVE_ANALYSIS", "0") == "1"
+SPECULATIVE_PAGE_TYPES = {
+    t.strip() for t in os.getenv("SPECULATIVE_PAGE_TYPES", "floor_plan").split(",") if t.strip()
+}
+speculative_scheduler = SpeculativeScheduler(max_queue=int(os.getenv("SPECULATIVE_MAX_QUEUE", "200")))
+
 # Page Classification Model Configuration (Roboflow)
 PAGE_API_KEY = os.getenv("PAGE_API_KEY", "")
 PAGE_PROJECT = os.getenv("PAGE_PROJECT", "")
 PAGE_VERSION = os.getenv("PAGE_VERSION", "")
 
+# "remote" uses the Roboflow classifier above; "ocr" or "onnx" classify in-process
+PAGE_CLASSIFIER = os.getenv("PAGE_CLASSIFIER", "remote").lower()
+
 # Initialize PDF processor (will be configured with classify_fn after _classify_image is defined)
 pdf_processor = None
 
@@ -91,25 +259,22 @@ CUSTOM_WINDOW_MODEL_PATH = os.getenv("CUSTOM_WINDOW_MODEL_PATH", "")
 CUSTOM_WINDOW_MODEL = None
 
 # Try to load custom YOLO model if path is provided
-print(f"[ML] DEBUG: CUSTOM_WINDOW_MODEL_PATH = {CUSTOM_WINDOW_MODEL_PATH}")
-print(f"[ML] DEBUG: Path exists? {os.path.exists(CUSTOM_WINDOW_MODEL_PATH) if CUSTOM_WINDOW_MODEL_PATH else 'No path set'}")
+logger.debug(f"CUSTOM_WINDOW_MODEL_PATH = {CUSTOM_WINDOW_MODEL_PATH}")
 
 if CUSTOM_WINDOW_MODEL_PATH and os.path.exists(CUSTOM_WINDOW_MODEL_PATH):
     try:
-        import time
         start_time = time.time()
         from ultralytics import YOLO
         CUSTOM_WINDOW_MODEL = YOLO(CUSTOM_WINDOW_MODEL_PATH)
         load_time = time.time() - start_time
-        print(f"[ML] SUCCESS: Loaded custom window model from: {CUSTOM_WINDOW_MODEL_PATH}")
-        print(f"[ML] Model loading took {load_time:.2f} seconds")
+        logger.info(f"Loaded custom window model from {CUSTOM_WINDOW_MODEL_PATH} in {load_time:.2f}s")
     except Exception as e:
-        print(f"[ML] WARNING: Failed to load custom window model: {e}")
+        logger.warning(f"Failed to load custom window model: {e}")
         CUSTOM_WINDOW_MODEL = None
 else:
-    print("[ML] INFO: Custom window model not configured (set CUSTOM_WINDOW_MODEL_PATH in .env)")
+    logger.info("Custom window model not configured (set CUSTOM_WINDOW_MODEL_PATH in .env)")
     if CUSTOM_WINDOW_MODEL_PATH:
-        print(f"[ML] ERROR: Path set but file not found: {CUSTOM_WINDOW_MODEL_PATH}")
+        logger.error(f"CUSTOM_WINDOW_MODEL_PATH set but file not found: {CUSTOM_WINDOW_MODEL_PATH}")
 
 # ------------------------------------------------------------------------------
 # App
@@ -135,7 +300,45 @@ if cors_origins:
 else:
     allowed_origins = default_origins
 
-print(f"[ML] CORS allowed origins: {allowed_origins}")
+logger.info(f"CORS allowed origins: {allowed_origins}")
+
+# Priority class per expensive endpoint before its body is read; /analyze-pages
+# becomes bulk once it asks for more than one page
+ADMISSION_PRIORITY = {"/analyze": INTERACTIVE, "/analyze-pages": INTERACTIVE, "/upload-pdf": BULK}
+
+
+def _busy_detail(e: AdmissionRejected) -> str:
+    return f"Server is busy ({e.reason}). Retry in {e.retry_after}s."
+
+
+# Registered before CORS so that it runs inside it and its 429s carry CORS headers
+@app.middleware("http")
+async def admission_precheck(request, call_next):
+    """Turn a request away before its body is read when its admission queue is already full."""
+    priority = ADMISSION_PRIORITY.get(request.url.path) if request.method == "POST" else None
+    if priority:
+        try:
+            admission.precheck(request.url.path, priority)
+        except AdmissionRejected as e:
+            return JSONResponse({"detail": _busy_detail(e)}, status_code=429, headers={"Retry-After": str(e.retry_after)})
+    return await call_next(request)
+
+
+async def _admit(endpoint: str, priority: str, cost_mb: float, work_units: float):
+    """Wait for admission; 429 with Retry-After when the service is saturated."""
+    try:
+        return await admission.acquire(endpoint, cost_mb, work_units, priority)
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=429, detail=_busy_detail(e), headers={"Retry-After": str(e.retry_after)})
+
+
+def _model_count(types_list: List[str]) -> int:
+    """Detection models a list of takeoff types runs (as in _detect_page)."""
+    return (
+        any(t in types_list for t in ["rooms", "floors", "flooring"])
+        + ("walls" in types_list)
+        + any(t in types_list for t in ["doors", "windows", "columns", "openings"])
+    )
 
 app.add_middleware(
     CORSMiddleware,
@@ -147,25 +350,198 @@ app.add_middleware(
     max_age=3600,
 )
 
+# Requests a user is waiting on; speculative background work pauses while any is in flight
+INTERACTIVE_PATHS = {"/analyze", "/analyze-pages", "/upload-pdf"}
+
+@app.middleware("http")
+async def mark_interactive_requests(request, call_next):
+    if request.method == "POST" and request.url.path in INTERACTIVE_PATHS:
+        with speculative_scheduler.interactive():
+            return await call_next(request)
+    return await call_next(request)
+
+
+def _route_label(scope) -> str:
+    """Route template a request matches (e.g. /pages/{upload_id}/{page_number}.jpg), keeping label cardinality bounded."""
+    partial = None
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and partial is None:
+            # Path matches but the method does not (405)
+            partial = route.path
+    return partial or "unmatched"
+
+
+@app.middleware("http")
+async def record_request_metrics(request, call_next):
+    if not metrics.enabled:
+        return await call_next(request)
+    endpoint = _route_label(request.scope)
+    start = time.perf_counter()
+    status = 500
+    # Stages recorded while handling the request are labeled with its endpoint
+    with metrics.endpoint(endpoint):
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            metrics.observe_request(endpoint, request.method, status, time.perf_counter() - start)
+
+
+# Scrapes and probes are not traced
+UNTRACED_PATHS = {"/metrics", "/healthz"}
+
+@app.middleware("http")
+async def trace_requests(request, call_next):
+    """Record each request as a trace; X-Debug-Trace: 1 returns its span timings."""
+    if not tracer.enabled or request.url.path in UNTRACED_PATHS:
+        return await call_next(request)
+    route = _route_label(request.scope)
+    with tracer.trace(
+        f"{request.method} {route}",
+        traceparent=request.headers.get("traceparent"),
+        debug=request.headers.get("x-debug-trace") == "1",
+        **{"http.method": request.method, "http.route": route, "request_id": current_request_id()},
+    ) as root:
+        response = await call_next(request)
+        if root:
+            root.set_attribute("http.status_code", response.status_code)
+    if root:
+        response.headers["X-Trace-ID"] = root.trace.trace_id
+        if root.trace.debug:
+            response.headers["Server-Timing"] = tracer.server_timing(root)
+    return response
+
+
+def _with_debug_trace(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Add the request's span timing tree as `trace` when the caller sent X-Debug-Trace: 1."""
+    tree = tracer.debug_tree()
+    if tree:
+        payload["trace"] = tree
+    return payload
+
+
+_profilable_in_flight = 0
+
+async def profile_requests(request, call_next):
+    """Profile an analysis request when PROFILE_REQUESTS is set or an admin sends X-Profile."""
+    global _profilable_in_flight
+    if request.method != "POST" or request.url.path not in INTERACTIVE_PATHS:
+        return await call_next(request)
+    _profilable_in_flight += 1
+    try:
+        mode = profiler.requested_mode(request.headers)
+        if not mode:
+            return await call_next(request)
+        with profiler.profile(
+            mode,
+            path=request.url.path,
+            request_id=current_request_id(),
+            concurrent_requests=_profilable_in_flight - 1,
+        ) as record:
+            response = await call_next(request)
+            if record is not None:
+                record["status_code"] = response.status_code
+    finally:
+        _profilable_in_flight -= 1
+    if record is None:
+        response.headers["X-Profile"] = "busy"
+    else:
+        response.headers["X-Profile-ID"] = record["profile_id"]
+    return response
+
+# Not installed at all unless profiling is configured
+if profiler.enabled:
+    app.middleware("http")(profile_requests)
+
+
+@app.middleware("http")
+async def assign_request_id(request, call_next):
+    """Correlate every log line of a request (including its worker threads) by request id."""
+    request_id = (request.headers.get("x-request-id") or uuid.uuid4().hex)[:64]
+    token = set_request_id(request_id)
+    try:
+        response = await call_next(request)
+    finally:
+        reset_request_id(token)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+class UploadFiles(StaticFiles):
+    """Static upload files; previews of uploads processed by another instance are fetched from the page store."""
+
+    async def get_response(self, path: str, scope) -> Response:
+        try:
+            return await super().get_response(path, scope)
+        except StarletteHTTPException as e:
+            parts = path.split("/")
+            if e.status_code != 404 or not page_store.shared or len(parts) != 3 or parts[0] != "pdfs":
+                raise
+            try:
+                uuid.UUID(parts[1])
+            except ValueError:
+                raise e
+            if not await asyncio.to_thread(page_store.fetch, parts[1], parts[2], os.path.join(PDF_UPLOAD_DIR, parts[1])):
+                raise
+            return await super().get_response(path, scope)
+
 # Mount PDF uploads directory for serving images
-app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
+app.mount("/uploads", UploadFiles(directory=UPLOAD_DIR), name="uploads")
 
 # Startup event
 @app.on_event("startup")
 async def startup_event():
-    print("[ML] 🚀 ML Service starting up...")
-    print(f"[ML] 📁 Upload directory: {UPLOAD_DIR}")
-    print(f"[ML] 📄 PDF upload directory: {PDF_UPLOAD_DIR}")
-    print(f"[ML] 🏠 Room model: {ROOM_MODEL_ID or 'Custom YOLO'}")
-    print(f"[ML] 🧱 Wall model: {WALL_MODEL_ID or 'Not configured'}")
-    print(f"[ML] 🚪 Door/Window model: {DOORWINDOW_MODEL_ID or 'Not configured'}")
-    print(f"[ML] 📋 Page classifier: {PAGE_PROJECT or 'Not configured'}")
-    print("[ML] ✅ ML Service ready!")
+    # Fork before any thread starts; every model is loaded by now
+    cpu_workers.start()
+    render_workers.start()
+    storage.start_sweeper(STORAGE_SWEEP_INTERVAL)
+    logger.info("ML service ready", extra={
+        "upload_dir": UPLOAD_DIR,
+        "upload_ttl_hours": storage.ttl_seconds / 3600,
+        "upload_quota_mb": storage.quota_bytes // (1024 * 1024),
+        "room_model": ROOM_MODEL_ID or "custom_yolo",
+        "wall_model": WALL_MODEL_ID or None,
+        "doorwindow_model": DOORWINDOW_MODEL_ID or None,
+        "page_classifier": pdf_processor.model_name if pdf_processor.classify_fn else None,
+        "cpu_workers": cpu_workers.workers,
+        "render_workers": render_workers.workers,
+    })
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    cpu_workers.shutdown()
+    render_workers.shutdown()
 
 # ------------------------------------------------------------------------------
 # Utilities
 # ------------------------------------------------------------------------------
 
+def _roboflow_client(api_url: str, api_key: str) -> InferenceHTTPClient:
+    """InferenceHTTPClient for `api_url`, using the hosted API's routes even when it is not roboflow.com."""
+    client = InferenceHTTPClient(api_url=api_url, api_key=api_key)
+    if "roboflow.com" not in api_url:
+        client.select_api_v0()
+    return client
+
+
+@functools.lru_cache(maxsize=None)
+def _classify_client(api_key: str) -> InferenceHTTPClient:
+    """
+    Page classification client, one per API key for the life of the process.
+    Lists of images are sent one image per request, PAGE_CLASSIFY_CONCURRENCY at a time.
+    """
+    from inference_sdk import InferenceConfiguration
+    
+    client = _roboflow_client(ROBOFLOW_CLASSIFY_API_URL, api_key)
+    client.configure(InferenceConfiguration(
+        max_concurrent_requests=max(1, int(os.getenv("PAGE_CLASSIFY_CONCURRENCY", "4"))),
+    ))
+    return client
+
+
 def _get_client(api_key: Optional[str] = None) -> InferenceHTTPClient:
     """Get Roboflow inference client with API key."""
     key = (api_key or ROOM_API_KEY or WALL_API_KEY or DOORWINDOW_API_KEY or "").strip()
@@ -173,42 +549,9 @@ def _get_client(api_key: Optional[str] = None) -> InferenceHTTPClient:
         raise RuntimeError(
             "Missing API KEY. Set ROOM_API_KEY, WALL_API_KEY, or DOORWINDOW_API_KEY in your .env file."
         )
-    return InferenceHTTPClient(
-        api_url="https://detect.roboflow.com",
-        api_key=key,
-    )
+    return _roboflow_client(ROBOFLOW_API_URL, key)
 
 
-def _image_size_from_bytes(data: bytes) -> tuple[int, int]:
-    """Get image dimensions from bytes with robust error handling."""
-    try:
-        # Create BytesIO object and ensure it's at the beginning
-        img_buffer = io.BytesIO(data)
-        img_buffer.seek(0)
-        
-        # Try to open and verify the image
-        with Image.open(img_buffer) as im:
-            # Verify the image by loading it
-            im.verify()
-            
-        # Reopen for actual size reading (verify() closes the image)
-        img_buffer.seek(0)
-        with Image.open(img_buffer) as im:
-            width, height = im.size
-            if width <= 0 or height <= 0:
-                raise ValueError(f"Invalid image dimensions: {width}x{height}")
-            return width, height
-            
-    except Exception as e:
-        # Log the error for debugging
-        print(f"[ERROR] Failed to read image: {str(e)}")
-        print(f"[ERROR] Data length: {len(data)} bytes")
-        print(f"[ERROR] First 20 bytes: {data[:20]}")
-        raise HTTPException(
-            status_code=400,
-            detail=f"Cannot identify image file. Please ensure the file is a valid image (PNG, JPG, etc.). Error: {str(e)}"
-        )
-
 def _calculate_polygon_area(points: List[Dict[str, float]]) -> float:
     """Calculate area of a polygon using the shoelace formula."""
     if len(points) < 3:
@@ -236,29 +579,82 @@ def _calculate_polygon_perimeter(points: List[Dict[str, float]]) -> float:
         perimeter += (dx * dx + dy * dy) ** 0.5
     return perimeter
 
-def _convert_to_real_units(pixel_value: float, scale: Optional[float], unit: str = "sq ft") -> float:
+def _image_dpi(img: Image.Image) -> Optional[float]:
+    """Return the pixel density recorded in an image header, if any."""
+    dpi = img.info.get("dpi")
+    if not dpi:
+        return None
+    try:
+        value = float(dpi[0] if isinstance(dpi, (tuple, list)) else dpi)
+    except (TypeError, ValueError):
+        return None
+    # Some encoders write a 1x1 density to mean "aspect ratio only"
+    return value if value > 1 else None
+
+def _prepare_image(upload_path: str, output_path: str, max_dimension: int, dpi: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Decode an upload downscaled to `max_dimension` and save the copy the models see.
+    Takes and returns paths and numbers only, so that it can run in a CPU worker.
+    Raises UnreadableImageError when the upload cannot be decoded.
+
+    Stage timings come back in "stage_seconds" for the caller to record with
+    metrics.observe_stage(): observations made in a CPU worker would stay in
+    that process.
+    """
+    stage_seconds = {}
+    start = time.perf_counter()
+    try:
+        with tracer.span("decode_resize"):
+            ingested = ingest_image(upload_path, max_dimension)
+    except Exception as e:
+        raise UnreadableImageError(str(e)) from e
+    stage_seconds["decode_resize"] = time.perf_counter() - start
+    img = ingested.image
+    try:
+        source_dpi = dpi or _image_dpi(img) or DEFAULT_IMAGE_DPI
+        # Save resized image (optimize=True costs an extra Huffman pass for ~2% smaller files)
+        start = time.perf_counter()
+        with tracer.span("image_encode"):
+            image_backend.save_image(img, output_path, quality=85, dpi=source_dpi * ingested.scale_factor)
+        stage_seconds["image_encode"] = time.perf_counter() - start
+        return {
+            "original_size": ingested.original_size,
+            "size": img.size,
+            "scale_factor": ingested.scale_factor,
+            "source_dpi": source_dpi,
+            "stage_seconds": stage_seconds,
+        }
+    finally:
+        img.close()
+
+def _convert_to_real_units(
+    pixel_value: float,
+    scale: Optional[float],
+    unit: str = "sq ft",
+    dpi: Optional[float] = None,
+) -> float:
     """Convert pixel measurements to real-world units using scale factor.
     
     Scale represents the drawing scale factor:
     - For 1/4" = 1' scale: scale = 0.25 (1/4 inch on drawing = 1 foot in reality)
     
-    Assumption: The drawing is scanned/uploaded at approximately 96 DPI (standard screen resolution)
-    - At 96 DPI: 1 inch on drawing = 96 pixels
-    - For 1/4" = 1' scale: 1 foot in reality = 0.25" on drawing = 24 pixels
-    - Therefore: 1 pixel = 1/(96 * scale) feet = 1/24 feet ≈ 0.042 feet for 1/4" scale
+    `dpi` is the effective pixel density of the image the pixels were measured
+    on, i.e. the source density multiplied by any resize factor applied before
+    inference. Falls back to DEFAULT_IMAGE_DPI when unknown.
+    - At 300 DPI: 1 inch on drawing = 300 pixels
+    - For 1/4" = 1' scale: 1 foot in reality = 0.25" on drawing = 75 pixels
     """
     if not scale or scale <= 0:
         return pixel_value
     
-    # Assume 96 DPI (pixels per inch) for scanned drawings
-    # This is a reasonable default for screen-resolution images
-    DPI = 96.0
+    if not dpi or dpi <= 0:
+        dpi = DEFAULT_IMAGE_DPI
     
     # Calculate feet per pixel:
     # - scale is in inches per foot (e.g., 0.25 for 1/4" = 1')
-    # - scale * DPI gives pixels per foot
-    # - 1 / (scale * DPI) gives feet per pixel
-    pixels_per_foot = scale * DPI
+    # - scale * dpi gives pixels per foot
+    # - 1 / (scale * dpi) gives feet per pixel
+    pixels_per_foot = scale * dpi
     feet_per_pixel = 1.0 / pixels_per_foot if pixels_per_foot > 0 else 0.0
     
     if unit == "sq ft":
@@ -268,22 +664,39 @@ def _convert_to_real_units(pixel_value: float, scale: Optional[float], unit: str
         # For length: direct multiplication
         return pixel_value * feet_per_pixel
 
+# Prediction ids only need to be unique, not unpredictable: a per-process prefix
+# plus a counter costs far less than a uuid4 per wall segment
+_PREDICTION_ID_PREFIX = uuid.uuid4().hex[:12]
+_prediction_ids = itertools.count(1)
+
+
+def _new_prediction_id() -> str:
+    return f"{_PREDICTION_ID_PREFIX}-{next(_prediction_ids)}"
+
+
+@metrics.timed("normalization")
 def _normalize_predictions(
     raw: Dict[str, Any],
     img_w: int,
     img_h: int,
     filter_classes: Optional[List[str]] = None,
     scale: Optional[float] = None,
+    dpi: Optional[float] = None,
 ) -> List[Dict[str, Any]]:
     """
     Normalize Roboflow predictions and optionally filter by class names.
     
+    Geometry is stored once: `points` and `mask` are the same list of pixel
+    coordinates. Normalized copies are derived per response format (see
+    responses.format_predictions).
+    
     Args:
         raw: Raw response from Roboflow API
         img_w: Image width
         img_h: Image height
         filter_classes: If provided, only include predictions with these class names
         scale: Scale factor for converting pixels to real-world units
+        dpi: Effective pixel density of the image the predictions were made on
     """
     preds = raw.get("predictions", []) or raw.get("data", {}).get("predictions", [])
     out: List[Dict[str, Any]] = []
@@ -295,11 +708,8 @@ def _normalize_predictions(
         if filter_classes and class_name not in filter_classes:
             continue
             
-        # Generate unique ID for this detection
-        item_id = str(uuid.uuid4())
-        
         item: Dict[str, Any] = {
-            "id": item_id,
+            "id": _new_prediction_id(),
             "class": class_name,
             "confidence": float(p.get("confidence", 0.0)),
             "category": class_name.lower() if class_name else "unknown",
@@ -321,17 +731,7 @@ def _normalize_predictions(
             x2 = x + w / 2
             y2 = y + h / 2
             
-            item.update(
-                {
-                    "bbox": {"x": x, "y": y, "w": w, "h": h},
-                    "bbox_norm": {
-                        "x": x / img_w if img_w else 0.0,
-                        "y": y / img_h if img_h else 0.0,
-                        "w": w / img_w if img_w else 0.0,
-                        "h": h / img_h if img_h else 0.0,
-                    },
-                }
-            )
+            item["bbox"] = {"x": x, "y": y, "w": w, "h": h}
             
             # Convert bounding box to polygon mask (4 corners)
             item["mask"] = [
@@ -341,35 +741,23 @@ def _normalize_predictions(
                 {"x": x1, "y": y2},  # Bottom-left
             ]
             item["points"] = item["mask"]
-            item["points_norm"] = [
-                {"x": x1 / img_w, "y": y1 / img_h},
-                {"x": x2 / img_w, "y": y1 / img_h},
-                {"x": x2 / img_w, "y": y2 / img_h},
-                {"x": x1 / img_w, "y": y2 / img_h},
-            ]
             
             # Add display metrics for openings (doors/windows)
             if class_name and class_name.lower() in ["door", "window"]:
                 item["display"].update({
-                    "width": _convert_to_real_units(w, scale, "ft"),
-                    "height": _convert_to_real_units(h, scale, "ft"),
+                    "width": _convert_to_real_units(w, scale, "ft", dpi),
+                    "height": _convert_to_real_units(h, scale, "ft", dpi),
                 })
 
         # Polygon variant (for rooms, walls)
         if "points" in p and isinstance(p["points"], list):
-            pts = p["points"]
-            item["points"] = pts
-            item["points_norm"] = [
-                {"x": pt["x"] / img_w, "y": pt["y"] / img_h}
-                for pt in pts
-                if isinstance(pt, dict) and "x" in pt and "y" in pt and img_w and img_h
-            ]
             # Convert points to mask format expected by frontend
             item["mask"] = [
                 {"x": pt["x"], "y": pt["y"]}
-                for pt in pts
+                for pt in p["points"]
                 if isinstance(pt, dict) and "x" in pt and "y" in pt
             ]
+            item["points"] = item["mask"]
             
             # Calculate area and perimeter for polygon detections
             if len(item["mask"]) >= 3:
@@ -377,22 +765,25 @@ def _normalize_predictions(
                 pixel_area = _calculate_polygon_area(item["mask"])
                 pixel_perimeter = _calculate_polygon_perimeter(item["mask"])
                 
-                # Debug logging for room calculations
-                if class_name and "room" in class_name.lower():
-                    print(f"[ML] Room '{class_name}' calculation:")
-                    print(f"  - Pixel area: {pixel_area:.2f} px²")
-                    print(f"  - Pixel perimeter: {pixel_perimeter:.2f} px")
-                    print(f"  - Scale factor: {scale}")
-                    print(f"  - Pixels per foot: {scale * 96 if scale else 'N/A'}")
+                # Per-detection debug output is sampled (off by default)
+                log_detection = sample_detection()
                 
                 # Add display metrics based on detection type
                 if class_name and "room" in class_name.lower():
                     # For rooms: area_sqft and perimeter_ft
-                    area_sqft = _convert_to_real_units(pixel_area, scale, "sq ft")
-                    perimeter_ft = _convert_to_real_units(pixel_perimeter, scale, "ft")
+                    area_sqft = _convert_to_real_units(pixel_area, scale, "sq ft", dpi)
+                    perimeter_ft = _convert_to_real_units(pixel_perimeter, scale, "ft", dpi)
                     
-                    print(f"  - Converted area: {area_sqft:.2f} sq ft")
-                    print(f"  - Converted perimeter: {perimeter_ft:.2f} ft")
+                    if log_detection:
+                        detection_logger.debug("Room measured", extra={
+                            "class_name": class_name,
+                            "area_px": pixel_area,
+                            "perimeter_px": pixel_perimeter,
+                            "scale": scale,
+                            "pixels_per_foot": scale * (dpi or DEFAULT_IMAGE_DPI) if scale else None,
+                            "area_sqft": area_sqft,
+                            "perimeter_ft": perimeter_ft,
+                        })
                     
                     item["display"].update({
                         "area_sqft": area_sqft,
@@ -420,12 +811,17 @@ def _normalize_predictions(
                     # For walls: perimeter_ft (length) and area_sqft
                     # Perimeter represents the wall length (Linear Feet)
                     # Area can be used for wall surface area calculations
-                    perimeter_ft = _convert_to_real_units(pixel_perimeter, scale, "ft")
-                    area_sqft = _convert_to_real_units(pixel_area, scale, "sq ft")
+                    perimeter_ft = _convert_to_real_units(pixel_perimeter, scale, "ft", dpi)
+                    area_sqft = _convert_to_real_units(pixel_area, scale, "sq ft", dpi)
                     
-                    print(f"  - Wall type: {item['class']}")
-                    print(f"  - Converted length: {perimeter_ft:.2f} ft")
-                    print(f"  - Converted area: {area_sqft:.2f} sq ft")
+                    if log_detection:
+                        detection_logger.debug("Wall measured", extra={
+                            "class_name": item["class"],
+                            "area_px": pixel_area,
+                            "perimeter_px": pixel_perimeter,
+                            "length_ft": perimeter_ft,
+                            "area_sqft": area_sqft,
+                        })
                     
                     item["display"].update({
                         "perimeter_ft": perimeter_ft,
@@ -437,8 +833,8 @@ def _normalize_predictions(
                 else:
                     # Generic polygon - provide both area and perimeter
                     item["display"].update({
-                        "area_sqft": _convert_to_real_units(pixel_area, scale, "sq ft"),
-                        "perimeter_ft": _convert_to_real_units(pixel_perimeter, scale, "ft"),
+                        "area_sqft": _convert_to_real_units(pixel_area, scale, "sq ft", dpi),
+                        "perimeter_ft": _convert_to_real_units(pixel_perimeter, scale, "ft", dpi),
                     })
                 
                 # Also add to metrics for consistency
@@ -452,6 +848,7 @@ def _normalize_predictions(
         out.append(item)
     return out
 
+@tracer.traced("inference")
 def _infer_image(
     image_path: str,
     model_id: str,
@@ -461,20 +858,60 @@ def _infer_image(
     """
     Calls Roboflow Inference API for a single model_id.
     `model_id` format: "workspace/project:version"
+    
+    Responses are cached by input file hash, model and params, so unchanged
+    sheets from re-uploaded revision sets are not sent to Roboflow again.
+    Concurrent calls with the same key are coalesced into one request.
     """
-    client = _get_client(api_key)
-    # You can pass extra params like `confidence`, `overlap`, `visualize`, etc. via kwargs.
-    try:
-        return client.infer(image_path, model_id=model_id, **kwargs)
-    except TypeError as exc:
-        # Some versions of the Roboflow client don't accept confidence/overlap kwargs.
-        if kwargs and "unexpected keyword argument" in str(exc):
-            print(
-                f"[ML] Warning: inference client rejected extra kwargs {list(kwargs.keys())}; "
-                "retrying without them."
-            )
-            return client.infer(image_path, model_id=model_id)
-        raise
+    span = tracer.current_span()
+    if span:
+        span.set_attribute("model_id", model_id)
+    cache_key = PageIndex.detection_key(file_hash(image_path), model_id, kwargs)
+    if DETECTION_CACHE:
+        cached = page_index.get_detections(cache_key)
+        if cached is not None:
+            logger.debug(f"Reusing cached {model_id} predictions for {os.path.basename(image_path)}")
+            if span:
+                span.set_attribute("cache", "hit")
+            return cached
+    
+    def call_model() -> Dict[str, Any]:
+        # A coalesced leader that finished just before we arrived has already cached its result
+        if DETECTION_CACHE:
+            cached = page_index.get_detections(cache_key)
+            if cached is not None:
+                return cached
+        
+        client = _get_client(api_key)
+        guard = UPSTREAM_BY_MODEL_ID.get(model_id)
+        
+        def infer(attempt: int = 1, **params: Any) -> Dict[str, Any]:
+            def timed() -> Dict[str, Any]:
+                with metrics.model_call(model_id, attempt=attempt):
+                    return client.infer(image_path, model_id=model_id, **params)
+            # Rate limited and circuit broken per model; upstream 429s are retried there
+            return guard.call(timed) if guard else timed()
+        
+        # You can pass extra params like `confidence`, `overlap`, `visualize`, etc. via kwargs.
+        try:
+            result = infer(**kwargs)
+        except TypeError as exc:
+            # Some versions of the Roboflow client don't accept confidence/overlap kwargs.
+            if kwargs and "unexpected keyword argument" in str(exc):
+                logger.warning(
+                    f"Inference client rejected extra kwargs {list(kwargs.keys())}; "
+                    "retrying without them."
+                )
+                metrics.retry("inference")
+                result = infer(attempt=2)
+            else:
+                raise
+        
+        if DETECTION_CACHE and isinstance(result, dict):
+            page_index.put_detections(cache_key, result)
+        return result
+    
+    return inflight_inferences.do(cache_key, call_model)
 
 def _classify_image(
     image_path: str,
@@ -487,16 +924,11 @@ def _classify_image(
     Calls Roboflow Classification using InferenceHTTPClient with serverless endpoint.
     Returns classification result with top class and confidence.
     """
-    from inference_sdk import InferenceHTTPClient
-    
     if not api_key:
         raise ValueError("API key is required for classification")
     
-    # Initialize client with serverless endpoint
-    client = InferenceHTTPClient(
-        api_url="https://serverless.roboflow.com",
-        api_key=api_key
-    )
+    # Shared client for the serverless endpoint
+    client = _classify_client(api_key)
     
     # Model ID format: project_id/version
     model_id = f"{project_id}/{version}"
@@ -506,13 +938,61 @@ def _classify_image(
     
     return result
 
+def _classify_images(
+    image_paths: List[str],
+    project_id: str,
+    version: str,
+    api_key: str,
+    workspace: str = None,
+) -> List[Dict[str, Any]]:
+    """
+    Classify several images with one InferenceHTTPClient call.
+    The SDK sends one request per image, PAGE_CLASSIFY_CONCURRENCY at a time;
+    this is the only fan-out, PDFProcessor sends batches one after another.
+    Returns one classification result per image, in order.
+    """
+    if not api_key:
+        raise ValueError("API key is required for classification")
+    
+    client = _classify_client(api_key)
+    results = client.infer(image_paths, model_id=f"{project_id}/{version}")
+    return results if isinstance(results, list) else [results]
+
 # Initialize PDF processor with classification function (now that _classify_image is defined)
-if PAGE_API_KEY and PAGE_PROJECT and PAGE_VERSION:
-    pdf_processor = PDFProcessor(classify_fn=_classify_image)
-    print(f"[ML] PDF Processor initialized with Roboflow classification: {PAGE_PROJECT}/{PAGE_VERSION}")
+local_page_classifier = None
+if PAGE_CLASSIFIER != "remote":
+    try:
+        local_page_classifier = load_page_classifier(PAGE_CLASSIFIER)
+    except Exception as e:
+        logger.warning(f"Could not load local page classifier '{PAGE_CLASSIFIER}': {e}")
+
+if local_page_classifier:
+    pdf_processor = PDFProcessor(
+        classify_fn=lambda image_path, **_: local_page_classifier.classify_image(image_path),
+        page_index=page_index,
+        classify_batch_fn=lambda image_paths, **_: local_page_classifier.classify_batch(image_paths),
+        model_name=local_page_classifier.name,
+        image_backend=image_backend,
+        metrics=metrics,
+        render_workers=render_workers,
+    )
+    logger.info(f"PDF Processor initialized with local classification: {local_page_classifier.name}")
+elif PAGE_API_KEY and PAGE_PROJECT and PAGE_VERSION:
+    pdf_processor = PDFProcessor(
+        classify_fn=_classify_image,
+        page_index=page_index,
+        classify_batch_fn=_classify_images,
+        image_backend=image_backend,
+        metrics=metrics,
+        upstream=upstream_guards["page"],
+        render_workers=render_workers,
+    )
+    logger.info(f"PDF Processor initialized with Roboflow classification: {PAGE_PROJECT}/{PAGE_VERSION}")
 else:
-    pdf_processor = PDFProcessor()
-    print("[ML] PDF Processor initialized without classification (missing config)")
+    pdf_processor = PDFProcessor(
+        page_index=page_index, image_backend=image_backend, metrics=metrics, render_workers=render_workers
+    )
+    logger.warning("PDF Processor initialized without classification (missing config)")
 
 def _calculate_iou(box1: Dict[str, float], box2: Dict[str, float]) -> float:
     """
@@ -545,6 +1025,7 @@ def _calculate_iou(box1: Dict[str, float], box2: Dict[str, float]) -> float:
     
     return intersection / union if union > 0 else 0.0
 
+@metrics.timed("ensemble")
 def _ensemble_door_window_predictions(
     roboflow_preds: List[Dict[str, Any]],
     custom_preds: List[Dict[str, Any]],
@@ -566,14 +1047,12 @@ def _ensemble_door_window_predictions(
     Returns:
         Combined list of predictions
     """
-    print(f"[ML] Ensemble: Roboflow={len(roboflow_preds)}, Custom={len(custom_preds)}")
-    
     if not custom_preds:
-        print("[ML] Ensemble: No custom predictions, returning Roboflow only")
+        logger.debug("Ensemble: no custom predictions, returning Roboflow only")
         return roboflow_preds
     
     if not roboflow_preds:
-        print("[ML] Ensemble: No Roboflow predictions, returning custom only")
+        logger.debug("Ensemble: no Roboflow predictions, returning custom only")
         return custom_preds
     
     combined = []
@@ -602,25 +1081,28 @@ def _ensemble_door_window_predictions(
             robo_pred = roboflow_preds[best_match_idx]
             if custom_pred["confidence"] > robo_pred["confidence"]:
                 combined.append(custom_pred)
-                print(f"[ML] Ensemble: Using custom (conf={custom_pred['confidence']:.2f}) over Roboflow (conf={robo_pred['confidence']:.2f})")
             else:
                 combined.append(robo_pred)
-                print(f"[ML] Ensemble: Using Roboflow (conf={robo_pred['confidence']:.2f}) over custom (conf={custom_pred['confidence']:.2f})")
+            if sample_detection():
+                detection_logger.debug("Ensemble match", extra={
+                    "iou": max_iou,
+                    "custom_confidence": custom_pred["confidence"],
+                    "roboflow_confidence": robo_pred["confidence"],
+                    "kept": "custom" if custom_pred["confidence"] > robo_pred["confidence"] else "roboflow",
+                })
             used_roboflow.add(best_match_idx)
             used_custom.add(i)
         else:
             # No overlap - add custom prediction
             combined.append(custom_pred)
             used_custom.add(i)
-            print(f"[ML] Ensemble: Added unique custom detection (conf={custom_pred['confidence']:.2f})")
     
     # Add remaining Roboflow predictions that weren't matched
     for j, robo_pred in enumerate(roboflow_preds):
         if j not in used_roboflow:
             combined.append(robo_pred)
-            print(f"[ML] Ensemble: Added unique Roboflow detection (conf={robo_pred['confidence']:.2f})")
     
-    print(f"[ML] Ensemble: Combined total = {len(combined)} detections")
+    logger.debug(f"Ensemble: Roboflow={len(roboflow_preds)}, custom={len(custom_preds)}, combined={len(combined)}")
     return combined
 
 def _run_custom_room_model(
@@ -628,7 +1110,8 @@ def _run_custom_room_model(
     img_w: int,
     img_h: int,
     confidence: float = 0.3,
-    scale: Optional[float] = None
+    scale: Optional[float] = None,
+    dpi: Optional[float] = None,
 ) -> List[Dict[str, Any]]:
     """
     Run custom YOLO model for room detection and convert to standard format.
@@ -639,6 +1122,7 @@ def _run_custom_room_model(
         img_h: Image height
         confidence: Confidence threshold
         scale: Scale factor for real-world units
+        dpi: Effective pixel density of the image
     
     Returns:
         List of predictions in standard format
@@ -648,7 +1132,8 @@ def _run_custom_room_model(
     
     try:
         # Run inference
-        results = CUSTOM_ROOM_MODEL(image_path, conf=confidence, iou=0.5)
+        with metrics.model_call("custom_room_yolo"):
+            results = CUSTOM_ROOM_MODEL(image_path, conf=confidence, iou=0.5)
         
         predictions = []
         for result in results:
@@ -705,8 +1190,8 @@ def _run_custom_room_model(
                     pred["perimeter_px"] = perimeter_px
                     
                     # Convert to real-world units
-                    area_sqft = _convert_to_real_units(area_px, scale, "sq ft")
-                    perimeter_ft = _convert_to_real_units(perimeter_px, scale, "ft")
+                    area_sqft = _convert_to_real_units(area_px, scale, "sq ft", dpi)
+                    perimeter_ft = _convert_to_real_units(perimeter_px, scale, "ft", dpi)
                     
                     pred["display"] = {
                         "area_sqft": area_sqft,
@@ -719,7 +1204,7 @@ def _run_custom_room_model(
         return predictions
         
     except Exception as e:
-        print(f"[ERROR] Error running custom room model: {e}")
+        logger.error(f"Error running custom room model: {e}")
         return []
 
 
@@ -728,7 +1213,8 @@ def _run_custom_yolo_model(
     img_w: int,
     img_h: int,
     confidence: float = 0.3,
-    scale: Optional[float] = None
+    scale: Optional[float] = None,
+    dpi: Optional[float] = None,
 ) -> List[Dict[str, Any]]:
     """
     Run custom YOLO model on image and convert to standard format.
@@ -739,6 +1225,7 @@ def _run_custom_yolo_model(
         img_h: Image height
         confidence: Confidence threshold
         scale: Scale factor for real-world units
+        dpi: Effective pixel density of the image
     
     Returns:
         List of predictions in standard format
@@ -748,12 +1235,13 @@ def _run_custom_yolo_model(
     
     try:
         # Run inference
-        results = CUSTOM_WINDOW_MODEL.predict(
-            image_path,
-            conf=confidence,
-            iou=0.5,
-            verbose=False
-        )
+        with metrics.model_call("custom_window_yolo"):
+            results = CUSTOM_WINDOW_MODEL.predict(
+                image_path,
+                conf=confidence,
+                iou=0.5,
+                verbose=False
+            )
         
         if not results or len(results) == 0:
             return []
@@ -789,7 +1277,7 @@ def _run_custom_yolo_model(
             ]
             
             pred = {
-                "id": str(uuid.uuid4()),
+                "id": _new_prediction_id(),
                 "class": class_name,
                 "confidence": float(box.conf[0]),
                 "category": class_name,
@@ -799,36 +1287,297 @@ def _run_custom_yolo_model(
                     "w": float(width),
                     "h": float(height)
                 },
-                "bbox_norm": {
-                    "x": float(center_x / img_w) if img_w else 0.0,
-                    "y": float(center_y / img_h) if img_h else 0.0,
-                    "w": float(width / img_w) if img_w else 0.0,
-                    "h": float(height / img_h) if img_h else 0.0,
-                },
                 "metrics": {},
                 "mask": mask_points,
                 "points": mask_points,
-                "points_norm": [
-                    {"x": float(x1 / img_w), "y": float(y1 / img_h)},
-                    {"x": float(x2 / img_w), "y": float(y1 / img_h)},
-                    {"x": float(x2 / img_w), "y": float(y2 / img_h)},
-                    {"x": float(x1 / img_w), "y": float(y2 / img_h)},
-                ],
                 "display": {
-                    "width": _convert_to_real_units(width, scale, "ft"),
-                    "height": _convert_to_real_units(height, scale, "ft"),
+                    "width": _convert_to_real_units(width, scale, "ft", dpi),
+                    "height": _convert_to_real_units(height, scale, "ft", dpi),
                 },
                 "source": "custom_yolo"  # Mark as custom model prediction
             }
             predictions.append(pred)
         
-        print(f"[ML] Custom YOLO model detected {len(predictions)} windows")
+        logger.debug(f"Custom YOLO model detected {len(predictions)} windows")
         return predictions
         
     except Exception as e:
-        print(f"[ML] Error running custom YOLO model: {e}")
+        logger.error(f"Error running custom YOLO model: {e}")
         return []
 
+def _page_analysis_path(upload_dir: str, page_num: int) -> str:
+    return os.path.join(upload_dir, f"analysis_page_{page_num}.json")
+
+
+def _save_page_analysis(upload_dir: str, page_num: int, params: Dict[str, Any], predictions: Dict[str, Any]) -> None:
+    """Keep a page's detections so a later revision can be analyzed incrementally."""
+    try:
+        with open(_page_analysis_path(upload_dir, page_num), "wb") as f:
+            f.write(dumps({"params": params, "predictions": predictions}))
+    except Exception as e:
+        logger.warning(f"Could not save analysis for page {page_num}: {e}")
+        return
+    page_store.put(os.path.basename(upload_dir), _page_analysis_path(upload_dir, page_num))
+
+
+def _load_page_analysis(upload_dir: str, page_num: int) -> Optional[Dict[str, Any]]:
+    page_store.fetch(os.path.basename(upload_dir), os.path.basename(_page_analysis_path(upload_dir, page_num)), upload_dir)
+    try:
+        with open(_page_analysis_path(upload_dir, page_num), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Could not read analysis for page {page_num}: {e}")
+        return None
+
+
+def _detect_page(
+    image_path: str,
+    img_w: int,
+    img_h: int,
+    types_list: List[str],
+    scale: Optional[float] = None,
+    confidence: Optional[float] = None,
+    dpi: Optional[float] = None,
+) -> tuple[Dict[str, List[Dict[str, Any]]], Dict[str, str]]:
+    """
+    Run the detection models requested by `types_list` on one page image.
+    
+    Returns:
+        (predictions keyed by rooms/walls/openings, errors keyed by model)
+    """
+    # Determine which models to run
+    detect_rooms = any(t in types_list for t in ["rooms", "floors", "flooring"])
+    detect_walls = "walls" in types_list
+    detect_doors_windows = any(t in types_list for t in ["doors", "windows", "columns", "openings"])
+
+    # Inference kwargs
+    infer_kwargs: Dict[str, Any] = {}
+    if confidence is not None:
+        infer_kwargs["confidence"] = confidence
+
+    page_predictions = {}
+    page_errors = {}
+
+    # Run room detection if requested
+    if detect_rooms:
+        room_predictions = []
+
+        # 1. Run Roboflow room detection
+        if ROOM_MODEL_ID:
+            try:
+                raw = _infer_image(image_path, model_id=ROOM_MODEL_ID, api_key=ROOM_API_KEY, **infer_kwargs)
+                roboflow_rooms = _normalize_predictions(raw, img_w, img_h, scale=scale, dpi=dpi)
+                room_predictions.extend(roboflow_rooms)
+                logger.debug(f"Roboflow room detection found {len(roboflow_rooms)} rooms")
+            except Exception as e:
+                page_errors["rooms_roboflow"] = str(e)
+
+        # 2. Run custom room detection model if available
+        if CUSTOM_ROOM_MODEL:
+            try:
+                custom_rooms = cpu_workers.run(_run_custom_room_model, image_path, img_w, img_h,
+                                               confidence=confidence, scale=scale, dpi=dpi)
+                # Convert to normalized format
+                custom_rooms_normalized = _normalize_predictions(
+                    {"predictions": custom_rooms}, 
+                    img_w, 
+                    img_h, 
+                    scale=scale,
+                    dpi=dpi,
+                )
+                room_predictions.extend(custom_rooms_normalized)
+                logger.debug(f"Custom room detection found {len(custom_rooms_normalized)} rooms")
+            except Exception as e:
+                page_errors["rooms_custom"] = str(e)
+
+        # 3. Apply ensemble method (simple merge for now, can be improved with NMS)
+        if room_predictions:
+            # For now, just take unique predictions based on class and position
+            # In a production environment, you might want to implement NMS here
+            unique_rooms = {}
+            for room in room_predictions:
+                # Create a unique key based on class and position
+                key = f"{room.get('class', 'room')}_{room.get('x', 0):.0f}_{room.get('y', 0):.0f}"
+                # Keep the one with higher confidence if duplicate
+                if key not in unique_rooms or room.get('confidence', 0) > unique_rooms[key].get('confidence', 0):
+                    unique_rooms[key] = room
+
+            page_predictions["rooms"] = list(unique_rooms.values())
+            logger.debug(f"Combined room detection found {len(unique_rooms)} unique rooms")
+
+    # Run wall detection
+    if detect_walls and WALL_MODEL_ID:
+        try:
+            raw = _infer_image(image_path, model_id=WALL_MODEL_ID, api_key=WALL_API_KEY, **infer_kwargs)
+            page_predictions["walls"] = _normalize_predictions(raw, img_w, img_h, scale=scale, dpi=dpi)
+        except Exception as e:
+            page_errors["walls"] = str(e)
+
+    # Run door/window detection
+    if detect_doors_windows and DOORWINDOW_MODEL_ID:
+        try:
+            raw = _infer_image(image_path, model_id=DOORWINDOW_MODEL_ID, api_key=DOORWINDOW_API_KEY, **infer_kwargs)
+            roboflow_preds = _normalize_predictions(raw, img_w, img_h, filter_classes=["door", "window", "Door", "Window"], scale=scale, dpi=dpi)
+
+            # Ensemble learning if custom model available
+            if CUSTOM_WINDOW_MODEL:
+                custom_preds = cpu_workers.run(
+                    _run_custom_yolo_model, image_path, img_w, img_h, confidence=confidence or 0.3, scale=scale, dpi=dpi
+                )
+                door_window_preds = _ensemble_door_window_predictions(roboflow_preds, custom_preds, iou_threshold=0.4)
+            else:
+                door_window_preds = roboflow_preds
+
+            page_predictions["openings"] = door_window_preds
+        except Exception as e:
+            page_errors["openings"] = str(e)
+
+    return page_predictions, page_errors
+
+
+def _translate_prediction(pred: Dict[str, Any], dx: float, dy: float) -> Dict[str, Any]:
+    """Move a normalized prediction from crop coordinates into page coordinates."""
+    pred = {k: v for k, v in pred.items() if k not in ("points_norm", "bbox_norm")}
+    points = pred.get("mask") or pred.get("points")
+    if points:
+        pred["mask"] = pred["points"] = [{"x": pt["x"] + dx, "y": pt["y"] + dy} for pt in points]
+    if pred.get("bbox"):
+        pred["bbox"] = dict(pred["bbox"], x=pred["bbox"]["x"] + dx, y=pred["bbox"]["y"] + dy)
+    return pred
+
+
+def _detect_page_incremental(
+    image_path: str,
+    base_image_path: str,
+    prior_predictions: Dict[str, List[Dict[str, Any]]],
+    img_w: int,
+    img_h: int,
+    types_list: List[str],
+    scale: Optional[float] = None,
+    confidence: Optional[float] = None,
+    dpi: Optional[float] = None,
+) -> Optional[tuple[Dict[str, List[Dict[str, Any]]], Dict[str, str], Dict[str, Any]]]:
+    """
+    Re-analyze a revised page by running detection only on regions that differ
+    from the previously analyzed render, keeping prior detections elsewhere.
+    
+    Returns None when a full pass is the better option (different page size,
+    too much of the sheet changed).
+    """
+    diff = changed_regions(base_image_path, image_path, tile_size=INCREMENTAL_TILE_SIZE)
+    if not diff["comparable"] or diff["changed_fraction"] > INCREMENTAL_MAX_CHANGED_FRACTION:
+        logger.info(f"Incremental analysis not worthwhile (changed {diff['changed_fraction']:.0%}), running full pass")
+        return None
+    
+    all_prior = [p for preds in prior_predictions.values() for p in preds]
+    regions = expand_regions(diff["regions"], all_prior)
+    logger.info(f"Incremental analysis: {len(regions)} changed regions ({diff['changed_fraction']:.0%} of tiles)")
+    
+    # Keep every prior detection that does not touch a changed region
+    page_predictions: Dict[str, List[Dict[str, Any]]] = {
+        key: [p for p in preds if not any(boxes_intersect(prediction_box(p), r) for r in regions)]
+        for key, preds in prior_predictions.items()
+    }
+    retained = sum(len(preds) for preds in page_predictions.values())
+    page_errors: Dict[str, str] = {}
+    
+    if regions:
+        with Image.open(image_path) as page_img:
+            page_img.load()
+            for region in regions:
+                crop_box = pad_box(region, INCREMENTAL_CONTEXT_MARGIN, img_w, img_h)
+                crop = page_img.crop(crop_box)
+                with storage.temp_file(".jpg") as crop_path:
+                    image_backend.save_jpeg(crop, crop_path, quality=95, dpi=dpi or DEFAULT_IMAGE_DPI)
+                    crop_predictions, crop_errors = _detect_page(
+                        crop_path, crop.width, crop.height, types_list, scale=scale, confidence=confidence, dpi=dpi
+                    )
+                page_errors.update(crop_errors)
+                
+                for key, preds in crop_predictions.items():
+                    for pred in preds:
+                        pred = _translate_prediction(pred, crop_box[0], crop_box[1])
+                        # Detections centred in the context margin belong to unchanged areas
+                        x1, y1, x2, y2 = prediction_box(pred)
+                        cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+                        if region[0] <= cx <= region[2] and region[1] <= cy <= region[3]:
+                            page_predictions.setdefault(key, []).append(pred)
+    
+    new_count = sum(len(preds) for preds in page_predictions.values()) - retained
+    summary = {
+        "mode": "incremental",
+        "changed_fraction": diff["changed_fraction"],
+        "regions": [list(r) for r in regions],
+        "retained": retained,
+        "new": new_count,
+    }
+    return page_predictions, page_errors, summary
+
+
+def _local_upload_dir(upload_id: str, label: str = "Upload ID") -> str:
+    """Upload directory on this instance, fetched from the shared page store if needed (404 if unknown)."""
+    try:
+        uuid.UUID(upload_id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail=f"{label} not found: {upload_id}")
+    upload_dir = os.path.join(PDF_UPLOAD_DIR, upload_id)
+    if not page_store.ensure_upload(upload_id, upload_dir):
+        raise HTTPException(status_code=404, detail=f"{label} not found: {upload_id}")
+    return upload_dir
+
+
+def _page_image(upload_id: str, upload_dir: str, page_num: int) -> str:
+    """
+    Full-resolution render of a page: cached locally, fetched from the shared
+    page store, or rendered here (and published for other instances).
+    """
+    image_path = PDFProcessor.page_image_path(upload_dir, page_num)
+    if page_store.fetch(upload_id, os.path.basename(image_path), upload_dir):
+        return image_path
+    image_path = pdf_processor.ensure_page_image(upload_dir, page_num)
+    page_store.put(upload_id, image_path)
+    return image_path
+
+
+def _schedule_speculative_analysis(upload_id: str, pages: List[Dict[str, Any]]) -> List[int]:
+    """
+    Queue background detection for analyzable pages of SPECULATIVE_PAGE_TYPES.
+    Uses the same inputs and params as a default /analyze-pages call, so its
+    model calls land in the detection cache that request will read.
+    """
+    models = [
+        (model_id, api_key)
+        for model_id, api_key in (
+            (ROOM_MODEL_ID, ROOM_API_KEY),
+            (WALL_MODEL_ID, WALL_API_KEY),
+            (DOORWINDOW_MODEL_ID, DOORWINDOW_API_KEY),
+        )
+        if model_id
+    ]
+    if not models or not DETECTION_CACHE:
+        return []
+    
+    upload_dir = os.path.join(PDF_UPLOAD_DIR, upload_id)
+    scheduled = []
+    for page in pages:
+        if not page.get('analyzable') or page.get('type') not in SPECULATIVE_PAGE_TYPES:
+            continue
+        # The first step also makes the page's full-resolution render
+        steps = [
+            metrics.bind(
+                lambda page_num=page['page_number'], model_id=model_id, api_key=api_key:
+                    _infer_image(_page_image(upload_id, upload_dir, page_num), model_id=model_id, api_key=api_key),
+                endpoint="speculative",
+            )
+            for model_id, api_key in models
+        ]
+        if speculative_scheduler.submit(f"{upload_id}:{page['page_number']}", steps):
+            scheduled.append(page['page_number'])
+    return scheduled
+
+
 # ------------------------------------------------------------------------------
 # Routes
 # ------------------------------------------------------------------------------
@@ -869,6 +1618,19 @@ def config() -> Dict[str, Any]:
         "has_room_api_key": bool(ROOM_API_KEY),
         "has_wall_api_key": bool(WALL_API_KEY),
         "has_doorwindow_api_key": bool(DOORWINDOW_API_KEY),
+        "image_backend": image_backend.name,
+        "metrics": metrics.enabled,
+        "admission": admission.stats(),
+        "cpu_workers": cpu_workers.stats(),
+        "render_workers": render_workers.stats(),
+        "upstreams": {name: guard.stats() for name, guard in upstream_guards.items()},
+        "profiling": profiler.enabled,
+        "inference_coalescing": inflight_inferences.stats(),
+        "speculative_analysis": {
+            "enabled": SPECULATIVE_ANALYSIS,
+            "page_types": sorted(SPECULATIVE_PAGE_TYPES),
+            **speculative_scheduler.stats(),
+        },
         "models": {
             "rooms": "Detects only room objects",
             "walls": "Detects only wall objects",
@@ -876,44 +1638,76 @@ def config() -> Dict[str, Any]:
         }
     }
 
-def convert_numpy_types(obj):
-    """Recursively convert numpy types to native Python types for JSON serialization."""
-    import numpy as np
-    
-    if isinstance(obj, (np.bool_, np.bool)):
-        return bool(obj)
-    elif isinstance(obj, np.floating):
-        return float(obj)
-    elif isinstance(obj, np.integer):
-        return int(obj)
-    elif isinstance(obj, np.ndarray):
-        return obj.tolist()
-    elif isinstance(obj, dict):
-        return {k: convert_numpy_types(v) for k, v in obj.items()}
-    elif isinstance(obj, (list, tuple)):
-        return [convert_numpy_types(item) for item in obj]
-    return obj
-
-@app.post("/analyze", response_class=JSONResponse)
-async def analyze(
-    file: UploadFile = File(..., description="Image file (plans/photo)"),
-    types: Optional[str] = Form(None, description="JSON array of types to analyze"),
-    scale: Optional[float] = Form(None, description="Scale in units per pixel"),
-    confidence: Optional[float] = Form(None),
-    overlap: Optional[float] = Form(None),
-) -> Dict[str, Any]:
+def _form_float(form: Dict[str, str], name: str) -> Optional[float]:
+    """Optional numeric form field; missing or empty means not set."""
+    value = (form.get(name) or "").strip()
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        raise HTTPException(status_code=422, detail=f"Form field '{name}' must be a number")
+
+
+def _form_bool(form: Dict[str, str], name: str) -> Optional[bool]:
+    """Optional boolean form field (true/false, 1/0, yes/no, on/off)."""
+    value = (form.get(name) or "").strip().lower()
+    if not value:
+        return None
+    if value in ("1", "true", "yes", "on"):
+        return True
+    if value in ("0", "false", "no", "off"):
+        return False
+    raise HTTPException(status_code=422, detail=f"Form field '{name}' must be a boolean")
+
+
+def _response_format(response_format: Optional[str]) -> str:
+    fmt = (response_format or "full").lower()
+    if fmt not in RESPONSE_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid response_format '{response_format}'. Use one of: {', '.join(RESPONSE_FORMATS)}"
+        )
+    return fmt
+
+@app.post("/analyze", response_class=FastJSONResponse, openapi_extra=multipart_openapi(
+    "Image file (plans/photo)",
+    types={"type": "string", "description": "JSON array of types to analyze"},
+    scale={"type": "number", "description": "Drawing scale in inches per foot (e.g. 0.25 for 1/4\" = 1')"},
+    confidence={"type": "number"},
+    overlap={"type": "number"},
+    dpi={"type": "number", "description": "Pixel density of the uploaded image; overrides the image header"},
+    pixels_per_foot={"type": "number", "description": "Calibrated pixels per foot on the uploaded image; overrides scale"},
+    response_format={"type": "string", "description": "full (default) or compact: flat point arrays, no duplicated geometry"},
+))
+async def analyze(request: Request) -> Dict[str, Any]:
     """
     Upload an image and run Roboflow inference for rooms, walls, doors, and windows.
+    The form (see multipart_openapi above) is read while the image streams to disk.
     
     Models:
     - rooms: Uses ROOM_MODEL (detects only rooms)
     - walls: Uses WALL_MODEL (detects only walls)
     - doors/windows: Uses DOORWINDOW_MODEL (filters to only doors and windows)
     """
-    import time
     request_start = time.time()
-    print(f"[ML] === Analysis request started at {time.strftime('%H:%M:%S')} ===")
+    upload_path = storage.new_temp_path(".upload")
+    temp_path = None
+    ticket = None
     try:
+        # Stream the upload to disk, reading the form fields around it
+        with metrics.stage("upload_read"):
+            upload, form = await receive_upload(
+                request, lambda _: upload_path, max_bytes=MAX_IMAGE_UPLOAD_MB * 1024 * 1024,
+            )
+        types = form.get("types")
+        scale = _form_float(form, "scale")
+        confidence = _form_float(form, "confidence")
+        overlap = _form_float(form, "overlap")
+        dpi = _form_float(form, "dpi")
+        pixels_per_foot = _form_float(form, "pixels_per_foot")
+        fmt = _response_format(form.get("response_format"))
+        
         # Parse types parameter (frontend sends JSON array)
         types_to_analyze = []
         if types:
@@ -931,20 +1725,21 @@ async def analyze(
         detect_walls = "walls" in types_to_analyze
         detect_doors_windows = any(t in types_to_analyze for t in ["doors", "windows", "columns", "openings"])
         
-        # Read and validate image
-        data = await file.read()
-        if not data:
+        ticket = await _admit("/analyze", INTERACTIVE, ADMISSION_ANALYZE_MB, _model_count(types_to_analyze))
+        
+        # Validate the upload
+        if not upload.size:
             raise HTTPException(status_code=400, detail="Empty upload.")
         
         # Validate minimum file size (at least 100 bytes for a valid image)
-        if len(data) < 100:
+        if upload.size < 100:
             raise HTTPException(
                 status_code=400, 
-                detail=f"File too small ({len(data)} bytes). Please upload a valid image file."
+                detail=f"File too small ({upload.size} bytes). Please upload a valid image file."
             )
         
         # Check file signature (magic bytes) for common image formats
-        file_signature = data[:8]
+        file_signature = upload.head[:8]
         valid_signatures = [
             b'\x89PNG\r\n\x1a\n',  # PNG
             b'\xff\xd8\xff',        # JPEG
@@ -963,34 +1758,39 @@ async def analyze(
                 detail="Invalid image format. Please upload a PNG, JPEG, GIF, or BMP file."
             )
 
-        # Get image dimensions with error handling
-        original_img_w, original_img_h = _image_size_from_bytes(data)
+        ext = os.path.splitext(upload.filename)[-1].lower() or ".jpg"
+        temp_path = storage.new_temp_path(ext)
         
-        # Resize image to max 1536px to speed up Roboflow API
+        # Decode once, downscaled to max 1536px to speed up Roboflow API
         # This significantly reduces upload time and processing time
         MAX_DIMENSION = 1536
-        img = Image.open(io.BytesIO(data))
-        
-        # Calculate scaling factor
-        scale_factor = 1.0
-        if max(original_img_w, original_img_h) > MAX_DIMENSION:
-            scale_factor = MAX_DIMENSION / max(original_img_w, original_img_h)
-            new_w = int(original_img_w * scale_factor)
-            new_h = int(original_img_h * scale_factor)
-            img = img.resize((new_w, new_h), Image.Resampling.LANCZOS)
-            print(f"[ML] Resized image from {original_img_w}x{original_img_h} to {new_w}x{new_h} (factor: {scale_factor:.2f})")
-        else:
-            new_w, new_h = original_img_w, original_img_h
-            print(f"[ML] Image size {original_img_w}x{original_img_h} is within limit, no resize needed")
+        try:
+            prepared = await admission.hold(
+                ticket, cpu_workers.run_async(_prepare_image, upload.path, temp_path, MAX_DIMENSION, dpi),
+            )
+        except UnreadableImageError as e:
+            logger.error(f"Failed to read image ({upload.size} bytes, starts {upload.head[:20]}): {str(e)}")
+            raise HTTPException(
+                status_code=400,
+                detail=f"Cannot identify image file. Please ensure the file is a valid image (PNG, JPG, etc.). Error: {str(e)}"
+            )
+        for stage, seconds in prepared["stage_seconds"].items():
+            metrics.observe_stage(stage, seconds)
+        original_img_w, original_img_h = prepared["original_size"]
+        scale_factor = prepared["scale_factor"]
+        source_dpi = prepared["source_dpi"]
         
         # Use resized dimensions for inference
-        img_w, img_h = new_w, new_h
-
-        ext = os.path.splitext(file.filename or "")[-1].lower() or ".jpg"
-        temp_path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4().hex}{ext}")
+        img_w, img_h = prepared["size"]
+        if scale_factor < 1.0:
+            logger.debug(f"Resized image from {original_img_w}x{original_img_h} to {img_w}x{img_h} (factor: {scale_factor:.2f})")
         
-        # Save resized image
-        img.save(temp_path, quality=85, optimize=True)
+        # Pixel density of the image the models actually see
+        effective_dpi = source_dpi * scale_factor
+        if pixels_per_foot and pixels_per_foot > 0:
+            # Calibration was measured on the original image; express it as an
+            # equivalent drawing scale at the effective density
+            scale = (pixels_per_foot * scale_factor) / effective_dpi
 
         # Inference kwargs
         infer_kwargs: Dict[str, Any] = {}
@@ -1000,50 +1800,63 @@ async def analyze(
             infer_kwargs["overlap"] = overlap
 
         results = {
-            "image": {"width": img_w, "height": img_h},
+            "image": {
+                "width": img_w,
+                "height": img_h,
+                "dpi": effective_dpi,
+                "source_dpi": source_dpi,
+                "original_width": original_img_w,
+                "original_height": original_img_h,
+                "resize_factor": scale_factor,
+            },
             "scale": scale,
-            "filename": file.filename,
+            "filename": upload.filename,
+            "file_hash": upload.file_hash,
             "predictions": {},
         }
         errors: Dict[str, str] = {}
 
         # Run all model inferences in parallel for speed
-        import asyncio
         from concurrent.futures import ThreadPoolExecutor
         
+        @tracer.traced("room_detection")
         def run_room_detection():
             if not detect_rooms or not ROOM_MODEL_ID:
                 return None
             try:
                 raw = _infer_image(temp_path, model_id=ROOM_MODEL_ID, api_key=ROOM_API_KEY, **infer_kwargs)
-                roboflow_rooms = _normalize_predictions(raw, img_w, img_h, scale=scale)
+                roboflow_rooms = _normalize_predictions(raw, img_w, img_h, scale=scale, dpi=effective_dpi)
                 
                 # Use custom room model as fallback only if Roboflow returns no results
                 if not roboflow_rooms and CUSTOM_ROOM_MODEL:
-                    print("[ML] Roboflow returned no rooms, using custom room model as fallback")
-                    roboflow_rooms = _run_custom_room_model(
+                    logger.info("Roboflow returned no rooms, using custom room model as fallback")
+                    roboflow_rooms = cpu_workers.run(
+                        _run_custom_room_model,
                         temp_path,
                         img_w,
                         img_h,
                         confidence=confidence or 0.3,
-                        scale=scale
+                        scale=scale,
+                        dpi=effective_dpi,
                     )
-                    print(f"[ML] Custom room model fallback detected {len(roboflow_rooms)} rooms")
+                    logger.debug(f"Custom room model fallback detected {len(roboflow_rooms)} rooms")
                 
                 return ("rooms", roboflow_rooms, None)
             except Exception as e:
                 return ("rooms", None, str(e))
         
+        @tracer.traced("wall_detection")
         def run_wall_detection():
             if not detect_walls or not WALL_MODEL_ID:
                 return None
             try:
                 raw = _infer_image(temp_path, model_id=WALL_MODEL_ID, api_key=WALL_API_KEY, **infer_kwargs)
-                walls = _normalize_predictions(raw, img_w, img_h, scale=scale)
+                walls = _normalize_predictions(raw, img_w, img_h, scale=scale, dpi=effective_dpi)
                 return ("walls", walls, None)
             except Exception as e:
                 return ("walls", None, str(e))
         
+        @tracer.traced("door_window_detection")
         def run_door_window_detection():
             if not detect_doors_windows or not DOORWINDOW_MODEL_ID:
                 return None
@@ -1051,18 +1864,19 @@ async def analyze(
                 # Run Roboflow model
                 raw = _infer_image(temp_path, model_id=DOORWINDOW_MODEL_ID, api_key=DOORWINDOW_API_KEY, **infer_kwargs)
                 # Filter to only include door and window classes
-                roboflow_preds = _normalize_predictions(raw, img_w, img_h, filter_classes=["door", "window", "Door", "Window"], scale=scale)
+                roboflow_preds = _normalize_predictions(raw, img_w, img_h, filter_classes=["door", "window", "Door", "Window"], scale=scale, dpi=effective_dpi)
                 
                 # If custom YOLO model is available, run ensemble learning
                 if CUSTOM_WINDOW_MODEL:
-                    print("[ML] Running ensemble learning for door/window detection")
                     # Run custom model
-                    custom_preds = _run_custom_yolo_model(
+                    custom_preds = cpu_workers.run(
+                        _run_custom_yolo_model,
                         temp_path,
                         img_w,
                         img_h,
                         confidence=confidence or 0.3,
-                        scale=scale
+                        scale=scale,
+                        dpi=effective_dpi,
                     )
                     
                     # Combine predictions using ensemble strategy
@@ -1071,53 +1885,70 @@ async def analyze(
                         custom_preds,
                         iou_threshold=0.4
                     )
-                    print(f"[ML] Ensemble result: {len(door_window_preds)} total detections")
                 else:
                     # No custom model - use Roboflow only
                     door_window_preds = roboflow_preds
-                    print(f"[ML] Using Roboflow only: {len(door_window_preds)} detections")
                 
                 return ("openings", door_window_preds, None)
             except Exception as e:
                 return ("openings", None, str(e))
         
         # Run all detections in parallel using ThreadPoolExecutor
-        print("[ML] Running parallel model inference...")
         parallel_start = time.time()
-        with ThreadPoolExecutor(max_workers=3) as executor:
-            room_result = executor.submit(run_room_detection)
-            wall_result = executor.submit(run_wall_detection)
-            door_result = executor.submit(run_door_window_detection)
-            
-            # Collect results
-            for future in [room_result, wall_result, door_result]:
-                result = future.result()
-                if result:
-                    key, predictions, error = result
-                    if error:
-                        errors[key] = error
-                    elif predictions:
-                        results["predictions"][key] = predictions
+        executor = ThreadPoolExecutor(max_workers=3)
+        detections = [
+            asyncio.wrap_future(executor.submit(metrics.bind(detect)))
+            for detect in (run_room_detection, run_wall_detection, run_door_window_detection)
+        ]
+        # The threads exit once their detection is done, without blocking the event loop here
+        executor.shutdown(wait=False)
+        
+        # Collect results; awaiting keeps the event loop free so concurrent
+        # requests for the same page overlap and share in-flight model calls
+        for result in await admission.hold(ticket, asyncio.gather(*detections)):
+            if result:
+                key, predictions, error = result
+                if error:
+                    errors[key] = error
+                elif predictions:
+                    results["predictions"][key] = predictions
         
         parallel_time = time.time() - parallel_start
-        print(f"[ML] Parallel inference completed in {parallel_time:.2f}s")
+        # Images and model responses are done with; give the reservation back before serializing
+        admission.release(ticket)
+        ticket = None
 
         if errors:
             results["errors"] = errors
 
         total_time = time.time() - request_start
-        print(f"[ML] === Analysis completed in {total_time:.2f}s ===")
+        logger.info("Analysis completed", extra={
+            "seconds": round(total_time, 3),
+            "inference_seconds": round(parallel_time, 3),
+            "image_size": [img_w, img_h],
+            "detections": {key: len(items) for key, items in results["predictions"].items()},
+            "errors": sorted(errors),
+        })
         results["processing_time"] = f"{total_time:.2f}s"
         
-        # Convert numpy types to native Python types for JSON serialization
-        results = convert_numpy_types(results)
+        results["format"] = fmt
+        if fmt == "compact":
+            results["schema_version"] = COMPACT_SCHEMA_VERSION
+        results["predictions"] = format_predictions(results["predictions"], fmt, img_w, img_h)
         
-        return results
+        # Serialized by orjson, numpy values included
+        with metrics.stage("serialization"):
+            return FastJSONResponse(_with_debug_trace(results))
 
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        # Request temp files never outlive the request
+        storage.discard(upload_path, temp_path)
+        if ticket:
+            admission.release(ticket, completed=False)
 
 
 # Convenience: allow Render's periodic HEAD health probe on /analyze (return 200 quickly)
@@ -1138,7 +1969,6 @@ def options_analyze():
 @app.get("/test")
 async def test_endpoint():
     """Test endpoint to verify ML service is running"""
-    print("[ML] 🧪 Test endpoint called!")
     return {"status": "ok", "message": "ML service is running"}
 
 
@@ -1147,105 +1977,133 @@ def options_upload_pdf():
     """Handle CORS preflight requests for /upload-pdf endpoint."""
     return PlainTextResponse("ok", status_code=200)
 
-@app.post("/upload-pdf", response_class=JSONResponse)
-async def upload_pdf(file: UploadFile = File(...)) -> Dict[str, Any]:
+@app.post("/upload-pdf", response_class=FastJSONResponse, openapi_extra=multipart_openapi(
+    "PDF drawing set",
+    speculative={"type": "boolean", "description": "Pre-analyze floor plans in the background"},
+))
+async def upload_pdf(request: Request) -> Dict[str, Any]:
     """
     Upload and process a multi-page PDF.
     Returns page classifications and thumbnails.
-    """
-    # Force UTF-8 encoding for stdout
-    import sys
-    import codecs
-    if sys.stdout.encoding != 'utf-8':
-        sys.stdout = codecs.getwriter('utf-8')(sys.stdout.buffer, 'strict')
-    
-    # Write to log file to debug
-    try:
-        with open("upload_log.txt", "a", encoding='utf-8') as f:
-            f.write(f"\n{'='*80}\n")
-            f.write(f"PDF UPLOAD RECEIVED at {datetime.now()}\n")
-            f.write(f"Filename: {file.filename}\n")
-            f.write(f"{'='*80}\n")
-    except Exception as e:
-        print(f"[WARNING] Failed to write to log file: {e}")
-    
-    sys.stdout.flush()
-    sys.stderr.flush()
     
+    With speculative pre-analysis enabled (SPECULATIVE_ANALYSIS=1 or the
+    `speculative` form field), detection for analyzable floor plans starts in
+    the background so that a later /analyze-pages call hits the cache.
+    """
     try:
-        # Validate file type
-        if not file.filename or not file.filename.lower().endswith('.pdf'):
-            raise HTTPException(
-                status_code=400,
-                detail="Invalid file type. Please upload a PDF file."
-            )
-        
         # Generate unique ID for this upload
         upload_id = str(uuid.uuid4())
         upload_dir = os.path.join(PDF_UPLOAD_DIR, upload_id)
-        os.makedirs(upload_dir, exist_ok=True)
         
-        # Save uploaded PDF
-        pdf_path = os.path.join(upload_dir, file.filename)
+        def pdf_destination(filename: str) -> str:
+            # Validate file type before any of the file is written
+            if not filename.lower().endswith('.pdf'):
+                raise HTTPException(
+                    status_code=400,
+                    detail="Invalid file type. Please upload a PDF file."
+                )
+            os.makedirs(upload_dir, exist_ok=True)
+            return os.path.join(upload_dir, filename)
+        
+        # Stream the uploaded PDF to disk; processing reads it from there
         try:
-            # Read the file content first
-            file_content = await file.read()
-            # Then write it to disk
-            with open(pdf_path, "wb") as buffer:
-                buffer.write(file_content)
+            with metrics.stage("upload_read"):
+                upload, form = await receive_upload(
+                    request, pdf_destination, max_bytes=MAX_PDF_UPLOAD_MB * 1024 * 1024,
+                )
+            speculative = _form_bool(form, "speculative")
+        except HTTPException:
+            shutil.rmtree(upload_dir, ignore_errors=True)
+            raise
         except Exception as e:
+            shutil.rmtree(upload_dir, ignore_errors=True)
             error_msg = f"Error saving PDF file: {str(e)}"
-            print(f"[ML] {error_msg}")
+            logger.error(error_msg)
             raise HTTPException(status_code=500, detail=error_msg)
+        pdf_path = upload.path
         
-        print("\n" + "="*80)
-        print("[ML] PDF UPLOAD RECEIVED")
-        print("="*80)
-        print(f"[ML] Filename: {file.filename}")
-        print(f"[ML] Upload ID: {upload_id}")
-        print(f"[ML] PDF Path: {pdf_path}")
-        print(f"[ML] Output Dir: {upload_dir}")
-        print("[ML] Starting PDF processing...")
-        print("="*80 + "\n")
+        logger.info("PDF upload received", extra={
+            "upload_id": upload_id,
+            "upload_filename": upload.filename,
+            "bytes": upload.size,
+            "file_hash": upload.file_hash,
+        })
+        
+        # Reserve memory for what processing will rasterize (page count × sheet size)
+        try:
+            sheets = await asyncio.to_thread(PDFProcessor.page_sizes, pdf_path)
+        except Exception:
+            sheets = []  # process_pdf reports the unreadable PDF
+        cost_mb = upload_cost_mb(
+            sheets, pdf_processor.preview_size, pdf_processor.dpi if pdf_processor.eager_full_render else None,
+            render_workers=pdf_processor.render_workers.workers if pdf_processor.render_workers else 0,
+        )
+        try:
+            ticket = await _admit("/upload-pdf", BULK, cost_mb, len(sheets))
+        except HTTPException:
+            shutil.rmtree(upload_dir, ignore_errors=True)
+            raise
         
-        # Process PDF - extract pages and classify
-        result = pdf_processor.process_pdf(pdf_path, upload_dir)
+        # Process PDF - extract pages and classify; off the event loop so that
+        # interactive requests keep being served meanwhile
+        try:
+            result = await admission.hold(ticket, asyncio.to_thread(pdf_processor.process_pdf, pdf_path, upload_dir))
+        except BaseException:
+            admission.release(ticket, completed=False)
+            raise
+        admission.release(ticket)
         
         # Add upload ID to result
         result['upload_id'] = upload_id
+        storage.touch(upload_id)
         
-        print("\n" + "="*80)
-        print("[ML] PDF PROCESSING COMPLETE")
-        print("="*80)
-        print(f"[ML] Total pages: {result['total_pages']}")
-        analyzable_count = sum(1 for p in result['pages'] if p['analyzable'])
-        print(f"[ML] Analyzable pages: {analyzable_count}/{result['total_pages']}")
-        print("="*80 + "\n")
+        # Share the upload so any instance can render and analyze its pages
+        if page_store.shared:
+            with metrics.stage("page_store_publish"):
+                await asyncio.to_thread(page_store.put_many, upload_id, [pdf_path] + [
+                    path for page in result['pages'] for path in (page['image_path'], page['preview_path'])
+                ])
+            logger.debug(f"Published upload {upload_id} to the shared page store")
+        result['file_hash'] = upload.file_hash
         
-        # Convert numpy types to native Python types for JSON serialization
-        result = convert_numpy_types(result)
+        reuse_report = result.get('reuse_report', {})
+        logger.info("PDF processing complete", extra={
+            "upload_id": upload_id,
+            "total_pages": result['total_pages'],
+            "analyzable_pages": sum(1 for p in result['pages'] if p['analyzable']),
+            "reused_pages": reuse_report.get('reused', 0),
+            "recomputed_pages": reuse_report.get('recomputed', 0),
+        })
+        
+        run_speculative = SPECULATIVE_ANALYSIS if speculative is None else speculative
+        if run_speculative:
+            scheduled_pages = _schedule_speculative_analysis(upload_id, result['pages'])
+            result['speculative'] = {'scheduled_pages': scheduled_pages}
+            logger.info(f"Speculative analysis scheduled for pages: {scheduled_pages}")
         
         # Convert file paths to HTTP URLs for frontend access
         ml_base_url = os.getenv("ML_BASE_URL", "http://127.0.0.1:8001")
         for page in result['pages']:
-            if 'image_path' in page and page['image_path']:
+            # Full-resolution pages are rendered on first request by /pages
+            page['image_path'] = f"{ml_base_url}/pages/{upload_id}/{page['page_number']}.jpg"
+            if page.get('preview_path'):
                 # Convert absolute path to relative URL
-                # e.g., /opt/render/project/src/uploads/pdfs/uuid/page_1.jpg 
-                # becomes http://127.0.0.1:8001/uploads/pdfs/uuid/page_1.jpg
-                rel_path = page['image_path'].replace(UPLOAD_DIR, '').lstrip('/')
-                page['image_path'] = f"{ml_base_url}/uploads/{rel_path}"
-                print(f"[ML] Converted image path to URL: {page['image_path']}")
+                # e.g., /opt/render/project/src/uploads/pdfs/uuid/page_1_preview.jpg 
+                # becomes http://127.0.0.1:8001/uploads/pdfs/uuid/page_1_preview.jpg
+                rel_path = page['preview_path'].replace(UPLOAD_DIR, '').lstrip('/')
+                page['preview_path'] = f"{ml_base_url}/uploads/{rel_path}"
         
-        return {
-            "success": True,
-            "data": result
-        }
+        with metrics.stage("serialization"):
+            return FastJSONResponse(_with_debug_trace({
+                "success": True,
+                "data": result
+            }))
     
     except HTTPException:
         raise
     except Exception as e:
         error_msg = str(e).encode('ascii', 'replace').decode('ascii')
-        print(f"[ML] Error processing PDF: {error_msg}")
+        logger.exception(f"Error processing PDF: {error_msg}")
         # Ensure error message is clean and safe
         safe_error = error_msg.replace('\n', ' ').replace('\r', ' ')[:500]  # Limit length
         raise HTTPException(
@@ -1254,180 +2112,249 @@ async def upload_pdf(file: UploadFile = File(...)) -> Dict[str, Any]:
         )
 
 
+@app.get("/metrics")
+def prometheus_metrics():
+    """Prometheus scrape endpoint: request, stage and model-call latency histograms and retry counters."""
+    if not metrics.enabled:
+        raise HTTPException(status_code=404, detail="Metrics are disabled (needs prometheus_client and METRICS_ENABLED=1)")
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
+
+def _require_profile_access(request: Request) -> None:
+    if not profiler.enabled:
+        raise HTTPException(status_code=404, detail="Profiling is disabled (set PROFILE_ADMIN_TOKEN or PROFILE_REQUESTS)")
+    if not profiler.admin_token:
+        raise HTTPException(status_code=403, detail="Profile downloads need PROFILE_ADMIN_TOKEN to be set")
+    if not profiler.can_download(request.headers):
+        raise HTTPException(status_code=403, detail="Profiles need a valid X-Admin-Token")
+
+
+@app.get("/profiles")
+def list_profiles(request: Request) -> Dict[str, Any]:
+    """Stored request profiles, newest first."""
+    _require_profile_access(request)
+    return {"profiles": profiler.list()}
+
+
+@app.get("/profiles/{profile_id}")
+def get_profile(profile_id: str, request: Request):
+    """Profile summary: hottest functions (self and total time) and, in memory mode, the top retained allocations."""
+    _require_profile_access(request)
+    path = profiler.artifact(profile_id, "summary")
+    if not path:
+        raise HTTPException(status_code=404, detail=f"Profile {profile_id} not found")
+    return FileResponse(path, media_type="application/json")
+
+
+@app.get("/profiles/{profile_id}/{artifact}")
+def download_profile(profile_id: str, artifact: str, request: Request):
+    """
+    Download a profile artifact: `stacks` (collapsed stacks for flamegraph.pl or
+    speedscope) or `tracemalloc` (load with tracemalloc.Snapshot.load).
+    """
+    _require_profile_access(request)
+    path = profiler.artifact(profile_id, artifact) if artifact in ("stacks", "tracemalloc") else None
+    if not path:
+        raise HTTPException(status_code=404, detail=f"No {artifact} artifact for profile {profile_id}")
+    media_type = "text/plain" if artifact == "stacks" else "application/octet-stream"
+    return FileResponse(path, media_type=media_type, filename=os.path.basename(path))
+
+
+@app.get("/storage")
+def storage_usage(request: Request) -> Dict[str, Any]:
+    """
+    Disk usage of UPLOAD_DIR by artifact category and eviction counters.
+    Per-upload sizes are listed only for a valid X-Admin-Token (PROFILE_ADMIN_TOKEN),
+    since upload ids give access to the uploads.
+    """
+    usage = storage.usage(extra_dirs={"page_index": PAGE_INDEX_DIR}, include_uploads=profiler.is_admin(request.headers))
+    usage["detection_cache"] = page_index.detection_stats()
+    return usage
+
+
+@app.get("/pages/{upload_id}/{page_number}.jpg")
+def get_page_image(upload_id: str, page_number: int):
+    """
+    Full-resolution render of an uploaded PDF page.
+    Pages are rendered on the first request and served from disk afterwards.
+    """
+    upload_dir = _local_upload_dir(upload_id)
+    storage.touch(upload_id)
+    try:
+        image_path = _page_image(upload_id, upload_dir, page_number)
+    except (FileNotFoundError, ValueError) as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return FileResponse(image_path, media_type="image/jpeg")
+
+
 @app.options("/analyze-pages", response_class=PlainTextResponse)
 def options_analyze_pages():
     """Handle CORS preflight requests for /analyze-pages endpoint."""
     return PlainTextResponse("ok", status_code=200)
 
-@app.post("/analyze-pages", response_class=JSONResponse)
+@app.post("/analyze-pages", response_class=FastJSONResponse)
 async def analyze_pages(
     upload_id: str = Form(...),
     page_numbers: str = Form(...),  # JSON array of page numbers
     takeoff_types: str = Form(...),  # JSON array of takeoff types
     scale: Optional[float] = Form(None),
     confidence: Optional[float] = Form(None),
+    base_upload_id: Optional[str] = Form(None),  # Previously analyzed revision of this set
+    base_page_numbers: Optional[str] = Form(None),  # JSON array matching page_numbers
+    response_format: Optional[str] = Form(None),  # full (default) or compact
 ) -> Dict[str, Any]:
     """
     Analyze selected pages from an uploaded PDF.
     
+    When `base_upload_id` is given, each page is diffed against the same page
+    (or the matching entry of `base_page_numbers`) of that earlier upload and
+    only the changed regions are re-detected; prior detections are kept for
+    the rest of the sheet.
+    
     Args:
         upload_id: UUID of the uploaded PDF
         page_numbers: JSON array of page numbers to analyze
         takeoff_types: JSON array of takeoff types (rooms, walls, doors, windows)
         scale: Scale factor for measurements
         confidence: Confidence threshold for detections
+        base_upload_id: UUID of a previously analyzed upload to diff against
+        base_page_numbers: JSON array of base page numbers, parallel to page_numbers
+        response_format: "compact" returns flat point arrays without duplicated geometry
     """
     try:
+        fmt = _response_format(response_format)
         # Parse parameters
         try:
             pages_to_analyze = json.loads(page_numbers)
             types_list = json.loads(takeoff_types)
+            base_pages = json.loads(base_page_numbers) if base_page_numbers else pages_to_analyze
         except json.JSONDecodeError as e:
             raise HTTPException(
                 status_code=400,
                 detail=f"Invalid JSON in parameters: {str(e)}"
             )
-        
-        # Validate upload directory exists
-        upload_dir = os.path.join(PDF_UPLOAD_DIR, upload_id)
-        if not os.path.exists(upload_dir):
+        if len(base_pages) != len(pages_to_analyze):
             raise HTTPException(
-                status_code=404,
-                detail=f"Upload ID not found: {upload_id}"
+                status_code=400,
+                detail="base_page_numbers must have one entry per page in page_numbers"
             )
         
-        print(f"[ML] Analyzing {len(pages_to_analyze)} pages from upload {upload_id}")
+        # Validate upload exists (here or in the shared page store, off the event loop)
+        upload_dir = await asyncio.to_thread(_local_upload_dir, upload_id)
+        base_upload_dir = (
+            await asyncio.to_thread(_local_upload_dir, base_upload_id, "Base upload ID") if base_upload_id else None
+        )
+        storage.touch(upload_id)
+        if base_upload_id:
+            storage.touch(base_upload_id)
         
-        results = []
+        logger.info(f"Analyzing {len(pages_to_analyze)} pages from upload {upload_id}")
         
-        for page_num in pages_to_analyze:
-            image_path = os.path.join(upload_dir, f'page_{page_num}.jpg')
-            
-            if not os.path.exists(image_path):
-                results.append({
-                    'page_number': page_num,
-                    'success': False,
-                    'error': f'Page {page_num} not found'
-                })
-                continue
+        # Reserve memory for the largest sheet to render and the models per page
+        models = _model_count(types_list)
+        try:
+            sheets = await asyncio.to_thread(PDFProcessor.page_sizes, PDFProcessor.upload_pdf_path(upload_dir))
+        except Exception:
+            sheets = []
+        page_sheets = [
+            sheets[n - 1] if isinstance(n, int) and 1 <= n <= len(sheets) else DEFAULT_SHEET_INCHES
+            for n in pages_to_analyze
+        ]
+        ticket = await _admit(
+            "/analyze-pages",
+            INTERACTIVE if len(pages_to_analyze) <= 1 else BULK,
+            page_analysis_cost_mb(page_sheets, pdf_processor.dpi, models),
+            len(pages_to_analyze) * max(models, 1),
+        )
+        
+        def analyze_selected_pages() -> List[Dict[str, Any]]:
+            results = []
+            for page_num, base_page_num in zip(pages_to_analyze, base_pages):
+                with tracer.span("page", page=page_num) as page_span:
+                    try:
+                        image_path = _page_image(upload_id, upload_dir, page_num)
+                    except (FileNotFoundError, ValueError):
+                        results.append({
+                            'page_number': page_num,
+                            'success': False,
+                            'error': f'Page {page_num} not found'
+                        })
+                        continue
             
-            try:
-                # Get image dimensions
-                with Image.open(image_path) as img:
-                    img_w, img_h = img.size
-                
-                # Determine which models to run
-                detect_rooms = any(t in types_list for t in ["rooms", "floors", "flooring"])
-                detect_walls = "walls" in types_list
-                detect_doors_windows = any(t in types_list for t in ["doors", "windows", "columns", "openings"])
-                
-                # Inference kwargs
-                infer_kwargs: Dict[str, Any] = {}
-                if confidence is not None:
-                    infer_kwargs["confidence"] = confidence
+                    try:
+                        # Get image dimensions and render density
+                        with Image.open(image_path) as img:
+                            img_w, img_h = img.size
+                            page_dpi = _image_dpi(img) or pdf_processor.dpi
                 
-                page_predictions = {}
-                page_errors = {}
+                        params = {'types': sorted(types_list), 'scale': scale, 'confidence': confidence, 'dpi': page_dpi}
+                        incremental = None
+                        if base_upload_dir and base_page_num is not None:
+                            prior = _load_page_analysis(base_upload_dir, base_page_num)
+                            base_image_path = page_store.fetch(base_upload_id, f'page_{base_page_num}.jpg', base_upload_dir)
+                            if prior and prior.get('params') == params and base_image_path:
+                                incremental = _detect_page_incremental(
+                                    image_path, base_image_path, prior['predictions'], img_w, img_h,
+                                    types_list, scale=scale, confidence=confidence, dpi=page_dpi,
+                                )
+                            else:
+                                logger.info(f"No comparable prior analysis for base page {base_page_num}, running full pass")
                 
-                # Run room detection if requested
-                if detect_rooms:
-                    room_predictions = []
-                    
-                    # 1. Run Roboflow room detection
-                    if ROOM_MODEL_ID:
-                        try:
-                            raw = _infer_image(image_path, model_id=ROOM_MODEL_ID, api_key=ROOM_API_KEY, **infer_kwargs)
-                            roboflow_rooms = _normalize_predictions(raw, img_w, img_h, scale=scale)
-                            room_predictions.extend(roboflow_rooms)
-                            print(f"[ML] Roboflow room detection found {len(roboflow_rooms)} rooms")
-                        except Exception as e:
-                            page_errors["rooms_roboflow"] = str(e)
-                    
-                    # 2. Run custom room detection model if available
-                    if CUSTOM_ROOM_MODEL:
-                        try:
-                            custom_rooms = _run_custom_room_model(image_path, img_w, img_h, 
-                                                              confidence=confidence, scale=scale)
-                            # Convert to normalized format
-                            custom_rooms_normalized = _normalize_predictions(
-                                {"predictions": custom_rooms}, 
-                                img_w, 
-                                img_h, 
-                                scale=scale
+                        if incremental:
+                            page_predictions, page_errors, incremental_summary = incremental
+                            incremental_summary.update({'base_upload_id': base_upload_id, 'base_page_number': base_page_num})
+                        else:
+                            page_predictions, page_errors = _detect_page(
+                                image_path, img_w, img_h, types_list, scale=scale, confidence=confidence, dpi=page_dpi
                             )
-                            room_predictions.extend(custom_rooms_normalized)
-                            print(f"[ML] Custom room detection found {len(custom_rooms_normalized)} rooms")
-                        except Exception as e:
-                            page_errors["rooms_custom"] = str(e)
-                    
-                    # 3. Apply ensemble method (simple merge for now, can be improved with NMS)
-                    if room_predictions:
-                        # For now, just take unique predictions based on class and position
-                        # In a production environment, you might want to implement NMS here
-                        unique_rooms = {}
-                        for room in room_predictions:
-                            # Create a unique key based on class and position
-                            key = f"{room.get('class', 'room')}_{room.get('x', 0):.0f}_{room.get('y', 0):.0f}"
-                            # Keep the one with higher confidence if duplicate
-                            if key not in unique_rooms or room.get('confidence', 0) > unique_rooms[key].get('confidence', 0):
-                                unique_rooms[key] = room
-                        
-                        page_predictions["rooms"] = list(unique_rooms.values())
-                        print(f"[ML] Combined room detection found {len(unique_rooms)} unique rooms")
+                            incremental_summary = {'mode': 'full'} if base_upload_dir else None
                 
-                # Run wall detection
-                if detect_walls and WALL_MODEL_ID:
-                    try:
-                        raw = _infer_image(image_path, model_id=WALL_MODEL_ID, api_key=WALL_API_KEY, **infer_kwargs)
-                        page_predictions["walls"] = _normalize_predictions(raw, img_w, img_h, scale=scale)
-                    except Exception as e:
-                        page_errors["walls"] = str(e)
-                
-                # Run door/window detection
-                if detect_doors_windows and DOORWINDOW_MODEL_ID:
-                    try:
-                        raw = _infer_image(image_path, model_id=DOORWINDOW_MODEL_ID, api_key=DOORWINDOW_API_KEY, **infer_kwargs)
-                        roboflow_preds = _normalize_predictions(raw, img_w, img_h, filter_classes=["door", "window", "Door", "Window"], scale=scale)
-                        
-                        # Ensemble learning if custom model available
-                        if CUSTOM_WINDOW_MODEL:
-                            custom_preds = _run_custom_yolo_model(image_path, img_w, img_h, confidence=confidence or 0.3, scale=scale)
-                            door_window_preds = _ensemble_door_window_predictions(roboflow_preds, custom_preds, iou_threshold=0.4)
-                        else:
-                            door_window_preds = roboflow_preds
-                        
-                        page_predictions["openings"] = door_window_preds
-                    except Exception as e:
-                        page_errors["openings"] = str(e)
+                        if not page_errors:
+                            _save_page_analysis(upload_dir, page_num, params, page_predictions)
                 
-                results.append({
-                    'page_number': page_num,
-                    'success': True,
-                    'image': {'width': img_w, 'height': img_h},
-                    'predictions': page_predictions,
-                    'errors': page_errors if page_errors else None
-                })
+                        results.append({
+                            'page_number': page_num,
+                            'success': True,
+                            'image': {'width': img_w, 'height': img_h, 'dpi': page_dpi},
+                            'predictions': format_predictions(page_predictions, fmt, img_w, img_h),
+                            'errors': page_errors if page_errors else None,
+                            'incremental': incremental_summary,
+                        })
                 
-                print(f"[ML] Page {page_num} analyzed successfully")
+                        logger.debug(f"Page {page_num} analyzed successfully")
                 
-            except Exception as e:
-                print(f"[ML] Error analyzing page {page_num}: {str(e)}")
-                results.append({
-                    'page_number': page_num,
-                    'success': False,
-                    'error': str(e)
-                })
+                    except Exception as e:
+                        logger.exception(f"Error analyzing page {page_num}: {str(e)}")
+                        if page_span:
+                            page_span.record_error(e)
+                        results.append({
+                            'page_number': page_num,
+                            'success': False,
+                            'error': str(e)
+                        })
+            return results
         
-        return {
-            "success": True,
-            "upload_id": upload_id,
-            "results": results
-        }
+        # Rendering and detection block, so they run off the event loop (in a copy
+        # of this context: metrics label, trace and request id stay attached)
+        try:
+            results = await admission.hold(ticket, asyncio.to_thread(analyze_selected_pages))
+        finally:
+            admission.release(ticket)
+        
+        with metrics.stage("serialization"):
+            return FastJSONResponse(_with_debug_trace({
+                "success": True,
+                "upload_id": upload_id,
+                "format": fmt,
+                **({"schema_version": COMPACT_SCHEMA_VERSION} if fmt == "compact" else {}),
+                "results": results
+            }))
     
     except HTTPException:
         raise
     except Exception as e:
-        print(f"[ML] Error in analyze_pages: {str(e)}")
+        logger.exception(f"Error in analyze_pages: {str(e)}")
         raise HTTPException(
             status_code=500,
             detail=f"Failed to analyze pages: {str(e)}"
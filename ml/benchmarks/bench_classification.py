@@ -0,0 +1,55 @@
+"""
+Compare per-page and batched page classification throughput.
+
+Usage (from ml/):
+    python -m benchmarks.bench_classification path/to/pages/*.jpg --batch-sizes 1 4 8 16
+
+Uses the classifier configured through PAGE_API_KEY / PAGE_PROJECT / PAGE_VERSION.
+Batch size 1 runs the per-page path. Every page is one request in both modes,
+with --concurrency requests in flight (PAGE_CLASSIFY_CONCURRENCY).
+"""
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="+", help="Page images to classify")
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 8])
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    # The classification client is configured from the environment when first used
+    os.environ["PAGE_CLASSIFY_CONCURRENCY"] = str(args.concurrency)
+    from app import _classify_image, _classify_images
+    from pdf_processor import PDFProcessor
+
+    page_paths = {i + 1: path for i, path in enumerate(args.images)}
+    rows = []
+    for batch_size in args.batch_sizes:
+        processor = PDFProcessor(classify_fn=_classify_image, classify_batch_fn=_classify_images)
+        processor.batch_size = batch_size
+        classifications = {}
+        stats = processor._classify_pages(page_paths, classifications)
+        stats["unknown_pages"] = sum(1 for c in classifications.values() if c["type"] == "unknown")
+        rows.append(stats)
+        print(json.dumps(stats))
+
+    baseline = next((r for r in rows if r["mode"] == "per_page"), None)
+    if baseline and baseline["pages_per_second"]:
+        for row in rows:
+            speedup = row["pages_per_second"] / baseline["pages_per_second"]
+            print(f"batch_size={row['batch_size']:>3}  {row['pages_per_second']:.2f} pages/s  ({speedup:.2f}x per-page)")
+
+
+if __name__ == "__main__":
+    main()
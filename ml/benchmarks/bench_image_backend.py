@@ -0,0 +1,126 @@
+"""
+Compare image backends on the JPEG work done for every uploaded PDF page.
+
+Usage (from ml/):
+    python -m benchmarks.bench_image_backend --backends pillow vips turbojpeg --runs 3
+    python -m benchmarks.bench_image_backend --sizes letter arch-d --dpi 300
+
+For each backend and sheet size this times, per page:
+  save      full-resolution quality-95 save of the rendered page
+  thumb     1200px UI thumbnail from the decoded page
+  compress  1024px quality-75 classification copy from the saved file
+and reports the peak RSS of a fresh process doing that work. Each case runs
+in its own subprocess so peak memory is not shared between backends.
+Backends that are not installed are skipped.
+"""
+
+import argparse
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw  # noqa: E402
+
+from image_backend import load_image_backend  # noqa: E402
+
+# Sheet sizes in inches (width, height), landscape
+SHEETS = {
+    'letter': (11, 8.5),
+    'tabloid': (17, 11),
+    'arch-c': (24, 18),
+    'arch-d': (36, 24),
+}
+
+
+def render_sheet(size, path: str) -> None:
+    """Stand-in for a pdf2image render: white sheet with plan-like linework, saved losslessly."""
+    rng = random.Random(0)
+    width, height = size
+    img = Image.new('RGB', size, 'white')
+    draw = ImageDraw.Draw(img)
+    for _ in range(width // 10):
+        x, y = rng.randrange(width), rng.randrange(height)
+        length = rng.randrange(width // 20, width // 4)
+        end = (min(width, x + length), y) if rng.random() < 0.5 else (x, min(height, y + length))
+        draw.line((x, y) + end, fill='black', width=rng.choice((2, 3, 6)))
+    img.save(path, 'PPM')
+
+
+def run_case(backend_name: str, source: str, dpi: int, runs: int) -> dict:
+    """Worker: time the three operations for one backend on one rendered page."""
+    backend = load_image_backend(backend_name)
+    work_dir = tempfile.mkdtemp(prefix="bench_backend_")
+    page_path = os.path.join(work_dir, "page.jpg")
+    with Image.open(source) as img:
+        image = img.convert('RGB')
+    timings = {'save': [], 'thumb': [], 'compress': []}
+    for _ in range(runs):
+        start = time.perf_counter()
+        backend.save_jpeg(image, page_path, quality=95, dpi=dpi)
+        timings['save'].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        backend.thumbnail_jpeg(page_path, 1200, quality=85, image=image)
+        timings['thumb'].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        backend.thumbnail_jpeg(page_path, 1024, quality=75)
+        timings['compress'].append(time.perf_counter() - start)
+
+    with Image.open(page_path) as saved:
+        saved_dpi = saved.info.get('dpi')
+    # ru_maxrss is KiB on Linux
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {
+        **{f"{op}_ms": round(statistics.median(ts) * 1000, 1) for op, ts in timings.items()},
+        'peak_rss_mb': round(peak_mb, 1),
+        'saved_dpi': round(float(saved_dpi[0])) if saved_dpi else None,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", default=['pillow', 'vips', 'turbojpeg'])
+    parser.add_argument("--sizes", nargs="+", default=['letter', 'arch-d'], choices=sorted(SHEETS))
+    parser.add_argument("--dpi", type=int, default=300)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--worker", nargs=2, metavar=("BACKEND", "SOURCE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_case(args.worker[0], args.worker[1], args.dpi, args.runs)))
+        return
+
+    work_dir = tempfile.mkdtemp(prefix="bench_backend_")
+    rows = []
+    for sheet in args.sizes:
+        inches = SHEETS[sheet]
+        size = (int(inches[0] * args.dpi), int(inches[1] * args.dpi))
+        source = os.path.join(work_dir, f"{sheet}.ppm")
+        render_sheet(size, source)
+        for backend_name in args.backends:
+            proc = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_image_backend", "--dpi", str(args.dpi),
+                 "--runs", str(args.runs), "--worker", backend_name, source],
+                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                capture_output=True, text=True,
+            )
+            if proc.returncode != 0:
+                print(f"skipping {backend_name}: {proc.stderr.strip().splitlines()[-1]}", file=sys.stderr)
+                continue
+            row = {'sheet': sheet, 'size': f"{size[0]}x{size[1]}", 'backend': backend_name,
+                   **json.loads(proc.stdout.strip().splitlines()[-1])}
+            rows.append(row)
+            print(json.dumps(row))
+
+
+if __name__ == "__main__":
+    main()
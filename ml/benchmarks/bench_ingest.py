@@ -0,0 +1,119 @@
+"""
+Compare the old /analyze image preparation with single-decode ingestion.
+
+Usage (from ml/):
+    python -m benchmarks.bench_ingest path/to/plans/*.jpg --runs 5
+    python -m benchmarks.bench_ingest --synthetic 7200x4800
+
+The old path verifies the upload, reopens it for its size, decodes it again,
+LANCZOS-resizes at full resolution and re-encodes with optimize=True. The new
+path is image_ingest.ingest_image followed by a plain quality-85 save. With
+--synthetic, plan-like line drawings of the given size are generated as JPEG
+and PNG.
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw  # noqa: E402
+
+from image_ingest import ingest_image  # noqa: E402
+
+MAX_DIMENSION = 1536
+
+
+def legacy_prepare(path: str, out_path: str) -> None:
+    with open(path, 'rb') as f:
+        data = f.read()
+    with Image.open(io.BytesIO(data)) as im:
+        im.verify()
+    with Image.open(io.BytesIO(data)) as im:
+        width, height = im.size
+    img = Image.open(io.BytesIO(data))
+    if max(width, height) > MAX_DIMENSION:
+        factor = MAX_DIMENSION / max(width, height)
+        img = img.resize((int(width * factor), int(height * factor)), Image.Resampling.LANCZOS)
+    img.save(out_path, quality=85, optimize=True)
+
+
+def ingest_prepare(path: str, out_path: str) -> None:
+    ingested = ingest_image(path, MAX_DIMENSION)
+    ingested.image.save(out_path, quality=85)
+    ingested.image.close()
+
+
+def synthetic_plan(size, path: str) -> None:
+    """White sheet with wall-like lines and room labels, roughly like a scanned plan."""
+    rng = random.Random(0)
+    width, height = size
+    img = Image.new('RGB', size, 'white')
+    draw = ImageDraw.Draw(img)
+    for _ in range(400):
+        x, y = rng.randrange(width), rng.randrange(height)
+        if rng.random() < 0.5:
+            draw.line((x, y, min(width, x + rng.randrange(200, 1500)), y), fill='black', width=rng.choice((2, 4, 8)))
+        else:
+            draw.line((x, y, x, min(height, y + rng.randrange(200, 1500))), fill='black', width=rng.choice((2, 4, 8)))
+    for _ in range(150):
+        draw.text((rng.randrange(width), rng.randrange(height)), "BEDROOM 12'-0\" x 14'-6\"", fill='black')
+    img.save(path, dpi=(300, 300), **({'quality': 92} if path.endswith('.jpg') else {}))
+
+
+def time_runs(fn, path: str, out_path: str, runs: int) -> float:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn(path, out_path)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="*", help="Plan images to ingest")
+    parser.add_argument("--synthetic", help="Generate JPEG and PNG plans of WIDTHxHEIGHT")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="bench_ingest_")
+    images = list(args.images)
+    if args.synthetic:
+        size = tuple(int(v) for v in args.synthetic.lower().split('x'))
+        for ext in ('.jpg', '.png'):
+            path = os.path.join(work_dir, f"plan_{args.synthetic}{ext}")
+            synthetic_plan(size, path)
+            images.append(path)
+    if not images:
+        parser.error("pass image paths or --synthetic WIDTHxHEIGHT")
+
+    rows = []
+    for path in images:
+        ext = os.path.splitext(path)[-1].lower() or '.jpg'
+        out_path = os.path.join(work_dir, f"out{ext}")
+        with Image.open(path) as img:
+            size = img.size
+        legacy = time_runs(legacy_prepare, path, out_path, args.runs)
+        ingest = time_runs(ingest_prepare, path, out_path, args.runs)
+        rows.append({
+            "image": os.path.basename(path),
+            "size": f"{size[0]}x{size[1]}",
+            "legacy_ms": round(legacy * 1000, 1),
+            "ingest_ms": round(ingest * 1000, 1),
+            "speedup": round(legacy / ingest, 2) if ingest else None,
+        })
+        print(json.dumps(rows[-1]))
+
+    print(json.dumps({"median_speedup": statistics.median(r["speedup"] for r in rows)}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+PDF page render + encode throughput (pages/s) vs. core count.
+
+Usage (from ml/):
+    python -m benchmarks.bench_pdf_render
+    python -m benchmarks.bench_pdf_render --cores 1 2 4 8 --pages 100 --mode full
+    python -m benchmarks.bench_pdf_render --pdf uploads/drawings.pdf --mode preview
+
+Renders every page of a synthetic drawing set (benchmarks/synthetic_pdfs.py,
+or --pdf) and saves it the way process_pdf does:
+  preview  rasterized at PDF_PREVIEW_SIZE, JPEG quality 85 (step 4)
+  full     rasterized at 300 DPI, JPEG quality 95 (PDF_EAGER_FULL_RENDER=1)
+
+Each core count runs in a fresh process pinned to that many cores
+(os.sched_setaffinity, inherited by pdftoppm) with PDF_RENDER_WORKERS=auto,
+i.e. one render worker per core, in-process on one core. An "in-process"
+row renders on all cores without workers, as before render workers existed:
+only pdftoppm runs in parallel there, the JPEG encodes do not. Prints one
+JSON line per case with pages/s and speedup over 1 core; core counts beyond
+the cores available here are skipped.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic_pdfs import generate_set  # noqa: E402
+from workers import CPUWorkerPool, worker_count  # noqa: E402
+
+
+def run_case(args, cores: int) -> dict:
+    """Worker: one core count (0 = all cores, no render workers), in this fresh process."""
+    if cores:
+        os.sched_setaffinity(0, sorted(os.sched_getaffinity(0))[:cores])
+    from pdf_processor import PDFProcessor
+
+    pool = CPUWorkerPool(worker_count('auto') if cores else 0, name='render')
+    pool.start()
+    processor = PDFProcessor(render_workers=pool)
+    size, quality = (processor.preview_size, 85) if args.mode == 'preview' else (None, 95)
+    work_dir = tempfile.mkdtemp(prefix="bench_pdf_render_")
+    outputs = {n: os.path.join(work_dir, f"page_{n}.jpg") for n in range(1, args.page_count + 1)}
+
+    start = time.perf_counter()
+    processor._render_and_save(args.pdf, outputs, size=size, quality=quality)
+    elapsed = time.perf_counter() - start
+    pool.shutdown()
+    return {
+        'cores': cores or len(os.sched_getaffinity(0)),
+        'render_workers': pool.workers if cores else 'in-process',
+        'pages': args.page_count,
+        'seconds': round(elapsed, 2),
+        'pages_per_s': round(args.page_count / elapsed, 2),
+        'mb_written': round(sum(os.path.getsize(p) for p in outputs.values()) / 1e6, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cores", nargs="+", type=int, default=[1, 2, 4, 8])
+    parser.add_argument("--pages", type=int, default=24, help="Pages of the synthetic set")
+    parser.add_argument("--mode", choices=['preview', 'full'], default='full')
+    parser.add_argument("--pdf", help="Render this PDF instead of a synthetic set")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--page-count", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--case", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case is not None:
+        print(json.dumps(run_case(args, args.case)))
+        return
+
+    if not args.pdf:
+        args.pdf = os.path.join(tempfile.mkdtemp(prefix="bench_pdf_render_"), "set.pdf")
+        generate_set(args.pdf, args.pages, args.seed)
+    from PyPDF2 import PdfReader
+    page_count = len(PdfReader(args.pdf).pages)
+    available = len(os.sched_getaffinity(0))
+    print(json.dumps({'available_cores': available, 'pdf': args.pdf, 'pages': page_count, 'mode': args.mode}))
+
+    baseline = None
+    for cores in sorted(set(args.cores)) + [0]:
+        if cores > available:
+            print(f"Skipping {cores} cores ({available} available)", file=sys.stderr)
+            continue
+        proc = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_pdf_render", "--case", str(cores), "--pdf", args.pdf,
+             "--page-count", str(page_count), "--mode", args.mode],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            print(f"{cores or 'in-process'} failed: {proc.stderr.strip().splitlines()[-1]}", file=sys.stderr)
+            continue
+        row = json.loads(proc.stdout.strip().splitlines()[-1])
+        if baseline is None and cores == 1:
+            baseline = row['pages_per_s']
+        if baseline:
+            row['speedup'] = round(row['pages_per_s'] / baseline, 2)
+        print(json.dumps(row))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Measure response bytes and server-side allocation per prediction schema.
+
+Usage (from ml/, with the service's dependencies installed):
+    python -m benchmarks.bench_prediction_schema --walls 1500 --rooms 40 --openings 120
+
+Builds a wall-heavy Roboflow response and, for each path, reports response
+size, time from raw model output to response bytes, and (tracemalloc) the
+memory the normalized predictions retain plus the peak while serializing:
+  legacy   predictions built the old way: uuid4 ids, `points`, `mask` and
+           `points_norm` as three separate lists, `bbox_norm` on every box
+  full     _normalize_predictions + format_predictions(..., "full")
+  compact  _normalize_predictions + format_predictions(..., "compact")
+"full" produces the same JSON shape as "legacy"; the difference is what the
+predictions retain while they sit in memory (ensemble, caching, saving).
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import _normalize_predictions  # noqa: E402
+from responses import dumps, format_predictions  # noqa: E402
+
+IMG_W, IMG_H = 10800, 7200
+
+
+def raw_response(walls: int, rooms: int, openings: int, seed: int = 0):
+    """Roboflow-shaped responses: polygon walls and rooms, box openings."""
+    rng = random.Random(seed)
+
+    def polygon(n):
+        cx, cy = rng.uniform(0, IMG_W), rng.uniform(0, IMG_H)
+        return [{"x": cx + rng.uniform(-300, 300), "y": cy + rng.uniform(-300, 300)} for _ in range(n)]
+
+    def poly_pred(cls, n):
+        return {"class": cls, "confidence": rng.uniform(0.4, 0.99), "points": polygon(n)}
+
+    return {
+        "walls": {"predictions": [poly_pred("Internal_Wall", rng.randint(4, 24)) for _ in range(walls)]},
+        "rooms": {"predictions": [poly_pred("room", rng.randint(12, 60)) for _ in range(rooms)]},
+        "openings": {"predictions": [
+            {"class": rng.choice(("door", "window")), "confidence": rng.uniform(0.4, 0.99),
+             "x": rng.uniform(0, IMG_W), "y": rng.uniform(0, IMG_H),
+             "width": rng.uniform(20, 80), "height": rng.uniform(20, 80)}
+            for _ in range(openings)
+        ]},
+    }
+
+
+def legacy_item(item, raw_pred):
+    """What _normalize_predictions used to add on top of today's item."""
+    item["id"] = str(uuid.uuid4())
+    if "points" in raw_pred:
+        item["points"] = raw_pred["points"]
+        item["points_norm"] = [{"x": pt["x"] / IMG_W, "y": pt["y"] / IMG_H} for pt in raw_pred["points"]]
+        item["mask"] = [{"x": pt["x"], "y": pt["y"]} for pt in raw_pred["points"]]
+    if "bbox" in item:
+        bbox = item["bbox"]
+        item["points_norm"] = [{"x": pt["x"] / IMG_W, "y": pt["y"] / IMG_H} for pt in item["mask"]]
+        item["bbox_norm"] = {"x": bbox["x"] / IMG_W, "y": bbox["y"] / IMG_H,
+                             "w": bbox["w"] / IMG_W, "h": bbox["h"] / IMG_H}
+    return item
+
+
+def normalize(raw, fmt):
+    """Predictions as held in memory between inference and the response."""
+    predictions = {}
+    for key, response in raw.items():
+        items = _normalize_predictions(response, IMG_W, IMG_H, scale=0.25, dpi=300)
+        if fmt == "legacy":
+            items = [legacy_item(item, pred) for item, pred in zip(items, response["predictions"])]
+        predictions[key] = items
+    return predictions
+
+
+def serialize(predictions, fmt):
+    if fmt != "legacy":
+        predictions = format_predictions(predictions, fmt, IMG_W, IMG_H)
+    return dumps({"image": {"width": IMG_W, "height": IMG_H}, "format": fmt, "predictions": predictions})
+
+
+def measure(raw, fmt, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        body = serialize(normalize(raw, fmt), fmt)
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    predictions = normalize(raw, fmt)
+    retained, _ = tracemalloc.get_traced_memory()
+    serialize(predictions, fmt)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"format": fmt, "bytes_kb": round(len(body) / 1024, 1), "retained_mb": round(retained / 1024 ** 2, 2),
+            "peak_alloc_mb": round(peak / 1024 ** 2, 2), "ms": round(statistics.median(timings) * 1000, 1)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--walls", type=int, default=1500)
+    parser.add_argument("--rooms", type=int, default=40)
+    parser.add_argument("--openings", type=int, default=120)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    raw = raw_response(args.walls, args.rooms, args.openings)
+    for fmt in ("legacy", "full", "compact"):
+        print(json.dumps(measure(raw, fmt, args.runs)))
+
+
+if __name__ == "__main__":
+    main()
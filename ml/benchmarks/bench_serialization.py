@@ -0,0 +1,145 @@
+"""
+Compare analysis response serialization paths.
+
+Usage (from ml/):
+    python -m benchmarks.bench_serialization uploads/pdfs/<id>/analysis_page_3.json
+    python -m benchmarks.bench_serialization --synthetic-walls 1500 --runs 20
+
+Payloads are saved /analyze or /analyze-pages responses, or analysis_page_N.json
+files from an upload directory; --synthetic-walls builds a wall-heavy sheet
+shaped like _normalize_predictions output (with numpy scalars, as the custom
+models produce). For each payload it times:
+  legacy   convert_numpy_types + jsonable_encoder + json.dumps (the old path)
+  orjson   responses.dumps on the full payload
+  compact  compact_predictions + responses.dumps
+and reports response sizes.
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+
+from responses import compact_predictions, dumps  # noqa: E402
+
+
+def convert_numpy_types(obj):
+    """The recursive conversion every response used to go through."""
+    import numpy as np
+
+    if isinstance(obj, (np.bool_, np.bool)):
+        return bool(obj)
+    elif isinstance(obj, np.floating):
+        return float(obj)
+    elif isinstance(obj, np.integer):
+        return int(obj)
+    elif isinstance(obj, np.ndarray):
+        return obj.tolist()
+    elif isinstance(obj, dict):
+        return {k: convert_numpy_types(v) for k, v in obj.items()}
+    elif isinstance(obj, (list, tuple)):
+        return [convert_numpy_types(item) for item in obj]
+    return obj
+
+
+def legacy_serialize(payload):
+    content = jsonable_encoder(convert_numpy_types(payload))
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def _polygon_item(class_name, points, img_w, img_h, rng):
+    mask = [{"x": pt["x"], "y": pt["y"]} for pt in points]
+    return {
+        "id": str(uuid.uuid4()),
+        "class": class_name,
+        "confidence": np.float32(rng.uniform(0.4, 0.99)),
+        "category": class_name,
+        "metrics": {"area_pixels": np.float64(rng.uniform(1e3, 1e5)), "perimeter_pixels": rng.uniform(100, 4000)},
+        "mask": mask,
+        "display": {"area_sqft": rng.uniform(10, 400), "perimeter_ft": rng.uniform(10, 90)},
+        "points": points,
+        "points_norm": [{"x": pt["x"] / img_w, "y": pt["y"] / img_h} for pt in points],
+    }
+
+
+def synthetic_payload(walls: int, rooms: int = 40, openings: int = 120, seed: int = 0):
+    rng = random.Random(seed)
+    img_w, img_h = 10800, 7200
+
+    def polygon(n):
+        cx, cy = rng.uniform(0, img_w), rng.uniform(0, img_h)
+        return [{"x": cx + rng.uniform(-300, 300), "y": cy + rng.uniform(-300, 300)} for _ in range(n)]
+
+    predictions = {
+        "walls": [_polygon_item("interior_wall", polygon(rng.randint(4, 24)), img_w, img_h, rng) for _ in range(walls)],
+        "rooms": [_polygon_item("room", polygon(rng.randint(12, 60)), img_w, img_h, rng) for _ in range(rooms)],
+        "openings": [],
+    }
+    for _ in range(openings):
+        x, y, w, h = rng.uniform(0, img_w), rng.uniform(0, img_h), rng.uniform(20, 80), rng.uniform(20, 80)
+        corners = [{"x": x - w / 2, "y": y - h / 2}, {"x": x + w / 2, "y": y - h / 2},
+                   {"x": x + w / 2, "y": y + h / 2}, {"x": x - w / 2, "y": y + h / 2}]
+        item = _polygon_item(rng.choice(("door", "window")), corners, img_w, img_h, rng)
+        item.update({"bbox": {"x": x, "y": y, "w": w, "h": h},
+                     "bbox_norm": {"x": x / img_w, "y": y / img_h, "w": w / img_w, "h": h / img_h}})
+        predictions["openings"].append(item)
+    return {"image": {"width": img_w, "height": img_h, "dpi": 300.0}, "predictions": predictions}
+
+
+def load_payload(path: str):
+    """Normalize a saved response / analysis file into {image, predictions} payloads."""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if "results" in data:  # /analyze-pages response
+        return [{"image": r.get("image"), "predictions": r["predictions"]} for r in data["results"] if r.get("success")]
+    return [data]
+
+
+def compact_serialize(payload):
+    return dumps({**payload, "predictions": compact_predictions(payload["predictions"])})
+
+
+def time_it(fn, payload, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        out = fn(payload)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), len(out)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("payloads", nargs="*", help="Saved response or analysis_page_N.json files")
+    parser.add_argument("--synthetic-walls", type=int, default=0, help="Add a synthetic sheet with this many walls")
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    payloads = []
+    for path in args.payloads:
+        payloads.extend((os.path.basename(path), p) for p in load_payload(path))
+    if args.synthetic_walls or not payloads:
+        walls = args.synthetic_walls or 1500
+        payloads.append((f"synthetic-{walls}-walls", synthetic_payload(walls)))
+
+    for name, payload in payloads:
+        row = {"payload": name, "predictions": sum(len(v) for v in payload["predictions"].values())}
+        for label, fn in (("legacy", legacy_serialize), ("orjson", dumps), ("compact", compact_serialize)):
+            seconds, size = time_it(fn, payload, args.runs)
+            row[f"{label}_ms"] = round(seconds * 1000, 2)
+            row[f"{label}_kb"] = round(size / 1024, 1)
+        row["orjson_speedup"] = round(row["legacy_ms"] / row["orjson_ms"], 1)
+        print(json.dumps(row))
+
+
+if __name__ == "__main__":
+    main()
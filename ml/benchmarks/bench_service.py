@@ -0,0 +1,390 @@
+"""
+End-to-end service benchmark against a local Roboflow stand-in.
+
+Usage (from ml/, with the service's dependencies and poppler installed):
+    python -m benchmarks.bench_service
+    python -m benchmarks.bench_service --scenarios analyze analyze-concurrent --requests 40 --concurrency 8
+    python -m benchmarks.bench_service --latency-ms 600 --kind-latency walls=1200 --error-rate 0.05
+    python -m benchmarks.bench_service --output after.jsonl --baseline before.jsonl --tolerance 0.15
+
+Starts benchmarks.fake_roboflow and the app under uvicorn as separate
+processes, with every model (rooms, walls, doors/windows, page classifier)
+pointed at the stand-in through ROBOFLOW_API_URL / ROBOFLOW_CLASSIFY_API_URL
+and the detection cache off. Then runs, in order:
+  analyze             --requests sequential /analyze calls, each on a distinct
+                      synthetic plan
+  analyze-concurrent  --requests /analyze calls from --concurrency clients
+  upload-pdf          --pdf-runs uploads of distinct --pages-page PDFs
+  analyze-pages       --pdf-runs /analyze-pages calls over all pages of a fresh
+                      upload (uploaded during setup, so the upload counts
+                      neither in the timings nor in peak RSS or upstream requests)
+Each scenario prints one JSON line: requests, failed requests, requests with
+model errors, throughput and p50/p95/p99 latency of the completed requests,
+the server's peak RSS during the scenario and the stand-in's request counts.
+
+With --baseline, results are compared to an earlier --output file and the
+run exits non-zero when a scenario's p95 or peak RSS grew, or its throughput
+fell, by more than --tolerance.
+"""
+
+import argparse
+import io
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import requests
+from PIL import Image, ImageDraw
+
+from benchmarks import fake_roboflow
+
+ML_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ("analyze", "analyze-concurrent", "upload-pdf", "analyze-pages")
+TAKEOFF_TYPES = '["rooms", "walls", "doors", "windows"]'
+
+
+# ------------------------------------------------------------------------------
+# Inputs
+# ------------------------------------------------------------------------------
+
+def plan_image(width: int, height: int, seed: int) -> Image.Image:
+    """A line drawing with the density of a floor plan: room grid, wall runs, door swings, labels."""
+    rng = random.Random(seed)
+    img = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(img)
+    margin = width // 20
+    draw.rectangle([margin, margin, width - margin, height - margin], outline="black", width=max(4, width // 600))
+    x = margin
+    while x < width - margin:
+        x += rng.randint(width // 12, width // 5)
+        draw.line([x, margin, x, height - margin], fill="black", width=max(3, width // 900))
+    y = margin
+    while y < height - margin:
+        y += rng.randint(height // 10, height // 4)
+        draw.line([margin, y, width - margin, y], fill="black", width=max(3, width // 900))
+    for _ in range(rng.randint(20, 60)):
+        cx, cy, r = rng.randint(margin, width - margin), rng.randint(margin, height - margin), rng.randint(20, 60)
+        draw.arc([cx - r, cy - r, cx + r, cy + r], 0, 90, fill="black", width=2)
+        draw.text((cx + r, cy), f"D{rng.randint(1, 99)}", fill="black")
+    return img
+
+
+def png_bytes(img: Image.Image) -> bytes:
+    buf = io.BytesIO()
+    img.save(buf, "PNG")
+    return buf.getvalue()
+
+
+def plan_pdf(path: str, pages: int, seed: int, width: int = 5400, height: int = 3600, dpi: int = 150) -> str:
+    """A raster PDF of distinct plan sheets (36" x 24" at the default size and dpi)."""
+    images = [plan_image(width, height, seed * 1000 + i) for i in range(pages)]
+    images[0].save(path, "PDF", save_all=True, append_images=images[1:], resolution=dpi)
+    return path
+
+
+# ------------------------------------------------------------------------------
+# Processes
+# ------------------------------------------------------------------------------
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(url: str, proc: subprocess.Popen, timeout: float = 120) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{proc.args} exited with {proc.returncode}")
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def fake_roboflow_args(args: argparse.Namespace) -> List[str]:
+    out = ["--latency-ms", str(args.latency_ms), "--latency-sigma", str(args.latency_sigma),
+           "--error-rate", str(args.error_rate), "--throttle-rate", str(args.throttle_rate),
+           "--walls", str(args.walls), "--rooms", str(args.rooms), "--openings", str(args.openings),
+           "--seed", str(args.seed)]
+    if args.kind_latency:
+        out += ["--kind-latency", *args.kind_latency]
+    return out
+
+
+def service_env(fake_url: str, upload_dir: str, extra: List[str]) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.update({
+        "ROBOFLOW_API_URL": fake_url,
+        "ROBOFLOW_CLASSIFY_API_URL": fake_url,
+        "ROOM_API_KEY": "bench", "ROOM_PROJECT": "bench-rooms", "ROOM_VERSION": "1",
+        "WALL_API_KEY": "bench", "WALL_PROJECT": "bench-walls", "WALL_VERSION": "1",
+        "DOORWINDOW_API_KEY": "bench", "DOORWINDOW_PROJECT": "bench-doors-windows", "DOORWINDOW_VERSION": "1",
+        "PAGE_API_KEY": "bench", "PAGE_PROJECT": "bench-pages", "PAGE_VERSION": "1",
+        "PAGE_CLASSIFIER": "remote",
+        "CUSTOM_ROOM_MODEL_PATH": "", "CUSTOM_WINDOW_MODEL_PATH": "",
+        "DETECTION_CACHE": "0",
+        "SPECULATIVE_ANALYSIS": "0",
+        "UPLOAD_DIR": upload_dir,
+        "LOG_LEVEL": "WARNING",
+    })
+    for item in extra:
+        key, _, value = item.partition("=")
+        env[key] = value
+    return env
+
+
+def start_local_service(args: argparse.Namespace, workdir: str):
+    """
+    Start the Roboflow stand-in and the app (uvicorn) pointed at it.
+    Returns (fake process, app process, stand-in URL, app URL) once both answer.
+    """
+    fake_port, app_port = free_port(), free_port()
+    fake_url, base_url = f"http://127.0.0.1:{fake_port}", f"http://127.0.0.1:{app_port}"
+    fake = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.fake_roboflow", "--port", str(fake_port), *fake_roboflow_args(args)],
+        cwd=ML_DIR, stdout=subprocess.DEVNULL,
+    )
+    app = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(app_port),
+         "--log-level", "warning"],
+        cwd=ML_DIR, env=service_env(fake_url, os.path.join(workdir, "uploads"), args.app_env),
+    )
+    try:
+        wait_until_up(fake_url, fake)
+        wait_until_up(f"{base_url}/healthz", app)
+    except Exception:
+        stop_processes(app, fake)
+        raise
+    return fake, app, fake_url, base_url
+
+
+def stop_processes(*procs: subprocess.Popen) -> None:
+    for proc in procs:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def reset_peak_rss(pid: int) -> None:
+    """Reset the kernel's peak RSS (VmHWM) for `pid`, so the next reading covers one scenario."""
+    try:
+        with open(f"/proc/{pid}/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _proc_status_mb(pid: int, field: str) -> Optional[float]:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def peak_rss_mb(pid: int) -> Optional[float]:
+    return _proc_status_mb(pid, "VmHWM")
+
+
+def rss_mb(pid: int) -> Optional[float]:
+    return _proc_status_mb(pid, "VmRSS")
+
+
+# ------------------------------------------------------------------------------
+# Scenarios
+# ------------------------------------------------------------------------------
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of `values` (0 when empty)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def timed_post(session: requests.Session, url: str, **kwargs) -> Tuple[float, Optional[Dict[str, Any]]]:
+    """Seconds taken and the JSON body (None unless HTTP 200)."""
+    start = time.perf_counter()
+    try:
+        response = session.post(url, timeout=600, **kwargs)
+        body = response.json() if response.status_code == 200 else None
+    except requests.RequestException:
+        body = None
+    return time.perf_counter() - start, body
+
+
+def has_model_errors(body: Dict[str, Any]) -> bool:
+    if body.get("errors"):
+        return True
+    return any(not r.get("success") or r.get("errors") for r in body.get("results", []))
+
+
+def run_requests(calls: List[Callable[[requests.Session], Tuple[float, Optional[Dict[str, Any]]]]],
+                 concurrency: int) -> Dict[str, Any]:
+    """Run `calls` from `concurrency` clients; latency stats over all of them."""
+    def worker(chunk):
+        with requests.Session() as session:
+            return [call(session) for call in chunk]
+
+    chunks = [calls[i::concurrency] for i in range(concurrency)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = [sample for chunk in pool.map(worker, chunks) for sample in chunk]
+    elapsed = time.perf_counter() - start
+    # Throughput and latency cover completed requests only; failures are counted separately
+    latencies = [seconds for seconds, body in samples if body is not None]
+    return {
+        "requests": len(samples),
+        "failed": len(samples) - len(latencies),
+        "model_errors": sum(1 for _, body in samples if body is not None and has_model_errors(body)),
+        "seconds": round(elapsed, 2),
+        "throughput_rps": round(len(latencies) / elapsed, 3) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+    }
+
+
+def analyze_calls(base_url: str, images: List[bytes]):
+    def call(session, image):
+        return timed_post(session, f"{base_url}/analyze", files={"file": ("plan.png", image, "image/png")},
+                          data={"types": TAKEOFF_TYPES, "scale": "0.25"})
+    return [lambda session, image=image: call(session, image) for image in images]
+
+
+def upload(session: requests.Session, base_url: str, pdf_path: str):
+    with open(pdf_path, "rb") as f:
+        return timed_post(session, f"{base_url}/upload-pdf", files={"file": (os.path.basename(pdf_path), f, "application/pdf")})
+
+
+def upload_calls(base_url: str, pdf_paths: List[str]):
+    return [lambda session, path=path: upload(session, base_url, path) for path in pdf_paths]
+
+
+def upload_all(base_url: str, pdf_paths: List[str]) -> List[str]:
+    """Upload ids of `pdf_paths`, uploaded one after another (scenario setup)."""
+    upload_ids = []
+    with requests.Session() as session:
+        for path in pdf_paths:
+            _, uploaded = upload(session, base_url, path)
+            if uploaded is None:
+                raise RuntimeError(f"Setup upload of {path} failed")
+            upload_ids.append(uploaded["data"]["upload_id"])
+    return upload_ids
+
+
+def analyze_pages_calls(base_url: str, upload_ids: List[str], pages: int):
+    def call(session, upload_id):
+        return timed_post(session, f"{base_url}/analyze-pages", data={
+            "upload_id": upload_id,
+            "page_numbers": json.dumps(list(range(1, pages + 1))),
+            "takeoff_types": TAKEOFF_TYPES,
+            "scale": "0.25",
+        })
+    return [lambda session, upload_id=upload_id: call(session, upload_id) for upload_id in upload_ids]
+
+
+# ------------------------------------------------------------------------------
+# Baseline comparison
+# ------------------------------------------------------------------------------
+
+def regressions(results: List[Dict[str, Any]], baseline_path: str, tolerance: float) -> List[str]:
+    with open(baseline_path) as f:
+        baseline = {row["scenario"]: row for row in map(json.loads, filter(str.strip, f))}
+    found = []
+    for row in results:
+        before = baseline.get(row["scenario"])
+        if not before:
+            continue
+        for key, worse_if_higher in (("p95_ms", True), ("peak_rss_mb", True), ("throughput_rps", False)):
+            old, new = before.get(key), row.get(key)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (change > tolerance) if worse_if_higher else (change < -tolerance):
+                found.append(f"{row['scenario']}: {key} {old} -> {new} ({change:+.0%})")
+    return found
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=20, help="Calls per /analyze scenario")
+    parser.add_argument("--concurrency", type=int, default=8, help="Clients in analyze-concurrent")
+    parser.add_argument("--image-size", default="3300x2550", help="Synthetic plan size for /analyze (WxH)")
+    parser.add_argument("--pages", type=int, default=10, help="Pages per PDF")
+    parser.add_argument("--pdf-runs", type=int, default=3, help="Uploads per PDF scenario")
+    parser.add_argument("--app-env", nargs="*", default=[], metavar="KEY=VALUE", help="Extra service settings")
+    parser.add_argument("--output", help="Append result lines to this file")
+    parser.add_argument("--baseline", help="Earlier --output file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    fake_roboflow.add_arguments(parser)
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.image_size.lower().split("x"))
+    workdir = tempfile.mkdtemp(prefix="bench_service_")
+    fake, app, fake_url, base_url = start_local_service(args, workdir)
+    results = []
+    try:
+        # Distinct inputs, so concurrent requests are not coalesced into shared model calls
+        images = [png_bytes(plan_image(width, height, args.seed * 1000 + i)) for i in range(args.requests)]
+        pdf_runs = {
+            scenario: [plan_pdf(os.path.join(workdir, f"{scenario}-{i}.pdf"), args.pages, seed=args.seed * 1000 + SCENARIOS.index(scenario) * 100 + i)
+                       for i in range(args.pdf_runs)]
+            for scenario in ("upload-pdf", "analyze-pages") if scenario in args.scenarios
+        }
+        plans = {
+            "analyze": (lambda: analyze_calls(base_url, images), 1),
+            "analyze-concurrent": (lambda: analyze_calls(base_url, images), args.concurrency),
+            "upload-pdf": (lambda: upload_calls(base_url, pdf_runs["upload-pdf"]), 1),
+            "analyze-pages": (lambda: analyze_pages_calls(
+                base_url, upload_all(base_url, pdf_runs["analyze-pages"]), args.pages), 1),
+        }
+        for scenario in args.scenarios:
+            setup, concurrency = plans[scenario]
+            # Setup (the analyze-pages uploads) happens before anything is measured
+            calls = setup()
+            before = requests.get(f"{fake_url}/stats").json()["requests"]
+            reset_peak_rss(app.pid)
+            row = {"scenario": scenario, **run_requests(calls, concurrency)}
+            if scenario in ("upload-pdf", "analyze-pages"):
+                row["pages_per_second"] = round(row["throughput_rps"] * args.pages, 3)
+            row["peak_rss_mb"] = peak_rss_mb(app.pid)
+            after = requests.get(f"{fake_url}/stats").json()["requests"]
+            row["upstream_requests"] = {k: v - before.get(k, 0) for k, v in after.items() if v - before.get(k, 0)}
+            results.append(row)
+            print(json.dumps(row), flush=True)
+    finally:
+        stop_processes(app, fake)
+
+    if args.output:
+        with open(args.output, "a") as f:
+            for row in results:
+                f.write(json.dumps(row) + "\n")
+    if args.baseline:
+        found = regressions(results, args.baseline, args.tolerance)
+        for line in found:
+            print(f"REGRESSION {line}")
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
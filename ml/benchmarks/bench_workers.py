@@ -0,0 +1,172 @@
+"""
+Throughput and memory of CPU worker processes (workers.py) vs. worker count.
+
+Usage (from ml/):
+    python -m benchmarks.bench_workers
+    python -m benchmarks.bench_workers --workers 0 1 2 4 8 --tasks 64 --weights-mb 500
+    python -m benchmarks.bench_workers --task yolo --model models/window_best.pt --workers 0 1 2 4
+
+Runs --tasks copies of one CPU-bound request stage from --concurrency
+callers at a time, the way concurrent requests would:
+  prepare  /analyze's decode, downscale to 1536px and re-encode of a plan image
+  yolo     local YOLO predict on that image (needs ultralytics and --model)
+With 0 workers the callers are threads of one process (the default
+deployment, serialized by the GIL); with N > 0 they hand their tasks to a
+CPUWorkerPool of N forked workers. Before forking, the parent loads --model,
+or allocates --weights-mb of stand-in weights that every task reads, so the
+memory columns show what the workers share rather than copy. The stand-in
+has no inference working memory; size CPU_WORKERS from a --task yolo run.
+
+Each worker count runs in a fresh process and prints one JSON line: tasks/s,
+speedup over 0 workers, p50/p95 task latency, the USS of each worker right
+after the fork, and RSS/PSS/USS of the parent and of each worker after the
+run. Speedup is bounded by the cores available (os.sched_getaffinity), which
+the first line reports.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+from PIL import Image  # noqa: E402
+
+from benchmarks.bench_image_backend import SHEETS, render_sheet  # noqa: E402
+from image_backend import load_image_backend  # noqa: E402
+from image_ingest import ingest_image  # noqa: E402
+from workers import CPUWorkerPool  # noqa: E402
+
+# Loaded in the parent before forking, shared by the workers
+_weights = None
+_model = None
+_backend = load_image_backend('pillow')
+
+
+def _read_weights() -> None:
+    # One read per page, like a forward pass touching every layer
+    if _weights is not None:
+        int(_weights[::512].sum())
+
+
+def prepare_task(source: str, output: str) -> None:
+    _read_weights()
+    ingested = ingest_image(source, 1536)
+    try:
+        _backend.save_image(ingested.image, output, quality=85, dpi=ingested.scale_factor * 150)
+    finally:
+        ingested.image.close()
+
+
+def yolo_task(source: str, output: str) -> None:
+    _model.predict(source, conf=0.3, iou=0.5, verbose=False)
+
+
+def run_case(args, workers: int) -> dict:
+    """Worker: one worker count, in this fresh process."""
+    global _weights, _model
+    if args.task == 'yolo':
+        from ultralytics import YOLO
+        _model = YOLO(args.model)
+    elif args.weights_mb:
+        _weights = np.ones(args.weights_mb * 1024 * 1024 // 8, dtype=np.float64)
+    task = yolo_task if args.task == 'yolo' else prepare_task
+
+    pool = CPUWorkerPool(workers)
+    pool.start()
+    idle_memory = pool.stats()['worker_memory']
+    work_dir = tempfile.mkdtemp(prefix="bench_workers_")
+    latencies = []
+
+    def one(i: int) -> None:
+        start = time.perf_counter()
+        pool.run(task, args.source, os.path.join(work_dir, f"{i % args.concurrency}.jpg"))
+        latencies.append(time.perf_counter() - start)
+
+    with ThreadPoolExecutor(args.concurrency) as callers:
+        list(callers.map(one, range(args.concurrency)))  # warm-up
+        latencies.clear()
+        start = time.perf_counter()
+        list(callers.map(one, range(args.tasks)))
+        elapsed = time.perf_counter() - start
+
+    stats = pool.stats()
+    pool.shutdown()
+    latencies.sort()
+    worker_memory = stats['worker_memory']
+    return {
+        'workers': workers,
+        'tasks_per_s': round(args.tasks / elapsed, 2),
+        'p50_ms': round(statistics.median(latencies) * 1000, 1),
+        'p95_ms': round(latencies[int(0.95 * (len(latencies) - 1))] * 1000, 1),
+        'parent': stats['parent_memory'],
+        'worker_idle_uss_mb': [w.get('uss_mb') for w in idle_memory],
+        'worker_uss_mb': [w.get('uss_mb') for w in worker_memory],
+        'worker_pss_mb': [w.get('pss_mb') for w in worker_memory],
+        'worker_rss_mb': [w.get('rss_mb') for w in worker_memory],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", nargs="+", type=int, default=[0, 1, 2, 4])
+    parser.add_argument("--task", choices=['prepare', 'yolo'], default='prepare')
+    parser.add_argument("--tasks", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, help="Concurrent callers (default: the largest --workers)")
+    parser.add_argument("--weights-mb", type=int, default=120, help="Stand-in model weights for --task prepare")
+    parser.add_argument("--model", help="YOLO weights for --task yolo")
+    parser.add_argument("--sheet", choices=sorted(SHEETS), default='arch-d')
+    parser.add_argument("--dpi", type=int, default=150, help="Pixel density of the synthetic plan image")
+    parser.add_argument("--source", help=argparse.SUPPRESS)
+    parser.add_argument("--case", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.concurrency = args.concurrency or max(max(args.workers), 1)
+    if args.task == 'yolo' and not args.model:
+        parser.error("--task yolo needs --model")
+
+    if args.case is not None:
+        print(json.dumps(run_case(args, args.case)))
+        return
+
+    work_dir = tempfile.mkdtemp(prefix="bench_workers_")
+    inches = SHEETS[args.sheet]
+    ppm = os.path.join(work_dir, "plan.ppm")
+    render_sheet((int(inches[0] * args.dpi), int(inches[1] * args.dpi)), ppm)
+    source = os.path.join(work_dir, "plan.png")
+    with Image.open(ppm) as img:
+        img.save(source, 'PNG', dpi=(args.dpi, args.dpi))
+    print(json.dumps({'cores': len(os.sched_getaffinity(0)), 'task': args.task, 'tasks': args.tasks,
+                      'concurrency': args.concurrency}))
+
+    baseline = None
+    for workers in args.workers:
+        command = [sys.executable, "-m", "benchmarks.bench_workers", "--case", str(workers), "--source", source,
+                   "--task", args.task, "--tasks", str(args.tasks), "--concurrency", str(args.concurrency),
+                   "--weights-mb", str(args.weights_mb)]
+        if args.model:
+            command += ["--model", args.model]
+        proc = subprocess.run(
+            command,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            print(f"{workers} workers failed: {proc.stderr.strip().splitlines()[-1]}", file=sys.stderr)
+            continue
+        row = json.loads(proc.stdout.strip().splitlines()[-1])
+        if baseline is None and workers == 0:
+            baseline = row['tasks_per_s']
+        if baseline:
+            row['speedup'] = round(row['tasks_per_s'] / baseline, 2)
+        print(json.dumps(row))
+
+
+if __name__ == "__main__":
+    main()
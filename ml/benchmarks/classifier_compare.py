@@ -0,0 +1,105 @@
+"""
+Compare a local page classifier against the hosted Roboflow classifier.
+
+Usage (from ml/):
+    python -m benchmarks.classifier_compare pages/*.jpg --local ocr
+    python -m benchmarks.classifier_compare pages/*.jpg --local onnx --labels labels.json
+
+Pages should be the 1024px `_compressed.jpg` copies that classification runs on.
+Without --labels the remote classifier's labels are the reference; a labels
+file maps image file names to page types (floor_plan, elevation, ...).
+Reports accuracy, a confusion list and per-page latency for both classifiers.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from page_classifier import load_page_classifier  # noqa: E402
+from pdf_processor import PDFProcessor  # noqa: E402
+
+
+def _timed_batches(classify_batch, paths, batch_size):
+    results, started = [], time.perf_counter()
+    for i in range(0, len(paths), batch_size):
+        results.extend(classify_batch(paths[i:i + batch_size]))
+    return results, time.perf_counter() - started
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="+")
+    parser.add_argument("--local", choices=["ocr", "onnx"], default="ocr")
+    parser.add_argument("--labels", help="JSON file mapping image file name to page type")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--skip-remote", action="store_true", help="Only time the local classifier")
+    args = parser.parse_args()
+
+    mapper = PDFProcessor()
+    to_type = lambda result: mapper._parse_classification_result(result)["type"]
+
+    local = load_page_classifier(args.local)
+    local_raw, local_seconds = _timed_batches(local.classify_batch, args.images, args.batch_size)
+    local_types = [to_type(r) for r in local_raw]
+
+    remote_types, remote_seconds = None, None
+    if not args.skip_remote:
+        from app import _classify_images, PAGE_API_KEY, PAGE_PROJECT, PAGE_VERSION
+
+        remote_raw, remote_seconds = _timed_batches(
+            lambda paths: _classify_images(paths, PAGE_PROJECT, PAGE_VERSION, PAGE_API_KEY),
+            args.images,
+            args.batch_size,
+        )
+        remote_types = [to_type(r) for r in remote_raw]
+
+    if args.labels:
+        with open(args.labels, "r", encoding="utf-8") as f:
+            labels = json.load(f)
+        reference = [labels.get(os.path.basename(path), "unknown") for path in args.images]
+        reference_name = "labels"
+    else:
+        reference = remote_types
+        reference_name = "remote"
+
+    n = len(args.images)
+    report = {
+        "pages": n,
+        "local": {
+            "classifier": local.name,
+            "seconds": round(local_seconds, 3),
+            "ms_per_page": round(1000 * local_seconds / n, 1),
+        },
+    }
+    if remote_seconds is not None:
+        report["remote"] = {"seconds": round(remote_seconds, 3), "ms_per_page": round(1000 * remote_seconds / n, 1)}
+
+    if reference:
+        confusion = Counter((ref, got) for ref, got in zip(reference, local_types) if ref != got)
+        per_class = Counter(reference)
+        correct = Counter(ref for ref, got in zip(reference, local_types) if ref == got)
+        report["reference"] = reference_name
+        report["local"]["accuracy"] = round(sum(correct.values()) / n, 3)
+        report["local"]["per_class_accuracy"] = {
+            label: round(correct[label] / total, 3) for label, total in sorted(per_class.items())
+        }
+        report["local"]["confusions"] = [
+            {"expected": ref, "got": got, "count": count} for (ref, got), count in confusion.most_common()
+        ]
+        if remote_types and reference_name == "labels":
+            report["remote"]["accuracy"] = round(sum(r == g for r, g in zip(reference, remote_types)) / n, 3)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
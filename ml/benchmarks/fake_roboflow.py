@@ -0,0 +1,261 @@
+"""
+Local stand-in for the Roboflow hosted inference API.
+
+Usage (from ml/):
+    python -m benchmarks.fake_roboflow --port 9001 --latency-ms 400 --latency-sigma 0.5 --error-rate 0.02
+
+Serves the hosted (v0) routes the service calls when ROBOFLOW_API_URL /
+ROBOFLOW_CLASSIFY_API_URL point at it: POST /{project}/{version} with a
+base64 image body. The kind of model is taken from the project name:
+  *room*            room polygons
+  *wall*            wall polygons (the large responses)
+  *door* / *window* door and window boxes
+  anything else     page classification ({"top", "confidence", "predictions"})
+Coordinates are scaled to the posted image, so normalization and
+measurements do their usual work.
+
+Latency is lognormal around --latency-ms (--latency-sigma 0 makes it fixed),
+per kind with e.g. --kind-latency walls=900 pages=150. A share of requests
+fails with HTTP 500 (--error-rate) or 429 with Retry-After (--throttle-rate).
+
+Responses are deterministic: the n-th request of a kind for a given image
+size gets the same payload in every run with the same --seed.
+"""
+
+import argparse
+import base64
+import binascii
+import io
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+from PIL import Image
+
+PAGE_CLASSES = ("floor_plan", "floor_plan", "floor_plan", "elevation", "section", "electrical", "schedule", "notes")
+
+
+def model_kind(project: str) -> str:
+    project = project.lower()
+    if "room" in project:
+        return "rooms"
+    if "wall" in project:
+        return "walls"
+    if "door" in project or "window" in project:
+        return "openings"
+    return "pages"
+
+
+class FakeRoboflow:
+    """Latency, failure and payload model behind the stand-in server."""
+
+    def __init__(self, latency_ms: float = 300, latency_sigma: float = 0.4, error_rate: float = 0.0,
+                 throttle_rate: float = 0.0, walls: int = 400, rooms: int = 25, openings: int = 60,
+                 kind_latency_ms: Optional[Dict[str, float]] = None, seed: int = 0):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.counts = {"walls": walls, "rooms": rooms, "openings": openings}
+        self.kind_latency_ms = kind_latency_ms or {}
+        self.seed = seed
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests: Dict[str, int] = {}
+        self._sequence: Dict[Tuple[str, int, int], int] = {}
+
+    def latency(self, kind: str) -> float:
+        median = self.kind_latency_ms.get(kind, self.latency_ms) / 1000
+        with self._lock:
+            return median * math.exp(self._rng.gauss(0, self.latency_sigma)) if self.latency_sigma else median
+
+    def outcome(self) -> Optional[int]:
+        """HTTP status of a failed request, or None for a successful one."""
+        with self._lock:
+            roll = self._rng.random()
+        if roll < self.error_rate:
+            return 500
+        if roll < self.error_rate + self.throttle_rate:
+            return 429
+        return None
+
+    def predict(self, kind: str, width: int, height: int) -> Dict[str, Any]:
+        """A response shaped like the hosted API's for a `width` x `height` image."""
+        with self._lock:
+            n = self._sequence.get((kind, width, height), 0)
+            self._sequence[(kind, width, height)] = n + 1
+        # A string seed is hashed the same way in every process (unlike hash())
+        rng = random.Random(f"{self.seed}:{kind}:{width}x{height}:{n}")
+
+        def new_id() -> str:
+            return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+        if kind == "pages":
+            top = rng.choice(PAGE_CLASSES)
+            confidence = rng.uniform(0.6, 0.99)
+            return {
+                "inference_id": new_id(),
+                "time": 0.05,
+                "image": {"width": width, "height": height},
+                "top": top,
+                "confidence": confidence,
+                "predictions": [{"class": top, "class_id": PAGE_CLASSES.index(top), "confidence": confidence}],
+            }
+
+        def polygon(n: int, radius: float):
+            cx, cy = rng.uniform(0, width), rng.uniform(0, height)
+            points = []
+            for i in range(n):
+                angle = 2 * math.pi * i / n
+                r = radius * rng.uniform(0.6, 1.0)
+                points.append({"x": min(max(cx + r * math.cos(angle), 0), width),
+                               "y": min(max(cy + r * math.sin(angle), 0), height)})
+            return points
+
+        predictions = []
+        scale = min(width, height)
+        for _ in range(self.counts[kind]):
+            if kind == "openings":
+                w, h = rng.uniform(0.004, 0.015) * scale, rng.uniform(0.004, 0.015) * scale
+                pred = {"x": rng.uniform(0, width), "y": rng.uniform(0, height), "width": w, "height": h,
+                        "class": rng.choice(("door", "window")), "class_id": 0}
+            else:
+                if kind == "walls":
+                    points = polygon(rng.randint(4, 24), rng.uniform(0.01, 0.05) * scale)
+                    cls = rng.choice(("Internal_Wall", "External_Wall"))
+                else:
+                    points = polygon(rng.randint(12, 60), rng.uniform(0.04, 0.12) * scale)
+                    cls = "room"
+                xs, ys = [p["x"] for p in points], [p["y"] for p in points]
+                pred = {"x": (min(xs) + max(xs)) / 2, "y": (min(ys) + max(ys)) / 2,
+                        "width": max(xs) - min(xs), "height": max(ys) - min(ys),
+                        "class": cls, "class_id": 0, "points": points}
+            pred["confidence"] = rng.uniform(0.4, 0.99)
+            pred["detection_id"] = new_id()
+            predictions.append(pred)
+        return {
+            "inference_id": new_id(),
+            "time": 0.1,
+            "image": {"width": width, "height": height},
+            "predictions": predictions,
+        }
+
+    def count(self, kind: str) -> None:
+        with self._lock:
+            self.requests[kind] = self.requests.get(kind, 0) + 1
+
+
+def _image_size(body: bytes) -> Tuple[int, int]:
+    """Size of the posted image (base64 or raw bytes); only the header is decoded."""
+    try:
+        data = base64.b64decode(body, validate=True)
+    except (binascii.Error, ValueError):
+        data = body
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            return img.size
+    except Exception:
+        return 1024, 1024
+
+
+def make_handler(fake: FakeRoboflow):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/stats":
+                self._send(200, {"requests": fake.requests})
+            else:
+                self._send(200, {"server": "fake-roboflow"})
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            parts = [p for p in urlparse(self.path).path.split("/") if p]
+            if len(parts) < 2:
+                self._send(404, {"message": "Use POST /{project}/{version}"})
+                return
+            kind = model_kind(parts[0])
+            fake.count(kind)
+            width, height = _image_size(body)
+            time.sleep(fake.latency(kind))
+            status = fake.outcome()
+            if status == 429:
+                self._send(429, {"message": "Rate limit exceeded"}, {"Retry-After": "1"})
+            elif status:
+                self._send(status, {"message": "Internal error (injected)"})
+            else:
+                self._send(200, fake.predict(kind, width, height))
+
+    return Handler
+
+
+def serve(fake: FakeRoboflow, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """Start the stand-in on a background thread; the bound port is server.server_address[1]."""
+    server = ThreadingHTTPServer((host, port), make_handler(fake))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-roboflow", daemon=True).start()
+    return server
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Stand-in options, shared with bench_service."""
+    parser.add_argument("--latency-ms", type=float, default=300, help="Median model latency")
+    parser.add_argument("--latency-sigma", type=float, default=0.4, help="Lognormal spread (0 = fixed latency)")
+    parser.add_argument("--kind-latency", nargs="*", default=[], metavar="KIND=MS",
+                        help="Per-kind median latency: rooms, walls, openings, pages")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests failing with HTTP 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of requests failing with HTTP 429")
+    parser.add_argument("--walls", type=int, default=400, help="Walls per wall-model response")
+    parser.add_argument("--rooms", type=int, default=25, help="Rooms per room-model response")
+    parser.add_argument("--openings", type=int, default=60, help="Doors and windows per response")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def from_arguments(args: argparse.Namespace) -> FakeRoboflow:
+    kind_latency = {}
+    for item in args.kind_latency:
+        kind, _, ms = item.partition("=")
+        kind_latency[kind] = float(ms)
+    return FakeRoboflow(
+        latency_ms=args.latency_ms, latency_sigma=args.latency_sigma, error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate, walls=args.walls, rooms=args.rooms, openings=args.openings,
+        kind_latency_ms=kind_latency, seed=args.seed,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9001)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = serve(from_arguments(args), args.host, args.port)
+    print(f"Fake Roboflow listening on http://{args.host}:{server.server_address[1]}", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""
+Mixed-workload load test: saturation point and memory growth.
+
+Usage (from ml/, with the service's dependencies and poppler installed):
+    python -m benchmarks.load_test
+    python -m benchmarks.load_test --concurrency 1 2 4 8 16 --step-seconds 120 --mix upload=1 analyze-pages=2 analyze=4
+    python -m benchmarks.load_test --url http://127.0.0.1:8001 --pid 4242 --pdf-dir out/
+
+Replays a weighted mix of operations from closed-loop virtual users, one
+step per --concurrency level:
+  upload         /upload-pdf of a synthetic drawing set (benchmarks.synthetic_pdfs)
+  analyze-pages  /analyze-pages of --analysis-pages random pages of an earlier upload
+  analyze        /analyze of a synthetic plan image
+Without --url the app and the Roboflow stand-in are started locally, as in
+benchmarks.bench_service (stand-in options apply). Uploads cycle through
+--sets drawing sets; repeats go through the page index reuse path like a
+re-uploaded revision would, and the report counts the reused pages.
+
+Each step prints one JSON line (throughput, error rate, latency per
+operation, RSS at the end of the step and its peak). The summary line gives
+the saturation point, the highest concurrency whose step still raised
+throughput by --saturation-gain without exceeding --max-error-rate or
+--slo-p95-ms, and memory growth: RSS after each step and after
+--settle-seconds idle, relative to RSS after warm-up. Server RSS needs a
+local server (or --pid on Linux).
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+
+from benchmarks import fake_roboflow
+from benchmarks.bench_service import (
+    TAKEOFF_TYPES, has_model_errors, peak_rss_mb, percentile, plan_image, png_bytes, reset_peak_rss, rss_mb,
+    start_local_service, stop_processes, timed_post,
+)
+from benchmarks.synthetic_pdfs import generate_set
+
+OPERATIONS = ("upload", "analyze-pages", "analyze")
+
+
+class Workload:
+    """Inputs and shared state for the virtual users."""
+
+    def __init__(self, base_url: str, pdf_paths: List[str], images: List[bytes], analysis_pages: int):
+        self.base_url = base_url
+        self.pdf_paths = pdf_paths
+        self.images = images
+        self.analysis_pages = analysis_pages
+        self._lock = threading.Lock()
+        self._next_pdf = 0
+        self._next_image = 0
+        self.uploads: List[Tuple[str, int]] = []  # (upload_id, total_pages)
+        self.pages_uploaded = 0
+        self.pages_reused = 0
+
+    def upload(self, session: requests.Session):
+        with self._lock:
+            path = self.pdf_paths[self._next_pdf % len(self.pdf_paths)]
+            self._next_pdf += 1
+        with open(path, "rb") as f:
+            seconds, body = timed_post(session, f"{self.base_url}/upload-pdf",
+                                       files={"file": (os.path.basename(path), f, "application/pdf")})
+        if body:
+            data = body["data"]
+            with self._lock:
+                self.uploads.append((data["upload_id"], data["total_pages"]))
+                self.pages_uploaded += data["total_pages"]
+                self.pages_reused += data.get("reuse_report", {}).get("reused", 0)
+        return seconds, body
+
+    def analyze_pages(self, session: requests.Session, rng: random.Random):
+        with self._lock:
+            if not self.uploads:
+                return None
+            upload_id, total_pages = rng.choice(self.uploads)
+        pages = sorted(rng.sample(range(1, total_pages + 1), min(self.analysis_pages, total_pages)))
+        return timed_post(session, f"{self.base_url}/analyze-pages", data={
+            "upload_id": upload_id,
+            "page_numbers": json.dumps(pages),
+            "takeoff_types": TAKEOFF_TYPES,
+            "scale": "0.25",
+        })
+
+    def analyze(self, session: requests.Session):
+        with self._lock:
+            image = self.images[self._next_image % len(self.images)]
+            self._next_image += 1
+        return timed_post(session, f"{self.base_url}/analyze", files={"file": ("plan.png", image, "image/png")},
+                          data={"types": TAKEOFF_TYPES, "scale": "0.25"})
+
+    def run(self, operation: str, session: requests.Session, rng: random.Random):
+        if operation == "upload":
+            return self.upload(session)
+        if operation == "analyze-pages":
+            return self.analyze_pages(session, rng) or self.upload(session)
+        return self.analyze(session)
+
+
+def run_step(workload: Workload, mix: Dict[str, float], concurrency: int, seconds: float, seed: int):
+    """Run `concurrency` closed-loop users for `seconds`; returns (operation, seconds, body) samples."""
+    samples: List[Tuple[str, float, Optional[Dict[str, Any]]]] = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+    operations, weights = zip(*mix.items())
+
+    def user(index: int):
+        rng = random.Random(seed * 1000 + index)
+        with requests.Session() as session:
+            while time.perf_counter() < deadline:
+                operation = rng.choices(operations, weights)[0]
+                elapsed, body = workload.run(operation, session, rng)
+                with lock:
+                    samples.append((operation, elapsed, body))
+
+    threads = [threading.Thread(target=user, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples
+
+
+def step_report(concurrency: int, samples, elapsed: float) -> Dict[str, Any]:
+    ok = [(op, s) for op, s, body in samples if body is not None]
+    by_operation: Dict[str, List[float]] = defaultdict(list)
+    for op, seconds in ok:
+        by_operation[op].append(seconds)
+    return {
+        "concurrency": concurrency,
+        "operations": len(samples),
+        "failed": len(samples) - len(ok),
+        "error_rate": round((len(samples) - len(ok)) / len(samples), 4) if samples else 0.0,
+        "model_errors": sum(1 for _, _, body in samples if body is not None and has_model_errors(body)),
+        "throughput_ops": round(len(ok) / elapsed, 3) if elapsed else 0.0,
+        "p50_ms": round(percentile([s for _, s in ok], 50) * 1000, 1),
+        "p95_ms": round(percentile([s for _, s in ok], 95) * 1000, 1),
+        "p99_ms": round(percentile([s for _, s in ok], 99) * 1000, 1),
+        "by_operation": {
+            op: {"count": len(values), "p50_ms": round(percentile(values, 50) * 1000, 1),
+                 "p95_ms": round(percentile(values, 95) * 1000, 1)}
+            for op, values in sorted(by_operation.items())
+        },
+    }
+
+
+def saturation_point(steps: List[Dict[str, Any]], gain: float, max_error_rate: float,
+                     slo_p95_ms: Optional[float]) -> Dict[str, Any]:
+    """Highest concurrency that still paid off: more throughput, within error and latency limits."""
+    best = None
+    for step in steps:
+        healthy = step["error_rate"] <= max_error_rate and (not slo_p95_ms or step["p95_ms"] <= slo_p95_ms)
+        if not healthy:
+            break
+        if best is not None and step["throughput_ops"] < best["throughput_ops"] * (1 + gain):
+            break
+        best = step
+    return {
+        "saturation_concurrency": best["concurrency"] if best else None,
+        "throughput_at_saturation": best["throughput_ops"] if best else 0.0,
+        "max_throughput": max((s["throughput_ops"] for s in steps), default=0.0),
+    }
+
+
+def parse_mix(items: List[str]) -> Dict[str, float]:
+    mix = {}
+    for item in items:
+        op, _, weight = item.partition("=")
+        if op not in OPERATIONS:
+            raise ValueError(f"Unknown operation '{op}'. Use one of: {', '.join(OPERATIONS)}")
+        mix[op] = float(weight or 1)
+    return mix
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Running service to load; started locally when omitted")
+    parser.add_argument("--pid", type=int, help="Process id of the --url service, for RSS readings")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 2, 4, 8, 16])
+    parser.add_argument("--step-seconds", type=float, default=60)
+    parser.add_argument("--mix", nargs="+", default=["upload=1", "analyze-pages=2", "analyze=4"], metavar="OP=WEIGHT")
+    parser.add_argument("--pdf-dir", help="Use the PDFs in this directory instead of generating sets")
+    parser.add_argument("--sets", type=int, default=12, help="Drawing sets to generate")
+    parser.add_argument("--pages", type=int, default=12, help="Sheets per generated set")
+    parser.add_argument("--analysis-pages", type=int, default=3, help="Pages per /analyze-pages call")
+    parser.add_argument("--images", type=int, default=16, help="Distinct /analyze images")
+    parser.add_argument("--image-size", default="3300x2550")
+    parser.add_argument("--saturation-gain", type=float, default=0.1)
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--slo-p95-ms", type=float)
+    parser.add_argument("--settle-seconds", type=float, default=10)
+    parser.add_argument("--app-env", nargs="*", default=[], metavar="KEY=VALUE", help="Extra settings for a local service")
+    parser.add_argument("--output", help="Append step and summary lines to this file")
+    fake_roboflow.add_arguments(parser)
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    workdir = tempfile.mkdtemp(prefix="load_test_")
+    if args.pdf_dir:
+        pdf_paths = sorted(os.path.join(args.pdf_dir, name) for name in os.listdir(args.pdf_dir) if name.endswith(".pdf"))
+    else:
+        pdf_paths = [generate_set(os.path.join(workdir, f"set_{i:03d}.pdf"), args.pages, args.seed * 1000 + i)["path"]
+                     for i in range(args.sets)]
+    width, height = (int(v) for v in args.image_size.lower().split("x"))
+    images = [png_bytes(plan_image(width, height, args.seed * 1000 + i)) for i in range(args.images)]
+
+    procs = ()
+    if args.url:
+        base_url, pid = args.url.rstrip("/"), args.pid
+    else:
+        fake, app, _, base_url = start_local_service(args, workdir)
+        procs, pid = (app, fake), app.pid
+
+    lines = []
+
+    def emit(row):
+        lines.append(row)
+        print(json.dumps(row), flush=True)
+
+    try:
+        workload = Workload(base_url, pdf_paths, images, args.analysis_pages)
+        # Warm-up: one upload to analyze and one /analyze, outside any step
+        with requests.Session() as session:
+            workload.upload(session)
+            workload.analyze(session)
+        baseline_rss = rss_mb(pid) if pid else None
+
+        steps = []
+        for concurrency in args.concurrency:
+            if pid:
+                reset_peak_rss(pid)
+            start = time.perf_counter()
+            samples = run_step(workload, mix, concurrency, args.step_seconds, seed=concurrency)
+            row = step_report(concurrency, samples, time.perf_counter() - start)
+            if pid:
+                row["rss_mb"] = rss_mb(pid)
+                row["peak_rss_mb"] = peak_rss_mb(pid)
+                row["rss_growth_mb"] = round(row["rss_mb"] - baseline_rss, 1) if row["rss_mb"] and baseline_rss else None
+            steps.append(row)
+            emit({"step": row})
+
+        time.sleep(args.settle_seconds)
+        summary = {
+            **saturation_point(steps, args.saturation_gain, args.max_error_rate, args.slo_p95_ms),
+            "mix": mix,
+            "pages_uploaded": workload.pages_uploaded,
+            "pages_reused": workload.pages_reused,
+        }
+        if pid:
+            settled = rss_mb(pid)
+            summary.update({
+                "rss_after_warmup_mb": baseline_rss,
+                "rss_after_steps_mb": [s.get("rss_mb") for s in steps],
+                "rss_settled_mb": settled,
+                "rss_growth_mb": round(settled - baseline_rss, 1) if settled and baseline_rss else None,
+                "peak_rss_mb": max((s["peak_rss_mb"] for s in steps if s.get("peak_rss_mb")), default=None),
+            })
+        emit({"summary": summary})
+    finally:
+        if procs:
+            stop_processes(*procs)
+
+    if args.output:
+        with open(args.output, "a") as f:
+            for row in lines:
+                f.write(json.dumps(row) + "\n")
+
+
+if __name__ == "__main__":
+    main()
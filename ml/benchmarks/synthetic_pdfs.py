@@ -0,0 +1,324 @@
+"""
+Synthetic construction drawing sets for load tests.
+
+Usage (from ml/):
+    python -m benchmarks.synthetic_pdfs out/ --sets 5 --pages 24
+    python -m benchmarks.synthetic_pdfs out/ --sets 1 --pages 100 --sizes "ARCH D" "ARCH E1" --mix floor_plan=3 raster=1
+
+Writes sets of multi-sheet PDFs that exercise process_pdf the way real
+uploads do: sheets of mixed ARCH sizes in one file, and a mix of
+  floor_plan  vector linework: walls, door swings, dimensions, room tags
+  elevation   vector linework: storeys, openings, level markers
+  raster      a scanned sheet: grayscale JPEG with noise and a slight skew
+  schedule    a door/window/finish schedule table of text
+  notes       a cover or general notes sheet, mostly text
+Every page is distinct (seeded per set and page), so the page index does
+not turn a load test into a cache test. Prints one JSON line per set.
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from PIL import Image, ImageDraw, ImageFilter
+
+# Sheet sizes in inches, landscape
+ARCH_SIZES = {
+    "ARCH A": (12, 9),
+    "ARCH B": (18, 12),
+    "ARCH C": (24, 18),
+    "ARCH D": (36, 24),
+    "ARCH E1": (42, 30),
+    "ARCH E": (48, 36),
+}
+PAGE_KINDS = ("floor_plan", "elevation", "raster", "schedule", "notes")
+DEFAULT_MIX = {"floor_plan": 5, "elevation": 2, "raster": 2, "schedule": 1, "notes": 1}
+DEFAULT_SIZES = ("ARCH C", "ARCH D", "ARCH D", "ARCH D", "ARCH E1")
+
+
+class _PdfWriter:
+    """Just enough of a PDF writer for line art, Helvetica text and embedded JPEGs."""
+
+    def __init__(self):
+        self.objects: List[Optional[bytes]] = []
+        self.page_ids: List[int] = []
+        self.pages_id = self.reserve()
+        self.font_id = self.add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    def reserve(self) -> int:
+        self.objects.append(None)
+        return len(self.objects)
+
+    def add(self, body: bytes, obj_id: Optional[int] = None) -> int:
+        if obj_id is None:
+            obj_id = self.reserve()
+        self.objects[obj_id - 1] = body
+        return obj_id
+
+    def add_stream(self, data: bytes, entries: bytes = b"") -> int:
+        return self.add(b"<< " + entries + b" /Length %d >>\nstream\n" % len(data) + data + b"\nendstream")
+
+    def add_page(self, width_in: float, height_in: float, content: bytes, jpeg: Optional[Tuple[bytes, int, int]] = None):
+        resources = b"/Font << /F1 %d 0 R >>" % self.font_id
+        if jpeg:
+            data, w, h = jpeg
+            image_id = self.add_stream(data, b"/Type /XObject /Subtype /Image /Width %d /Height %d "
+                                             b"/ColorSpace /DeviceGray /BitsPerComponent 8 /Filter /DCTDecode" % (w, h))
+            resources += b" /XObject << /Im1 %d 0 R >>" % image_id
+        content_id = self.add_stream(content)
+        self.page_ids.append(self.add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %d %d] /Resources << %s >> /Contents %d 0 R >>"
+            % (self.pages_id, round(width_in * 72), round(height_in * 72), resources, content_id)
+        ))
+
+    def write(self, path: str) -> None:
+        kids = b" ".join(b"%d 0 R" % i for i in self.page_ids)
+        self.add(b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(self.page_ids)), self.pages_id)
+        catalog_id = self.add(b"<< /Type /Catalog /Pages %d 0 R >>" % self.pages_id)
+        out = io.BytesIO()
+        out.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        offsets = []
+        for obj_id, body in enumerate(self.objects, start=1):
+            offsets.append(out.tell())
+            out.write(b"%d 0 obj\n" % obj_id + body + b"\nendobj\n")
+        xref = out.tell()
+        out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(self.objects) + 1))
+        for offset in offsets:
+            out.write(b"%010d 00000 n \n" % offset)
+        out.write(b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+                  % (len(self.objects) + 1, catalog_id, xref))
+        with open(path, "wb") as f:
+            f.write(out.getvalue())
+
+
+class _Canvas:
+    """Content-stream builder in inches (origin bottom left)."""
+
+    def __init__(self):
+        self.ops: List[bytes] = []
+
+    def line_width(self, inches: float):
+        self.ops.append(b"%.3f w" % (inches * 72))
+
+    def line(self, x1: float, y1: float, x2: float, y2: float):
+        self.ops.append(b"%.2f %.2f m %.2f %.2f l S" % (x1 * 72, y1 * 72, x2 * 72, y2 * 72))
+
+    def rect(self, x: float, y: float, w: float, h: float):
+        self.ops.append(b"%.2f %.2f %.2f %.2f re S" % (x * 72, y * 72, w * 72, h * 72))
+
+    def arc(self, cx: float, cy: float, r: float, quadrant: int):
+        """Quarter circle (a door swing) as one Bezier curve."""
+        k = 0.5523 * r
+        sx, sy = (1, 1) if quadrant == 0 else (-1, 1) if quadrant == 1 else (-1, -1) if quadrant == 2 else (1, -1)
+        points = [(cx + sx * r, cy), (cx + sx * r, cy + sy * k), (cx + sx * k, cy + sy * r), (cx, cy + sy * r)]
+        self.ops.append(b"%.2f %.2f m " % (points[0][0] * 72, points[0][1] * 72)
+                        + b" ".join(b"%.2f %.2f" % (x * 72, y * 72) for x, y in points[1:]) + b" c S")
+
+    def text(self, x: float, y: float, size_pt: float, value: str):
+        escaped = value.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)").encode("latin-1", "replace")
+        self.ops.append(b"BT /F1 %.1f Tf %.2f %.2f Td (%s) Tj ET" % (size_pt, x * 72, y * 72, escaped))
+
+    def content(self) -> bytes:
+        return b"\n".join(self.ops)
+
+
+def _title_block(c: _Canvas, w: float, h: float, rng: random.Random, sheet: str, title: str) -> None:
+    c.line_width(0.02)
+    c.rect(0.5, 0.5, w - 1.0, h - 1.0)
+    c.rect(w - 4.5, 0.5, 4.0, 2.0)
+    c.text(w - 4.3, 2.1, 10, "ESTIMAGENT TEST ARCHITECTS")
+    c.text(w - 4.3, 1.6, 14, title.upper())
+    c.text(w - 4.3, 1.1, 9, f"PROJECT {rng.randint(1000, 9999)}  DATE 2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}")
+    c.text(w - 1.6, 0.8, 22, sheet)
+
+
+def _floor_plan(c: _Canvas, w: float, h: float, rng: random.Random) -> None:
+    left, bottom, right, top = 1.0, 3.0, w - 5.0, h - 1.0
+    c.line_width(0.04)
+    c.rect(left, bottom, right - left, top - bottom)
+    xs = [left]
+    while xs[-1] < right - 2:
+        xs.append(xs[-1] + rng.uniform(2, 6))
+    ys = [bottom]
+    while ys[-1] < top - 2:
+        ys.append(ys[-1] + rng.uniform(2, 5))
+    c.line_width(0.03)
+    for x in xs[1:]:
+        c.line(x, bottom, x, top)
+    for y in ys[1:]:
+        c.line(left, y, right, y)
+    c.line_width(0.01)
+    for i, x in enumerate(xs[:-1]):
+        for j, y in enumerate(ys[:-1]):
+            c.text(x + 0.3, y + 0.4, 8, f"ROOM {100 * (j + 1) + i}")
+            c.arc(x + 0.2, y, rng.uniform(0.5, 0.9), rng.randint(0, 1))
+            c.text(x + 0.3, y + 0.2, 6, f"{rng.randint(80, 400)} SF")
+    # Dimension strings and hatching give vector sheets their operator density
+    for x1, x2 in zip(xs, xs[1:]):
+        c.line(x1, top + 0.3, x2, top + 0.3)
+        c.text((x1 + x2) / 2, top + 0.35, 6, f"{int(x2 - x1)}'-{rng.randint(0, 11)}\"")
+    for _ in range(rng.randint(200, 600)):
+        x, y = rng.uniform(left, right), rng.uniform(bottom, top)
+        c.line(x, y, x + 0.15, y + 0.15)
+
+
+def _elevation(c: _Canvas, w: float, h: float, rng: random.Random) -> None:
+    left, right, ground = 1.5, w - 6.0, 4.0
+    storeys = rng.randint(2, 6)
+    height = min((h - 6.0) / storeys, 3.0)
+    c.line_width(0.04)
+    c.line(1.0, ground, w - 5.0, ground)
+    for s in range(storeys):
+        y = ground + s * height
+        c.rect(left, y, right - left, height)
+        c.text(right + 0.2, y + height, 8, f"LEVEL {s + 1}  EL. {s * 12}'-0\"")
+        x = left + 0.5
+        while x < right - 1.5:
+            c.rect(x, y + 0.6, 1.0, height - 1.2)
+            c.line(x + 0.5, y + 0.6, x + 0.5, y + height - 0.6)
+            x += rng.uniform(1.5, 3.0)
+
+
+def _schedule(c: _Canvas, w: float, h: float, rng: random.Random) -> None:
+    columns = ["MARK", "TYPE", "WIDTH", "HEIGHT", "MATERIAL", "FINISH", "HARDWARE", "REMARKS"]
+    rows = rng.randint(30, 80)
+    col_w = min((w - 6.0) / len(columns), 2.5)
+    row_h = min((h - 4.0) / (rows + 1), 0.3)
+    top = h - 1.5
+    c.line_width(0.01)
+    c.text(1.0, top + 0.3, 14, rng.choice(("DOOR SCHEDULE", "WINDOW SCHEDULE", "ROOM FINISH SCHEDULE")))
+    for r in range(rows + 2):
+        c.line(1.0, top - r * row_h, 1.0 + col_w * len(columns), top - r * row_h)
+    for i in range(len(columns) + 1):
+        c.line(1.0 + i * col_w, top, 1.0 + i * col_w, top - (rows + 1) * row_h)
+    for i, name in enumerate(columns):
+        c.text(1.05 + i * col_w, top - row_h + 0.08, 7, name)
+    for r in range(rows):
+        y = top - (r + 2) * row_h + 0.08
+        values = [f"{rng.choice('DW')}{r + 1:03d}", rng.choice(("A", "B", "C", "HM", "WD")),
+                  f"{rng.randint(2, 6)}'-{rng.randint(0, 11)}\"", f"{rng.randint(6, 9)}'-0\"",
+                  rng.choice(("WOOD", "HM", "ALUM", "GLASS")), rng.choice(("PT-1", "ST-2", "CLEAR")),
+                  f"HW-{rng.randint(1, 12)}", rng.choice(("", "FIRE RATED", "SEE DETAIL 4/A-501", "NIC"))]
+        for i, value in enumerate(values):
+            c.text(1.05 + i * col_w, y, 7, value)
+
+
+def _notes(c: _Canvas, w: float, h: float, rng: random.Random) -> None:
+    c.text(1.0, h - 2.0, 28, rng.choice(("GENERAL NOTES", "COVER SHEET", "CODE ANALYSIS")))
+    words = ("CONTRACTOR SHALL VERIFY ALL DIMENSIONS IN FIELD PRIOR TO CONSTRUCTION AND "
+             "NOTIFY ARCHITECT OF ANY DISCREPANCIES ALL WORK TO COMPLY WITH APPLICABLE CODES").split()
+    y = h - 3.0
+    column_x = 1.0
+    for n in range(rng.randint(40, 120)):
+        c.text(column_x, y, 8, f"{n + 1}. " + " ".join(rng.choice(words) for _ in range(rng.randint(8, 16))))
+        y -= 0.25
+        if y < 3.0:
+            y, column_x = h - 3.0, column_x + (w - 6.0) / 2
+
+
+def _scanned_sheet(w: float, h: float, rng: random.Random, dpi: int) -> Tuple[bytes, int, int]:
+    """A grayscale 'scan' of a plan: drawn at `dpi`, blurred, noisy and slightly rotated."""
+    px_w, px_h = int(w * dpi), int(h * dpi)
+    img = Image.new("L", (px_w, px_h), 235)
+    draw = ImageDraw.Draw(img)
+    border = dpi // 2
+    draw.rectangle([border, border, px_w - border, px_h - border], outline=20, width=max(2, dpi // 40))
+    for _ in range(rng.randint(20, 50)):
+        if rng.random() < 0.5:
+            x = rng.randint(border, px_w - border)
+            draw.line([x, border, x, px_h - border], fill=30, width=max(2, dpi // 60))
+        else:
+            y = rng.randint(border, px_h - border)
+            draw.line([border, y, px_w - border, y], fill=30, width=max(2, dpi // 60))
+    for _ in range(rng.randint(30, 90)):
+        x, y = rng.randint(border, px_w - border), rng.randint(border, px_h - border)
+        draw.text((x, y), f"RM {rng.randint(100, 999)}", fill=40)
+    img = img.rotate(rng.uniform(-1.5, 1.5), fillcolor=235, resample=Image.BILINEAR)
+    img = img.filter(ImageFilter.GaussianBlur(0.8))
+    noise = Image.effect_noise((px_w, px_h), 18)
+    img = Image.blend(img, noise, 0.12)
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=70)
+    return buf.getvalue(), px_w, px_h
+
+
+_DRAWERS = {"floor_plan": _floor_plan, "elevation": _elevation, "schedule": _schedule, "notes": _notes}
+_PREFIX = {"floor_plan": "A-1", "elevation": "A-2", "raster": "A-1", "schedule": "A-6", "notes": "G-0"}
+
+
+def generate_set(path: str, pages: int, seed: int, mix: Optional[Dict[str, float]] = None,
+                 sizes: Sequence[str] = DEFAULT_SIZES, scan_dpi: int = 150) -> Dict[str, object]:
+    """
+    Write one drawing set of `pages` sheets to `path`.
+
+    Args:
+        path: Output PDF path
+        pages: Number of sheets
+        seed: Seed for page kinds, sizes and content
+        mix: Relative weight per page kind (PAGE_KINDS); DEFAULT_MIX when None
+        sizes: ARCH sizes to draw sheet sizes from (repeat a size to weight it)
+        scan_dpi: Resolution of the embedded scans on raster sheets
+
+    Returns:
+        Summary of the set: path, bytes, and page counts per kind and size
+    """
+    rng = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    kinds, weights = zip(*mix.items())
+    writer = _PdfWriter()
+    counts: Dict[str, int] = {}
+    size_counts: Dict[str, int] = {}
+    for page in range(pages):
+        kind = rng.choices(kinds, weights)[0]
+        size = rng.choice(list(sizes))
+        w, h = ARCH_SIZES[size]
+        page_rng = random.Random(rng.random())
+        canvas = _Canvas()
+        jpeg = None
+        if kind == "raster":
+            jpeg = _scanned_sheet(w, h, page_rng, scan_dpi)
+            canvas.ops.append(b"q %.2f 0 0 %.2f 0 0 cm /Im1 Do Q" % (w * 72, h * 72))
+        else:
+            _DRAWERS[kind](canvas, w, h, page_rng)
+        _title_block(canvas, w, h, page_rng, f"{_PREFIX[kind]}{page + 1:02d}", kind.replace("_", " "))
+        writer.add_page(w, h, canvas.content(), jpeg)
+        counts[kind] = counts.get(kind, 0) + 1
+        size_counts[size] = size_counts.get(size, 0) + 1
+    writer.write(path)
+    return {"path": path, "bytes": os.path.getsize(path), "pages": pages, "kinds": counts, "sizes": size_counts}
+
+
+def parse_mix(items: Sequence[str]) -> Dict[str, float]:
+    """["floor_plan=3", "raster=1"] -> {"floor_plan": 3.0, "raster": 1.0}"""
+    mix = {}
+    for item in items:
+        kind, _, weight = item.partition("=")
+        if kind not in PAGE_KINDS:
+            raise ValueError(f"Unknown page kind '{kind}'. Use one of: {', '.join(PAGE_KINDS)}")
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("out_dir")
+    parser.add_argument("--sets", type=int, default=3)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--mix", nargs="*", default=[], metavar="KIND=WEIGHT", help=f"Page kinds: {', '.join(PAGE_KINDS)}")
+    parser.add_argument("--sizes", nargs="*", default=list(DEFAULT_SIZES), choices=list(ARCH_SIZES))
+    parser.add_argument("--scan-dpi", type=int, default=150)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    mix = parse_mix(args.mix) if args.mix else None
+    for i in range(args.sets):
+        path = os.path.join(args.out_dir, f"set_{args.seed}_{i + 1:03d}.pdf")
+        print(json.dumps(generate_set(path, args.pages, args.seed * 1000 + i, mix, args.sizes, args.scan_dpi)))
+
+
+if __name__ == "__main__":
+    main()
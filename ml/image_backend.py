@@ -0,0 +1,180 @@
+"""
+Image Codec Backends for EstimAgent
+JPEG encoding and downscaling used by PDF processing and /analyze, behind one
+small interface so a faster library can be used where it is installed.
+
+Backends, selected with IMAGE_BACKEND:
+- "pillow":    PIL only (Pillow wheels already ship libjpeg-turbo). Thumbnails
+               of in-memory pages use a reducing gap instead of a full copy.
+- "vips":      libvips via pyvips. Thumbnails are made from the file on disk
+               with shrink-on-load and a streaming, multi-threaded resize, so
+               the full-resolution page is never decoded again.
+- "turbojpeg": libjpeg-turbo via PyTurboJPEG for encoding and for scaled
+               (1/2, 1/4, 1/8) decoding of files on disk.
+- "auto":      vips when installed, otherwise pillow.
+
+Every backend produces baseline JPEGs with the render density in the JFIF
+header, so downstream unit conversion reads the same DPI whichever is used.
+"""
+
+import logging
+import struct
+from io import BytesIO
+from typing import Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+try:
+    import pyvips
+except (ImportError, OSError):
+    pyvips = None
+
+try:
+    import turbojpeg
+except (ImportError, OSError):
+    turbojpeg = None
+
+logger = logging.getLogger(__name__)
+
+_JPEG_EXTENSIONS = ('.jpg', '.jpeg')
+
+
+def _fit(size: Tuple[int, int], max_size: int) -> Tuple[int, int]:
+    """Size that fits within max_size x max_size keeping aspect ratio (never enlarges)."""
+    width, height = size
+    factor = min(1.0, max_size / max(width, height))
+    return max(1, round(width * factor)), max(1, round(height * factor))
+
+
+def _with_jfif_density(data: bytes, dpi: Optional[float]) -> bytes:
+    """Set the pixel density of a JPEG's JFIF APP0 segment (encoders that lack a DPI option)."""
+    if not dpi or data[6:11] != b'JFIF\x00':
+        return data
+    density = max(1, min(65535, int(round(dpi))))
+    return data[:13] + struct.pack('>BHH', 1, density, density) + data[18:]
+
+
+class PillowBackend:
+    """Reference backend using PIL for everything."""
+
+    name = 'pillow'
+
+    def save_jpeg(self, image: Image.Image, path: str, quality: int, dpi: Optional[float] = None) -> None:
+        image.save(path, 'JPEG', quality=quality, **({'dpi': (dpi, dpi)} if dpi else {}))
+
+    def save_image(self, image: Image.Image, path: str, quality: int, dpi: Optional[float] = None) -> None:
+        """Save in the format implied by the extension, using the fast JPEG path when it applies."""
+        if path.lower().endswith(_JPEG_EXTENSIONS):
+            self.save_jpeg(image, path, quality, dpi)
+        else:
+            image.save(path, quality=quality, **({'dpi': (dpi, dpi)} if dpi else {}))
+
+    def thumbnail_jpeg(self, path: str, max_size: int, quality: int, image: Optional[Image.Image] = None) -> bytes:
+        """
+        Downscale a page to fit max_size and encode it as JPEG.
+
+        Args:
+            path: Page image on disk
+            max_size: Longest side of the result in pixels
+            quality: JPEG quality
+            image: Already-decoded pixels of `path`, used instead of the file when given
+
+        Returns:
+            JPEG bytes
+        """
+        if image is None:
+            with Image.open(path) as img:
+                # thumbnail() uses JPEG draft mode, decoding at a reduced scale
+                img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+                return self._encode(img, quality)
+        thumb = image.resize(_fit(image.size, max_size), Image.Resampling.LANCZOS, reducing_gap=2.0)
+        return self._encode(thumb, quality)
+
+    def _encode(self, image: Image.Image, quality: int) -> bytes:
+        buffered = BytesIO()
+        image.convert('RGB').save(buffered, format='JPEG', quality=quality)
+        return buffered.getvalue()
+
+
+class TurboJpegBackend(PillowBackend):
+    """libjpeg-turbo through PyTurboJPEG for encoding and scaled decoding."""
+
+    name = 'turbojpeg'
+
+    def __init__(self):
+        if turbojpeg is None:
+            raise RuntimeError("PyTurboJPEG is not installed")
+        self._tj = turbojpeg.TurboJPEG()
+
+    def _encode(self, image: Image.Image, quality: int, dpi: Optional[float] = None) -> bytes:
+        if image.mode == 'L':
+            data = self._tj.encode(np.asarray(image)[:, :, None], quality=quality,
+                                   pixel_format=turbojpeg.TJPF_GRAY, jpeg_subsample=turbojpeg.TJSAMP_GRAY)
+        else:
+            data = self._tj.encode(np.asarray(image.convert('RGB')), quality=quality,
+                                   pixel_format=turbojpeg.TJPF_RGB, jpeg_subsample=turbojpeg.TJSAMP_420)
+        return _with_jfif_density(data, dpi)
+
+    def save_jpeg(self, image: Image.Image, path: str, quality: int, dpi: Optional[float] = None) -> None:
+        data = self._encode(image, quality, dpi)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def thumbnail_jpeg(self, path: str, max_size: int, quality: int, image: Optional[Image.Image] = None) -> bytes:
+        if image is not None or not path.lower().endswith(_JPEG_EXTENSIONS):
+            return super().thumbnail_jpeg(path, max_size, quality, image)
+        with open(path, 'rb') as f:
+            data = f.read()
+        width, height, _, _ = self._tj.decode_header(data)
+        target = _fit((width, height), max_size)
+        # Largest libjpeg-turbo DCT scaling that still decodes to at least the target size
+        factor = max(
+            (f for f in self._tj.scaling_factors
+             if f[0] <= f[1] and -(-width * f[0] // f[1]) >= target[0] and -(-height * f[0] // f[1]) >= target[1]),
+            key=lambda f: -f[0] / f[1],
+            default=(1, 1),
+        )
+        pixels = self._tj.decode(data, pixel_format=turbojpeg.TJPF_RGB, scaling_factor=factor)
+        img = Image.fromarray(pixels)
+        if img.size != target:
+            img = img.resize(target, Image.Resampling.LANCZOS)
+        return self._encode(img, quality)
+
+
+class VipsBackend(PillowBackend):
+    """libvips through pyvips for file-based thumbnails and encoding."""
+
+    name = 'vips'
+
+    def __init__(self):
+        if pyvips is None:
+            raise RuntimeError("pyvips is not installed")
+
+    def save_jpeg(self, image: Image.Image, path: str, quality: int, dpi: Optional[float] = None) -> None:
+        if image.mode not in ('L', 'RGB'):
+            image = image.convert('RGB')
+        vimg = pyvips.Image.new_from_memory(image.tobytes(), image.width, image.height,
+                                            len(image.getbands()), 'uchar')
+        if dpi:
+            # libvips resolution is in pixels per millimetre
+            vimg = vimg.copy(xres=dpi / 25.4, yres=dpi / 25.4)
+        vimg.jpegsave(path, Q=quality, strip=False)
+
+    def thumbnail_jpeg(self, path: str, max_size: int, quality: int, image: Optional[Image.Image] = None) -> bytes:
+        # Always from the file: shrink-on-load beats copying decoded pixels into libvips
+        thumb = pyvips.Image.thumbnail(path, max_size, height=max_size, size='down')
+        return thumb.jpegsave_buffer(Q=quality)
+
+
+def load_image_backend(kind: str = 'auto'):
+    """Build the image backend named by IMAGE_BACKEND ("auto", "pillow", "vips" or "turbojpeg")."""
+    if kind == 'auto':
+        kind = 'vips' if pyvips is not None else 'pillow'
+    if kind == 'pillow':
+        return PillowBackend()
+    if kind == 'vips':
+        return VipsBackend()
+    if kind == 'turbojpeg':
+        return TurboJpegBackend()
+    raise ValueError(f"Unknown image backend: {kind}")
@@ -0,0 +1,74 @@
+"""
+Image Ingestion for EstimAgent
+Turns an uploaded plan image into the downscaled image the models see while
+decoding its pixels exactly once.
+
+Format and dimensions come from the header (PIL opens lazily), JPEGs that
+need downscaling are decoded in draft mode straight at a reduced DCT scale,
+and the remaining resize uses a reducing gap so only the final step is
+LANCZOS-filtered.
+"""
+
+from dataclasses import dataclass
+from typing import Tuple
+
+from PIL import Image
+
+SUPPORTED_FORMATS = ('PNG', 'JPEG', 'GIF', 'BMP')
+
+
+class UnreadableImageError(ValueError):
+    """The upload is not an image that can be decoded."""
+
+
+@dataclass
+class IngestedImage:
+    image: Image.Image  # Decoded (and possibly downscaled) pixels; header info is preserved
+    format: str
+    original_size: Tuple[int, int]
+    scale_factor: float  # Output size / original size
+
+
+def ingest_image(path: str, max_dimension: int) -> IngestedImage:
+    """
+    Decode an image once, downscaled so its longest side is at most `max_dimension`.
+
+    Args:
+        path: Image file on disk
+        max_dimension: Longest side of the output in pixels
+
+    Returns:
+        IngestedImage with the decoded pixels and the applied scale factor
+
+    Raises:
+        ValueError: If the image format or dimensions are not supported
+        OSError: If the file cannot be identified or decoded
+    """
+    img = Image.open(path)
+    try:
+        # Header only so far: format, size and info are known, pixels are not decoded
+        fmt = img.format
+        if fmt not in SUPPORTED_FORMATS:
+            raise ValueError(f"Unsupported image format: {fmt}")
+        width, height = img.size
+        if width <= 0 or height <= 0:
+            raise ValueError(f"Invalid image dimensions: {width}x{height}")
+
+        scale_factor = 1.0
+        target = (width, height)
+        if max(width, height) > max_dimension:
+            scale_factor = max_dimension / max(width, height)
+            target = (int(width * scale_factor), int(height * scale_factor))
+            # JPEG only: decode at the smallest 1/2, 1/4 or 1/8 scale still >= target
+            img.draft(img.mode if img.mode in ('L', 'RGB') else 'RGB', target)
+
+        # The single decode; truncated or corrupt data fails here
+        img.load()
+        if img.size != target:
+            resized = img.resize(target, Image.Resampling.LANCZOS, reducing_gap=3.0)
+            img.close()
+            img = resized
+        return IngestedImage(image=img, format=fmt, original_size=(width, height), scale_factor=scale_factor)
+    except Exception:
+        img.close()
+        raise
@@ -0,0 +1,166 @@
+"""
+Structured Logging for EstimAgent
+Leveled JSON-lines (or plain text) logs with the request id on every record,
+written through a queue so request threads never block on stdout.
+
+- configure_logging() puts a single QueueHandler on the root logger; a
+  QueueListener thread formats the records and writes them to stdout.
+- The request id is a context variable set by the HTTP middleware (taken from
+  an incoming X-Request-ID header when present) and stamped on every record by
+  a filter, including records from thread pools that run under Metrics.bind().
+- In a forked child (CPU workers) the listener thread does not exist; records
+  are written straight to stdout there. listener_paused() stops the thread
+  around a fork so that the parent forks with no other thread running.
+- Per-detection debug output (room/wall measurements, ensemble matches) goes
+  to the "estimagent.detections" logger and is sampled: DETECTION_LOG_SAMPLE_RATE
+  is the fraction of detections logged, 0 (off) by default.
+
+Extra fields passed with `extra={...}` become top-level JSON keys.
+"""
+
+import os
+import sys
+import json
+import queue
+import random
+import atexit
+import logging
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+_request_id = contextvars.ContextVar('request_id', default='-')
+
+detection_logger = logging.getLogger('estimagent.detections')
+_detection_sample_rate = 0.0
+
+# Attributes every LogRecord has; anything else on a record came from `extra`
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime', 'request_id'}
+
+_listener: Optional[QueueListener] = None
+
+
+def set_request_id(request_id: str) -> contextvars.Token:
+    """Set the current request id; pass the returned token to reset_request_id()."""
+    return _request_id.set(request_id)
+
+
+def reset_request_id(token: contextvars.Token) -> None:
+    _request_id.reset(token)
+
+
+def current_request_id() -> str:
+    return _request_id.get()
+
+
+def sample_detection() -> bool:
+    """Whether to log debug output for this detection (DETECTION_LOG_SAMPLE_RATE)."""
+    return _detection_sample_rate > 0 and random.random() < _detection_sample_rate
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamps the current request id on records, in the thread that logged them."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = _request_id.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, request_id, message and any extra fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'request_id': getattr(record, 'request_id', '-'),
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class _QueueHandler(QueueHandler):
+    """
+    Hands records to the listener thread without formatting them first, so the
+    formatter still sees extra fields; only the message and traceback are
+    resolved here, while the arguments are still valid.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def configure_logging(level: str = 'INFO', fmt: str = 'json', detection_sample_rate: float = 0.0) -> None:
+    """
+    Route all logging through a non-blocking queue to stdout.
+    Calling it again only updates the level and detection sampling.
+    """
+    global _listener, _detection_sample_rate
+    _detection_sample_rate = max(0.0, min(1.0, detection_sample_rate))
+    detection_logger.setLevel(logging.DEBUG if _detection_sample_rate > 0 else logging.WARNING)
+
+    root = logging.getLogger()
+    root.setLevel(level.upper())
+    if _listener is not None:
+        return
+
+    stream = logging.StreamHandler(sys.stdout)
+    if fmt == 'json':
+        stream.setFormatter(JsonFormatter())
+    else:
+        stream.setFormatter(logging.Formatter('%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s'))
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    handler = _QueueHandler(log_queue)
+    handler.addFilter(RequestIdFilter())
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+
+    _listener = QueueListener(log_queue, stream, respect_handler_level=False)
+    _listener.start()
+    atexit.register(_listener.stop)
+    os.register_at_fork(after_in_child=_log_directly)
+
+
+@contextmanager
+def listener_paused():
+    """Stop the listener thread for the block; records logged meanwhile are written after it."""
+    if _listener is None:
+        yield
+        return
+    _listener.stop()
+    try:
+        yield
+    finally:
+        _listener.start()
+
+
+def _log_directly() -> None:
+    """After a fork the listener thread is gone: write records straight to its handlers."""
+    global _listener
+    if _listener is None:
+        return
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, _QueueHandler):
+            root.removeHandler(handler)
+    for handler in _listener.handlers:
+        handler.addFilter(RequestIdFilter())
+        root.addHandler(handler)
+    _listener = None
@@ -0,0 +1,200 @@
+"""
+Prometheus Metrics for EstimAgent
+Latency histograms per processing stage and per model call, labeled by the
+endpoint that triggered the work, exposed on /metrics.
+
+The endpoint label lives in a context variable set by the HTTP middleware, so
+code deep inside a request (PDFProcessor, _infer_image) records against the
+right endpoint without threading it through every call. Work handed to a
+thread pool must be wrapped with Metrics.bind() to keep the label; anything
+unlabeled is reported as "background".
+
+Without prometheus_client installed (or with METRICS_ENABLED=0) every method
+is a no-op and /metrics returns 404.
+
+Given a Tracer (tracing.py), every stage and model call is also recorded as a
+span of the current request trace, whether or not metrics are enabled.
+"""
+
+import time
+import contextvars
+import functools
+from contextlib import contextmanager
+from typing import Any, Callable, Optional, Tuple
+
+from tracing import Tracer
+
+try:
+    from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+except ImportError:
+    CollectorRegistry = None
+
+_endpoint = contextvars.ContextVar('metrics_endpoint', default='background')
+
+# Stages range from sub-millisecond (normalization) to minutes (100-page PDFs)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+
+class Metrics:
+    """Per-stage and per-model latency histograms plus retry counters."""
+
+    def __init__(self, enabled: bool = True, namespace: str = 'estimagent', tracer: Optional[Tracer] = None):
+        self.enabled = enabled and CollectorRegistry is not None
+        self.tracer = tracer or Tracer(enabled=False)
+        if not self.enabled:
+            return
+        self.registry = CollectorRegistry()
+        self.request_seconds = Histogram(
+            'request_seconds', 'HTTP request latency',
+            ['endpoint', 'method', 'status'], namespace=namespace, registry=self.registry, buckets=LATENCY_BUCKETS,
+        )
+        self.stage_seconds = Histogram(
+            'stage_seconds', 'Latency of one processing stage',
+            ['endpoint', 'stage'], namespace=namespace, registry=self.registry, buckets=LATENCY_BUCKETS,
+        )
+        self.model_call_seconds = Histogram(
+            'model_call_seconds', 'Latency of one model call (remote inference, classification or local YOLO)',
+            ['endpoint', 'model_id', 'outcome'], namespace=namespace, registry=self.registry, buckets=LATENCY_BUCKETS,
+        )
+        self.retries = Counter(
+            'retries_total', 'Attempts retried after a failed upstream call',
+            ['endpoint', 'stage'], namespace=namespace, registry=self.registry,
+        )
+        self.admissions = Counter(
+            'admissions_total', 'Admission decisions for expensive requests (admission.py)',
+            ['endpoint', 'priority', 'outcome'], namespace=namespace, registry=self.registry,
+        )
+        self.admission_wait_seconds = Histogram(
+            'admission_wait_seconds', 'Time a request waited for admission',
+            ['endpoint', 'priority'], namespace=namespace, registry=self.registry, buckets=LATENCY_BUCKETS,
+        )
+        self.upstream_throttles = Counter(
+            'upstream_throttled_total', 'Upstream calls throttled: by the provider (remote 429) or held back locally',
+            ['upstream', 'source'], namespace=namespace, registry=self.registry,
+        )
+        self.upstream_wait_seconds = Histogram(
+            'upstream_wait_seconds', 'Time a model call waited for the rate limiter',
+            ['upstream'], namespace=namespace, registry=self.registry, buckets=LATENCY_BUCKETS,
+        )
+        self.circuit_rejections = Counter(
+            'circuit_rejections_total', 'Model calls failed fast by an open circuit',
+            ['upstream'], namespace=namespace, registry=self.registry,
+        )
+        self.circuit_open = Gauge(
+            'circuit_open', 'Whether the circuit to an upstream model is open (1), half-open (0.5) or closed (0)',
+            ['upstream'], namespace=namespace, registry=self.registry,
+        )
+
+    # -- request context -----------------------------------------------------------
+
+    @contextmanager
+    def endpoint(self, name: str):
+        """Attribute everything recorded inside the block to `name`."""
+        token = _endpoint.set(name)
+        try:
+            yield
+        finally:
+            _endpoint.reset(token)
+
+    @staticmethod
+    def bind(fn: Callable, endpoint: Optional[str] = None) -> Callable:
+        """
+        Wrap `fn` to run in a copy of the current context (and optionally under
+        another endpoint label), for handing work to thread pools and workers.
+        """
+        context = contextvars.copy_context()
+
+        @functools.wraps(fn)
+        def run(*args, **kwargs):
+            def call():
+                if endpoint is not None:
+                    _endpoint.set(endpoint)
+                return fn(*args, **kwargs)
+            # A context can only be entered by one thread at a time; copy it per call
+            return context.copy().run(call)
+
+        return run
+
+    # -- recording -----------------------------------------------------------------
+
+    @contextmanager
+    def stage(self, name: str, **attributes: Any):
+        """Time the block as processing stage `name`; `attributes` only go on its span."""
+        with self.tracer.span(name, **attributes):
+            if not self.enabled:
+                yield
+                return
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                self.stage_seconds.labels(_endpoint.get(), name).observe(time.perf_counter() - start)
+
+    def observe_stage(self, name: str, seconds: float) -> None:
+        """Record stage `name` timed elsewhere, e.g. in a CPU worker process whose own metrics are not exported."""
+        if self.enabled:
+            self.stage_seconds.labels(_endpoint.get(), name).observe(seconds)
+
+    def timed(self, name: str) -> Callable:
+        """Decorator form of stage()."""
+        def decorator(fn: Callable) -> Callable:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    @contextmanager
+    def model_call(self, model_id: str, **attributes: Any):
+        """Time one model call; failures are recorded with outcome="error"."""
+        with self.tracer.span('model_call', model_id=model_id or 'unknown', **attributes):
+            if not self.enabled:
+                yield
+                return
+            start = time.perf_counter()
+            outcome = 'error'
+            try:
+                yield
+                outcome = 'ok'
+            finally:
+                self.model_call_seconds.labels(_endpoint.get(), model_id or 'unknown', outcome).observe(
+                    time.perf_counter() - start
+                )
+
+    def retry(self, stage: str) -> None:
+        if self.enabled:
+            self.retries.labels(_endpoint.get(), stage).inc()
+
+    def observe_admission(self, endpoint: str, priority: str, outcome: str, wait_seconds: float) -> None:
+        # Explicit endpoint: a waiting request is admitted from the request that releases capacity
+        if self.enabled:
+            self.admissions.labels(endpoint, priority, outcome).inc()
+            if outcome == 'admitted':
+                self.admission_wait_seconds.labels(endpoint, priority).observe(wait_seconds)
+
+    def upstream_throttled(self, upstream: str, source: str) -> None:
+        if self.enabled:
+            self.upstream_throttles.labels(upstream, source).inc()
+
+    def upstream_wait(self, upstream: str, seconds: float) -> None:
+        if self.enabled:
+            self.upstream_wait_seconds.labels(upstream).observe(seconds)
+
+    def circuit_rejected(self, upstream: str) -> None:
+        if self.enabled:
+            self.circuit_rejections.labels(upstream).inc()
+
+    def circuit_state(self, upstream: str, state: str) -> None:
+        if self.enabled:
+            self.circuit_open.labels(upstream).set({'open': 1, 'half_open': 0.5}.get(state, 0))
+
+    def observe_request(self, endpoint: str, method: str, status: int, seconds: float) -> None:
+        if self.enabled:
+            self.request_seconds.labels(endpoint, method, str(status)).observe(seconds)
+
+    # -- exposition ----------------------------------------------------------------
+
+    def render(self) -> Tuple[bytes, str]:
+        """Prometheus text exposition of every metric, with its content type."""
+        return generate_latest(self.registry), CONTENT_TYPE_LATEST
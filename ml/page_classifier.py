@@ -0,0 +1,200 @@
+"""
+Local Page Classifiers for EstimAgent
+In-process alternatives to the hosted Roboflow page classifier, so PDF uploads
+can be classified without a network round trip per page.
+
+Two classifiers are available, selected with PAGE_CLASSIFIER:
+- "ocr":  reads the title block and sheet number with Tesseract and scores
+          page types by keyword. Needs only the tesseract binary.
+- "onnx": small CNN exported to ONNX (PAGE_CLASSIFIER_ONNX_PATH), run with
+          onnxruntime on batches of pages.
+
+Both return results in the Roboflow classification format
+({"top", "confidence", "predictions"}) so PDFProcessor parses them unchanged.
+"""
+
+import os
+import re
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageOps
+
+try:
+    import pytesseract
+except ImportError:
+    pytesseract = None
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+logger = logging.getLogger(__name__)
+
+# Keyword evidence per raw class (labels understood by PDFProcessor._map_classification_result)
+_KEYWORDS: Dict[str, Tuple[str, ...]] = {
+    'floor_plan': ('floor plan', 'first floor', 'second floor', 'ground floor', 'level 1', 'level 2',
+                   'basement plan', 'roof plan', 'reflected ceiling', 'furniture plan', 'dimension plan'),
+    'elevation': ('elevation', 'elevations', 'north elevation', 'south elevation', 'east elevation',
+                  'west elevation', 'exterior elevation', 'interior elevation'),
+    'section': ('section', 'sections', 'building section', 'wall section'),
+    'electrical': ('electrical', 'lighting plan', 'power plan', 'panel', 'receptacle'),
+    'plumbing': ('plumbing', 'sanitary', 'domestic water', 'waste and vent', 'riser'),
+    'hvac': ('hvac', 'mechanical', 'ductwork', 'diffuser', 'air handling'),
+    'site': ('site plan', 'site', 'grading', 'landscape', 'civil', 'survey', 'parking'),
+    'detail': ('detail', 'details', 'typical detail', 'enlarged'),
+    'notes': ('general notes', 'notes', 'specifications', 'abbreviations', 'legend', 'code analysis'),
+    'cover': ('cover sheet', 'cover', 'title sheet', 'sheet index', 'drawing index', 'project directory'),
+    'schedule': ('schedule', 'door schedule', 'window schedule', 'finish schedule', 'room finish'),
+}
+
+# Discipline / series conventions of US National CAD Standard sheet numbers (A101, E-201, ...)
+_SHEET_PREFIXES: Tuple[Tuple[str, str], ...] = (
+    (r'^A-?1\d\d', 'floor_plan'),
+    (r'^A-?2\d\d', 'elevation'),
+    (r'^A-?3\d\d', 'section'),
+    (r'^A-?[45]\d\d', 'detail'),
+    (r'^A-?6\d\d', 'schedule'),
+    (r'^A-?0\d\d', 'notes'),
+    (r'^E-?\d', 'electrical'),
+    (r'^P-?\d', 'plumbing'),
+    (r'^M-?\d', 'hvac'),
+    (r'^[CL]-?\d', 'site'),
+    (r'^[GT]-?0\d\d', 'cover'),
+)
+
+_SHEET_NUMBER = re.compile(r'\b([A-Z]{1,2}-?\d{1,3}(?:\.\d{1,2})?)\b')
+
+
+def _as_result(scores: Dict[str, float]) -> Dict[str, Any]:
+    """Turn class scores into a Roboflow-style classification result."""
+    total = sum(scores.values())
+    if total <= 0:
+        return {'top': 'unknown', 'confidence': 0.0, 'predictions': []}
+    predictions = sorted(
+        ({'class': label, 'confidence': score / total} for label, score in scores.items() if score > 0),
+        key=lambda p: p['confidence'],
+        reverse=True,
+    )
+    return {'top': predictions[0]['class'], 'confidence': predictions[0]['confidence'], 'predictions': predictions}
+
+
+class OcrPageClassifier:
+    """
+    Heuristic classifier over title-block OCR.
+
+    The title block is usually in the bottom-right corner or along the right
+    edge; the sheet title and number found there carry most of the signal,
+    with the full-page text as weaker evidence.
+    """
+
+    name = 'local/ocr-title-block'
+
+    def __init__(self, workers: int = 4):
+        if pytesseract is None:
+            raise RuntimeError("pytesseract is not installed")
+        self.workers = workers
+
+    def _ocr(self, image: Image.Image) -> str:
+        return pytesseract.image_to_string(image, config='--psm 11').lower()
+
+    def classify_image(self, image_path: str) -> Dict[str, Any]:
+        with Image.open(image_path) as img:
+            gray = ImageOps.grayscale(img)
+        width, height = gray.size
+
+        # Title block candidates, upscaled so small lettering survives the 1024px compression
+        title_regions = [
+            gray.crop((int(width * 0.65), int(height * 0.75), width, height)),
+            gray.crop((int(width * 0.85), 0, width, height)),
+        ]
+        title_text = ' '.join(
+            self._ocr(region.resize((region.width * 2, region.height * 2), Image.Resampling.BICUBIC))
+            for region in title_regions
+        )
+        page_text = self._ocr(gray)
+
+        scores: Dict[str, float] = {label: 0.0 for label in _KEYWORDS}
+        for label, keywords in _KEYWORDS.items():
+            for keyword in keywords:
+                # Multi-word phrases are stronger evidence than single words
+                weight = 1.0 + keyword.count(' ')
+                scores[label] += 3.0 * weight * title_text.count(keyword)
+                scores[label] += 0.5 * weight * page_text.count(keyword)
+
+        for match in _SHEET_NUMBER.findall(title_text.upper()):
+            for pattern, label in _SHEET_PREFIXES:
+                if re.match(pattern, match):
+                    scores[label] += 4.0
+                    break
+
+        return _as_result(scores)
+
+    def classify_batch(self, image_paths: List[str]) -> List[Dict[str, Any]]:
+        # Tesseract runs as a subprocess, so threads give real parallelism
+        with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(image_paths)))) as executor:
+            return list(executor.map(self.classify_image, image_paths))
+
+
+class OnnxPageClassifier:
+    """
+    Small CNN page classifier exported to ONNX.
+
+    Expects an NCHW float32 input of `input_size` (ImageNet normalization) and
+    a single logits output; class labels are read from PAGE_CLASSIFIER_LABELS
+    or from a `<model>.labels.txt` file next to the model, one per line.
+    """
+
+    _MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32).reshape(1, 3, 1, 1)
+    _STD = np.array([0.229, 0.224, 0.225], dtype=np.float32).reshape(1, 3, 1, 1)
+
+    def __init__(self, model_path: str, labels: Optional[List[str]] = None, input_size: int = 224):
+        if onnxruntime is None:
+            raise RuntimeError("onnxruntime is not installed")
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"ONNX page classifier not found: {model_path}")
+        if labels is None:
+            labels_path = f"{os.path.splitext(model_path)[0]}.labels.txt"
+            with open(labels_path, 'r', encoding='utf-8') as f:
+                labels = [line.strip() for line in f if line.strip()]
+        self.labels = labels
+        self.input_size = input_size
+        self.session = onnxruntime.InferenceSession(model_path, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        self.name = f"local/onnx-{os.path.basename(model_path)}"
+
+    def _preprocess(self, image_path: str) -> np.ndarray:
+        with Image.open(image_path) as img:
+            img.draft('RGB', (self.input_size * 2, self.input_size * 2))
+            rgb = img.convert('RGB').resize((self.input_size, self.input_size), Image.Resampling.BILINEAR)
+        return np.asarray(rgb, dtype=np.float32).transpose(2, 0, 1) / 255.0
+
+    def classify_batch(self, image_paths: List[str]) -> List[Dict[str, Any]]:
+        batch = (np.stack([self._preprocess(path) for path in image_paths]) - self._MEAN) / self._STD
+        logits = self.session.run(None, {self.input_name: batch.astype(np.float32)})[0]
+        logits = logits - logits.max(axis=1, keepdims=True)
+        probs = np.exp(logits) / np.exp(logits).sum(axis=1, keepdims=True)
+        return [
+            _as_result({label: float(p) for label, p in zip(self.labels, row)})
+            for row in probs
+        ]
+
+    def classify_image(self, image_path: str) -> Dict[str, Any]:
+        return self.classify_batch([image_path])[0]
+
+
+def load_page_classifier(kind: str):
+    """Build the local classifier named by PAGE_CLASSIFIER ("ocr" or "onnx")."""
+    if kind == 'ocr':
+        return OcrPageClassifier(workers=int(os.getenv('PAGE_CLASSIFY_CONCURRENCY', '4')))
+    if kind == 'onnx':
+        labels = os.getenv('PAGE_CLASSIFIER_LABELS')
+        return OnnxPageClassifier(
+            os.getenv('PAGE_CLASSIFIER_ONNX_PATH', './models/page_classifier.onnx'),
+            labels=[label.strip() for label in labels.split(',')] if labels else None,
+            input_size=int(os.getenv('PAGE_CLASSIFIER_INPUT_SIZE', '224')),
+        )
+    raise ValueError(f"Unknown local page classifier: {kind}")
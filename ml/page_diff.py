@@ -0,0 +1,162 @@
+"""
+Page Diff for EstimAgent
+Finds the regions of a revised sheet that differ from a previously analyzed
+render, so that detection only has to run on what changed.
+"""
+
+from collections import deque
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+Box = Tuple[int, int, int, int]  # x1, y1, x2, y2 in full-resolution pixels
+
+
+def _load_gray(path: str, reduce: int) -> Tuple[np.ndarray, Tuple[int, int]]:
+    """Decode an image as grayscale at 1/reduce size, returning pixels and full size."""
+    with Image.open(path) as img:
+        full_size = img.size
+        target = (max(1, full_size[0] // reduce), max(1, full_size[1] // reduce))
+        # JPEG draft mode decodes straight at a reduced scale instead of full resolution
+        img.draft('L', target)
+        gray = img.convert('L')
+        if gray.size != target:
+            gray = gray.resize(target, Image.Resampling.BILINEAR)
+        return np.asarray(gray, dtype=np.int16), full_size
+
+
+def _merge_boxes(boxes: List[Box]) -> List[Box]:
+    """Merge overlapping boxes until none overlap."""
+    merged = list(boxes)
+    changed = True
+    while changed:
+        changed = False
+        result: List[Box] = []
+        for box in merged:
+            for i, other in enumerate(result):
+                if box[0] <= other[2] and other[0] <= box[2] and box[1] <= other[3] and other[1] <= box[3]:
+                    result[i] = (min(box[0], other[0]), min(box[1], other[1]),
+                                 max(box[2], other[2]), max(box[3], other[3]))
+                    changed = True
+                    break
+            else:
+                result.append(box)
+        merged = result
+    return merged
+
+
+def changed_regions(
+    old_path: str,
+    new_path: str,
+    tile_size: int = 256,
+    reduce: int = 4,
+    pixel_threshold: int = 40,
+    min_changed_pixels: int = 4,
+) -> Dict[str, Any]:
+    """
+    Compare two renders of the same sheet and return the changed tiles grouped into boxes.
+
+    Args:
+        old_path: Render that the previous analysis ran on
+        new_path: Render of the revised sheet
+        tile_size: Tile edge in full-resolution pixels
+        reduce: Downsampling factor used for the comparison
+        pixel_threshold: Minimum grayscale difference for a pixel to count as changed
+        min_changed_pixels: Changed (downsampled) pixels needed to flag a tile
+
+    Returns:
+        {'comparable': bool, 'changed_fraction': float, 'regions': [(x1, y1, x2, y2), ...]}
+        Pages of different sizes are not comparable.
+    """
+    old, old_size = _load_gray(old_path, reduce)
+    new, new_size = _load_gray(new_path, reduce)
+    if old_size != new_size or old.shape != new.shape:
+        return {'comparable': False, 'changed_fraction': 1.0, 'regions': []}
+
+    changed = np.abs(new - old) > pixel_threshold
+    cell = max(1, tile_size // reduce)
+    rows = -(-changed.shape[0] // cell)
+    cols = -(-changed.shape[1] // cell)
+    padded = np.zeros((rows * cell, cols * cell), dtype=bool)
+    padded[:changed.shape[0], :changed.shape[1]] = changed
+    counts = padded.reshape(rows, cell, cols, cell).sum(axis=(1, 3))
+    flagged = counts >= min_changed_pixels
+
+    changed_fraction = float(flagged.sum()) / float(rows * cols)
+    if not flagged.any():
+        return {'comparable': True, 'changed_fraction': 0.0, 'regions': []}
+
+    # Group 8-connected flagged tiles into regions
+    width, height = new_size
+    seen = np.zeros_like(flagged)
+    regions: List[Box] = []
+    for r, c in zip(*np.nonzero(flagged)):
+        if seen[r, c]:
+            continue
+        r1, c1, r2, c2 = r, c, r, c
+        queue = deque([(r, c)])
+        seen[r, c] = True
+        while queue:
+            cr, cc = queue.popleft()
+            r1, c1, r2, c2 = min(r1, cr), min(c1, cc), max(r2, cr), max(c2, cc)
+            for nr in range(max(0, cr - 1), min(rows, cr + 2)):
+                for nc in range(max(0, cc - 1), min(cols, cc + 2)):
+                    if flagged[nr, nc] and not seen[nr, nc]:
+                        seen[nr, nc] = True
+                        queue.append((nr, nc))
+        regions.append((
+            int(c1 * tile_size), int(r1 * tile_size),
+            int(min(width, (c2 + 1) * tile_size)), int(min(height, (r2 + 1) * tile_size)),
+        ))
+
+    return {
+        'comparable': True,
+        'changed_fraction': changed_fraction,
+        'regions': _merge_boxes(regions),
+    }
+
+
+def prediction_box(pred: Dict[str, Any]) -> Box:
+    """Axis-aligned bounds of a normalized prediction in pixels."""
+    points = pred.get('mask') or pred.get('points') or []
+    if points:
+        xs = [pt['x'] for pt in points]
+        ys = [pt['y'] for pt in points]
+        return (min(xs), min(ys), max(xs), max(ys))
+    bbox = pred.get('bbox') or {}
+    x, y, w, h = bbox.get('x', 0.0), bbox.get('y', 0.0), bbox.get('w', 0.0), bbox.get('h', 0.0)
+    return (x - w / 2, y - h / 2, x + w / 2, y + h / 2)
+
+
+def boxes_intersect(a: Sequence[float], b: Sequence[float]) -> bool:
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def expand_regions(regions: List[Box], prior_predictions: List[Dict[str, Any]]) -> List[Box]:
+    """
+    Grow changed regions so they fully contain every prior detection they touch,
+    so that re-detection never replaces an object with a truncated copy of it.
+    """
+    prior_boxes = [prediction_box(p) for p in prior_predictions]
+    grown = list(regions)
+    for _ in range(3):
+        next_regions = []
+        for region in grown:
+            x1, y1, x2, y2 = region
+            for box in prior_boxes:
+                if boxes_intersect(region, box):
+                    x1, y1 = min(x1, box[0]), min(y1, box[1])
+                    x2, y2 = max(x2, box[2]), max(y2, box[3])
+            next_regions.append((int(x1), int(y1), int(-(-x2 // 1)), int(-(-y2 // 1))))
+        next_regions = _merge_boxes(next_regions)
+        if next_regions == grown:
+            break
+        grown = next_regions
+    return grown
+
+
+def pad_box(box: Box, margin: int, width: int, height: int) -> Box:
+    """Pad a region with surrounding context, clamped to the page."""
+    x1, y1, x2, y2 = box
+    return (max(0, x1 - margin), max(0, y1 - margin), min(width, x2 + margin), min(height, y2 + margin))
@@ -0,0 +1,394 @@
+"""
+Page Index for EstimAgent
+Remembers every rendered PDF page by content hash so that re-uploaded revision
+sets can reuse renders, thumbnails, classifications and model outputs for
+sheets that did not change.
+
+Three levels of identity are tracked for each page:
+- content hash: digest of the page's PDF content streams and resources, known
+  before rendering. A hit lets us skip rasterization entirely.
+- file hash: digest of the JPEG rendered at upload (the page preview).
+  Identical pixels, so classification and thumbnail can be reused.
+- visual hash: 256-bit difference hash of the render. A sheet with the same
+  hash and the same page size keeps its classification, everything else is
+  recomputed. Near matches are not reused: 16x16 gradients of sparse or
+  near-blank sheets differ in a handful of bits, so a distance threshold
+  would copy classifications between different sheets, and sheets with
+  almost no gradient (blank ones) are never matched at all.
+"""
+
+import os
+import json
+import base64
+import hashlib
+import logging
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from PIL import Image
+from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, StreamObject
+
+logger = logging.getLogger(__name__)
+
+# Page dictionary keys that affect what a page looks like
+_PAGE_KEYS = ('/Contents', '/Resources', '/MediaBox', '/CropBox', '/Rotate', '/Annots', '/UserUnit')
+
+# Back-references that would pull the whole document into the hash
+_SKIPPED_KEYS = {'/Parent', '/P', '/StructParents', '/B'}
+
+# Fewest set bits of a visual hash matched across uploads (blank sheets hash to ~0)
+MIN_VISUAL_BITS = 16
+
+
+def _hash_pdf_object(obj: Any, hasher, seen: set) -> None:
+    """Feed a PDF object into `hasher` recursively, resolving indirect references."""
+    if isinstance(obj, IndirectObject):
+        ref = (obj.idnum, obj.generation)
+        if ref in seen:
+            hasher.update(b'R')
+            return
+        seen.add(ref)
+        obj = obj.get_object()
+
+    if isinstance(obj, StreamObject):
+        hasher.update(b'S')
+        _hash_pdf_object(DictionaryObject({k: v for k, v in obj.items() if k != '/Length'}), hasher, seen)
+        # Hash the encoded bytes; decoding image streams would be far more expensive
+        data = getattr(obj, '_data', None)
+        if data is None:
+            data = obj.get_data()
+        hasher.update(len(data).to_bytes(8, 'little'))
+        hasher.update(data)
+    elif isinstance(obj, DictionaryObject):
+        hasher.update(b'D')
+        for key in sorted(obj.keys()):
+            if key in _SKIPPED_KEYS:
+                continue
+            hasher.update(str(key).encode('utf-8'))
+            _hash_pdf_object(obj[key], hasher, seen)
+    elif isinstance(obj, (ArrayObject, list, tuple)):
+        hasher.update(b'A')
+        for item in obj:
+            _hash_pdf_object(item, hasher, seen)
+    else:
+        hasher.update(repr(obj).encode('utf-8'))
+
+
+def pdf_page_size(page) -> str:
+    """Displayed size of a PyPDF2 page in points, as "<width>x<height>"."""
+    width, height = float(page.mediabox.width), float(page.mediabox.height)
+    if int(page.get('/Rotate', 0) or 0) % 180:
+        width, height = height, width
+    return f"{round(width)}x{round(height)}"
+
+
+def pdf_page_content_hash(page) -> str:
+    """Digest of everything that determines how a PyPDF2 page renders."""
+    hasher = hashlib.blake2b(digest_size=20)
+    seen: set = set()
+    for key in _PAGE_KEYS:
+        if key in page:
+            hasher.update(key.encode('utf-8'))
+            _hash_pdf_object(page[key], hasher, seen)
+    return hasher.hexdigest()
+
+
+def file_hash(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Digest of a file's bytes (used for rendered pages and inference inputs)."""
+    hasher = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def visual_hash(image: Image.Image, hash_size: int = 16) -> str:
+    """Difference hash of an image as a hex string (hash_size**2 bits)."""
+    small = image.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR)
+    pixels = small.tobytes()
+    bits = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return f"{bits:0{hash_size * hash_size // 4}x}"
+
+
+class PageIndex:
+    """
+    Persistent, thread-safe index of rendered pages and cached model outputs.
+
+    Layout under `root`:
+        index.json              page records keyed by content hash
+        thumbs/<file_hash>.jpg  UI thumbnails
+        detections/<key>.json   raw model responses keyed by input + model + params
+
+    Cached detections expire `detection_ttl_seconds` after their last use and
+    are evicted least recently used first once they exceed
+    `detection_max_bytes` (a file's mtime is its last use).
+    """
+
+    def __init__(self, root: str, max_entries: int = 5000, detection_max_bytes: int = 256 * 1024 ** 2,
+                 detection_ttl_seconds: float = 7 * 24 * 3600):
+        self.root = root
+        self.max_entries = max_entries
+        self.detection_max_bytes = detection_max_bytes
+        self.detection_ttl_seconds = detection_ttl_seconds
+        self._index_path = os.path.join(root, 'index.json')
+        self._thumb_dir = os.path.join(root, 'thumbs')
+        self._detection_dir = os.path.join(root, 'detections')
+        os.makedirs(self._thumb_dir, exist_ok=True)
+        os.makedirs(self._detection_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._records: Dict[str, Dict[str, Any]] = {}
+        self._by_file: Dict[str, str] = {}
+        self._load()
+        self._prune_lock = threading.Lock()
+        self._detection_bytes = 0
+        self._detection_stats = {'evicted_ttl': 0, 'evicted_size': 0}
+        self.prune_detections()
+
+    # -- persistence -----------------------------------------------------------
+
+    def _load(self) -> None:
+        if not os.path.exists(self._index_path):
+            return
+        try:
+            with open(self._index_path, 'r', encoding='utf-8') as f:
+                self._records = json.load(f)
+        except Exception as e:
+            logger.warning(f"Could not load page index, starting empty: {e}")
+            self._records = {}
+        self._by_file = {
+            rec['file_hash']: content_hash
+            for content_hash, rec in self._records.items()
+            if rec.get('file_hash')
+        }
+
+    def save(self) -> None:
+        """Write the index to disk, evicting the least recently seen records past max_entries."""
+        # Saves run one at a time so that an older snapshot never replaces a newer one;
+        # lookups only wait for the snapshot, not for the write
+        with self._save_lock:
+            with self._lock:
+                if len(self._records) > self.max_entries:
+                    ordered = sorted(self._records.items(), key=lambda kv: kv[1].get('last_seen', 0))
+                    for content_hash, rec in ordered[:len(self._records) - self.max_entries]:
+                        del self._records[content_hash]
+                        self._by_file.pop(rec.get('file_hash'), None)
+                snapshot = json.dumps(self._records)
+            # Unique per call: other processes sharing the index must not share a temp file
+            tmp_path = None
+            try:
+                with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=self.root, prefix='.index.',
+                                                 suffix='.tmp', delete=False) as f:
+                    tmp_path = f.name
+                    f.write(snapshot)
+                os.replace(tmp_path, self._index_path)
+            finally:
+                if tmp_path and os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    # -- page records ----------------------------------------------------------
+
+    def lookup_content(self, content_hash: str) -> Optional[Dict[str, Any]]:
+        """Record for a page with identical PDF content whose full render or preview still exists on disk."""
+        with self._lock:
+            rec = self._records.get(content_hash)
+            if rec and any(rec.get(key) and os.path.exists(rec[key]) for key in ('image_path', 'preview_path')):
+                rec['last_seen'] = time.time()
+                return dict(rec)
+        return None
+
+    def lookup_file(self, file_hash_: str) -> Optional[Dict[str, Any]]:
+        """Record for a page whose rendered JPEG is byte-identical."""
+        with self._lock:
+            content_hash = self._by_file.get(file_hash_)
+            rec = self._records.get(content_hash) if content_hash else None
+            if rec:
+                rec['last_seen'] = time.time()
+                return dict(rec)
+        return None
+
+    def lookup_visual(self, visual_hash_: str, page_size: str) -> Optional[Dict[str, Any]]:
+        """Most recent record with the same visual hash and page size (none for near-blank renders)."""
+        if not visual_hash_ or not page_size or bin(int(visual_hash_, 16)).count('1') < MIN_VISUAL_BITS:
+            return None
+        best = None
+        with self._lock:
+            for rec in self._records.values():
+                if rec.get('visual_hash') == visual_hash_ and rec.get('page_size') == page_size \
+                        and (best is None or rec.get('last_seen', 0) > best.get('last_seen', 0)):
+                    best = rec
+        return dict(best) if best else None
+
+    def record_page(
+        self,
+        content_hash: str,
+        image_path: str,
+        file_hash_: str,
+        visual_hash_: str,
+        classification: Optional[Dict[str, Any]],
+        preview_path: Optional[str] = None,
+        page_size: Optional[str] = None,
+    ) -> None:
+        """
+        Remember a page render and its classification.
+        `file_hash_` identifies the render made at upload time (the preview, when one is given);
+        `page_size` is pdf_page_size() of the page.
+        """
+        with self._lock:
+            rec = self._records.get(content_hash, {})
+            # Keep pointing at the oldest render that still exists so reuse chains stay short
+            if not (rec.get('image_path') and os.path.exists(rec['image_path'])):
+                rec['image_path'] = image_path
+            if preview_path and not (rec.get('preview_path') and os.path.exists(rec['preview_path'])):
+                rec['preview_path'] = preview_path
+            rec.update({
+                'file_hash': file_hash_,
+                'visual_hash': visual_hash_,
+                'last_seen': time.time(),
+            })
+            if page_size:
+                rec['page_size'] = page_size
+            if classification is not None:
+                rec['classification'] = classification
+            self._records[content_hash] = rec
+            self._by_file[file_hash_] = content_hash
+
+    def record_full_render(self, content_hash: str, image_path: str) -> None:
+        """Point a page record at a full-resolution render made after upload."""
+        with self._lock:
+            rec = self._records.get(content_hash)
+            if rec is not None and not (rec.get('image_path') and os.path.exists(rec['image_path'])):
+                rec['image_path'] = image_path
+                rec['last_seen'] = time.time()
+
+    # -- thumbnails ------------------------------------------------------------
+
+    def has_thumbnail(self, file_hash_: str) -> bool:
+        return os.path.exists(os.path.join(self._thumb_dir, f"{file_hash_}.jpg"))
+
+    def get_thumbnail(self, file_hash_: str) -> Optional[str]:
+        path = os.path.join(self._thumb_dir, f"{file_hash_}.jpg")
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            return f"data:image/jpeg;base64,{base64.b64encode(f.read()).decode()}"
+
+    def put_thumbnail(self, file_hash_: str, thumbnail_b64: str) -> None:
+        if not thumbnail_b64:
+            return
+        path = os.path.join(self._thumb_dir, f"{file_hash_}.jpg")
+        with open(path, 'wb') as f:
+            f.write(base64.b64decode(thumbnail_b64.split(',', 1)[-1]))
+
+    # -- model outputs ---------------------------------------------------------
+
+    @staticmethod
+    def detection_key(input_hash: str, model_id: str, params: Dict[str, Any]) -> str:
+        payload = json.dumps([input_hash, model_id, params], sort_keys=True, default=str)
+        return hashlib.blake2b(payload.encode('utf-8'), digest_size=20).hexdigest()
+
+    def get_detections(self, key: str) -> Optional[Dict[str, Any]]:
+        path = os.path.join(self._detection_dir, f"{key}.json")
+        try:
+            if time.time() - os.path.getmtime(path) > self.detection_ttl_seconds:
+                self._remove_detections(path, 'ttl')
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                raw = json.load(f)
+            os.utime(path, None)
+            return raw
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Discarding unreadable cached detections {key}: {e}")
+            return None
+
+    def put_detections(self, key: str, raw: Dict[str, Any]) -> None:
+        path = os.path.join(self._detection_dir, f"{key}.json")
+        tmp_path = None
+        try:
+            with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=self._detection_dir,
+                                             prefix=f".{key}.", suffix='.tmp', delete=False) as f:
+                tmp_path = f.name
+                json.dump(raw, f, default=str)
+            size = os.path.getsize(tmp_path)
+            try:
+                size -= os.path.getsize(path)
+            except OSError:
+                pass
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"Could not cache detections {key}: {e}")
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        with self._lock:
+            self._detection_bytes += size
+            over = self._detection_bytes > self.detection_max_bytes
+        if over:
+            self.prune_detections()
+
+    def _remove_detections(self, path: str, reason: str) -> int:
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return 0
+        with self._lock:
+            self._detection_bytes -= size
+            self._detection_stats[f'evicted_{reason}'] += 1
+        return size
+
+    def prune_detections(self) -> None:
+        """
+        Remove expired cached detections, then the least recently used ones
+        until they take at most 90% of detection_max_bytes (so that a full
+        cache is not rescanned on every write). Skipped while a prune runs.
+        """
+        if not self._prune_lock.acquire(blocking=False):
+            return
+        try:
+            now = time.time()
+            entries = []
+            with os.scandir(self._detection_dir) as it:
+                for entry in it:
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    if entry.name.endswith('.tmp'):
+                        # Left behind by a crash mid-write
+                        if now - stat.st_mtime > 3600:
+                            os.remove(entry.path)
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            with self._lock:
+                self._detection_bytes = sum(size for _, size, _ in entries)
+            budget = self.detection_max_bytes * 0.9
+            evicted = 0
+            for mtime, size, path in sorted(entries):
+                if now - mtime > self.detection_ttl_seconds:
+                    evicted += self._remove_detections(path, 'ttl')
+                elif self._detection_bytes > budget:
+                    evicted += self._remove_detections(path, 'size')
+                else:
+                    break
+            if evicted:
+                logger.info(f"Evicted {evicted / 1024 ** 2:.1f} MB of cached detections, "
+                            f"{self._detection_bytes / 1024 ** 2:.1f} MB left")
+        except OSError as e:
+            logger.warning(f"Could not prune cached detections: {e}")
+        finally:
+            self._prune_lock.release()
+
+    def detection_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._detection_stats, bytes=self._detection_bytes, max_bytes=self.detection_max_bytes,
+                        ttl_seconds=self.detection_ttl_seconds)
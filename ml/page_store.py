@@ -0,0 +1,219 @@
+"""
+Shared Page Store for EstimAgent
+Keeps upload artifacts (the PDF, page renders, per-page analysis results) in
+object storage so any instance can serve /pages and /analyze-pages for an
+upload, not only the one that handled /upload-pdf.
+
+The local upload directory acts as a read-through cache: artifacts are
+fetched on first use and then read from disk, and StorageManager evicts them
+like any other upload.
+
+Stores, selected with PAGE_STORE:
+- "local": no shared storage (single instance); every call is a no-op.
+- "s3":    any S3-compatible bucket via boto3: AWS S3, MinIO, or Google Cloud
+           Storage through its XML API (endpoint https://storage.googleapis.com
+           with HMAC keys).
+- "fs":    a directory standing in for a bucket, e.g. a shared volume or a
+           local MinIO replacement in development and tests.
+"""
+
+import os
+import glob
+import shutil
+import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Optional
+
+from singleflight import SingleFlight
+
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+except ImportError:
+    boto3 = None
+    ClientError = Exception
+
+logger = logging.getLogger(__name__)
+
+
+class S3ObjectClient:
+    """Minimal object client over an S3-compatible bucket."""
+
+    def __init__(self, bucket: str, endpoint_url: Optional[str] = None, region: Optional[str] = None):
+        if boto3 is None:
+            raise RuntimeError("boto3 is not installed")
+        self.bucket = bucket
+        self._s3 = boto3.client('s3', endpoint_url=endpoint_url or None, region_name=region or None)
+
+    def put_file(self, key: str, path: str) -> None:
+        self._s3.upload_file(path, self.bucket, key)
+
+    def get_file(self, key: str, path: str) -> bool:
+        try:
+            self._s3.download_file(self.bucket, key, path)
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def list(self, prefix: str) -> List[str]:
+        keys = []
+        for page in self._s3.get_paginator('list_objects_v2').paginate(Bucket=self.bucket, Prefix=prefix):
+            keys.extend(obj['Key'] for obj in page.get('Contents', []))
+        return keys
+
+
+class FilesystemObjectClient:
+    """Object client over a directory, with the same semantics as S3ObjectClient."""
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        path = os.path.normpath(os.path.join(self.root, key))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            raise ValueError(f"Invalid object key: {key}")
+        return path
+
+    def put_file(self, key: str, path: str) -> None:
+        dest = self._path(key)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        # Unique per call: concurrent writers of one key must not share a temp file
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(dest), prefix=os.path.basename(dest) + '.',
+                                         suffix='.tmp', delete=False) as tmp:
+            pass
+        try:
+            shutil.copyfile(path, tmp.name)
+            os.replace(tmp.name, dest)
+        finally:
+            if os.path.exists(tmp.name):
+                os.remove(tmp.name)
+
+    def get_file(self, key: str, path: str) -> bool:
+        src = self._path(key)
+        if not os.path.exists(src):
+            return False
+        shutil.copyfile(src, path)
+        return True
+
+    def list(self, prefix: str) -> List[str]:
+        base = self._path(prefix.rstrip('/'))
+        if not os.path.isdir(base):
+            return []
+        return [
+            os.path.relpath(os.path.join(dirpath, name), self.root).replace(os.sep, '/')
+            for dirpath, _, names in os.walk(base)
+            for name in names
+            if not name.endswith('.tmp')
+        ]
+
+
+class PageStore:
+    """
+    Upload artifacts in shared object storage, cached in local upload directories.
+    With no client, everything stays local (single-instance deployments).
+    """
+
+    def __init__(self, client=None, prefix: str = '', workers: int = 8):
+        self.client = client
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+        self.workers = workers
+        self._uploads = SingleFlight()
+
+    @property
+    def shared(self) -> bool:
+        return self.client is not None
+
+    def _key(self, upload_id: str, name: str) -> str:
+        return f"{self.prefix}uploads/{upload_id}/{name}"
+
+    def put(self, upload_id: str, local_path: str) -> None:
+        """Publish one local artifact of an upload (best effort; logged on failure)."""
+        if not self.client:
+            return
+        try:
+            self.client.put_file(self._key(upload_id, os.path.basename(local_path)), local_path)
+        except Exception as e:
+            logger.warning(f"Could not publish {local_path} for upload {upload_id}: {e}")
+
+    def put_many(self, upload_id: str, local_paths: Iterable[str]) -> None:
+        """Publish several artifacts concurrently; raises if any fails (used when the upload must be shared)."""
+        if not self.client:
+            return
+        paths = [p for p in local_paths if p and os.path.exists(p)]
+        with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(paths) or 1))) as executor:
+            list(executor.map(
+                lambda p: self.client.put_file(self._key(upload_id, os.path.basename(p)), p), paths
+            ))
+
+    def fetch(self, upload_id: str, name: str, upload_dir: str) -> Optional[str]:
+        """
+        Local path of an upload artifact, downloading it into `upload_dir` if it
+        is not cached there yet. Returns None when the artifact does not exist.
+        """
+        local_path = os.path.join(upload_dir, name)
+        if os.path.exists(local_path):
+            return local_path
+        if not self.client:
+            return None
+        os.makedirs(upload_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=upload_dir, prefix=f".{name}.", suffix='.download', delete=False) as tmp:
+            tmp_path = tmp.name
+        try:
+            if not self.client.get_file(self._key(upload_id, name), tmp_path):
+                return None
+            os.replace(tmp_path, local_path)
+            logger.info(f"Fetched {name} for upload {upload_id} from shared storage")
+            return local_path
+        except Exception as e:
+            logger.warning(f"Could not fetch {name} for upload {upload_id}: {e}")
+            return None
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @staticmethod
+    def _has_pdf(upload_dir: str) -> bool:
+        return bool(glob.glob(os.path.join(upload_dir, '*.[pP][dD][fF]')))
+
+    def ensure_upload(self, upload_id: str, upload_dir: str) -> bool:
+        """
+        Make an upload usable on this instance: True if its PDF is in
+        `upload_dir` or could be fetched there from shared storage.
+        Concurrent requests for one upload share a single fetch.
+        """
+        if self._has_pdf(upload_dir):
+            return True
+        if not self.client:
+            return False
+        return self._uploads.do(upload_id, lambda: self._fetch_upload(upload_id, upload_dir))
+
+    def _fetch_upload(self, upload_id: str, upload_dir: str) -> bool:
+        if self._has_pdf(upload_dir):
+            return True
+        try:
+            names = [key.rsplit('/', 1)[-1] for key in self.client.list(self._key(upload_id, ''))]
+        except Exception as e:
+            logger.warning(f"Could not look up upload {upload_id} in shared storage: {e}")
+            return False
+        pdf_names = [name for name in names if name.lower().endswith('.pdf')]
+        return bool(pdf_names) and self.fetch(upload_id, pdf_names[0], upload_dir) is not None
+
+
+def load_page_store(kind: str) -> PageStore:
+    """Build the page store named by PAGE_STORE ("local", "s3" or "fs")."""
+    prefix = os.getenv('PAGE_STORE_PREFIX', '')
+    if kind == 'local':
+        return PageStore()
+    if kind == 's3':
+        return PageStore(S3ObjectClient(
+            os.environ['PAGE_STORE_BUCKET'],
+            endpoint_url=os.getenv('PAGE_STORE_ENDPOINT_URL'),
+            region=os.getenv('PAGE_STORE_REGION'),
+        ), prefix=prefix)
+    if kind == 'fs':
+        return PageStore(FilesystemObjectClient(os.environ['PAGE_STORE_FS_ROOT']), prefix=prefix)
+    raise ValueError(f"Unknown page store: {kind}")
@@ -4,11 +4,13 @@ Handles multi-page PDF processing and page classification using Roboflow Inferen
 """
 
 import os
+import glob
+import time
+import shutil
 import logging
 import base64
 import requests
-from io import BytesIO
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # PDF & Image processing
@@ -16,28 +18,128 @@ import PyPDF2
 from pdf2image import convert_from_path
 from PIL import Image
 
+from image_backend import load_image_backend
+from metrics import Metrics
+from page_index import PageIndex, file_hash, pdf_page_content_hash, pdf_page_size, visual_hash
+from singleflight import SingleFlight
+from upstream import CircuitOpenError, RateLimitedError, UpstreamGuard, is_throttle
+from workers import CPUWorkerPool
+
 # Roboflow SDK for classification (used if classify_fn not provided)
 try:
     from roboflow import Roboflow
 except ImportError:
     Roboflow = None
 
-# Configure Logging
-logging.basicConfig(level=logging.INFO)
+# Logging is configured by the app (log_config.py)
 logger = logging.getLogger(__name__)
 
+# Image backends of this process, by name (render workers build their own)
+_backends: Dict[str, Any] = {}
+
+
+def render_pages(pdf_path: str, page_numbers: List[int], dpi: int, size: Optional[int] = None,
+                 thread_count: int = 4, metrics: Optional[Metrics] = None):
+    """
+    Yield (page_num, image) for the given pages, rendering contiguous runs together.
+    With `size`, pages are rasterized so their longest side is `size` pixels
+    (pdftoppm -scale-to) instead of at `dpi`. Images are decoded on first access.
+    """
+    metrics = metrics or Metrics(enabled=False)
+    runs: List[List[int]] = []
+    for page_num in sorted(page_numbers):
+        if runs and runs[-1][-1] == page_num - 1:
+            runs[-1].append(page_num)
+        else:
+            runs.append([page_num])
+    
+    for run in runs:
+        try:
+            with metrics.stage('pdf_render_preview' if size else 'pdf_render_full'):
+                images = convert_from_path(
+                    pdf_path, 
+                    **({'size': size} if size else {'dpi': dpi}),
+                    fmt='jpeg',
+                    thread_count=thread_count,
+                    first_page=run[0],
+                    last_page=run[-1],
+                )
+        except Exception as e:
+            logger.error(f"pdf2image conversion failed: {e}")
+            raise Exception("Failed to convert PDF pages to images. Ensure Poppler is installed.")
+        yield from zip(run, images)
+
+
+def render_and_save_pages(pdf_path: str, outputs: Dict[int, str], dpi: int, size: Optional[int] = None,
+                          quality: int = 95, backend: Any = 'pillow', hashes: bool = False,
+                          thread_count: int = 1, metrics: Optional[Metrics] = None) -> Dict[int, Dict[str, str]]:
+    """
+    Render the pages of `outputs` ({page_num: path}) and save each as a JPEG,
+    decoding one page at a time. Full-DPI renders record `dpi` in the JPEG.
+    `backend` is an image backend, or the name of one when running in a
+    render worker (which builds its own).
+    
+    Takes paths and returns strings, so process_pdf can hand runs of pages to
+    render workers without pickling images.
+    
+    Returns:
+        {page_num: {'file_hash', 'visual_hash'}} for every saved page
+        (empty dicts unless `hashes`)
+    """
+    metrics = metrics or Metrics(enabled=False)
+    if isinstance(backend, str):
+        if backend not in _backends:
+            _backends[backend] = load_image_backend(backend)
+        backend = _backends[backend]
+    results = {}
+    for page_num, image in render_pages(pdf_path, list(outputs), dpi, size, thread_count, metrics):
+        path = outputs[page_num]
+        try:
+            with metrics.stage('page_encode', page=page_num):
+                backend.save_jpeg(image, path, quality=quality, dpi=None if size else dpi)
+            results[page_num] = {'file_hash': file_hash(path), 'visual_hash': visual_hash(image)} if hashes else {}
+        finally:
+            image.close()
+    return results
+
+
 class PDFProcessor:
     """
     Process multi-page construction PDFs and classify pages using Roboflow hosted inference.
     """
     
-    def __init__(self, classify_fn=None):
+    # Resolution pages are rasterized at; recorded in each page JPEG so that
+    # pixel measurements can be converted back to drawing inches.
+    RENDER_DPI = 300
+    
+    # Longest side of the preview rendered at upload; it doubles as the UI
+    # thumbnail and is the source of the classification image.
+    PREVIEW_SIZE = 1200
+    
+    def __init__(self, classify_fn=None, page_index: Optional[PageIndex] = None, classify_batch_fn=None,
+                 model_name: Optional[str] = None, image_backend=None, metrics: Optional[Metrics] = None,
+                 upstream: Optional[UpstreamGuard] = None, render_workers: Optional[CPUWorkerPool] = None):
         """
         Initialize PDFProcessor.
         
         Args:
             classify_fn: Optional classification function from app.py (_classify_image).
                         If provided, will be used instead of direct HTTP requests.
+            page_index: Optional PageIndex used to reuse work for pages seen before.
+            classify_batch_fn: Optional function classifying a list of images in one call
+                        (_classify_images), itself keeping up to PAGE_CLASSIFY_CONCURRENCY
+                        requests in flight. Used when PAGE_CLASSIFY_BATCH_SIZE > 1.
+            model_name: Name recorded as the classifier in page metadata.
+                        Defaults to the Roboflow "project/version".
+            image_backend: JPEG encode/downscale backend (image_backend.py).
+                        Defaults to the one named by IMAGE_BACKEND.
+            metrics: Optional Metrics collector for per-stage latencies (metrics.py).
+                        Its tracer also records per-page and per-attempt spans.
+            upstream: Optional UpstreamGuard (upstream.py) rate limiting classification
+                        calls and failing fast while the model is down. A batch counts
+                        as one call per page against the rate.
+            render_workers: Optional CPUWorkerPool (workers.py) that renders and encodes
+                        pages in parallel processes. Without it pages are rendered here.
         """
         # Load Configuration
         self.api_key = os.getenv('PAGE_API_KEY', '')
@@ -47,202 +149,525 @@ class PDFProcessor:
         
         # Store classification function (from app.py)
         self.classify_fn = classify_fn
+        self.page_index = page_index
+        self.classify_batch_fn = classify_batch_fn
+        self.model_name = model_name or f"{self.project_id}/{self.version}"
+        
+        # Pages per batch and classification requests in flight
+        self.batch_size = max(1, int(os.getenv('PAGE_CLASSIFY_BATCH_SIZE', '8')))
+        self.concurrency = max(1, int(os.getenv('PAGE_CLASSIFY_CONCURRENCY', '4')))
+        
+        self.dpi = int(os.getenv('PDF_RENDER_DPI', str(self.RENDER_DPI)))
+        self.preview_size = int(os.getenv('PDF_PREVIEW_SIZE', str(self.PREVIEW_SIZE)))
+        # Full-resolution pages are rendered on first use unless this is set
+        self.eager_full_render = os.getenv('PDF_EAGER_FULL_RENDER', '0') == '1'
+        self._full_renders = SingleFlight()
+        self.image_backend = image_backend or load_image_backend(os.getenv('IMAGE_BACKEND', 'auto'))
+        self.metrics = metrics or Metrics(enabled=False)
+        self.tracer = self.metrics.tracer
+        self.upstream = upstream
+        if render_workers and render_workers.enabled and not self._backend_rebuildable():
+            logger.warning(f"Image backend {self.image_backend.name} cannot be rebuilt in render workers; "
+                           f"rendering pages in-process")
+            render_workers = None
+        self.render_workers = render_workers
         
         logger.info(f"PDFProcessor initialized. Project: {self.project_id}, Version: {self.version}")
         logger.info(f"API Key: {'***' + self.api_key[-4:] if self.api_key else 'NOT SET'}")
         logger.info(f"Using {'external' if classify_fn else 'built-in'} classification function")
+        if classify_batch_fn and self.batch_size > 1:
+            logger.info(f"Batched classification: {self.batch_size} pages/batch, {self.concurrency} concurrent requests")
+        logger.info(f"Image backend: {self.image_backend.name}")
+        if render_workers and render_workers.enabled:
+            logger.info(f"Rendering pages in {render_workers.workers} {render_workers.name} worker processes")
 
     def process_pdf(self, pdf_path: str, output_dir: str) -> Dict[str, Any]:
         """
         Main entry point: Convert PDF to images and classify each page.
+        
+        Pages are rendered straight at preview size for thumbnails and
+        classification; the full-resolution render (`image_path`) is made
+        later by ensure_page_image, when something needs it.
+        
+        When a page index is configured, pages already seen (in this or an
+        earlier upload) reuse their renders, thumbnail and classification.
         """
+        with self.tracer.span('process_pdf', pdf=os.path.basename(pdf_path)) as span:
+            result = self._process_pdf(pdf_path, output_dir)
+            if span:
+                span.set_attribute('pages', result['total_pages'])
+                span.set_attribute('reused_pages', result['reuse_report']['reused'])
+            return result
+
+    def _process_pdf(self, pdf_path: str, output_dir: str) -> Dict[str, Any]:
         if not os.path.exists(pdf_path):
             raise FileNotFoundError(f"PDF file not found: {pdf_path}")
 
         # 1. Create output directory
         os.makedirs(output_dir, exist_ok=True)
 
-        # 2. Get PDF Metadata
+        # 2. Get PDF Metadata and per-page content hashes
         try:
             with open(pdf_path, 'rb') as file:
                 pdf_reader = PyPDF2.PdfReader(file)
                 total_pages = len(pdf_reader.pages)
+                content_hashes = self._content_hashes(pdf_reader)
+                page_sizes = {i + 1: pdf_page_size(page) for i, page in enumerate(pdf_reader.pages)} \
+                    if self.page_index else {}
         except Exception as e:
             logger.error(f"Failed to read PDF metadata: {e}")
             raise Exception(f"Invalid PDF file: {str(e)}")
 
         logger.info(f"Processing {total_pages} pages from {os.path.basename(pdf_path)}")
 
-        # 3. Convert PDF to Images
-        # Thread count of 4 is usually optimal for standard PDFs
-        try:
-            images = convert_from_path(
-                pdf_path, 
-                dpi=300,
-                fmt='jpeg',
-                thread_count=4
-            )
-        except Exception as e:
-            logger.error(f"pdf2image conversion failed: {e}")
-            raise Exception("Failed to convert PDF pages to images. Ensure Poppler is installed.")
+        image_paths = {
+            page_num: self.page_image_path(output_dir, page_num)
+            for page_num in range(1, total_pages + 1)
+        }
+        preview_paths = {
+            page_num: os.path.join(output_dir, f"page_{page_num}_preview.jpg")
+            for page_num in range(1, total_pages + 1)
+        }
+        thumbnails: Dict[int, str] = {}
+        classifications: Dict[int, Dict[str, Any]] = {}
+        file_hashes: Dict[int, str] = {}
+        visual_hashes: Dict[int, str] = {}
+        reuse: Dict[int, str] = {}
 
-        # 4. Save all images first
-        image_paths = []
-        thumbnails = {}
-        
-        for i, image in enumerate(images):
-            page_num = i + 1
-            filename = f"page_{page_num}.jpg"
-            image_path = os.path.join(output_dir, filename)
-            
-            # Save full resolution image to disk
-            image.save(image_path, 'JPEG', quality=95)
-            image_paths.append((page_num, image_path))
+        # 3. Reuse renders of pages whose PDF content is unchanged
+        first_with_hash: Dict[str, int] = {}
+        duplicates: Dict[int, int] = {}
+        to_render: List[int] = []
+        for page_num in range(1, total_pages + 1):
+            content_hash = content_hashes.get(page_num)
+            if content_hash and content_hash in first_with_hash:
+                duplicates[page_num] = first_with_hash[content_hash]
+                continue
+            if content_hash:
+                first_with_hash[content_hash] = page_num
+            record = self.page_index.lookup_content(content_hash) if content_hash else None
+            if record and self._reuse_renders(record, image_paths[page_num], preview_paths[page_num]):
+                reuse[page_num] = 'content'
+                file_hashes[page_num] = record['file_hash']
+                visual_hashes[page_num] = record.get('visual_hash', '')
+                self._reuse_record(page_num, record, thumbnails, classifications)
+            else:
+                to_render.append(page_num)
+
+        # 4. Render remaining pages directly at preview size (no full-resolution bitmap)
+        rendered = self._render_and_save(
+            pdf_path, {page_num: preview_paths[page_num] for page_num in to_render},
+            size=self.preview_size, quality=85, hashes=bool(self.page_index),
+        )
+        for page_num in sorted(rendered):
+            with self.tracer.span('page', page=page_num):
+                preview_path = preview_paths[page_num]
+                if self.page_index:
+                    file_hashes[page_num] = rendered[page_num]['file_hash']
+                    visual_hashes[page_num] = rendered[page_num]['visual_hash']
+                    record = self.page_index.lookup_file(file_hashes[page_num])
+                    if record:
+                        reuse[page_num] = 'file'
+                        self._reuse_record(page_num, record, thumbnails, classifications)
+                    else:
+                        record = self.page_index.lookup_visual(visual_hashes[page_num], page_sizes.get(page_num))
+                        if record and self._reusable_classification(record):
+                            reuse[page_num] = 'visual'
+                            classifications[page_num] = record['classification']
             
-            # Generate UI Thumbnail (Base64)
-            thumbnails[page_num] = self._generate_thumbnail_b64(image)
+                # UI Thumbnail (Base64) is the preview itself
+                if page_num not in thumbnails:
+                    thumbnails[page_num] = self._generate_thumbnail_b64(preview_path)
+        
+        # Content-reused pages whose thumbnail was not kept use their linked preview
+        for page_num in [n for n in reuse if n not in thumbnails]:
+            thumbnails[page_num] = self._generate_thumbnail_b64(preview_paths[page_num])
         
-        # 5. Parallel Classification - Process up to 4 pages simultaneously
+        if self.eager_full_render:
+            missing = [n for n in image_paths if n not in duplicates and not os.path.exists(image_paths[n])]
+            self._render_and_save(pdf_path, {page_num: image_paths[page_num] for page_num in missing})
+
+        # 5. Parallel Classification - in batches when a batch classifier is configured
+        to_classify = [
+            page_num for page_num in image_paths
+            if page_num not in duplicates and page_num not in classifications
+        ]
         processed_pages = []
-        max_workers = min(4, len(image_paths))  # Use up to 4 parallel workers
+        classification_stats = self._classify_pages(
+            {page_num: preview_paths[page_num] for page_num in to_classify},
+            classifications,
+        )
+        logger.info(
+            f"Classified {len(to_classify)} pages ({classification_stats['mode']}, "
+            f"{classification_stats['requests']} requests) in {classification_stats['seconds']:.2f}s "
+            f"= {classification_stats['pages_per_second']:.2f} pages/s; "
+            f"{total_pages - len(to_classify) - len(duplicates)} reused, {len(duplicates)} duplicates"
+        )
+
+        # 6. Pages repeated within this upload share the first occurrence's results
+        for page_num, source_num in duplicates.items():
+            if not self._link_or_copy(preview_paths[source_num], preview_paths[page_num]):
+                preview_paths[page_num] = preview_paths[source_num]
+            if os.path.exists(image_paths[source_num]):
+                self._link_or_copy(image_paths[source_num], image_paths[page_num])
+            thumbnails[page_num] = thumbnails.get(source_num, "")
+            classifications[page_num] = classifications[source_num]
+            file_hashes[page_num] = file_hashes.get(source_num, '')
+            reuse[page_num] = 'duplicate'
+
+        for page_num in sorted(image_paths):
+            classification = classifications[page_num]
+            
+            # Structure Data
+            processed_pages.append({
+                'page_number': page_num,
+                'image_path': image_paths[page_num],
+                'preview_path': preview_paths[page_num],
+                'thumbnail': thumbnails.get(page_num, ""),
+                'dpi': self.dpi,
+                # Classification Data
+                'type': classification['type'],
+                'confidence': classification['confidence'],
+                'title': classification['title'],
+                'analyzable': classification['analyzable'],
+                'metadata': classification['metadata'],
+                'reused': reuse.get(page_num),
+            })
+            if page_num not in reuse:
+                logger.debug(f"Page {page_num}: {classification['title']} ({classification['confidence']:.1%})")
+
+        # 7. Remember this upload's pages for the next revision
+        if self.page_index:
+            for page_num, content_hash in content_hashes.items():
+                if page_num in duplicates or page_num not in file_hashes:
+                    continue
+                classification = classifications[page_num]
+                self.page_index.record_page(
+                    content_hash,
+                    image_paths[page_num],
+                    file_hashes[page_num],
+                    visual_hashes.get(page_num, ''),
+                    classification if self._reusable_classification({'classification': classification}) else None,
+                    preview_path=preview_paths[page_num],
+                    page_size=page_sizes.get(page_num),
+                )
+                if not self.page_index.has_thumbnail(file_hashes[page_num]):
+                    self.page_index.put_thumbnail(file_hashes[page_num], thumbnails.get(page_num, ""))
+            try:
+                self.page_index.save()
+            except Exception as e:
+                logger.warning(f"Could not persist page index: {e}")
+
+        reused_pages = sorted(n for n, level in reuse.items() if level != 'visual')
+        recomputed_pages = sorted(n for n in image_paths if n not in reused_pages)
+        logger.info(f"Reused {len(reused_pages)} pages, recomputed {len(recomputed_pages)}")
+
+        return {
+            'total_pages': total_pages,
+            'pages': processed_pages,
+            'pdf_path': pdf_path,
+            'reuse_report': {
+                'reused': len(reused_pages),
+                'recomputed': len(recomputed_pages),
+                'rendered': len(to_render),
+                'classified': len(to_classify),
+                'reused_pages': reused_pages,
+                'recomputed_pages': recomputed_pages,
+                'classification_only_pages': sorted(n for n, level in reuse.items() if level == 'visual'),
+            },
+            'classification_stats': classification_stats,
+        }
+
+    def _content_hashes(self, pdf_reader) -> Dict[int, str]:
+        """Content hash per page number; empty when no page index is configured."""
+        if not self.page_index:
+            return {}
+        hashes = {}
+        for i, page in enumerate(pdf_reader.pages):
+            try:
+                hashes[i + 1] = pdf_page_content_hash(page)
+            except Exception as e:
+                logger.warning(f"Could not hash page {i + 1}, it will be re-rendered: {e}")
+        return hashes
+
+    @staticmethod
+    def page_image_path(output_dir: str, page_num: int) -> str:
+        """Path of a page's full-resolution render (which may not exist yet)."""
+        return os.path.join(output_dir, f"page_{page_num}.jpg")
+
+    def ensure_page_image(self, output_dir: str, page_num: int) -> str:
+        """
+        Return the full-resolution render of a page, rendering it on first use.
         
-        logger.info(f"Starting parallel classification with {max_workers} workers for {len(image_paths)} pages")
+        Reuses an identical page's render from the page index when possible.
+        Concurrent callers for the same page share one render.
+        
+        Raises:
+            FileNotFoundError: If the upload's PDF is gone
+            ValueError: If the page number is out of range
+        """
+        image_path = self.page_image_path(output_dir, page_num)
+        if os.path.exists(image_path):
+            return image_path
+        return self._full_renders.do(image_path, lambda: self._render_full_page(output_dir, page_num, image_path))
+
+    @staticmethod
+    def upload_pdf_path(output_dir: str) -> str:
+        """The uploaded PDF inside an upload directory."""
+        pdf_files = glob.glob(os.path.join(output_dir, '*.[pP][dD][fF]'))
+        if not pdf_files:
+            raise FileNotFoundError(f"No PDF found in {output_dir}")
+        return pdf_files[0]
+
+    @staticmethod
+    def page_sizes(pdf_path: str) -> List[Tuple[float, float]]:
+        """Sheet size (width, height) in inches of every page, from the media boxes (nothing is rendered)."""
+        with open(pdf_path, 'rb') as file:
+            pdf_reader = PyPDF2.PdfReader(file)
+            return [(float(page.mediabox.width) / 72, float(page.mediabox.height) / 72) for page in pdf_reader.pages]
+
+    def _render_full_page(self, output_dir: str, page_num: int, image_path: str) -> str:
+        if os.path.exists(image_path):
+            return image_path
+        pdf_path = self.upload_pdf_path(output_dir)
+        
+        content_hash = None
+        with open(pdf_path, 'rb') as file:
+            pdf_reader = PyPDF2.PdfReader(file)
+            if not 1 <= page_num <= len(pdf_reader.pages):
+                raise ValueError(f"Page {page_num} out of range (1-{len(pdf_reader.pages)})")
+            if self.page_index:
+                try:
+                    content_hash = pdf_page_content_hash(pdf_reader.pages[page_num - 1])
+                except Exception as e:
+                    logger.warning(f"Could not hash page {page_num}: {e}")
+        
+        record = self.page_index.lookup_content(content_hash) if content_hash else None
+        if record and record.get('image_path') and os.path.exists(record['image_path']) \
+                and self._link_or_copy(record['image_path'], image_path):
+            logger.info(f"Reused full render of page {page_num} from {record['image_path']}")
+            return image_path
+        
+        start = time.time()
+        # Write under a temporary name so readers never see a partial file
+        tmp_path = f"{image_path}.tmp.jpg"
+        self._render_and_save(pdf_path, {page_num: tmp_path})
+        os.replace(tmp_path, image_path)
+        logger.info(f"Rendered page {page_num} at {self.dpi} DPI in {time.time() - start:.2f}s")
+        
+        if content_hash:
+            self.page_index.record_full_render(content_hash, image_path)
+            try:
+                self.page_index.save()
+            except Exception as e:
+                logger.warning(f"Could not persist page index: {e}")
+        return image_path
+
+    def _reuse_renders(self, record: Dict[str, Any], image_path: str, preview_path: str) -> bool:
+        """
+        Link a page index record's renders into this upload.
+        Returns True when a preview is available afterwards (derived from the full render if needed).
+        """
+        if record.get('image_path') and os.path.exists(record['image_path']):
+            self._link_or_copy(record['image_path'], image_path)
+        if record.get('preview_path') and os.path.exists(record['preview_path']):
+            return self._link_or_copy(record['preview_path'], preview_path)
+        if not os.path.exists(image_path):
+            return False
+        try:
+            data = self.image_backend.thumbnail_jpeg(image_path, self.preview_size, quality=85)
+            with open(preview_path, 'wb') as f:
+                f.write(data)
+            return True
+        except Exception as e:
+            logger.warning(f"Could not derive preview from {image_path}: {e}")
+            return False
+
+    def _backend_rebuildable(self) -> bool:
+        """Whether render workers can build the same image backend from its name."""
+        try:
+            return type(load_image_backend(self.image_backend.name)) is type(self.image_backend)
+        except Exception:
+            return False
+
+    def _render_and_save(self, pdf_path: str, outputs: Dict[int, str], size: Optional[int] = None,
+                         quality: int = 95, hashes: bool = False) -> Dict[int, Dict[str, str]]:
+        """
+        render_and_save_pages for `outputs`, split into chunks of consecutive
+        pages over the render workers when there are any. Each chunk is one
+        pdftoppm run in its worker; two chunks per worker even out uneven pages.
+        """
+        options = dict(size=size, quality=quality, hashes=hashes)
+        workers = self.render_workers
+        if not outputs:
+            return {}
+        if not (workers and workers.enabled):
+            # Thread count of 4 is usually optimal for standard PDFs
+            return render_and_save_pages(pdf_path, outputs, self.dpi, backend=self.image_backend,
+                                         thread_count=4, metrics=self.metrics, **options)
         
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        options['backend'] = self.image_backend.name
+        page_numbers = sorted(outputs)
+        chunk_size = -(-len(page_numbers) // min(len(page_numbers), 2 * workers.workers))
+        chunks = [page_numbers[i:i + chunk_size] for i in range(0, len(page_numbers), chunk_size)]
+        if len(chunks) == 1:
+            return workers.run(render_and_save_pages, pdf_path, outputs, self.dpi, **options)
+        results: Dict[int, Dict[str, str]] = {}
+        with ThreadPoolExecutor(max_workers=len(chunks)) as executor:
+            futures = [
+                executor.submit(
+                    self.metrics.bind(workers.run), render_and_save_pages,
+                    pdf_path, {n: outputs[n] for n in chunk}, self.dpi, **options,
+                )
+                for chunk in chunks
+            ]
+            for future in futures:
+                results.update(future.result())
+        return results
+
+    def _reuse_record(self, page_num: int, record: Dict[str, Any], thumbnails: Dict[int, str],
+                      classifications: Dict[int, Dict[str, Any]]) -> None:
+        """Copy a page index record's thumbnail and classification onto a page, when usable."""
+        thumbnail = self.page_index.get_thumbnail(record['file_hash'])
+        if thumbnail:
+            thumbnails[page_num] = thumbnail
+        if self._reusable_classification(record):
+            classifications[page_num] = record['classification']
+
+    def _reusable_classification(self, record: Dict[str, Any]) -> bool:
+        """Only reuse successful classifications made by the currently configured model."""
+        classification = record.get('classification')
+        if not classification or classification.get('type') == 'unknown':
+            return False
+        return classification.get('metadata', {}).get('model_used') == self.model_name
+
+    @staticmethod
+    def _link_or_copy(src: str, dst: str) -> bool:
+        """Hard-link (or copy across filesystems) a previous render into this upload."""
+        if os.path.abspath(src) == os.path.abspath(dst):
+            return True
+        try:
+            if os.path.exists(dst):
+                os.remove(dst)
+            try:
+                os.link(src, dst)
+            except OSError:
+                shutil.copyfile(src, dst)
+            return True
+        except Exception as e:
+            logger.warning(f"Could not reuse {src}: {e}")
+            return False
+
+    def _classify_pages(self, page_paths: Dict[int, str], classifications: Dict[int, Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Classify pages into `classifications`, either page by page or in
+        batches of `batch_size`, and return timing stats for the run.
+
+        There is one level of concurrency: per page, `concurrency` pages are
+        classified at once; batches go one after another, each fanned out by
+        classify_batch_fn itself. Either way every page is one request (the
+        hosted classifier takes one image per request).
+        """
+        batched = bool(self.classify_batch_fn) and self.batch_size > 1
+        if batched:
+            page_nums = list(page_paths)
+            units = [page_nums[i:i + self.batch_size] for i in range(0, len(page_nums), self.batch_size)]
+            task = lambda nums: self._classify_batch([page_paths[n] for n in nums])
+        else:
+            units = [[page_num] for page_num in page_paths]
+            task = lambda nums: [self._classify_page(page_paths[nums[0]])]
+
+        call_seconds: List[float] = []
+
+        def timed(nums):
+            start = time.perf_counter()
+            try:
+                with self.tracer.span('classify', pages=','.join(map(str, nums))):
+                    return task(nums)
+            finally:
+                call_seconds.append(time.perf_counter() - start)
+
+        started = time.perf_counter()
+        max_workers = 1 if batched else max(1, min(self.concurrency, len(units)))
+        with self.metrics.stage('classification'), ThreadPoolExecutor(max_workers=max_workers) as executor:
             # Submit all classification tasks
-            future_to_page = {
-                executor.submit(self._classify_page, image_path): page_num 
-                for page_num, image_path in image_paths
-            }
+            future_to_pages = {executor.submit(self.metrics.bind(timed), nums): nums for nums in units}
             
             # Collect results as they complete
-            for future in as_completed(future_to_page):
-                page_num = future_to_page[future]
-                image_path = next(path for num, path in image_paths if num == page_num)
-                
+            for future in as_completed(future_to_pages):
+                nums = future_to_pages[future]
                 try:
-                    classification = future.result()
-                    
-                    # Structure Data
-                    page_data = {
-                        'page_number': page_num,
-                        'image_path': image_path,
-                        'thumbnail': thumbnails.get(page_num, ""),
-                        # Classification Data
-                        'type': classification['type'],
-                        'confidence': classification['confidence'],
-                        'title': classification['title'],
-                        'analyzable': classification['analyzable'],
-                        'metadata': classification['metadata']
-                    }
-                    
-                    processed_pages.append(page_data)
-                    logger.info(f"Page {page_num}: {classification['title']} ({classification['confidence']:.1%})")
-                    
+                    for page_num, classification in zip(nums, future.result()):
+                        classifications[page_num] = classification
                 except Exception as e:
-                    logger.error(f"Error processing page {page_num}: {e}")
+                    logger.error(f"Error processing pages {nums}: {e}")
                     # Fallback for individual page failure
-                    processed_pages.append({
-                        'page_number': page_num,
-                        'image_path': image_path,
-                        'thumbnail': thumbnails.get(page_num, ""),
-                        'type': 'unknown',
-                        'confidence': 0.0,
-                        'title': 'Processing Error',
-                        'analyzable': False,
-                        'metadata': {'error': str(e)}
-                    })
+                    for page_num in nums:
+                        classifications[page_num] = {
+                            'type': 'unknown',
+                            'confidence': 0.0,
+                            'title': 'Processing Error',
+                            'analyzable': False,
+                            'metadata': {'error': str(e)}
+                        }
+        elapsed = time.perf_counter() - started
 
         return {
-            'total_pages': total_pages,
-            'pages': processed_pages,
-            'pdf_path': pdf_path
+            'mode': 'batched' if batched else 'per_page',
+            'pages': len(page_paths),
+            'requests': len(page_paths),
+            'batches': len(units) if batched else 0,
+            'batch_size': self.batch_size if batched else 1,
+            'concurrency': min(self.concurrency, self.batch_size) if batched else max_workers,
+            'seconds': round(elapsed, 3),
+            'pages_per_second': round(len(page_paths) / elapsed, 3) if elapsed > 0 else 0.0,
+            'mean_call_seconds': round(sum(call_seconds) / len(call_seconds), 3) if call_seconds else 0.0,
         }
 
-    def _classify_page(self, image_path: str) -> Dict[str, Any]:
-        """
-        Sends image to Roboflow Classification API.
-        Uses external classify_fn if provided, otherwise uses direct HTTP POST.
-        Includes retry logic for transient failures.
-        Compresses image before sending to speed up API requests.
-        """
-        import time
-        max_retries = 3
-        retry_delay = 1  # Reduced from 2 to speed up retries
-        
-        # Compress image for faster API transmission
+    def _compress_for_classification(self, image_path: str) -> str:
+        """Write a small JPEG copy of a page for faster API transmission."""
         compressed_path = image_path.replace('.jpg', '_compressed.jpg')
         try:
-            img = Image.open(image_path)
             # Resize to max 1024px while maintaining aspect ratio
-            img.thumbnail((1024, 1024), Image.Resampling.LANCZOS)
-            img.save(compressed_path, 'JPEG', quality=75, optimize=True)
-            classify_image_path = compressed_path
+            with self.metrics.stage('classification_resize'):
+                data = self.image_backend.thumbnail_jpeg(image_path, 1024, quality=75)
+            with open(compressed_path, 'wb') as f:
+                f.write(data)
             logger.debug(f"Compressed image for faster classification: {image_path}")
+            return compressed_path
         except Exception as e:
             logger.warning(f"Could not compress image, using original: {e}")
-            classify_image_path = image_path
-        
+            return image_path
+
+    def _with_retries(self, call, label: str, max_retries: int = 3, retry_delay: float = 1,
+                      tokens: int = 1, slots: int = 1):
+        """
+        Run `call` with retries for transient failures, through the upstream
+        guard when there is one (`tokens` calls' worth of its rate limit,
+        `slots` of its concurrency limit).
+        Returns its result, or None once all attempts have failed.
+        """
         for attempt in range(max_retries):
+            def timed_call(attempt=attempt):
+                with self.metrics.model_call(self.model_name, attempt=attempt + 1):
+                    return call()
+
             try:
-                logger.info(f"Classifying {image_path} (attempt {attempt + 1}/{max_retries})")
-                
-                # Use external function if provided (from app.py)
-                if self.classify_fn:
-                    result = self.classify_fn(
-                        image_path=classify_image_path,  # Use compressed image
-                        project_id=self.project_id,
-                        version=self.version,
-                        api_key=self.api_key,
-                        workspace=self.workspace
-                    )
-                else:
-                    # Fallback: Use InferenceHTTPClient with serverless endpoint
-                    from inference_sdk import InferenceHTTPClient
-                    
-                    client = InferenceHTTPClient(
-                        api_url="https://serverless.roboflow.com",
-                        api_key=self.api_key
-                    )
-                    model_id = f"{self.project_id}/{self.version}"
-                    result = client.infer(classify_image_path, model_id=model_id)  # Use compressed image
-                
-                logger.debug(f"API Response keys: {result.keys()}")
-                
-                # Parse Response - Roboflow Serverless format:
-                # {
-                #   "top": "class_name",
-                #   "confidence": 0.97,
-                #   "predictions": [{"class": "class_name", "confidence": 0.97}]
-                # }
-                
-                top_class = "unknown"
-                confidence = 0.0
-
-                # Primary: Use 'top' and 'confidence' fields (serverless format)
-                if 'top' in result and 'confidence' in result:
-                    top_class = result['top']
-                    confidence = float(result['confidence'])
-                    logger.info(f"✓ Classification: {top_class} ({confidence:.1%})")
-                    return self._map_classification_result(top_class, confidence)
-                
-                # Fallback: Use predictions array
-                if 'predictions' in result and isinstance(result['predictions'], list) and result['predictions']:
-                    top_pred = result['predictions'][0]
-                    top_class = top_pred.get('class', 'unknown')
-                    confidence = float(top_pred.get('confidence', 0.0))
-                    logger.info(f"✓ Classification: {top_class} ({confidence:.1%})")
-                    return self._map_classification_result(top_class, confidence)
-                
-                # If we get here, response format is unexpected
-                logger.warning(f"Unexpected response format. Keys: {list(result.keys())}")
-                logger.debug(f"Full response: {result}")
-                return self._map_classification_result("unknown", 0.0)
+                logger.debug(f"Classifying {label} (attempt {attempt + 1}/{max_retries})")
+                if self.upstream:
+                    return self.upstream.call(timed_call, tokens, slots)
+                return timed_call()
+
+            except (CircuitOpenError, RateLimitedError) as e:
+                # Retrying cannot help while the model is down or the rate budget is spent
+                logger.error(f"❌ Classification of {label} skipped: {e}")
+                return None
 
             except requests.exceptions.Timeout:
                 logger.warning(f"Attempt {attempt + 1} failed: Request timeout")
                 if attempt < max_retries - 1:
                     logger.info(f"Retrying in {retry_delay}s...")
+                    self.metrics.retry('classification')
                     time.sleep(retry_delay)
                     
             except requests.exceptions.HTTPError as e:
@@ -255,7 +680,8 @@ class PDFProcessor:
                     logger.error(f"Error: {error_msg}")
                 elif attempt < max_retries - 1:
                     logger.info(f"Retrying in {retry_delay}s...")
-                    time.sleep(retry_delay)
+                    self.metrics.retry('classification')
+                    self._retry_pause(e, retry_delay)
                     
             except Exception as e:
                 error_msg = str(e)
@@ -267,9 +693,106 @@ class PDFProcessor:
                     logger.error(f"Error: {error_msg}")
                 elif attempt < max_retries - 1:
                     logger.info(f"Retrying in {retry_delay}s...")
-                    time.sleep(retry_delay)
+                    self.metrics.retry('classification')
+                    self._retry_pause(e, retry_delay)
+        return None
+
+    def _retry_pause(self, error: Exception, retry_delay: float) -> None:
+        # After an upstream 429 the guard has already paused every caller
+        if not (self.upstream and is_throttle(error)):
+            time.sleep(retry_delay)
+
+    def _classify_page(self, image_path: str) -> Dict[str, Any]:
+        """
+        Sends image to Roboflow Classification API.
+        Uses external classify_fn if provided, otherwise uses direct HTTP POST.
+        Includes retry logic for transient failures.
+        Compresses image before sending to speed up API requests.
+        """
+        classify_image_path = self._compress_for_classification(image_path)
+
+        def call():
+            # Use external function if provided (from app.py)
+            if self.classify_fn:
+                return self.classify_fn(
+                    image_path=classify_image_path,  # Use compressed image
+                    project_id=self.project_id,
+                    version=self.version,
+                    api_key=self.api_key,
+                    workspace=self.workspace
+                )
+            # Fallback: Use InferenceHTTPClient with serverless endpoint
+            from inference_sdk import InferenceHTTPClient
+            
+            api_url = os.getenv('ROBOFLOW_CLASSIFY_API_URL', 'https://serverless.roboflow.com')
+            client = InferenceHTTPClient(api_url=api_url, api_key=self.api_key)
+            if 'roboflow.com' not in api_url:
+                client.select_api_v0()
+            model_id = f"{self.project_id}/{self.version}"
+            return client.infer(classify_image_path, model_id=model_id)  # Use compressed image
+
+        result = self._with_retries(call, image_path)
+        if result is None:
+            # All retries exhausted
+            return self._map_classification_result("unknown", 0.0)
+        return self._parse_classification_result(result)
+
+    def _classify_batch(self, image_paths: List[str]) -> List[Dict[str, Any]]:
+        """
+        Classify several pages with a single classify_batch_fn call.
+        Retries the whole batch on transient failures.
+        """
+        compressed_paths = [self._compress_for_classification(path) for path in image_paths]
+
+        def call():
+            results = self.classify_batch_fn(
+                image_paths=compressed_paths,
+                project_id=self.project_id,
+                version=self.version,
+                api_key=self.api_key,
+                workspace=self.workspace
+            )
+            if len(results) != len(compressed_paths):
+                raise ValueError(f"Batch classifier returned {len(results)} results for {len(compressed_paths)} pages")
+            return results
+
+        # classify_batch_fn sends up to PAGE_CLASSIFY_CONCURRENCY of the pages at once
+        results = self._with_retries(call, f"batch of {len(image_paths)} pages", tokens=len(image_paths),
+                                     slots=min(self.concurrency, len(image_paths)))
+        if results is None:
+            # All retries exhausted
+            return [self._map_classification_result("unknown", 0.0) for _ in image_paths]
+        return [self._parse_classification_result(result) for result in results]
+
+    def _parse_classification_result(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Parse Response - Roboflow Serverless format:
+        {
+          "top": "class_name",
+          "confidence": 0.97,
+          "predictions": [{"class": "class_name", "confidence": 0.97}]
+        }
+        """
+        logger.debug(f"API Response keys: {result.keys()}")
+        
+        # Primary: Use 'top' and 'confidence' fields (serverless format)
+        if 'top' in result and 'confidence' in result:
+            top_class = result['top']
+            confidence = float(result['confidence'])
+            logger.debug(f"✓ Classification: {top_class} ({confidence:.1%})")
+            return self._map_classification_result(top_class, confidence)
         
-        # All retries exhausted
+        # Fallback: Use predictions array
+        if 'predictions' in result and isinstance(result['predictions'], list) and result['predictions']:
+            top_pred = result['predictions'][0]
+            top_class = top_pred.get('class', 'unknown')
+            confidence = float(top_pred.get('confidence', 0.0))
+            logger.debug(f"✓ Classification: {top_class} ({confidence:.1%})")
+            return self._map_classification_result(top_class, confidence)
+        
+        # If we get here, response format is unexpected
+        logger.warning(f"Unexpected response format. Keys: {list(result.keys())}")
+        logger.debug(f"Full response: {result}")
         return self._map_classification_result("unknown", 0.0)
 
     def _map_classification_result(self, raw_class: str, confidence: float) -> Dict[str, Any]:
@@ -311,18 +834,21 @@ class PDFProcessor:
             'title': title,
             'analyzable': analyzable,
             'metadata': {
-                'model_used': f"{self.project_id}/{self.version}",
+                'model_used': self.model_name,
                 'raw_class': raw_class
             }
         }
 
-    def _generate_thumbnail_b64(self, image: Image.Image, max_size: int = 1200) -> str:
-        """Create a high-quality base64 thumbnail for the UI."""
-        thumb = image.copy()
-        thumb.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
-        
-        buffered = BytesIO()
-        thumb.save(buffered, format="JPEG", quality=85)
-        img_str = base64.b64encode(buffered.getvalue()).decode()
+    def _generate_thumbnail_b64(self, image_path: str, max_size: int = 1200) -> str:
+        """Create a high-quality base64 thumbnail for the UI (previews that already fit are used as is)."""
+        with self.metrics.stage('thumbnail'):
+            with Image.open(image_path) as img:
+                fits = max(img.size) <= max_size
+            if fits:
+                with open(image_path, 'rb') as f:
+                    data = f.read()
+            else:
+                data = self.image_backend.thumbnail_jpeg(image_path, max_size, quality=85)
+            img_str = base64.b64encode(data).decode()
         
         return f"data:image/jpeg;base64,{img_str}"
\ No newline at end of file
@@ -0,0 +1,329 @@
+"""
+Per-request Profiling for EstimAgent
+Captures a sampling CPU profile, and optionally a tracemalloc allocation
+snapshot, of one /analyze, /upload-pdf or /analyze-pages request, without
+redeploying with ad-hoc instrumentation.
+
+- A request is profiled when PROFILE_REQUESTS is "cpu" or "memory", or when
+  it carries `X-Profile: cpu|memory` plus `X-Admin-Token` matching
+  PROFILE_ADMIN_TOKEN. With neither setting the middleware is not installed.
+- The sampler is a background thread reading sys._current_frames() every
+  PROFILE_INTERVAL_MS, so profiled code runs unmodified (no per-call hooks as
+  with cProfile) and the request's thread-pool work is included. Sampling is
+  process-wide: one profile runs at a time, and concurrent requests show up
+  in it too (the count in flight at the start is recorded).
+- Threads parked waiting for work (the idle event loop, idle pool workers,
+  lock and event waits) are counted as idle and left out of the stacks; time
+  blocked on model calls (socket reads) is kept.
+- "memory" mode also traces allocations for the request: the snapshot lists
+  what is still allocated when the request ends (caches, leaks) and the
+  traced peak. tracemalloc slows allocation-heavy code noticeably.
+
+Artifacts, under PROFILE_DIR (kept out of UPLOAD_DIR, which is served
+publicly), at most PROFILE_MAX_ARTIFACTS profiles. They hold code paths and
+allocation sites, so /profiles only serves them with a valid X-Admin-Token;
+with PROFILE_REQUESTS but no PROFILE_ADMIN_TOKEN they are only on disk:
+    <profile_id>.json         summary: hottest functions (self and total), memory top
+    <profile_id>.folded       collapsed stacks for flamegraph.pl / speedscope
+    <profile_id>.tracemalloc  tracemalloc.Snapshot.load()-able snapshot (memory mode)
+"""
+
+import os
+import re
+import sys
+import hmac
+import json
+import time
+import uuid
+import logging
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Mapping, Optional
+
+logger = logging.getLogger(__name__)
+
+MODES = ('cpu', 'memory')
+
+# Leaf frames of threads waiting for work: (file name, function)
+_IDLE_LEAVES = {
+    ('selectors.py', 'select'),     # event loop with nothing to run
+    ('thread.py', '_worker'),       # idle ThreadPoolExecutor worker
+    ('queue.py', 'get'),
+    ('threading.py', 'wait'),
+    ('threading.py', '_wait_for_tstate_lock'),
+    ('handlers.py', 'dequeue'),     # logging QueueListener
+}
+
+_PROFILE_ID = re.compile(r'^[0-9a-f]{32}$')
+
+_ARTIFACTS = {
+    'summary': '.json',
+    'stacks': '.folded',
+    'tracemalloc': '.tracemalloc',
+}
+
+
+def _short_path(filename: str) -> str:
+    """File name relative to the longest sys.path entry containing it."""
+    best = ''
+    for entry in sys.path:
+        entry = os.path.join(os.path.abspath(entry or '.'), '')
+        if filename.startswith(entry) and len(entry) > len(best):
+            best = entry
+    return filename[len(best):] if best else filename
+
+
+class SamplingProfiler:
+    """Samples every thread's stack from a background thread into collapsed-stack counts."""
+
+    def __init__(self, interval: float = 0.005, max_depth: int = 128):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.idle_samples = 0
+        self.duration = 0.0
+        self._labels: Dict[Any, str] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._start = 0.0
+
+    def start(self) -> None:
+        self._start = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.duration = time.perf_counter() - self._start
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    self._sample(names.get(ident, str(ident)), frame)
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})".replace(';', ',')
+            self._labels[code] = label
+        return label
+
+    def _sample(self, thread_name: str, frame) -> None:
+        code = frame.f_code
+        if (os.path.basename(code.co_filename), code.co_name) in _IDLE_LEAVES:
+            self.idle_samples += 1
+            return
+        stack = []
+        while frame is not None and len(stack) < self.max_depth:
+            stack.append(self._label(frame.f_code))
+            frame = frame.f_back
+        stack.append(thread_name)
+        self.stacks[';'.join(reversed(stack))] += 1
+        self.samples += 1
+
+    def folded(self) -> str:
+        """Collapsed stacks, one `thread;outer;...;leaf count` line each."""
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self, top: int = 30) -> Dict[str, Any]:
+        self_counts: Counter = Counter()
+        total_counts: Counter = Counter()
+        threads: Counter = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(';')
+            threads[frames[0]] += count
+            self_counts[frames[-1]] += count
+            for frame in set(frames[1:]):
+                total_counts[frame] += count
+
+        def ranked(counts: Counter) -> List[Dict[str, Any]]:
+            return [
+                {'function': name, 'samples': n, 'percent': round(100 * n / self.samples, 1)}
+                for name, n in counts.most_common(top)
+            ]
+
+        return {
+            'interval_ms': self.interval * 1000,
+            'duration_seconds': round(self.duration, 3),
+            'samples': self.samples,
+            'idle_samples': self.idle_samples,
+            'threads': dict(threads.most_common()),
+            'top_self': ranked(self_counts) if self.samples else [],
+            'top_total': ranked(total_counts) if self.samples else [],
+        }
+
+
+def _memory_summary(snapshot: tracemalloc.Snapshot, current: int, peak: int, top: int = 30) -> Dict[str, Any]:
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<unknown>'),
+    ))
+    stats = snapshot.statistics('lineno')
+    return {
+        'traced_current_mb': round(current / 1024 / 1024, 2),
+        'traced_peak_mb': round(peak / 1024 / 1024, 2),
+        'retained_mb': round(sum(s.size for s in stats) / 1024 / 1024, 2),
+        'top_retained': [
+            {
+                'location': f"{_short_path(s.traceback[0].filename)}:{s.traceback[0].lineno}",
+                'size_kb': round(s.size / 1024, 1),
+                'count': s.count,
+            }
+            for s in stats[:top]
+        ],
+    }
+
+
+class RequestProfiler:
+    """Profiles one request at a time and keeps the results as artifacts in `directory`."""
+
+    def __init__(
+        self,
+        directory: str,
+        default_mode: str = 'off',
+        admin_token: str = '',
+        interval: float = 0.005,
+        memory_frames: int = 25,
+        max_artifacts: int = 50,
+    ):
+        default_mode = (default_mode or 'off').lower()
+        if default_mode not in ('off',) + MODES:
+            raise ValueError(f"Unknown profile mode: {default_mode}")
+        self.directory = directory
+        self.default_mode = default_mode
+        self.admin_token = admin_token
+        self.interval = interval
+        self.memory_frames = memory_frames
+        self.max_artifacts = max_artifacts
+        self.enabled = default_mode != 'off' or bool(admin_token)
+        self._lock = threading.Lock()
+        if self.enabled:
+            os.makedirs(directory, exist_ok=True)
+
+    def is_admin(self, headers: Mapping[str, str]) -> bool:
+        token = headers.get('x-admin-token') or ''
+        return bool(self.admin_token) and hmac.compare_digest(token.encode(), self.admin_token.encode())
+
+    def can_download(self, headers: Mapping[str, str]) -> bool:
+        """Artifacts always need the admin token; without PROFILE_ADMIN_TOKEN they stay on disk only."""
+        return self.enabled and self.is_admin(headers)
+
+    def requested_mode(self, headers: Mapping[str, str]) -> Optional[str]:
+        """Profile mode for a request: an admin's X-Profile header, else PROFILE_REQUESTS."""
+        header = (headers.get('x-profile') or '').lower()
+        if header and self.is_admin(headers):
+            if header in ('0', 'off'):
+                return None
+            return header if header in MODES else 'cpu'
+        return None if self.default_mode == 'off' else self.default_mode
+
+    @contextmanager
+    def profile(self, mode: str, **metadata) -> Iterator[Optional[Dict[str, Any]]]:
+        """
+        Profile the enclosed work. Yields the profile record (add fields to it
+        before the block ends), or None when another profile is running.
+        """
+        if not self._lock.acquire(blocking=False):
+            yield None
+            return
+        try:
+            record: Dict[str, Any] = {
+                'profile_id': uuid.uuid4().hex,
+                'mode': mode,
+                'started_at': time.time(),
+                **metadata,
+            }
+            trace_memory = mode == 'memory'
+            started_tracemalloc = trace_memory and not tracemalloc.is_tracing()
+            if started_tracemalloc:
+                tracemalloc.start(self.memory_frames)
+            elif trace_memory:
+                tracemalloc.clear_traces()
+                tracemalloc.reset_peak()
+            sampler = SamplingProfiler(self.interval)
+            sampler.start()
+            try:
+                yield record
+            finally:
+                sampler.stop()
+                snapshot = None
+                if trace_memory:
+                    snapshot = tracemalloc.take_snapshot()
+                    current, peak = tracemalloc.get_traced_memory()
+                    if started_tracemalloc:
+                        tracemalloc.stop()
+                    record['memory'] = _memory_summary(snapshot, current, peak)
+                record['cpu'] = sampler.summary()
+                try:
+                    self._save(record, sampler, snapshot)
+                except OSError:
+                    logger.exception("Could not save profile %s", record['profile_id'])
+        finally:
+            self._lock.release()
+
+    def _path(self, profile_id: str, artifact: str) -> str:
+        return os.path.join(self.directory, profile_id + _ARTIFACTS[artifact])
+
+    def _save(self, record: Dict[str, Any], sampler: SamplingProfiler,
+              snapshot: Optional[tracemalloc.Snapshot]) -> None:
+        profile_id = record['profile_id']
+        with open(self._path(profile_id, 'stacks'), 'w') as f:
+            f.write(sampler.folded())
+        if snapshot is not None:
+            snapshot.dump(self._path(profile_id, 'tracemalloc'))
+        # Summary last: its presence marks a complete profile
+        with open(self._path(profile_id, 'summary'), 'w') as f:
+            json.dump(record, f, indent=2)
+        logger.info(
+            "Saved %s profile %s: %d samples over %.2fs",
+            record['mode'], profile_id, sampler.samples, sampler.duration,
+        )
+        self._prune()
+
+    def _summaries(self) -> List[str]:
+        try:
+            names = [n for n in os.listdir(self.directory) if n.endswith(_ARTIFACTS['summary'])]
+        except FileNotFoundError:
+            return []
+        paths = [os.path.join(self.directory, n) for n in names]
+        return sorted(paths, key=lambda p: os.path.getmtime(p), reverse=True)
+
+    def _prune(self) -> None:
+        for path in self._summaries()[self.max_artifacts:]:
+            profile_id = os.path.basename(path)[:-len(_ARTIFACTS['summary'])]
+            for artifact in _ARTIFACTS:
+                try:
+                    os.remove(self._path(profile_id, artifact))
+                except FileNotFoundError:
+                    pass
+
+    def list(self) -> List[Dict[str, Any]]:
+        """Newest first, without the per-function breakdowns."""
+        profiles = []
+        for path in self._summaries():
+            try:
+                with open(path) as f:
+                    record = json.load(f)
+            except (OSError, ValueError):
+                continue
+            record.pop('cpu', None)
+            record.pop('memory', None)
+            profiles.append(record)
+        return profiles
+
+    def artifact(self, profile_id: str, artifact: str) -> Optional[str]:
+        """Path of a stored artifact, or None if there is no such profile or artifact."""
+        if not _PROFILE_ID.match(profile_id) or artifact not in _ARTIFACTS:
+            return None
+        path = self._path(profile_id, artifact)
+        return path if os.path.exists(path) else None
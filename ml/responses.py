@@ -0,0 +1,122 @@
+"""
+JSON Responses for EstimAgent
+Serializes analysis payloads in one pass with orjson, which handles numpy
+scalars and arrays natively, instead of walking every response with a
+recursive numpy-to-Python conversion and then FastAPI's generic encoder.
+
+Routes return FastJSONResponse instances directly: FastAPI only runs
+jsonable_encoder over plain return values, not over Response objects.
+
+Predictions are built with their geometry once: `points` (shared with
+`mask`) in pixels, plus `bbox` for box detections. Two response formats are
+derived from that at serialization time:
+- "full":    the original shape the frontend reads, with `points_norm` /
+             `bbox_norm` computed from the image dimensions.
+- "compact": versioned by COMPACT_SCHEMA_VERSION; polygons as flat pixel
+             coordinate arrays and bboxes as [cx, cy, w, h], nothing duplicated.
+             Clients expand it with client/src/lib/predictions.ts.
+"""
+
+import json
+from typing import Any, Dict, List
+
+import numpy as np
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+RESPONSE_FORMATS = ('full', 'compact')
+
+# Bump whenever the compact prediction shape changes; clients check it before expanding
+COMPACT_SCHEMA_VERSION = 1
+
+
+def _default(obj: Any) -> Any:
+    """Fallback for types neither serializer handles natively."""
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, (set, tuple)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    """Serialize to UTF-8 JSON bytes, accepting numpy values anywhere in the payload."""
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def _flat(points: List[Dict[str, float]]) -> List[float]:
+    flat: List[float] = []
+    for pt in points:
+        flat.append(pt['x'])
+        flat.append(pt['y'])
+    return flat
+
+
+def compact_prediction(item: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Compact form of a normalized prediction: geometry once, as a flat
+    [x1, y1, x2, y2, ...] pixel array. Normalized coordinates are dropped;
+    divide by the response's image width/height to recover them.
+    """
+    out = {k: v for k, v in item.items() if k not in ('mask', 'points', 'points_norm', 'bbox', 'bbox_norm')}
+    points = item.get('points') or item.get('mask') or []
+    out['points'] = _flat(points)
+    bbox = item.get('bbox')
+    if bbox:
+        out['bbox'] = [bbox['x'], bbox['y'], bbox['w'], bbox['h']]
+    return out
+
+
+def compact_predictions(predictions: Dict[str, List[Dict[str, Any]]]) -> Dict[str, List[Dict[str, Any]]]:
+    """Compact every prediction list of a {type: [items]} mapping."""
+    return {key: [compact_prediction(item) for item in items] for key, items in predictions.items()}
+
+
+def full_prediction(item: Dict[str, Any], img_w: int, img_h: int) -> Dict[str, Any]:
+    """
+    Full (original) form of a prediction: adds the normalized `points_norm` and
+    `bbox_norm` copies the frontend has always received, and `mask` when an
+    item only carries `points`.
+    """
+    out = dict(item)
+    points = item.get('points') or item.get('mask') or []
+    out.setdefault('mask', points)
+    out.setdefault('points', points)
+    if img_w and img_h:
+        out['points_norm'] = [{'x': pt['x'] / img_w, 'y': pt['y'] / img_h} for pt in points]
+    else:
+        out['points_norm'] = []
+    bbox = item.get('bbox')
+    if bbox:
+        out['bbox_norm'] = {
+            'x': bbox['x'] / img_w if img_w else 0.0,
+            'y': bbox['y'] / img_h if img_h else 0.0,
+            'w': bbox['w'] / img_w if img_w else 0.0,
+            'h': bbox['h'] / img_h if img_h else 0.0,
+        }
+    return out
+
+
+def full_predictions(predictions: Dict[str, List[Dict[str, Any]]], img_w: int, img_h: int) -> Dict[str, List[Dict[str, Any]]]:
+    """Full form of every prediction list of a {type: [items]} mapping."""
+    return {key: [full_prediction(item, img_w, img_h) for item in items] for key, items in predictions.items()}
+
+
+def format_predictions(predictions: Dict[str, List[Dict[str, Any]]], fmt: str, img_w: int, img_h: int) -> Dict[str, List[Dict[str, Any]]]:
+    """Predictions in the requested response format ("full" or "compact")."""
+    if fmt == 'compact':
+        return compact_predictions(predictions)
+    return full_predictions(predictions, img_w, img_h)
@@ -0,0 +1,75 @@
+"""
+Single-Flight Call Coalescing for EstimAgent
+Concurrent calls with the same key share one execution: the first caller runs
+the function, later callers wait for it and receive the same result (or the
+same exception). Used to keep identical model calls — a double-submitted
+/analyze, two estimators on one sheet, speculative pre-analysis racing the
+user's request — from each going upstream.
+"""
+
+import threading
+from typing import Any, Callable, Dict
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException = None
+
+
+class SingleFlight:
+    """Thread-safe per-key call deduplication with coalescing counters."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._stats = {'executed': 0, 'coalesced': 0, 'failed': 0}
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """
+        Run `fn` unless a call with the same key is already in flight, in which
+        case wait for that call and return its result.
+
+        Args:
+            key: Identity of the call (same key means interchangeable results)
+            fn: Zero-argument function performing the call
+
+        Returns:
+            The result of the (possibly shared) call; its exception is re-raised
+            in every waiting caller.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self._stats['coalesced'] += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self._stats['executed'] += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            with self._lock:
+                self._stats['failed'] += 1
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats, in_flight=len(self._calls))
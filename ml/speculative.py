@@ -0,0 +1,107 @@
+"""
+Speculative Pre-Analysis for EstimAgent
+Runs detection for likely-to-be-analyzed pages in the background right after
+upload, so the user's later analysis request is served from the result cache.
+
+Background work yields to interactive requests: each job is a list of small
+steps (one model call each) and the worker waits before every step while any
+interactive request is in flight.
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+
+class SpeculativeScheduler:
+    """Single low-priority worker draining a bounded queue of speculative jobs."""
+
+    def __init__(self, max_queue: int = 200, max_age_seconds: float = 1800):
+        self.max_queue = max_queue
+        self.max_age_seconds = max_age_seconds
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._interactive = 0
+        self._cond = threading.Condition()
+        self._worker = None
+        self._stats = {'scheduled': 0, 'completed_steps': 0, 'failed_steps': 0, 'dropped': 0, 'preemptions': 0}
+
+    # -- interactive side --------------------------------------------------------
+
+    @contextmanager
+    def interactive(self):
+        """Mark an interactive request as in flight; background steps pause until it ends."""
+        with self._cond:
+            self._interactive += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._interactive -= 1
+                self._cond.notify_all()
+
+    # -- scheduling ----------------------------------------------------------------
+
+    def submit(self, key: str, steps: List[Callable[[], Any]]) -> bool:
+        """Queue a job (replacing any queued job with the same key). Returns False if the queue is full."""
+        if not steps:
+            return False
+        with self._cond:
+            if key not in self._jobs and len(self._jobs) >= self.max_queue:
+                self._stats['dropped'] += 1
+                return False
+            self._jobs[key] = {'steps': list(steps), 'queued_at': time.time()}
+            self._stats['scheduled'] += 1
+            self._ensure_worker()
+            self._cond.notify_all()
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return dict(self._stats, queued_jobs=len(self._jobs), interactive_in_flight=self._interactive)
+
+    def _ensure_worker(self) -> None:
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name="speculative-analysis", daemon=True)
+            self._worker.start()
+
+    def _next_step(self):
+        """Block until there is a step to run and no interactive request is in flight."""
+        with self._cond:
+            while True:
+                if self._interactive:
+                    self._stats['preemptions'] += 1
+                    self._cond.wait_for(lambda: self._interactive == 0)
+                    continue
+                if not self._jobs:
+                    self._cond.wait()
+                    continue
+                key, job = next(iter(self._jobs.items()))
+                if time.time() - job['queued_at'] > self.max_age_seconds or not job['steps']:
+                    if job['steps']:
+                        self._stats['dropped'] += 1
+                    del self._jobs[key]
+                    continue
+                return key, job['steps'].pop(0)
+
+    def _run(self) -> None:
+        try:
+            # Linux schedules threads individually, so this lowers only this worker's priority
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+        except (AttributeError, OSError):
+            pass
+        while True:
+            key, step = self._next_step()
+            try:
+                step()
+                outcome = 'completed_steps'
+            except Exception as e:
+                outcome = 'failed_steps'
+                logger.warning(f"Speculative step for {key} failed: {e}")
+            with self._cond:
+                self._stats[outcome] += 1
@@ -0,0 +1,251 @@
+"""
+Upload Storage Lifecycle for EstimAgent
+Keeps UPLOAD_DIR bounded: PDF uploads are evicted after a TTL since their last
+access and, least recently used first, whenever the total exceeds a quota.
+Per-request temp files live in their own directory and are removed when the
+request ends (and swept if a crash left them behind).
+
+On Cloud Run the filesystem is in memory, so every byte here is RAM.
+
+Layout under `root` (UPLOAD_DIR):
+    pdfs/<upload_id>/   one directory per /upload-pdf; `.last_access` marks its LRU time
+    tmp/                request temp files
+    page_index/         shared page index (reported, bounded by the index itself)
+"""
+
+import os
+import time
+import uuid
+import shutil
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_ACCESS_MARKER = '.last_access'
+
+
+def _categorize(filename: str) -> str:
+    """Artifact category of a file inside an upload directory."""
+    name = filename.lower()
+    if name.endswith('.pdf'):
+        return 'pdf'
+    if name.endswith('_compressed.jpg'):
+        return 'classification_copies'
+    if name.endswith('_preview.jpg'):
+        return 'previews'
+    if name.startswith('page_') and name.endswith('.jpg'):
+        return 'page_renders'
+    if name.startswith('analysis_') and name.endswith('.json'):
+        return 'analysis_results'
+    return 'other'
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                pass
+    return total
+
+
+class StorageManager:
+    """Tracks upload directories by last access and evicts them by TTL and total-size quota."""
+
+    def __init__(
+        self,
+        root: str,
+        ttl_seconds: float = 24 * 3600,
+        quota_bytes: int = 2 * 1024 ** 3,
+        min_idle_seconds: float = 600,
+        temp_max_age_seconds: float = 3600,
+    ):
+        self.root = root
+        self.pdf_dir = os.path.join(root, 'pdfs')
+        self.temp_dir = os.path.join(root, 'tmp')
+        self.ttl_seconds = ttl_seconds
+        self.quota_bytes = quota_bytes
+        # Uploads touched more recently than this are never evicted, even over quota
+        self.min_idle_seconds = min_idle_seconds
+        self.temp_max_age_seconds = temp_max_age_seconds
+        os.makedirs(self.pdf_dir, exist_ok=True)
+        os.makedirs(self.temp_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._sweeper = None
+        self._stats = {'evicted_ttl': 0, 'evicted_quota': 0, 'evicted_bytes': 0, 'temp_removed': 0, 'sweeps': 0}
+
+    # -- access tracking ---------------------------------------------------------
+
+    def upload_dir(self, upload_id: str) -> str:
+        return os.path.join(self.pdf_dir, upload_id)
+
+    def touch(self, upload_id: str) -> None:
+        """Record an access to an upload (resets its TTL and LRU position)."""
+        upload_dir = self.upload_dir(upload_id)
+        if not os.path.isdir(upload_dir):
+            return
+        marker = os.path.join(upload_dir, _ACCESS_MARKER)
+        try:
+            with open(marker, 'a'):
+                pass
+            os.utime(marker, None)
+        except OSError as e:
+            logger.warning(f"Could not record access to upload {upload_id}: {e}")
+
+    def last_access(self, upload_id: str) -> float:
+        upload_dir = self.upload_dir(upload_id)
+        try:
+            return os.path.getmtime(os.path.join(upload_dir, _ACCESS_MARKER))
+        except OSError:
+            return os.path.getmtime(upload_dir)
+
+    # -- request temp files --------------------------------------------------------
+
+    def new_temp_path(self, suffix: str = '') -> str:
+        """Unique path for a request temp file; pass it to discard() when the request ends."""
+        return os.path.join(self.temp_dir, f"{uuid.uuid4().hex}{suffix}")
+
+    def discard(self, *paths: Optional[str]) -> None:
+        """Remove request temp files, ignoring ones that were never written."""
+        for path in paths:
+            if not path:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Could not remove temp file {path}: {e}")
+
+    @contextmanager
+    def temp_file(self, suffix: str = ''):
+        """Path for a request-scoped temp file, removed when the block exits."""
+        path = self.new_temp_path(suffix)
+        try:
+            yield path
+        finally:
+            self.discard(path)
+
+    # -- eviction ------------------------------------------------------------------
+
+    def _uploads(self) -> List[Tuple[str, float, int]]:
+        """(upload_id, last_access, size) for every upload directory."""
+        uploads = []
+        for upload_id in os.listdir(self.pdf_dir):
+            path = self.upload_dir(upload_id)
+            if not os.path.isdir(path):
+                continue
+            try:
+                uploads.append((upload_id, self.last_access(upload_id), _dir_size(path)))
+            except OSError:
+                continue
+        return uploads
+
+    def _evict(self, upload_id: str, size: int, reason: str) -> None:
+        shutil.rmtree(self.upload_dir(upload_id), ignore_errors=True)
+        self._stats[f'evicted_{reason}'] += 1
+        self._stats['evicted_bytes'] += size
+        logger.info(f"Evicted upload {upload_id} ({size / 1024 ** 2:.1f} MB, {reason})")
+
+    def sweep(self) -> Dict[str, Any]:
+        """Evict expired uploads, then LRU uploads until under quota, and remove stale temp files."""
+        with self._lock:
+            now = time.time()
+            evicted: List[str] = []
+            uploads = self._uploads()
+
+            remaining = []
+            for upload_id, accessed, size in uploads:
+                if now - accessed > self.ttl_seconds:
+                    self._evict(upload_id, size, 'ttl')
+                    evicted.append(upload_id)
+                else:
+                    remaining.append((upload_id, accessed, size))
+
+            total = sum(size for _, _, size in remaining)
+            for upload_id, accessed, size in sorted(remaining, key=lambda u: u[1]):
+                if total <= self.quota_bytes:
+                    break
+                if now - accessed < self.min_idle_seconds:
+                    continue
+                self._evict(upload_id, size, 'quota')
+                evicted.append(upload_id)
+                total -= size
+
+            for filename in os.listdir(self.temp_dir):
+                path = os.path.join(self.temp_dir, filename)
+                try:
+                    if now - os.path.getmtime(path) > self.temp_max_age_seconds:
+                        os.remove(path)
+                        self._stats['temp_removed'] += 1
+                except OSError:
+                    pass
+
+            self._stats['sweeps'] += 1
+            if total > self.quota_bytes:
+                logger.warning(
+                    f"Uploads use {total / 1024 ** 2:.0f} MB, over the {self.quota_bytes / 1024 ** 2:.0f} MB quota, "
+                    "but every remaining upload is in active use"
+                )
+            return {'evicted': evicted, 'upload_bytes': total}
+
+    def start_sweeper(self, interval_seconds: float = 300) -> None:
+        """Run sweep() periodically on a daemon thread."""
+        if self._sweeper is not None and self._sweeper.is_alive():
+            return
+
+        def run():
+            while True:
+                try:
+                    self.sweep()
+                except Exception as e:
+                    logger.warning(f"Storage sweep failed: {e}")
+                time.sleep(interval_seconds)
+
+        self._sweeper = threading.Thread(target=run, name="storage-sweeper", daemon=True)
+        self._sweeper.start()
+
+    # -- reporting -----------------------------------------------------------------
+
+    def usage(self, extra_dirs: Optional[Dict[str, str]] = None, include_uploads: bool = False) -> Dict[str, Any]:
+        """
+        Disk usage by artifact category. Per-upload sizes and ages (largest
+        first) only with `include_uploads`: upload ids grant access to the
+        uploads, so they are for admins only.
+        """
+        categories: Dict[str, int] = {}
+        uploads = []
+        now = time.time()
+        for upload_id, accessed, size in self._uploads():
+            uploads.append({'upload_id': upload_id, 'bytes': size, 'idle_seconds': round(now - accessed)})
+            for dirpath, _, filenames in os.walk(self.upload_dir(upload_id)):
+                for filename in filenames:
+                    if filename == _ACCESS_MARKER:
+                        continue
+                    try:
+                        size_ = os.path.getsize(os.path.join(dirpath, filename))
+                    except OSError:
+                        continue
+                    category = _categorize(filename)
+                    categories[category] = categories.get(category, 0) + size_
+        categories['temp'] = _dir_size(self.temp_dir)
+        for name, path in (extra_dirs or {}).items():
+            categories[name] = _dir_size(path) if os.path.isdir(path) else 0
+
+        usage = {
+            'total_bytes': sum(categories.values()),
+            'upload_bytes': sum(u['bytes'] for u in uploads),
+            'upload_count': len(uploads),
+            'quota_bytes': self.quota_bytes,
+            'ttl_seconds': self.ttl_seconds,
+            'categories': categories,
+            'stats': dict(self._stats),
+        }
+        if include_uploads:
+            usage['uploads'] = sorted(uploads, key=lambda u: u['bytes'], reverse=True)
+        return usage
@@ -0,0 +1,189 @@
+import asyncio
+import threading
+
+import pytest
+
+from admission import BULK, INTERACTIVE, AdmissionController, AdmissionRejected, page_analysis_cost_mb, upload_cost_mb
+
+
+def controller(**kwargs):
+    kwargs.setdefault('memory_high_water', 100)  # ignore this machine's memory use
+    kwargs.setdefault('max_wait_seconds', 2)
+    return AdmissionController(**kwargs)
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_admits_within_budget_and_queues_beyond_it():
+    async def run():
+        admission = controller(budget_mb=100)
+        first = await admission.acquire('/a', 60, priority=INTERACTIVE)
+        waiter = asyncio.ensure_future(admission.acquire('/a', 60, priority=INTERACTIVE))
+        await settle()
+        assert not waiter.done()
+        assert admission.stats()['waiting'][INTERACTIVE] == 1
+        admission.release(first)
+        second = await waiter
+        assert admission.stats()['reserved_mb'] == 60
+        admission.release(second)
+        assert admission.stats()['reserved_mb'] == 0
+    asyncio.run(run())
+
+
+def test_anything_is_admitted_when_idle():
+    async def run():
+        admission = controller(budget_mb=100)
+        ticket = await admission.acquire('/upload-pdf', 5000, priority=BULK)
+        assert admission.stats()['reserved_mb'] == 5000
+        admission.release(ticket)
+    asyncio.run(run())
+
+
+def test_bulk_share_and_max_bulk():
+    async def run():
+        admission = controller(budget_mb=100, bulk_share=0.5, max_bulk=2)
+        bulk = await admission.acquire('/upload-pdf', 40, priority=BULK)
+        with pytest.raises(AdmissionRejected):  # 80 MB of bulk is over half the budget
+            await _acquire_with_wait(admission, '/upload-pdf', 40, BULK, wait=0.05)
+        interactive = await admission.acquire('/analyze', 50, priority=INTERACTIVE)
+        admission.release(interactive)
+        small = await admission.acquire('/upload-pdf', 5, priority=BULK)
+        with pytest.raises(AdmissionRejected):  # third bulk job
+            await _acquire_with_wait(admission, '/upload-pdf', 1, BULK, wait=0.05)
+        admission.release(bulk)
+        admission.release(small)
+    asyncio.run(run())
+
+
+async def _acquire_with_wait(admission, endpoint, cost_mb, priority, wait):
+    admission.max_wait_seconds = wait
+    try:
+        return await admission.acquire(endpoint, cost_mb, priority=priority)
+    finally:
+        admission.max_wait_seconds = 2
+
+
+def test_interactive_waiters_go_first_and_block_bulk():
+    async def run():
+        admission = controller(budget_mb=100, bulk_share=1, max_bulk=4)
+        upload = await admission.acquire('/upload-pdf', 60, priority=BULK)
+        page = await admission.acquire('/analyze', 30, priority=INTERACTIVE)
+        order = []
+
+        async def wait(name, cost_mb, priority):
+            ticket = await admission.acquire('/x', cost_mb, priority=priority)
+            order.append(name)
+            return ticket
+
+        big_bulk = asyncio.ensure_future(wait('big bulk', 20, BULK))
+        interactive = asyncio.ensure_future(wait('interactive', 50, INTERACTIVE))
+        await settle()
+        small_bulk = asyncio.ensure_future(wait('small bulk', 5, BULK))
+        await settle()
+        assert order == []  # small bulk would fit, but others are waiting
+        admission.release(page)
+        await settle()
+        # Room for both bulk jobs, none for the interactive waiter: nothing starts
+        assert order == []
+        admission.release(upload)
+        await settle()
+        assert order == ['interactive', 'big bulk', 'small bulk']
+        for task in (big_bulk, interactive, small_bulk):
+            admission.release(task.result())
+        assert admission.stats()['reserved_mb'] == 0
+    asyncio.run(run())
+
+
+def test_queue_full_and_timeout():
+    async def run():
+        admission = controller(budget_mb=100, max_waiting=1, max_wait_seconds=0.05)
+        running = await admission.acquire('/a', 100)
+        waiter = asyncio.ensure_future(admission.acquire('/a', 10))
+        await settle()
+        with pytest.raises(AdmissionRejected) as e:
+            await admission.acquire('/a', 10)
+        assert e.value.reason == 'admission queue full'
+        with pytest.raises(AdmissionRejected) as e:
+            await waiter
+        assert e.value.retry_after >= 1
+        stats = admission.stats()
+        assert stats['rejected_queue_full'] == 1 and stats['rejected_timeout'] == 1
+        assert stats['waiting'] == {INTERACTIVE: 0, BULK: 0}
+        admission.release(running)
+    asyncio.run(run())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def run():
+        admission = controller(budget_mb=100)
+        running = await admission.acquire('/a', 100)
+        waiter = asyncio.ensure_future(admission.acquire('/a', 10))
+        await settle()
+        waiter.cancel()
+        await settle()
+        assert admission.stats()['waiting'][BULK] == 0
+        admission.release(running)
+        assert admission.stats()['reserved_mb'] == 0
+    asyncio.run(run())
+
+
+def test_release_waits_for_held_work():
+    async def run():
+        admission = controller(budget_mb=100)
+        ticket = await admission.acquire('/analyze-pages', 80)
+        started, finish = threading.Event(), threading.Event()
+
+        def work():
+            started.set()
+            finish.wait(5)
+            return 'done'
+
+        request = asyncio.ensure_future(admission.hold(ticket, asyncio.to_thread(work)))
+        await asyncio.to_thread(started.wait, 5)
+        # The client goes away; the thread keeps running with the memory
+        request.cancel()
+        await settle()
+        admission.release(ticket, completed=False)
+        assert admission.stats()['reserved_mb'] == 80
+        waiter = asyncio.ensure_future(admission.acquire('/analyze-pages', 80))
+        await settle()
+        assert not waiter.done()
+        finish.set()
+        second = await asyncio.wait_for(waiter, 2)
+        assert admission.stats()['reserved_mb'] == 80
+        admission.release(second)
+        assert admission.stats()['reserved_mb'] == 0
+    asyncio.run(run())
+
+
+def test_hold_returns_the_result_and_raises_errors():
+    async def run():
+        admission = controller(budget_mb=100)
+        ticket = await admission.acquire('/a', 10)
+        assert await admission.hold(ticket, asyncio.to_thread(lambda: 42)) == 42
+        with pytest.raises(ZeroDivisionError):
+            await admission.hold(ticket, asyncio.to_thread(lambda: 1 / 0))
+        admission.release(ticket)
+        assert admission.stats()['reserved_mb'] == 0
+    asyncio.run(run())
+
+
+def test_disabled_admits_everything():
+    async def run():
+        admission = controller(budget_mb=1, enabled=False)
+        tickets = [await admission.acquire('/a', 1000) for _ in range(3)]
+        assert admission.stats()['reserved_mb'] == 0
+        for ticket in tickets:
+            admission.release(ticket)
+    asyncio.run(run())
+
+
+def test_cost_estimates_grow_with_pages_and_dpi():
+    letter, arch_d = (8.5, 11.0), (36.0, 24.0)
+    assert upload_cost_mb([arch_d] * 4, 1200) > upload_cost_mb([arch_d], 1200)
+    assert upload_cost_mb([arch_d], 1200, full_dpi=300) > upload_cost_mb([arch_d], 1200)
+    assert page_analysis_cost_mb([letter, arch_d], 300, 3) == page_analysis_cost_mb([arch_d], 300, 3)
+    assert page_analysis_cost_mb([arch_d], 300, 3) > page_analysis_cost_mb([arch_d], 150, 3)
@@ -0,0 +1,50 @@
+from PIL import Image, ImageDraw
+
+from page_diff import changed_regions, expand_regions, pad_box
+
+
+def sheet(path, boxes=(), size=(2048, 1536)):
+    img = Image.new('L', size, 255)
+    draw = ImageDraw.Draw(img)
+    for box in boxes:
+        draw.rectangle(box, fill=0)
+    img.save(path, quality=95)
+    return str(path)
+
+
+def test_identical_renders_have_no_changes(tmp_path):
+    old = sheet(tmp_path / 'old.jpg', [(100, 100, 400, 300)])
+    new = sheet(tmp_path / 'new.jpg', [(100, 100, 400, 300)])
+    assert changed_regions(old, new) == {'comparable': True, 'changed_fraction': 0.0, 'regions': []}
+
+
+def test_changes_are_grouped_into_tile_aligned_regions(tmp_path):
+    old = sheet(tmp_path / 'old.jpg')
+    new = sheet(tmp_path / 'new.jpg', [(300, 300, 700, 400), (1800, 1300, 1900, 1400)])
+    diff = changed_regions(old, new, tile_size=256)
+    assert diff['comparable']
+    assert 0 < diff['changed_fraction'] < 0.25
+    assert sorted(diff['regions']) == [(256, 256, 768, 512), (1792, 1280, 2048, 1536)]
+
+
+def test_different_page_sizes_are_not_comparable(tmp_path):
+    old = sheet(tmp_path / 'old.jpg', size=(2048, 1536))
+    new = sheet(tmp_path / 'new.jpg', size=(1536, 2048))
+    assert changed_regions(old, new)['comparable'] is False
+
+
+def test_expand_regions_contains_touched_detections():
+    door = {'bbox': {'x': 300, 'y': 300, 'w': 100, 'h': 100}}
+    room = {'points': [{'x': 500, 'y': 100}, {'x': 900, 'y': 100}, {'x': 900, 'y': 600}, {'x': 500, 'y': 600}]}
+    far = {'bbox': {'x': 1500, 'y': 1500, 'w': 50, 'h': 50}}
+    # Touches the door, which then reaches the room
+    assert expand_regions([(256, 256, 512, 512)], [door, room, far]) == [(250, 100, 900, 600)]
+
+
+def test_expand_regions_merges_regions_that_grow_into_each_other():
+    wall = {'bbox': {'x': 500, 'y': 100, 'w': 600, 'h': 20}}
+    assert expand_regions([(200, 80, 260, 120), (740, 80, 800, 120)], [wall]) == [(200, 80, 800, 120)]
+
+
+def test_pad_box_is_clamped_to_the_page():
+    assert pad_box((10, 20, 990, 500), 32, 1000, 520) == (0, 0, 1000, 520)
@@ -0,0 +1,107 @@
+import json
+import os
+import threading
+import time
+
+from page_index import MIN_VISUAL_BITS, PageIndex
+
+VISUAL = 'f' * 64  # 256 set bits
+BLANK = '0' * 63 + '1'
+
+
+def record(index, content_hash, **kwargs):
+    kwargs.setdefault('visual_hash_', VISUAL)
+    kwargs.setdefault('page_size', '2592x1728')
+    index.record_page(content_hash, f'/missing/{content_hash}.jpg', f'file-{content_hash}',
+                      classification={'category': 'floor_plan'}, **kwargs)
+
+
+def test_concurrent_saves_leave_a_complete_index(tmp_path):
+    index = PageIndex(str(tmp_path))
+    errors = []
+
+    def worker(n):
+        try:
+            for i in range(30):
+                record(index, f'{n}-{i}')
+                index.save()
+        except Exception as e:  # pragma: no cover - reported below
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    index.save()
+    with open(tmp_path / 'index.json', encoding='utf-8') as f:
+        assert len(json.load(f)) == 8 * 30
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.tmp')]
+    assert len(PageIndex(str(tmp_path))._records) == 8 * 30
+
+
+def test_save_evicts_least_recently_seen_records(tmp_path):
+    index = PageIndex(str(tmp_path), max_entries=2)
+    for content_hash in ('a', 'b', 'c'):
+        record(index, content_hash)
+        time.sleep(0.01)
+    index.lookup_file('file-a')  # a is now the most recently seen
+    index.save()
+    reloaded = PageIndex(str(tmp_path))
+    assert sorted(reloaded._records) == ['a', 'c']
+    assert reloaded.lookup_file('file-b') is None
+
+
+def test_lookup_visual_needs_exact_hash_and_page_size(tmp_path):
+    index = PageIndex(str(tmp_path))
+    record(index, 'a')
+    assert index.lookup_visual(VISUAL, '2592x1728')['classification'] == {'category': 'floor_plan'}
+    assert index.lookup_visual(VISUAL, '1728x2592') is None
+    assert index.lookup_visual('e' + VISUAL[1:], '2592x1728') is None
+
+
+def test_lookup_visual_ignores_near_blank_renders(tmp_path):
+    index = PageIndex(str(tmp_path))
+    record(index, 'blank', visual_hash_=BLANK)
+    assert bin(int(BLANK, 16)).count('1') < MIN_VISUAL_BITS
+    assert index.lookup_visual(BLANK, '2592x1728') is None
+
+
+def test_detections_round_trip_and_expire(tmp_path):
+    index = PageIndex(str(tmp_path), detection_ttl_seconds=60)
+    key = PageIndex.detection_key('input', 'doors/1', {'confidence': 0.4})
+    index.put_detections(key, {'predictions': [1, 2]})
+    assert index.get_detections(key) == {'predictions': [1, 2]}
+    path = tmp_path / 'detections' / f'{key}.json'
+    old = time.time() - 120
+    os.utime(path, (old, old))
+    assert index.get_detections(key) is None
+    assert not path.exists()
+    assert index.detection_stats()['evicted_ttl'] == 1
+
+
+def test_detections_evicted_least_recently_used_over_the_cap(tmp_path):
+    payload = {'predictions': ['x' * 1000]}
+    index = PageIndex(str(tmp_path), detection_max_bytes=3500)
+    keys = [f'key{n}' for n in range(3)]
+    for n, key in enumerate(keys):
+        index.put_detections(key, payload)
+        past = time.time() - 100 + n
+        os.utime(tmp_path / 'detections' / f'{key}.json', (past, past))
+    assert index.get_detections('key0')  # now the most recently used
+    index.put_detections('key3', payload)  # over the cap: prunes down to 90% of it
+    assert index.get_detections('key1') is None
+    assert index.get_detections('key0') and index.get_detections('key3')
+    stats = index.detection_stats()
+    assert stats['evicted_size'] >= 1
+    assert stats['bytes'] <= 3500 * 0.9
+
+
+def test_prune_removes_expired_detections_at_startup(tmp_path):
+    index = PageIndex(str(tmp_path), detection_ttl_seconds=60)
+    index.put_detections('old', {'predictions': []})
+    old = time.time() - 120
+    os.utime(tmp_path / 'detections' / 'old.json', (old, old))
+    PageIndex(str(tmp_path), detection_ttl_seconds=60)
+    assert not (tmp_path / 'detections' / 'old.json').exists()
@@ -0,0 +1,54 @@
+import json
+
+import numpy as np
+
+from responses import COMPACT_SCHEMA_VERSION, dumps, format_predictions
+
+POLYGON = [{'x': 10.0, 'y': 20.0}, {'x': 110.0, 'y': 20.0}, {'x': 110.0, 'y': 220.0}]
+PREDICTIONS = {
+    'rooms': [{'class': 'room', 'confidence': 0.9, 'points': POLYGON, 'area': 1234.5}],
+    'doors': [{'class': 'door', 'confidence': 0.8, 'bbox': {'x': 50.0, 'y': 60.0, 'w': 20.0, 'h': 10.0},
+               'points': [{'x': 40.0, 'y': 55.0}, {'x': 60.0, 'y': 65.0}]}],
+}
+
+
+def expand(item):
+    """expandPrediction() of client/src/lib/predictions.ts."""
+    flat = item['points']
+    points = [{'x': flat[i], 'y': flat[i + 1]} for i in range(0, len(flat) - 1, 2)]
+    out = dict(item, points=points, mask=points)
+    if 'bbox' in item:
+        x, y, w, h = item['bbox']
+        out['bbox'] = {'x': x, 'y': y, 'w': w, 'h': h}
+    return out
+
+
+def test_compact_round_trips_to_full():
+    full = json.loads(dumps(format_predictions(PREDICTIONS, 'full', 400, 300)))
+    compact = json.loads(dumps(format_predictions(PREDICTIONS, 'compact', 400, 300)))
+    expanded = {key: [expand(item) for item in items] for key, items in compact.items()}
+    # The normalized copies are only in the full format
+    for items in full.values():
+        for item in items:
+            item.pop('points_norm')
+            item.pop('bbox_norm', None)
+    assert expanded == full
+
+
+def test_compact_has_geometry_once():
+    door = format_predictions(PREDICTIONS, 'compact', 400, 300)['doors'][0]
+    assert door['points'] == [40.0, 55.0, 60.0, 65.0]
+    assert door['bbox'] == [50.0, 60.0, 20.0, 10.0]
+    assert not {'mask', 'points_norm', 'bbox_norm'} & set(door)
+    assert COMPACT_SCHEMA_VERSION >= 1
+
+
+def test_full_keeps_the_original_shape():
+    room = format_predictions(PREDICTIONS, 'full', 400, 300)['rooms'][0]
+    assert room['mask'] == room['points'] == POLYGON
+    assert room['points_norm'][1] == {'x': 110.0 / 400, 'y': 20.0 / 300}
+
+
+def test_dumps_handles_numpy():
+    payload = {'area': np.float32(1.5), 'count': np.int64(3), 'box': np.array([1, 2]), 'ids': (1, 2)}
+    assert json.loads(dumps(payload)) == {'area': 1.5, 'count': 3, 'box': [1, 2], 'ids': [1, 2]}
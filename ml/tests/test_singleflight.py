@@ -0,0 +1,64 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        release.wait(5)
+        return {'predictions': []}
+
+    with ThreadPoolExecutor(5) as pool:
+        futures = [pool.submit(flight.do, 'key', fn)]
+        wait_until(lambda: calls)
+        futures += [pool.submit(flight.do, 'key', fn) for _ in range(4)]
+        wait_until(lambda: flight.stats()['coalesced'] == 4)
+        release.set()
+        results = [f.result(5) for f in futures]
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    assert flight.stats() == {'executed': 1, 'coalesced': 4, 'failed': 0, 'in_flight': 0}
+
+
+def test_errors_reach_every_waiter_and_are_not_cached():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+
+    def fail():
+        started.set()
+        release.wait(5)
+        raise RuntimeError('upstream down')
+
+    with ThreadPoolExecutor(2) as pool:
+        leader = pool.submit(flight.do, 'key', fail)
+        started.wait(5)
+        follower = pool.submit(flight.do, 'key', fail)
+        wait_until(lambda: flight.stats()['coalesced'] == 1)
+        release.set()
+        for future in (leader, follower):
+            with pytest.raises(RuntimeError):
+                future.result(5)
+    assert flight.do('key', lambda: 'ok') == 'ok'
+    assert flight.stats()['failed'] == 1
+
+
+def test_different_keys_run_separately():
+    flight = SingleFlight()
+    assert [flight.do(key, lambda key=key: key) for key in ('a', 'b')] == ['a', 'b']
+    assert flight.stats()['executed'] == 2
@@ -0,0 +1,119 @@
+import asyncio
+import hashlib
+import os
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from uploads import HEAD_SIZE, MAX_FIELD_BYTES, receive_upload
+
+BOUNDARY = 'test-boundary'
+
+
+def multipart(fields=(), files=()):
+    body = b''
+    for name, value in fields:
+        body += (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n').encode()
+        body += (value if isinstance(value, bytes) else value.encode()) + b'\r\n'
+    for name, filename, data in files:
+        body += (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                 'Content-Type: application/octet-stream\r\n\r\n').encode() + data + b'\r\n'
+    return body + f'--{BOUNDARY}--\r\n'.encode()
+
+
+def make_request(body: bytes, chunk_size: int = 65536, content_length: bool = True) -> Request:
+    headers = [(b'content-type', f'multipart/form-data; boundary={BOUNDARY}'.encode())]
+    if content_length:
+        headers.append((b'content-length', str(len(body)).encode()))
+    chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)] or [b'']
+
+    async def receive():
+        chunk = chunks.pop(0) if chunks else b''
+        return {'type': 'http.request', 'body': chunk, 'more_body': bool(chunks)}
+
+    return Request({'type': 'http', 'method': 'POST', 'headers': headers}, receive)
+
+
+def receive(body: bytes, tmp_path, max_bytes: int = 1024 * 1024, **kwargs):
+    def dest_for(filename):
+        return str(tmp_path / filename)
+    return asyncio.run(receive_upload(make_request(body, **kwargs), dest_for, max_bytes))
+
+
+def test_file_and_fields(tmp_path):
+    data = os.urandom(3 * 1024 * 1024 + 17)
+    upload, fields = receive(
+        multipart([('scale', '0.25'), ('types', '["doors"]')], [('file', 'plan.pdf', data)]),
+        tmp_path, max_bytes=4 * 1024 * 1024, chunk_size=1000,
+    )
+    assert fields == {'scale': '0.25', 'types': '["doors"]'}
+    assert upload.filename == 'plan.pdf'
+    assert upload.size == len(data)
+    assert upload.head == data[:HEAD_SIZE]
+    assert upload.file_hash == hashlib.blake2b(data, digest_size=20).hexdigest()
+    with open(upload.path, 'rb') as f:
+        assert f.read() == data
+
+
+def test_filename_is_reduced_to_its_base_name(tmp_path):
+    upload, _ = receive(multipart(files=[('file', '..\\..\\evil.pdf', b'%PDF')]), tmp_path)
+    assert upload.path == str(tmp_path / 'evil.pdf')
+
+
+def test_declared_length_over_limit_is_rejected_before_reading(tmp_path):
+    body = multipart(files=[('file', 'big.pdf', b'x' * (3 * 1024 * 1024))])
+    with pytest.raises(HTTPException) as e:
+        receive(body, tmp_path, max_bytes=1024)
+    assert e.value.status_code == 413
+    assert os.listdir(tmp_path) == []
+
+
+def test_streamed_body_over_limit_is_rejected_and_removed(tmp_path):
+    body = multipart(files=[('file', 'big.pdf', b'x' * (3 * 1024 * 1024))])
+    with pytest.raises(HTTPException) as e:
+        receive(body, tmp_path, max_bytes=2 * 1024 * 1024, content_length=False)
+    assert e.value.status_code == 413
+    assert os.listdir(tmp_path) == []
+
+
+def test_file_exactly_at_limit(tmp_path):
+    upload, _ = receive(multipart(files=[('file', 'a.pdf', b'x' * 4096)]), tmp_path, max_bytes=4096)
+    assert upload.size == 4096
+
+
+@pytest.mark.parametrize('body', [
+    multipart(files=[('file', '', b'data')]),
+    multipart([('types', '[]')], [('other', 'a.pdf', b'data')]),
+    multipart(files=[('file', 'a.pdf', b'1'), ('file', 'b.pdf', b'2')]),
+    multipart(files=[('file', 'a.pdf', b'data')])[:-30],
+])
+def test_bad_uploads_are_rejected_with_400(tmp_path, body):
+    with pytest.raises(HTTPException) as e:
+        receive(body, tmp_path)
+    assert e.value.status_code == 400
+    assert os.listdir(tmp_path) == []
+
+
+def test_oversized_form_field(tmp_path):
+    body = multipart([('types', 'x' * (MAX_FIELD_BYTES + 1))], [('file', 'a.pdf', b'data')])
+    with pytest.raises(HTTPException) as e:
+        receive(body, tmp_path)
+    assert e.value.status_code == 413
+
+
+def test_destination_can_reject_by_name(tmp_path):
+    def dest_for(filename):
+        raise HTTPException(status_code=400, detail='PDF only')
+
+    request = make_request(multipart(files=[('file', 'a.txt', b'data')]))
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(receive_upload(request, dest_for, 1024))
+    assert e.value.detail == 'PDF only'
+
+
+def test_not_multipart(tmp_path):
+    request = Request({'type': 'http', 'method': 'POST', 'headers': [(b'content-type', b'application/json')]})
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(receive_upload(request, lambda name: str(tmp_path / name), 1024))
+    assert e.value.status_code == 400
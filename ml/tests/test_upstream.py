@@ -0,0 +1,169 @@
+import threading
+import time
+
+import pytest
+import requests
+
+from upstream import (
+    CLOSED, HALF_OPEN, OPEN,
+    CircuitBreaker, CircuitOpenError, RateLimitedError, TokenBucket, UpstreamGuard, is_failure,
+)
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+def wrapped_connection_error() -> Exception:
+    """What inference_sdk's wrap_errors raises for a refused connection: a status-less error chained to it."""
+    try:
+        try:
+            raise requests.exceptions.ConnectionError("Connection refused")
+        except requests.exceptions.ConnectionError as error:
+            raise RuntimeError(f"Error with server connection: {error}") from error
+    except RuntimeError as error:
+        return error
+
+
+def fail_with(exc):
+    def fn():
+        raise exc
+    return fn
+
+
+def test_is_failure():
+    assert is_failure(requests.exceptions.ConnectionError())
+    assert is_failure(requests.exceptions.ReadTimeout())
+    assert is_failure(wrapped_connection_error())
+    assert is_failure(StatusError(503))
+    assert is_failure(StatusError(408))
+    assert not is_failure(StatusError(400))
+    assert not is_failure(StatusError(429))
+    assert not is_failure(ValueError("bad image"))
+
+
+def test_breaker_opens_on_wrapped_sdk_connection_error():
+    errors = pytest.importorskip("inference_sdk.http.errors")
+    try:
+        try:
+            raise requests.exceptions.ConnectionError("Connection refused")
+        except requests.exceptions.ConnectionError as error:
+            raise errors.HTTPClientError(f"Error with server connection: {error}") from error
+    except errors.HTTPClientError as error:
+        sdk_error = error
+    guard = UpstreamGuard('room', rate=0, failure_threshold=2, reset_seconds=60)
+    for _ in range(2):
+        with pytest.raises(errors.HTTPClientError):
+            guard.call(fail_with(sdk_error))
+    assert guard.breaker.state == OPEN
+
+
+def test_breaker_opens_on_wrapped_connection_errors_and_rejects():
+    guard = UpstreamGuard('room', rate=0, failure_threshold=3, reset_seconds=60)
+    for _ in range(3):
+        with pytest.raises(RuntimeError):
+            guard.call(fail_with(wrapped_connection_error()))
+    assert guard.breaker.state == OPEN
+    calls = []
+    with pytest.raises(CircuitOpenError):
+        guard.call(lambda: calls.append(1))
+    assert not calls
+    assert guard.stats()['circuit_rejections'] == 1
+
+
+def test_client_errors_do_not_open_the_breaker():
+    guard = UpstreamGuard('room', rate=0, failure_threshold=1)
+    for exc in (StatusError(400), ValueError("bad image")):
+        with pytest.raises(type(exc)):
+            guard.call(fail_with(exc))
+    assert guard.breaker.state == CLOSED
+
+
+def test_breaker_half_open_probe():
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=0.05)
+    assert breaker.record(False) == OPEN
+    assert not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()  # only one probe at a time
+    assert breaker.record(False) == OPEN
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.record(True) == CLOSED
+    assert breaker.allow()
+
+
+def test_breaker_released_probe_lets_the_next_call_probe():
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=0)
+    breaker.record(False)
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.release_probe()
+    assert breaker.allow()
+
+
+def test_token_bucket_burst_then_paced():
+    bucket = TokenBucket(rate=10, burst=2)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.02)
+    bucket.refund()
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.02)
+
+
+def test_token_bucket_pause():
+    bucket = TokenBucket(rate=0, burst=1)
+    assert bucket.reserve() == 0
+    bucket.pause(5)
+    assert bucket.reserve() == pytest.approx(5, abs=0.1)
+
+
+def test_rate_limited_beyond_max_wait_refunds():
+    guard = UpstreamGuard('room', rate=1, burst=1, max_wait=0.5)
+    guard.call(lambda: None)
+    with pytest.raises(RateLimitedError):
+        guard.call(lambda: None, tokens=5)
+    assert guard.stats()['throttled_local'] == 1
+    # The 5 tokens were given back; only the first call's debt remains
+    assert guard.bucket.reserve() < 1.1
+
+
+def test_throttle_is_retried_after_pause():
+    guard = UpstreamGuard('room', rate=0, throttle_retries=1)
+    error = StatusError(429)
+    error.response = type('Response', (), {'headers': {'Retry-After': '0.05'}, 'status_code': 429})()
+    attempts = []
+
+    def fn():
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise error
+        return 'ok'
+
+    assert guard.call(fn) == 'ok'
+    assert attempts[1] - attempts[0] >= 0.04
+    assert guard.stats()['throttled_remote'] == 1
+    assert guard.breaker.state == CLOSED
+
+
+def test_concurrency_slots():
+    guard = UpstreamGuard('room', rate=0, max_concurrency=3, max_wait=0.1)
+    started, release = threading.Event(), threading.Event()
+
+    def batch():
+        started.set()
+        release.wait(5)
+
+    worker = threading.Thread(target=guard.call, args=(batch,), kwargs={'tokens': 4, 'slots': 2})
+    worker.start()
+    started.wait(5)
+    assert guard.call(lambda: 'ok') == 'ok'  # one slot left
+    with pytest.raises(RateLimitedError):
+        guard.call(lambda: None, slots=2)
+    release.set()
+    worker.join(5)
+    assert guard.call(lambda: 'ok', slots=3) == 'ok'
+    assert guard.stats()['calls'] == 4 + 1 + 1
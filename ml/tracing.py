@@ -0,0 +1,394 @@
+"""
+Request Tracing for EstimAgent
+OpenTelemetry-style spans for every stage of a request, so a slow /analyze can
+be attributed to the wall model, the door/window call, the local YOLO ensemble
+or the resize.
+
+- The HTTP middleware opens one trace per request (joining an incoming W3C
+  `traceparent` when present). Everything timed with Metrics.stage() /
+  Metrics.model_call() becomes a child span, plus the spans opened here with
+  Tracer.span() (per page, per detection task, per classification attempt).
+- The current span lives in a context variable, like the metrics endpoint
+  label and the request id, so work handed to thread pools through
+  Metrics.bind() nests under the span that submitted it.
+- Finished traces are exported off the request path by a background thread,
+  as OTLP/JSON: appended to a file (TRACE_EXPORTER=file, readable by the
+  collector's otlpjsonfile receiver) or posted to a collector's OTLP/HTTP
+  endpoint (TRACE_EXPORTER=otlp).
+- A request sent with `X-Debug-Trace: 1` gets its span timing tree back in a
+  `trace` field of the JSON body and a Server-Timing header, exporter or not.
+
+Requests that are neither exported (TRACE_SAMPLE_RATE) nor debugged record
+nothing, and Tracer.span() is a no-op outside a trace.
+"""
+
+import os
+import json
+import queue
+import random
+import atexit
+import logging
+import threading
+import contextvars
+import functools
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar('trace_span', default=None)
+
+# OTLP span kinds and status codes
+_KIND_INTERNAL, _KIND_SERVER = 1, 2
+_STATUS_OK, _STATUS_ERROR = 1, 2
+
+
+class Span:
+    """One timed operation; `attributes` are exported as OTLP attributes."""
+
+    __slots__ = ('trace', 'name', 'span_id', 'parent_id', 'start_ns', 'end_ns', 'attributes', 'error')
+
+    def __init__(self, trace: '_Trace', name: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = attributes
+        self.error: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def record_error(self, exc: BaseException) -> None:
+        self.error = f"{type(exc).__name__}: {exc}"[:500]
+
+    def end(self) -> None:
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+
+
+class _Trace:
+    """Spans of one request, shared by every thread working on it."""
+
+    def __init__(self, trace_id: str, debug: bool, sampled: bool, max_spans: int):
+        self.trace_id = trace_id
+        self.debug = debug
+        self.sampled = sampled
+        self.max_spans = max_spans
+        self.spans: List[Span] = []
+        self.dropped = 0
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def add(self, span: Span) -> bool:
+        with self._lock:
+            if self.closed or len(self.spans) >= self.max_spans:
+                self.dropped += 1
+                return False
+            self.spans.append(span)
+            return True
+
+    def snapshot(self) -> List[Span]:
+        with self._lock:
+            return list(self.spans)
+
+    def close(self) -> List[Span]:
+        with self._lock:
+            self.closed = True
+            return list(self.spans)
+
+
+class Tracer:
+    """Creates request traces and spans, and hands finished traces to the exporter."""
+
+    def __init__(self, enabled: bool = True, exporter=None, sample_rate: float = 1.0,
+                 max_spans: int = 5000, service_name: str = 'estimagent-ml'):
+        self.enabled = enabled
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.max_spans = max_spans
+        self.service_name = service_name
+        self._export_queue = _ExportQueue(exporter, service_name) if enabled and exporter else None
+
+    # -- traces --------------------------------------------------------------------
+
+    @contextmanager
+    def trace(self, name: str, traceparent: Optional[str] = None, debug: bool = False, **attributes: Any):
+        """
+        Run the block as the root span of a new trace (or a child of the remote
+        span in `traceparent`). Yields the root Span, or None when not recorded.
+        """
+        parent = _parse_traceparent(traceparent)
+        sampled = self._export_queue is not None and (
+            (parent is not None and parent[2]) or random.random() < self.sample_rate
+        )
+        if not self.enabled or not (sampled or debug):
+            yield None
+            return
+        trace = _Trace(parent[0] if parent else os.urandom(16).hex(), debug, sampled, self.max_spans)
+        root = Span(trace, name, parent[1] if parent else None, attributes)
+        root.attributes['span.kind'] = 'server'
+        trace.add(root)
+        token = _current.set(root)
+        try:
+            yield root
+        except BaseException as exc:
+            root.record_error(exc)
+            raise
+        finally:
+            root.end()
+            _current.reset(token)
+            spans = trace.close()
+            if trace.dropped:
+                root.set_attribute('dropped_spans', trace.dropped)
+            if sampled:
+                self._export_queue.put(spans)
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any):
+        """Time the block as a child of the current span; a no-op outside a recorded trace."""
+        parent = _current.get()
+        if parent is None or parent.trace.closed:
+            yield None
+            return
+        span = Span(parent.trace, name, parent.span_id, attributes)
+        if not parent.trace.add(span):
+            yield None
+            return
+        token = _current.set(span)
+        try:
+            yield span
+        except BaseException as exc:
+            span.record_error(exc)
+            raise
+        finally:
+            span.end()
+            _current.reset(token)
+
+    def traced(self, name: str) -> Callable:
+        """Decorator form of span()."""
+        def decorator(fn: Callable) -> Callable:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    @staticmethod
+    def current_span() -> Optional[Span]:
+        return _current.get()
+
+    # -- debug output --------------------------------------------------------------
+
+    @staticmethod
+    def debug_tree() -> Optional[Dict[str, Any]]:
+        """
+        Span timing tree of the current request when it asked for one
+        (X-Debug-Trace: 1), else None. Spans still open are timed up to now.
+        """
+        span = _current.get()
+        if span is None or not span.trace.debug:
+            return None
+        return timing_tree(span.trace.snapshot())
+
+    @staticmethod
+    def server_timing(root: Span) -> str:
+        """Server-Timing header value: total time per direct child of the root span."""
+        totals: Dict[str, float] = {}
+        for span in root.trace.snapshot():
+            if span.parent_id == root.span_id and span.end_ns is not None:
+                key = ''.join(c if c.isalnum() or c in '_-.' else '_' for c in span.name)
+                totals[key] = totals.get(key, 0.0) + (span.end_ns - span.start_ns) / 1e6
+        totals['total'] = ((root.end_ns or time.time_ns()) - root.start_ns) / 1e6
+        return ', '.join(f"{name};dur={ms:.1f}" for name, ms in totals.items())
+
+
+def timing_tree(spans: List[Span]) -> Dict[str, Any]:
+    """Nest spans under their parents: name, start offset and duration in ms, attributes."""
+    if not spans:
+        return {}
+    now = time.time_ns()
+    origin = spans[0].start_ns
+    nodes: Dict[str, Dict[str, Any]] = {}
+    for span in spans:
+        end = span.end_ns if span.end_ns is not None else now
+        node = {
+            'name': span.name,
+            'start_ms': round((span.start_ns - origin) / 1e6, 2),
+            'duration_ms': round((end - span.start_ns) / 1e6, 2),
+        }
+        if span.end_ns is None:
+            node['in_progress'] = True
+        if span.attributes:
+            node['attributes'] = dict(span.attributes)
+        if span.error:
+            node['error'] = span.error
+        node['children'] = []
+        nodes[span.span_id] = node
+    root = nodes[spans[0].span_id]
+    for span in spans[1:]:
+        nodes.get(span.parent_id, root)['children'].append(nodes[span.span_id])
+    for node in nodes.values():
+        node['children'].sort(key=lambda child: child['start_ms'])
+    return root
+
+
+def _parse_traceparent(header: Optional[str]):
+    """(trace_id, parent_span_id, sampled) from a W3C traceparent header, or None."""
+    if not header:
+        return None
+    parts = header.strip().split('-')
+    if len(parts) < 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+        flags = int(parts[3][:2], 16)
+    except ValueError:
+        return None
+    if parts[1] == '0' * 32 or parts[2] == '0' * 16:
+        return None
+    return parts[1], parts[2], bool(flags & 1)
+
+
+# ------------------------------------------------------------------------------
+# Export
+# ------------------------------------------------------------------------------
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def otlp_payload(spans: List[Span], service_name: str) -> Dict[str, Any]:
+    """An OTLP/JSON ExportTraceServiceRequest for `spans`."""
+    otlp_spans = []
+    for span in spans:
+        attributes = dict(span.attributes)
+        kind = _KIND_SERVER if attributes.pop('span.kind', None) == 'server' else _KIND_INTERNAL
+        item = {
+            'traceId': span.trace.trace_id,
+            'spanId': span.span_id,
+            'name': span.name,
+            'kind': kind,
+            'startTimeUnixNano': str(span.start_ns),
+            'endTimeUnixNano': str(span.end_ns or span.start_ns),
+            'attributes': [{'key': k, 'value': _otlp_value(v)} for k, v in attributes.items()],
+            'status': {'code': _STATUS_ERROR, 'message': span.error} if span.error else {'code': _STATUS_OK},
+        }
+        if span.parent_id:
+            item['parentSpanId'] = span.parent_id
+        otlp_spans.append(item)
+    return {'resourceSpans': [{
+        'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': service_name}}]},
+        'scopeSpans': [{'scope': {'name': 'estimagent'}, 'spans': otlp_spans}],
+    }]}
+
+
+class FileSpanExporter:
+    """Appends one OTLP/JSON request per line to a file."""
+
+    name = 'file'
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+    def export(self, payload: Dict[str, Any]) -> None:
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(payload, separators=(',', ':')) + '\n')
+
+
+class OTLPHttpSpanExporter:
+    """Posts OTLP/JSON to a collector's traces endpoint (e.g. http://localhost:4318/v1/traces)."""
+
+    name = 'otlp'
+
+    def __init__(self, endpoint: str, timeout: float = 5.0):
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self._session = requests.Session()
+
+    def export(self, payload: Dict[str, Any]) -> None:
+        response = self._session.post(
+            self.endpoint,
+            data=json.dumps(payload, separators=(',', ':')),
+            headers={'Content-Type': 'application/json'},
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+
+
+class _ExportQueue:
+    """
+    Batches finished traces and exports them from a daemon thread; drops traces when full.
+    The thread starts with the first trace, so importing the app starts no thread (workers.py forks after).
+    """
+
+    def __init__(self, exporter, service_name: str, max_queued: int = 1000, interval: float = 1.0):
+        self.exporter = exporter
+        self.service_name = service_name
+        self.interval = interval
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queued)
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        atexit.register(self.stop)
+
+    def put(self, spans: List[Span]) -> None:
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='trace-export', daemon=True)
+                    self._thread.start()
+        try:
+            self._queue.put_nowait(spans)
+        except queue.Full:
+            logger.warning("Trace export queue full, dropping a trace")
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 5)
+
+    def _run(self) -> None:
+        while True:
+            batch: List[Span] = []
+            try:
+                batch.extend(self._queue.get(timeout=self.interval))
+                while len(batch) < 5000:
+                    batch.extend(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            if batch:
+                try:
+                    self.exporter.export(otlp_payload(batch, self.service_name))
+                except Exception as e:
+                    logger.warning(f"Trace export to {self.exporter.name} failed, dropped {len(batch)} spans: {e}")
+            elif self._stopped.is_set():
+                return
+
+
+def load_span_exporter(kind: str):
+    """Build the span exporter named by TRACE_EXPORTER ("none", "file" or "otlp")."""
+    if kind in ('', 'none'):
+        return None
+    if kind == 'file':
+        return FileSpanExporter(os.getenv('TRACE_FILE', 'traces.jsonl'))
+    if kind == 'otlp':
+        endpoint = os.getenv('OTEL_EXPORTER_OTLP_TRACES_ENDPOINT')
+        if not endpoint:
+            endpoint = os.getenv('OTEL_EXPORTER_OTLP_ENDPOINT', 'http://localhost:4318').rstrip('/') + '/v1/traces'
+        return OTLPHttpSpanExporter(endpoint)
+    raise ValueError(f"Unknown trace exporter: {kind}")
@@ -0,0 +1,211 @@
+"""
+Upload Streaming for EstimAgent
+Parses multipart uploads straight off the request body and writes the file
+part to its destination as the bytes arrive, hashing it and enforcing the
+size limit on the way, instead of letting the framework spool the whole body
+to a temporary file first and copying it from there.
+
+- Endpoints using receive_upload() take the Request and no File()/Form()
+  parameters: declaring those would make FastAPI read the body before the
+  handler runs. Form fields come back as a dict of strings.
+- A Content-Length beyond the limit is rejected with 413 before anything is
+  read; without one (chunked bodies) the limit is enforced while streaming.
+- Parsing, hashing and disk writes run in a worker thread, a batch of body
+  chunks at a time, so large uploads do not block the event loop. Memory per
+  upload stays at one batch regardless of file size.
+"""
+
+import os
+import asyncio
+import hashlib
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, Request
+
+try:
+    from python_multipart.exceptions import FormParserError
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ModuleNotFoundError:
+    from multipart.exceptions import FormParserError
+    from multipart.multipart import MultipartParser, parse_options_header
+
+HEAD_SIZE = 64  # Enough for file signature checks
+MAX_FIELD_BYTES = 64 * 1024
+# Multipart boundaries, part headers and the small form fields around the file
+FORM_OVERHEAD_BYTES = 16 * MAX_FIELD_BYTES
+# Body bytes collected before handing them to the parsing thread
+WRITE_BATCH_BYTES = 1024 * 1024
+
+
+@dataclass
+class SpooledUpload:
+    path: str
+    filename: str
+    size: int
+    file_hash: str  # blake2b-160, same digest as page_index.file_hash
+    head: bytes
+
+
+def _too_large(max_bytes: int) -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"File too large. Maximum upload size is {max_bytes // (1024 * 1024)} MB.",
+    )
+
+
+class _UploadParser:
+    """multipart callbacks: the file part goes to disk, other parts are kept as form fields."""
+
+    def __init__(self, file_field: str, dest_for: Callable[[str], str], max_bytes: int):
+        self.file_field = file_field
+        self.dest_for = dest_for
+        self.max_bytes = max_bytes
+        self.fields: Dict[str, str] = {}
+        self.upload: Optional[SpooledUpload] = None
+        self._out = None
+        self._hasher = hashlib.blake2b(digest_size=20)
+        self._headers: List[Tuple[bytes, bytes]] = []
+        self._header_name = b''
+        self._header_value = b''
+        self._name = ''
+        self._data = bytearray()
+        self._to_file = False
+
+    def callbacks(self) -> Dict[str, Any]:
+        return {
+            'on_part_begin': self.on_part_begin,
+            'on_part_data': self.on_part_data,
+            'on_part_end': self.on_part_end,
+            'on_header_field': self.on_header_field,
+            'on_header_value': self.on_header_value,
+            'on_header_end': self.on_header_end,
+            'on_headers_finished': self.on_headers_finished,
+        }
+
+    def on_part_begin(self) -> None:
+        self._headers = []
+        self._data = bytearray()
+        self._to_file = False
+
+    def on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def on_header_end(self) -> None:
+        self._headers.append((self._header_name.lower(), self._header_value))
+        self._header_name = self._header_value = b''
+
+    def on_headers_finished(self) -> None:
+        disposition = dict(self._headers).get(b'content-disposition', b'')
+        _, options = parse_options_header(disposition)
+        self._name = options.get(b'name', b'').decode('utf-8', 'replace')
+        if self._name != self.file_field:
+            return
+        if self.upload is not None:
+            raise HTTPException(status_code=400, detail=f"Only one '{self.file_field}' part is allowed.")
+        filename = os.path.basename(options.get(b'filename', b'').decode('utf-8', 'replace').replace('\\', '/'))
+        if not filename:
+            raise HTTPException(status_code=400, detail="The uploaded file has no filename.")
+        path = self.dest_for(filename)
+        self._out = open(path, 'wb')
+        self.upload = SpooledUpload(path=path, filename=filename, size=0, file_hash='', head=b'')
+        self._to_file = True
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        chunk = data[start:end]
+        if not self._to_file:
+            if len(self._data) + len(chunk) > MAX_FIELD_BYTES:
+                raise HTTPException(status_code=413, detail=f"Form field '{self._name}' is too large.")
+            self._data += chunk
+            return
+        upload = self.upload
+        upload.size += len(chunk)
+        if upload.size > self.max_bytes:
+            raise _too_large(self.max_bytes)
+        if len(upload.head) < HEAD_SIZE:
+            upload.head += chunk[:HEAD_SIZE - len(upload.head)]
+        self._hasher.update(chunk)
+        self._out.write(chunk)
+
+    def on_part_end(self) -> None:
+        if self._to_file:
+            self.close()
+            self.upload.file_hash = self._hasher.hexdigest()
+        elif self._name:
+            self.fields[self._name] = self._data.decode('utf-8', 'replace')
+
+    def close(self) -> None:
+        if self._out is not None:
+            self._out.close()
+            self._out = None
+
+
+async def receive_upload(
+    request: Request,
+    dest_for: Callable[[str], str],
+    max_bytes: int,
+    file_field: str = 'file',
+) -> Tuple[SpooledUpload, Dict[str, str]]:
+    """
+    Stream a multipart/form-data request body, writing its file part to disk.
+
+    Args:
+        request: Incoming request, with its body not yet read
+        dest_for: Called (in a worker thread) with the file's (base) name
+            once its part headers arrive; returns where to write the bytes,
+            or raises HTTPException to reject the upload before any of it is
+            written
+        max_bytes: File size limit; exceeding it aborts with 413 and removes the partial file
+        file_field: Name of the form field carrying the file
+
+    Returns:
+        SpooledUpload with the final path, file name, size, content hash and
+        leading bytes, and the other form fields
+    """
+    content_type, params = parse_options_header(request.headers.get('content-type', ''))
+    if content_type != b'multipart/form-data' or b'boundary' not in params:
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload.")
+    try:
+        declared = int(request.headers.get('content-length', ''))
+    except ValueError:
+        declared = None
+    if declared is not None and declared > max_bytes + FORM_OVERHEAD_BYTES:
+        raise _too_large(max_bytes)
+
+    parts = _UploadParser(file_field, dest_for, max_bytes)
+    parser = MultipartParser(params[b'boundary'], parts.callbacks())
+    try:
+        try:
+            batch = bytearray()
+            async for chunk in request.stream():
+                batch += chunk
+                if len(batch) >= WRITE_BATCH_BYTES:
+                    await asyncio.to_thread(parser.write, bytes(batch))
+                    batch.clear()
+            if batch:
+                await asyncio.to_thread(parser.write, bytes(batch))
+            await asyncio.to_thread(parser.finalize)
+        except FormParserError:
+            raise HTTPException(status_code=400, detail="Invalid multipart data.")
+        finally:
+            parts.close()
+        if parts.upload is None:
+            raise HTTPException(status_code=400, detail=f"Missing '{file_field}' file in the upload.")
+        if not parts.upload.file_hash:
+            raise HTTPException(status_code=400, detail="Incomplete multipart data.")
+    except BaseException:
+        if parts.upload and os.path.exists(parts.upload.path):
+            os.remove(parts.upload.path)
+        raise
+    return parts.upload, parts.fields
+
+
+def multipart_openapi(file_description: str, **fields: Dict[str, Any]) -> Dict[str, Any]:
+    """`openapi_extra` documenting the form of a receive_upload() endpoint, which FastAPI cannot infer."""
+    properties = {'file': {'type': 'string', 'format': 'binary', 'description': file_description}, **fields}
+    return {'requestBody': {'required': True, 'content': {'multipart/form-data': {
+        'schema': {'type': 'object', 'required': ['file'], 'properties': properties},
+    }}}}
@@ -0,0 +1,379 @@
+"""
+Upstream Rate Limiting and Circuit Breaking for EstimAgent
+Every call to a Roboflow model goes through the UpstreamGuard of its role
+(room, wall, door/window or page model, each with its own API key):
+
+- A token bucket paces calls to the configured rate with a burst allowance,
+  and a semaphore caps calls in flight, so bursts from concurrent requests
+  are smoothed here instead of turning into upstream 429s. A call waits for
+  its turn up to `max_wait` seconds, then fails with RateLimitedError.
+- A 429 from upstream pauses the whole bucket for its Retry-After (or an
+  exponential backoff when the response has none) and the call is retried
+  after the pause, instead of every caller sleeping blindly on its own.
+- A circuit breaker opens after `failure_threshold` consecutive failures
+  (5xx and 408 responses, connection errors and timeouts) and rejects calls
+  immediately with CircuitOpenError for `reset_seconds`; then one probe call
+  is let through and its outcome closes or re-opens the circuit. 4xx other
+  than 429 are the caller's problem and do not count, nor do errors raised
+  on our side (a bad image, a parse error).
+- A call that fans out into several concurrent requests (a classification
+  batch) takes that many concurrency slots.
+
+Limits come from the environment per role (ROOM_, WALL_, DOORWINDOW_, PAGE_
+prefixes) with UPSTREAM_* defaults, see load_upstream_guard(). Roles sharing
+one API key each get their own budget; split the provider's limit between
+them.
+"""
+
+import os
+import math
+import time
+import random
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+
+
+class RateLimitedError(Exception):
+    """No call slot within the allowed wait."""
+
+
+class CircuitOpenError(Exception):
+    """The upstream is failing; calls are rejected without being sent."""
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    """HTTP status of an inference_sdk (status_code) or requests (response.status_code) error."""
+    status = getattr(exc, 'status_code', None)
+    if status is None:
+        status = getattr(getattr(exc, 'response', None), 'status_code', None)
+    try:
+        return int(status) if status is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _retry_after(exc: BaseException) -> Optional[float]:
+    headers = getattr(getattr(exc, 'response', None), 'headers', None) or {}
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+def is_throttle(exc: BaseException) -> bool:
+    return _status_code(exc) == 429
+
+
+def _causes(exc: BaseException):
+    """`exc` and the errors it was raised from, outermost first."""
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        seen.add(id(exc))
+        yield exc
+        exc = exc.__cause__ or exc.__context__
+
+
+def is_failure(exc: BaseException) -> bool:
+    """
+    Whether an error says the upstream is unhealthy: unreachable, timed out,
+    or a 5xx/408 response. inference_sdk re-raises connection errors as a
+    status-less HTTPClientError, so the errors behind `exc` are checked too.
+    """
+    for error in _causes(exc):
+        if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+            return True
+        status = _status_code(error)
+        if status is not None:
+            return status >= 500 or status == 408
+    return False
+
+
+class TokenBucket:
+    """Thread-safe token bucket; `rate` tokens per second up to `burst`. A rate of 0 disables it."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, tokens: float = 1) -> float:
+        """Take `tokens` (going into debt if needed); returns the seconds to wait before using them."""
+        if self.rate <= 0:
+            return max(0.0, self._paused_until - time.monotonic())
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= tokens
+            debt_wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            return max(debt_wait, self._paused_until - now, 0.0)
+
+    def refund(self, tokens: float = 1) -> None:
+        if self.rate > 0:
+            with self._lock:
+                self._tokens = min(self.burst, self._tokens + tokens)
+
+    def pause(self, seconds: float) -> None:
+        """Hold every caller back for `seconds` (after an upstream 429)."""
+        with self._lock:
+            now = time.monotonic()
+            self._paused_until = max(self._paused_until, now + seconds)
+            if self.rate > 0:
+                self._refill(now)
+                self._tokens = min(self._tokens, 0.0)
+
+    def paused_for(self) -> float:
+        return max(0.0, self._paused_until - time.monotonic())
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a single half-open probe."""
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def retry_in(self) -> float:
+        return max(0.0, self._opened_at + self.reset_seconds - time.monotonic())
+
+    def allow(self) -> bool:
+        """Whether a call may go upstream now (claims the probe when half-open)."""
+        if self.failure_threshold <= 0:
+            return True
+        with self._lock:
+            if self.state == OPEN and not self.retry_in():
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record(self, ok: bool) -> Optional[str]:
+        """Record a call's outcome; returns the new state when it changed."""
+        with self._lock:
+            previous = self.state
+            if ok:
+                self._failures = 0
+                self.state = CLOSED
+            else:
+                self._failures += 1
+                if self.state == HALF_OPEN or self._failures >= self.failure_threshold > 0:
+                    self.state = OPEN
+                    self._opened_at = time.monotonic()
+            self._probing = False
+            return self.state if self.state != previous else None
+
+    def release_probe(self) -> None:
+        """A probe ended without a verdict (e.g. a 4xx); let the next call probe."""
+        with self._lock:
+            self._probing = False
+
+
+class UpstreamGuard:
+    """Rate limit, concurrency cap and circuit breaker for one upstream model."""
+
+    def __init__(
+        self,
+        name: str,
+        rate: float = 10,
+        burst: float = 10,
+        max_concurrency: int = 8,
+        max_wait: float = 30,
+        throttle_retries: int = 2,
+        failure_threshold: int = 5,
+        reset_seconds: float = 30,
+        metrics=None,
+    ):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(failure_threshold, reset_seconds)
+        self.max_concurrency = max_concurrency
+        self.max_wait = max_wait
+        self.throttle_retries = throttle_retries
+        self.metrics = metrics
+        self._in_flight = 0
+        self._slot_freed = threading.Condition()
+        self._throttle_streak = 0
+        self._lock = threading.Lock()
+        self._stats = {'calls': 0, 'failures': 0, 'throttled_remote': 0, 'throttled_local': 0,
+                       'circuit_rejections': 0, 'wait_seconds': 0.0}
+        if metrics:
+            metrics.circuit_state(name, CLOSED)
+
+    def _count(self, key: str, amount: float = 1) -> None:
+        with self._lock:
+            self._stats[key] += amount
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats, wait_seconds=round(self._stats['wait_seconds'], 3))
+        stats.update({
+            'circuit': self.breaker.state,
+            'rate': self.bucket.rate,
+            'burst': self.bucket.burst,
+            'max_concurrency': self.max_concurrency,
+            'paused_seconds': round(self.bucket.paused_for(), 3),
+        })
+        return stats
+
+    def _wait_for_turn(self, tokens: float) -> float:
+        """Sleep until the bucket allows `tokens`; returns the seconds waited."""
+        wait = self.bucket.reserve(tokens)
+        if wait > self.max_wait:
+            self.bucket.refund(tokens)
+            self._count('throttled_local')
+            if self.metrics:
+                self.metrics.upstream_throttled(self.name, 'local')
+            raise RateLimitedError(f"{self.name}: no call slot within {self.max_wait:g}s (rate limit)")
+        waited = 0.0
+        while wait > 0:
+            time.sleep(wait)
+            waited += wait
+            # A 429 may have paused the bucket while we slept
+            wait = self.bucket.paused_for()
+        return waited
+
+    def _acquire_slots(self, slots: int) -> bool:
+        """Take `slots` concurrency slots at once, waiting up to `max_wait`."""
+        if self.max_concurrency <= 0:
+            return True
+        with self._slot_freed:
+            if not self._slot_freed.wait_for(lambda: self._in_flight + slots <= self.max_concurrency,
+                                             timeout=self.max_wait):
+                return False
+            self._in_flight += slots
+            return True
+
+    def _release_slots(self, slots: int) -> None:
+        if self.max_concurrency <= 0:
+            return
+        with self._slot_freed:
+            self._in_flight -= slots
+            self._slot_freed.notify_all()
+
+    def _set_state(self, state: Optional[str]) -> None:
+        if state:
+            log = logger.warning if state == OPEN else logger.info
+            log(f"Circuit for {self.name} is now {state}", extra={"upstream": self.name, "circuit": state})
+            if self.metrics:
+                self.metrics.circuit_state(self.name, state)
+
+    def call(self, fn: Callable[[], Any], tokens: float = 1, slots: int = 1) -> Any:
+        """
+        Run `fn` (one upstream request, or a batch worth `tokens` requests
+        with up to `slots` of them in flight at once) within the limits.
+        Upstream 429s are retried after the bucket's pause; other errors are
+        re-raised.
+        """
+        slots = max(1, min(slots, self.max_concurrency or slots))
+        attempt = 0
+        while True:
+            state = self.breaker.state
+            allowed = self.breaker.allow()
+            if self.breaker.state != state:
+                self._set_state(self.breaker.state)
+            if not allowed:
+                self._count('circuit_rejections')
+                if self.metrics:
+                    self.metrics.circuit_rejected(self.name)
+                raise CircuitOpenError(
+                    f"{self.name} model is unavailable (circuit open, retry in {math.ceil(self.breaker.retry_in())}s)"
+                )
+            try:
+                waited = self._wait_for_turn(tokens)
+                if not self._acquire_slots(slots):
+                    self.bucket.refund(tokens)
+                    self._count('throttled_local')
+                    if self.metrics:
+                        self.metrics.upstream_throttled(self.name, 'local')
+                    raise RateLimitedError(f"{self.name}: no call slot within {self.max_wait:g}s (concurrency limit)")
+            except RateLimitedError:
+                self.breaker.release_probe()
+                raise
+            if waited:
+                self._count('wait_seconds', waited)
+                if self.metrics:
+                    self.metrics.upstream_wait(self.name, waited)
+            self._count('calls', tokens)  # requests, for a batch
+            try:
+                result = fn()
+            except Exception as e:
+                if is_throttle(e):
+                    self.breaker.release_probe()
+                    pause = self._throttled(e)
+                    if attempt < self.throttle_retries:
+                        attempt += 1
+                        logger.info(f"{self.name} throttled upstream; retrying after {pause:.1f}s")
+                        continue
+                elif is_failure(e):
+                    self._count('failures')
+                    self._set_state(self.breaker.record(False))
+                else:
+                    self.breaker.release_probe()
+                raise
+            finally:
+                self._release_slots(slots)
+            with self._lock:
+                self._throttle_streak = 0
+            self._set_state(self.breaker.record(True))
+            return result
+
+    def _throttled(self, exc: BaseException) -> float:
+        """Pause the bucket after an upstream 429; returns the pause."""
+        with self._lock:
+            self._throttle_streak += 1
+            streak = self._throttle_streak
+        pause = _retry_after(exc)
+        if pause is None:
+            pause = min(2 ** (streak - 1), 30) * random.uniform(0.8, 1.2)
+        self.bucket.pause(pause)
+        self._count('throttled_remote')
+        if self.metrics:
+            self.metrics.upstream_throttled(self.name, 'remote')
+        return pause
+
+
+def load_upstream_guard(name: str, prefix: str, metrics=None) -> UpstreamGuard:
+    """
+    Guard configured from {prefix}_RATE_LIMIT (calls/s, 0 = unlimited),
+    {prefix}_BURST and {prefix}_MAX_CONCURRENCY, falling back to the
+    UPSTREAM_* settings, plus the shared UPSTREAM_MAX_WAIT_SECONDS,
+    UPSTREAM_THROTTLE_RETRIES, CIRCUIT_FAILURE_THRESHOLD (0 = no breaker)
+    and CIRCUIT_RESET_SECONDS.
+    """
+    def setting(key: str, default: str) -> float:
+        return float(os.getenv(f"{prefix}_{key}") or os.getenv(f"UPSTREAM_{key}") or default)
+
+    rate = setting('RATE_LIMIT', '10')
+    return UpstreamGuard(
+        name,
+        rate=rate,
+        burst=setting('BURST', str(max(rate, 1))),
+        max_concurrency=int(setting('MAX_CONCURRENCY', '8')),
+        max_wait=float(os.getenv('UPSTREAM_MAX_WAIT_SECONDS', '30')),
+        throttle_retries=int(os.getenv('UPSTREAM_THROTTLE_RETRIES', '2')),
+        failure_threshold=int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5')),
+        reset_seconds=float(os.getenv('CIRCUIT_RESET_SECONDS', '30')),
+        metrics=metrics,
+    )
@@ -0,0 +1,424 @@
+"""
+CPU Worker Processes for EstimAgent
+Runs the CPU-bound stages of a request (decoding and re-encoding uploads,
+the local YOLO models, rendering and encoding PDF pages) in forked worker
+processes, so concurrent requests are not serialized by the GIL of the
+single uvicorn process.
+
+- CPU_WORKERS=N forks N workers when the app starts, after every model is
+  loaded. The workers inherit the loaded torch/YOLO weights copy-on-write
+  instead of each loading their own, as `uvicorn --workers N` would. The GC
+  is frozen around the fork so that collections in the workers do not write
+  to (and so copy) the inherited objects. With 0 (the default) the stages
+  run in-process as before.
+- PDF pages are rendered and encoded by a second pool, PDF_RENDER_WORKERS
+  ("auto" = the available cores not taken by CPU_WORKERS, see
+  worker_count()), passed to PDFProcessor.
+- Forking a process that runs other threads can leave locks held by those
+  threads locked forever in the child. So the parent forks exactly once per
+  pool, in start(), before any thread starts (the log listener thread is
+  paused for it): the child is a single-threaded supervisor that forks the
+  workers, at startup and whenever one has to be replaced, and does nothing
+  else. Workers and supervisor exit when the app closes their connections
+  or dies.
+- Tasks take and return file paths and plain values, never images, so
+  pickling each way costs next to nothing.
+- Each worker limits torch to CPU_WORKER_TORCH_THREADS intra-op threads so
+  N workers do not oversubscribe the cores. The parent must not run torch
+  before forking (OpenMP thread pools do not survive a fork); in worker mode
+  it never runs the models at all.
+- Worker log records carry the request id of their task. Metrics and spans
+  recorded inside a worker stay there, so the parent records each task as a
+  "worker:<task>" stage; a task can return finer timings for the caller to
+  record with Metrics.observe_stage() (see app._prepare_image).
+- A worker killed mid-task (e.g. by the OOM killer) fails its task with
+  BrokenProcessPool and is replaced; the other workers carry on. If the
+  supervisor itself is gone, tasks run in-process once no worker is left.
+
+Memory per worker is reported on /config (PSS splits shared pages between
+the processes sharing them, USS counts private pages only); size the pools
+by the USS, not the RSS. Measured with benchmarks/bench_workers.py --task
+yolo on a YOLOv8s network (torch 2.5 CPU, ARCH D sheets at 150 DPI): a
+freshly forked worker's USS is ~2 MB, the weights and libraries (~300 MB)
+stay shared, but once it has run the model a worker keeps ~260-380 MB of
+private inference working memory (decoded sheet, activations, allocator
+caches). With 0 workers the parent needed ~850 MB for 4 concurrent
+predictions, against ~140 MB + 4 x ~260 MB with 4 workers. On the single
+core measured, 4 workers gave 1.2x the throughput of 0 (the GIL-free
+overlap of decode and inference); more cores are needed for more.
+"""
+
+import os
+import gc
+import sys
+import math
+import signal
+import asyncio
+import logging
+import threading
+import traceback
+import contextvars
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import reduction
+from multiprocessing.connection import Connection
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from log_config import current_request_id, listener_paused, set_request_id
+from metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+# Seconds a new worker may take to report in
+_START_TIMEOUT = 30
+
+# Every started pool, so a supervisor forked later can close the others' connections
+_pools: List['CPUWorkerPool'] = []
+
+
+def available_cpus() -> int:
+    """Cores this process may run on: its CPU affinity, capped by a cgroup v2 CPU quota."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()[:2]
+        if quota != 'max':
+            cpus = min(cpus, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    return max(cpus, 1)
+
+
+def worker_count(setting: str, reserved: int = 0) -> int:
+    """
+    Workers for a pool setting: a number, or "auto" for the available cores
+    minus `reserved` (taken by another pool); none when that leaves one core.
+    """
+    if setting.strip().lower() == 'auto':
+        cpus = available_cpus() - reserved
+        return cpus if cpus > 1 else 0
+    return int(setting)
+
+
+def process_memory(pid: int) -> Dict[str, float]:
+    """RSS, PSS and USS of a process in MB (Linux; empty elsewhere)."""
+    fields: Dict[str, int] = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].endswith(':') and parts[1].isdigit():
+                    fields[parts[0][:-1]] = int(parts[1])  # kB
+    except OSError:
+        return {}
+    private = fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)
+    return {
+        'rss_mb': round(fields.get('Rss', 0) / 1024, 1),
+        'pss_mb': round(fields.get('Pss', 0) / 1024, 1),
+        'uss_mb': round(private / 1024, 1),
+    }
+
+
+class RemoteTraceback(Exception):
+    """Traceback of an exception raised in a worker, chained to it in the parent."""
+
+    def __str__(self) -> str:
+        return self.args[0]
+
+
+def _init_worker(torch_threads: int) -> None:
+    # Ctrl-C reaches the whole process group; the parent shuts the pool down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    torch = sys.modules.get('torch')
+    if torch is not None and torch_threads > 0:
+        torch.set_num_threads(torch_threads)
+
+
+def _run_task(request_id: str, fn: Callable, args: Tuple, kwargs: Dict[str, Any]) -> Any:
+    set_request_id(request_id)
+    return fn(*args, **kwargs)
+
+
+def _serve(conn: Connection, torch_threads: int) -> None:
+    """Worker: run tasks from the parent until it closes the connection."""
+    _init_worker(torch_threads)
+    conn.send(os.getpid())
+    while True:
+        try:
+            task = conn.recv()
+        except (EOFError, OSError):
+            return
+        fn = task[1]
+        try:
+            reply = (True, _run_task(*task), None)
+        except BaseException as e:
+            reply = (False, e, traceback.format_exc())
+        try:
+            conn.send(reply)
+        except (EOFError, OSError):
+            return
+        except Exception as e:
+            # Result or exception cannot be pickled
+            conn.send((False, RuntimeError(f"{fn.__name__}: unpicklable result ({e})"), reply[2]))
+
+
+def _supervise(control: Connection, torch_threads: int) -> None:
+    """Supervisor: fork a worker for every connection the parent sends, until the parent goes away."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Exited workers are reaped by the kernel
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    while True:
+        try:
+            fd = reduction.recv_handle(control)
+        except (EOFError, OSError):
+            break
+        pid = os.fork()
+        if pid == 0:
+            control.close()
+            code = 1
+            try:
+                _serve(Connection(fd), torch_threads)
+                code = 0
+            finally:
+                os._exit(code)
+        os.close(fd)
+    # Wait for the workers (wait() fails with ECHILD once they are all gone)
+    try:
+        while True:
+            os.wait()
+    except ChildProcessError:
+        pass
+
+
+class _Worker:
+    __slots__ = ('pid', 'conn')
+
+    def __init__(self, pid: int, conn: Connection):
+        self.pid = pid
+        self.conn = conn
+
+
+class CPUWorkerPool:
+    """Forked worker processes for CPU-bound tasks; runs them in-process when `workers` is 0."""
+
+    def __init__(self, workers: int = 0, torch_threads: int = 1, metrics: Optional[Metrics] = None,
+                 name: str = 'cpu'):
+        if workers > 0 and 'fork' not in multiprocessing.get_all_start_methods():
+            logger.warning(f"{name} workers need the fork start method; running their tasks in-process")
+            workers = 0
+        self.workers = workers
+        self.torch_threads = torch_threads
+        self.metrics = metrics or Metrics(enabled=False)
+        self.name = name
+        self.restarts = 0
+        self._supervisor_pid: Optional[int] = None
+        self._control: Optional[Connection] = None
+        self._all: Dict[int, _Worker] = {}
+        self._idle: List[_Worker] = []
+        self._cond = threading.Condition()
+        self._spawn_lock = threading.Lock()
+        self._closed = False
+        self._callers: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0
+
+    def start(self) -> None:
+        """
+        Fork the supervisor and the workers. Call once everything they should
+        share is loaded and before any thread other than the log listener starts.
+        """
+        if not self.enabled or self._control is not None:
+            return
+        with listener_paused():
+            others = [t.name for t in threading.enumerate() if t is not threading.current_thread()]
+            if others:
+                logger.warning(f"Forking {self.name} workers with threads running: {', '.join(others)}")
+            parent_end, child_end = multiprocessing.Pipe()
+            # Everything allocated so far is shared copy-on-write; keep the workers' GC off it
+            gc.collect()
+            gc.freeze()
+            try:
+                pid = os.fork()
+                if pid == 0:
+                    code = 1
+                    try:
+                        parent_end.close()
+                        for pool in _pools:
+                            pool._close_inherited()
+                        _supervise(child_end, self.torch_threads)
+                        code = 0
+                    finally:
+                        os._exit(code)
+            finally:
+                gc.unfreeze()
+        child_end.close()
+        self._supervisor_pid, self._control = pid, parent_end
+        _pools.append(self)
+        for _ in range(self.workers):
+            self._spawn()
+        logger.info(f"Started {self.workers} {self.name} workers", extra={
+            "pool": self.name, "supervisor_pid": pid, "pids": sorted(self._all),
+        })
+
+    def _close_inherited(self) -> None:
+        """In another pool's freshly forked supervisor: drop this pool's connections."""
+        for conn in [self._control] + [worker.conn for worker in self._all.values()]:
+            if conn is not None:
+                conn.close()
+
+    def _spawn(self) -> None:
+        """Have the supervisor fork one worker and add it to the idle workers."""
+        with self._spawn_lock:
+            ours, theirs = multiprocessing.Pipe()
+            try:
+                reduction.send_handle(self._control, theirs.fileno(), self._supervisor_pid)
+            finally:
+                theirs.close()
+            if not ours.poll(_START_TIMEOUT):
+                ours.close()
+                raise RuntimeError(f"{self.name} worker did not start within {_START_TIMEOUT}s")
+            worker = _Worker(ours.recv(), ours)
+        with self._cond:
+            self._all[worker.pid] = worker
+            self._idle.append(worker)
+            self._cond.notify()
+
+    def _replace(self, worker: _Worker) -> None:
+        """Drop a dead worker and fork a replacement from the supervisor."""
+        worker.conn.close()
+        with self._cond:
+            self._all.pop(worker.pid, None)
+            if self._closed:
+                self._cond.notify_all()
+                return
+            self.restarts += 1
+        logger.error(f"A {self.name} worker died (pid {worker.pid}); replacing it")
+        try:
+            self._spawn()
+        except Exception as e:
+            left = len(self._all)
+            logger.error(f"Could not replace the {self.name} worker: {e}; {left} left"
+                         + ("" if left else ", running its tasks in-process from now on"))
+        with self._cond:
+            self._cond.notify_all()
+
+    def _acquire(self) -> Optional[_Worker]:
+        """An idle worker, waiting for one; None when no worker is left."""
+        with self._cond:
+            while not self._idle:
+                if not self._all or self._closed:
+                    return None
+                self._cond.wait()
+            return self._idle.pop()
+
+    def _release(self, worker: _Worker) -> None:
+        with self._cond:
+            if worker.pid in self._all:
+                self._idle.append(worker)
+                self._cond.notify()
+
+    def _call(self, fn: Callable, args: Tuple, kwargs: Dict[str, Any]) -> Any:
+        for attempt in range(self.workers + 1):
+            worker = self._acquire()
+            if worker is None:
+                return fn(*args, **kwargs)
+            try:
+                worker.conn.send((current_request_id(), fn, args, kwargs))
+                break
+            except (EOFError, OSError) as e:
+                # Died while idle: the task never reached it, so another worker may run it
+                self._replace(worker)
+                if attempt == self.workers:
+                    raise BrokenProcessPool(f"{self.name} worker {worker.pid} is gone") from e
+            except Exception:
+                # Arguments could not be pickled; the worker is fine
+                self._release(worker)
+                raise
+        try:
+            ok, value, remote_traceback = worker.conn.recv()
+        except (EOFError, OSError) as e:
+            self._replace(worker)
+            raise BrokenProcessPool(f"{self.name} worker {worker.pid} died running {fn.__name__}") from e
+        except Exception:
+            # The reply could not be unpickled; the worker is fine
+            self._release(worker)
+            raise
+        except BaseException:
+            # Interrupted mid-exchange: the connection is out of step
+            self._replace(worker)
+            raise
+        self._release(worker)
+        if not ok:
+            if remote_traceback:
+                value.__cause__ = RemoteTraceback(remote_traceback)
+            raise value
+        return value
+
+    def shutdown(self) -> None:
+        with self._cond:
+            if self._closed or self._control is None:
+                return
+            self._closed = True
+            workers = list(self._all.values())
+            self._all.clear()
+            self._idle.clear()
+            self._cond.notify_all()
+        # Closed connections make the workers, then the supervisor, exit
+        for worker in workers:
+            worker.conn.close()
+        self._control.close()
+        try:
+            os.waitpid(self._supervisor_pid, 0)
+        except ChildProcessError:
+            pass
+        if self._callers:
+            self._callers.shutdown(wait=False)
+        if self in _pools:
+            _pools.remove(self)
+
+    @staticmethod
+    def _stage(fn: Callable) -> str:
+        return f"worker:{fn.__name__.lstrip('_')}"
+
+    def run(self, fn: Callable, *args: Any, **kwargs: Any) -> Any:
+        """
+        fn(*args, **kwargs) in a worker, waiting for the result. `fn` must be
+        a module-level function; arguments and result are pickled.
+        """
+        if not self.enabled:
+            return fn(*args, **kwargs)
+        with self.metrics.stage(self._stage(fn)):
+            return self._call(fn, args, kwargs)
+
+    async def run_async(self, fn: Callable, *args: Any, **kwargs: Any) -> Any:
+        """run() for the event loop: waits for the worker on a thread of this pool instead of the loop."""
+        if not self.enabled:
+            return fn(*args, **kwargs)
+        with self._cond:
+            if self._callers is None:
+                self._callers = ThreadPoolExecutor(self.workers, thread_name_prefix=f"{self.name}-worker-caller")
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            self._callers, lambda: context.run(self.run, fn, *args, **kwargs)
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            pids = sorted(self._all)
+        return {
+            'name': self.name,
+            'workers': self.workers,
+            'alive': len(pids),
+            'restarts': self.restarts,
+            'parent_memory': process_memory(os.getpid()),
+            'supervisor_memory': process_memory(self._supervisor_pid) if self._supervisor_pid else {},
+            'worker_memory': [{'pid': pid, **process_memory(pid)} for pid in pids],
+        }